@@ -0,0 +1,274 @@
+# بنچمارک مرحله به مرحله ساخت صورت‌های مالی
+# زمان هر تابع populate_* (هر مرحله ساخت)، wb.save و کل create_full_financial_report را در چند مقیاس
+# اندازه می‌گیرد و نتیجه را به صورت JSON (برای مقایسه بین commitها) به همراه حافظه ذخیره می‌کند:
+# حداکثر حافظه تخصیص یافته در هر مرحله (tracemalloc، از صفر برای هر مرحله) و حداکثر RSS فرایندی که فقط
+# create_full_financial_report را اجرا کرده است.
+#
+# نمونه اجرا:
+#   python benchmark_financial_report.py --scales small,medium -o bench.json
+#   python benchmark_financial_report.py --scales 2000:50 --repeat 3 --compare bench_old.json
+
+import os
+import sys
+import io
+import json
+import time
+import argparse
+import platform
+import tempfile
+import statistics
+import tracemalloc
+import contextlib
+import subprocess
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import resource # فقط در یونیکس؛ برای حداکثر حافظه فرایند
+except ImportError:
+    resource = None
+
+import generate_financial_report as report
+
+# مقیاس‌های از پیش تعریف شده: (تعداد کارمندان، تعداد اقلام موجودی)
+BENCHMARK_SCALES = {
+    'small': (100, 5),
+    'medium': (10_000, 1_000),
+    'large': (100_000, 100_000),
+}
+BENCHMARK_SEED = 1402
+FULL_REPORT_STAGE = 'create_full_financial_report'
+SAVE_STAGE = 'wb.save'
+
+
+def peak_memory_mb():
+    """
+    حداکثر حافظه مقیم (RSS) فرایند جاری از شروع آن به مگابایت (تجمعی، نه مخصوص یک مرحله)؛
+    None اگر قابل اندازه‌گیری نباشد.
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # لینوکس کیلوبایت و macOS بایت برمی‌گرداند
+    return round(peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024, 1)
+
+
+def parse_scale(text):
+    """تبدیل 'small' یا '2000:50' به (نام، کارمندان، اقلام)."""
+    if text in BENCHMARK_SCALES:
+        return (text, *BENCHMARK_SCALES[text])
+    try:
+        employees, items = (int(part) for part in text.split(':'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"مقیاس نامعتبر '{text}' (یکی از {', '.join(BENCHMARK_SCALES)} یا کارمندان:اقلام)")
+    return (text, employees, items)
+
+
+def traced_peak_meter():
+    """
+    تابعی که در هر فراخوانی حداکثر افزایش حافظه تخصیص یافته (tracemalloc) از فراخوانی قبلی را به مگابایت
+    برمی‌گرداند، یعنی حافظه اضافه همان مرحله و نه حافظه نگه داشته شده مراحل قبل؛ None اگر tracemalloc فعال نباشد.
+    حافظه فرایندهای ساخت موازی (workers) را شامل نمی‌شود.
+    """
+    baseline = [tracemalloc.get_traced_memory()[0]]
+
+    def measure():
+        if not tracemalloc.is_tracing():
+            return None
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        increase, baseline[0] = peak - baseline[0], current
+        return round(increase / (1024 * 1024), 1)
+
+    tracemalloc.reset_peak()
+    return measure
+
+
+def _run_stages(num_employees, inventory_items, streaming, output_folder, workers=1, backend='openpyxl'):
+    """
+    یک بار ساخت و ذخیره با زمان‌سنجی هر مرحله؛ خروجی: {مرحله: (ثانیه، حداکثر حافظه tracemalloc همان مرحله)}.
+    حافظه فقط وقتی tracemalloc فعال باشد اندازه‌گیری می‌شود (وگرنه None).
+    """
+    stages = {}
+    traced_peak_mb = traced_peak_meter()
+
+    def on_step(step, seconds):
+        stages[step.name] = (seconds, traced_peak_mb())
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        wb, _ = report.build_report_workbook(num_employees, inventory_items, streaming, BENCHMARK_SEED, on_step=on_step,
+                                             workers=workers)
+        output_path = os.path.join(output_folder, 'stages.xlsx')
+        started = time.perf_counter()
+        if backend == 'direct':
+            streamed = report.streamed_report_sheets(num_employees, inventory_items, BENCHMARK_SEED) if streaming else None
+            report.save_direct_workbook(wb, output_path, streamed)
+        elif streaming:
+            report.save_streaming_workbook(wb, output_path, num_employees, inventory_items, BENCHMARK_SEED)
+        else:
+            wb.active = wb['وضعیت مالی']
+            wb.save(output_path)
+        stages[SAVE_STAGE] = (time.perf_counter() - started, traced_peak_mb())
+    return stages
+
+
+def benchmark_stages(num_employees, num_items, repeat=1, streaming=False, workers=1, backend='openpyxl', memory=True):
+    """
+    زمان مراحل در repeat اجرا (بدون tracemalloc تا زمان‌ها مخدوش نشوند) و در صورت memory یک اجرای اضافه
+    با tracemalloc برای حافظه هر مرحله. خروجی: ({مرحله: [ثانیه‌ها]}، {مرحله: مگابایت}).
+    """
+    inventory_items = report.generate_inventory_items(num_items, seed=BENCHMARK_SEED)
+    timings, stage_memory = {}, {}
+    with tempfile.TemporaryDirectory() as output_folder:
+        for _ in range(repeat):
+            for stage, (seconds, _) in _run_stages(num_employees, inventory_items, streaming, output_folder, workers, backend).items():
+                timings.setdefault(stage, []).append(seconds)
+        if memory:
+            tracemalloc.start()
+            try:
+                stages = _run_stages(num_employees, inventory_items, streaming, output_folder, workers, backend)
+            finally:
+                tracemalloc.stop()
+            stage_memory = {stage: peak for stage, (_, peak) in stages.items()}
+    return timings, stage_memory
+
+
+def benchmark_full_report(num_employees, num_items, streaming=False, workers=1, backend='openpyxl'):
+    """
+    یک اجرای create_full_financial_report (ساخت و ذخیره) در فرایندی که کار دیگری نکرده است؛
+    خروجی: (ثانیه، حداکثر RSS همین فرایند، اندازه فایل).
+    """
+    inventory_items = report.generate_inventory_items(num_items, seed=BENCHMARK_SEED)
+    with tempfile.TemporaryDirectory() as output_folder:
+        started = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            report.create_full_financial_report(output_folder, 'full.xlsx', num_employees=num_employees,
+                                                inventory_items=inventory_items, streaming=streaming, seed=BENCHMARK_SEED,
+                                                workers=workers, output_backend=backend)
+        seconds = time.perf_counter() - started
+        return seconds, peak_memory_mb(), os.path.getsize(os.path.join(output_folder, 'full.xlsx'))
+
+
+def _in_fresh_process(func, *args):
+    """اجرای func در یک فرایند تازه (spawn) تا حافظه و کش‌های اجراهای قبلی روی نتیجه اثر نگذارند."""
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as pool:
+        return pool.submit(func, *args).result()
+
+
+def benchmark_scale(name, num_employees, num_items, repeat=1, streaming=False, workers=1, backend='openpyxl', memory=True):
+    """
+    اجرای بنچمارک یک مقیاس: مراحل در یک فرایند تازه و هر اجرای کامل گزارش در فرایند تازه خودش.
+    برای هر مرحله همه زمان‌ها، کمینه و میانه و peak_traced_mb (حداکثر حافظه اضافه تخصیص یافته در همان مرحله) گزارش
+    می‌شود؛ peak_memory_mb حداکثر RSS فرایندهای اجرای کامل گزارش است، نه مقدار تجمعی چند اجرا.
+    """
+    timings, stage_memory = _in_fresh_process(benchmark_stages, num_employees, num_items, repeat, streaming, workers,
+                                              backend, memory)
+    full_runs = [_in_fresh_process(benchmark_full_report, num_employees, num_items, streaming, workers, backend)
+                 for _ in range(repeat)]
+    timings[FULL_REPORT_STAGE] = [seconds for seconds, _, _ in full_runs]
+    rss_peaks = [peak for _, peak, _ in full_runs if peak is not None]
+
+    return {
+        'scale': name,
+        'employees': num_employees,
+        'inventory_items': num_items,
+        'streaming': streaming,
+        'workers': workers,
+        'backend': backend,
+        'repeat': repeat,
+        'file_size_bytes': full_runs[-1][2],
+        'peak_memory_mb': max(rss_peaks) if rss_peaks else None,
+        'stages': {
+            stage: {
+                'seconds': [round(value, 6) for value in values],
+                'min': round(min(values), 6),
+                'median': round(statistics.median(values), 6),
+                'peak_traced_mb': stage_memory.get(stage),
+            }
+            for stage, values in timings.items()
+        },
+    }
+
+
+def benchmark_metadata():
+    """اطلاعات محیط اجرا برای قابل مقایسه بودن نتایج."""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(report.__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    import openpyxl
+    import numpy
+    return {
+        'commit': commit,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'openpyxl': openpyxl.__version__,
+        'numpy': numpy.__version__,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'seed': BENCHMARK_SEED,
+    }
+
+
+def run_benchmarks(scales, repeat=1, streaming=False, workers=1, backend='openpyxl', memory=True):
+    """اجرای همه مقیاس‌ها؛ هر اندازه‌گیری در فرایند تازه خودش (benchmark_scale)."""
+    results = []
+    for name, num_employees, num_items in scales:
+        result = benchmark_scale(name, num_employees, num_items, repeat, streaming, workers, backend, memory)
+        results.append(result)
+        full = result['stages'][FULL_REPORT_STAGE]
+        print(f"{name}: {num_employees:,} کارمند، {num_items:,} قلم کالا -> کل {full['median']:.2f} ثانیه، "
+              f"حداکثر حافظه فرایند گزارش {result['peak_memory_mb']} مگابایت")
+    return {'meta': benchmark_metadata(), 'results': results}
+
+
+def benchmark_key(result):
+    """کلید مقایسه یک نتیجه: فقط اجراهایی با مقیاس، حالت ذخیره، تعداد فرایند و روش ذخیره یکسان مقایسه می‌شوند."""
+    return (result['scale'], result['streaming'], result.get('workers', 1), result.get('backend', 'openpyxl'))
+
+
+def compare_benchmarks(previous, current):
+    """چاپ نسبت میانه زمان هر مرحله نسبت به نتیجه قبلی (بزرگتر از 1 یعنی کندتر)."""
+    previous_by_key = {benchmark_key(r): r for r in previous['results']}
+    for result in current['results']:
+        old = previous_by_key.get(benchmark_key(result))
+        if not old:
+            continue
+        print(f"--- {result['scale']} (workers={result['workers']}، {result['backend']}؛ "
+              f"قبلی: {previous['meta'].get('commit')}) ---")
+        for stage, stats in result['stages'].items():
+            if stage in old['stages'] and old['stages'][stage]['median'] > 0:
+                ratio = stats['median'] / old['stages'][stage]['median']
+                print(f"{stage}: {old['stages'][stage]['median']:.4f} -> {stats['median']:.4f} ثانیه (x{ratio:.2f})")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="بنچمارک مرحله به مرحله create_full_financial_report")
+    parser.add_argument('--scales', default='small,medium',
+                        help="فهرست مقیاس‌ها با کاما: small, medium, large یا کارمندان:اقلام (پیش‌فرض: small,medium)")
+    parser.add_argument('--repeat', type=int, default=1, help="تعداد تکرار هر مقیاس")
+    parser.add_argument('--streaming', action='store_true', help="بنچمارک حالت ذخیره write-only")
+    parser.add_argument('-w', '--workers', type=int, default=1, help="تعداد فرایندهای ساخت موازی شیت‌ها (0: تعداد هسته‌ها)")
+    parser.add_argument('--backend', choices=report.OUTPUT_BACKENDS, default='openpyxl', help="روش ذخیره فایل xlsx")
+    parser.add_argument('--no-memory', dest='memory', action='store_false',
+                        help="بدون اجرای اضافه با tracemalloc برای حافظه هر مرحله")
+    parser.add_argument('-o', '--output', default='benchmark_results.json', help="مسیر فایل JSON خروجی")
+    parser.add_argument('--compare', help="فایل JSON یک اجرای قبلی برای مقایسه")
+    args = parser.parse_args(argv)
+
+    scales = [parse_scale(text.strip()) for text in args.scales.split(',') if text.strip()]
+    results = run_benchmarks(scales, args.repeat, args.streaming, args.workers or None, args.backend,
+                             args.memory)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print(f"نتایج در '{args.output}' ذخیره شد.")
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            compare_benchmarks(json.load(f), results)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,220 @@
+# خط فرمان ساخت صورت‌های مالی
+# این ماژول فقط از کتابخانه استاندارد استفاده می‌کند؛ generate_financial_report (و openpyxl و numpy) تنها
+# وقتی بارگذاری می‌شود که واقعاً کارپوشه‌ای ساخته شود، پس --help و خطاهای ورودی فوری‌اند.
+#
+# نمونه اجرا:
+#   python financial_report_cli.py -o report.xlsx --employees 500 --seed 1402
+#   python financial_report_cli.py -o - --scale medium --streaming -q > report.xlsx
+#   python financial_report_cli.py -o report.xlsx --assumptions scenario.json --log-format json
+#   python financial_report_cli.py scenarios scenarios.csv -o out/ -w 4
+#   python financial_report_cli.py jobs jobs.jsonl -o out/ -w 4
+#   python financial_report_cli.py serve --port 8765 -w 4
+
+import os
+import sys
+import io
+import json
+import time
+import argparse
+import contextlib
+
+from financial_report_options import REPORT_SCALE_PRESETS, OUTPUT_BACKENDS, positive_int, non_negative_int
+
+DEFAULT_OUTPUT_FILE_NAME = 'صورت_مالی_کامل_پویا_مرغداری_تراز_شده_نهایی.xlsx'
+LOG_FORMATS = ('text', 'json')
+
+
+class JsonLogStream(io.TextIOBase):
+    """تبدیل هر خط چاپ شده (پیام‌های پیشرفت توابع گزارش) به یک رکورد JSON در جریان مقصد."""
+
+    def __init__(self, target):
+        self.target = target
+        self.pending = ''
+
+    def writable(self):
+        return True
+
+    def write(self, text):
+        self.pending += text
+        *lines, self.pending = self.pending.split('\n')
+        for line in lines:
+            if line.strip():
+                self.emit(line)
+        return len(text)
+
+    def emit(self, message, level='info', **fields):
+        record = {'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'), 'level': level, 'message': message, **fields}
+        self.target.write(json.dumps(record, ensure_ascii=False, default=str) + '\n')
+        self.target.flush()
+
+    def flush(self):
+        if self.pending.strip():
+            self.emit(self.pending)
+        self.pending = ''
+
+
+def load_assumption_overrides(path):
+    """
+    مفروضات جایگزین از فایل: JSON به شکل {شرح: مقدار} (با «شرح [1402]» برای سال 1402) یا
+    CSV با یک سناریو در قالب جدول سناریوها.
+    """
+    if path.lower().endswith('.json'):
+        with open(path, encoding='utf-8-sig') as f:
+            overrides = json.load(f)
+        if not isinstance(overrides, dict):
+            raise ValueError(f"فایل مفروضات '{path}' باید یک شیء JSON به شکل {{شرح: مقدار}} باشد.")
+        return overrides
+    from generate_financial_report import load_scenario_table
+    scenarios = load_scenario_table(path)
+    if len(scenarios) != 1:
+        raise ValueError(f"فایل مفروضات '{path}' باید دقیقاً یک سناریو داشته باشد ({len(scenarios)} سناریو دارد).")
+    if scenarios[0]['error']:
+        raise ValueError(scenarios[0]['error'])
+    return scenarios[0]['overrides']
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="ساخت کارپوشه اکسل صورت‌های مالی یکپارچه",
+                                     epilog="اجرای دسته‌ای سناریوها: financial_report_cli.py scenarios <جدول.csv> -o <پوشه>؛ "
+                                            "کارهای JSONL: financial_report_cli.py jobs <کارها.jsonl> -o <پوشه>؛ "
+                                            "سرویس HTTP: financial_report_cli.py serve")
+    parser.add_argument('-o', '--output', default=DEFAULT_OUTPUT_FILE_NAME,
+                        help="مسیر فایل xlsx خروجی یا '-' برای نوشتن در stdout")
+    parser.add_argument('--assumptions', help="فایل مفروضات جایگزین (JSON یا CSV یک سناریو)")
+    parser.add_argument('--seed', type=int, default=None, help="seed داده‌های فرضی (برای خروجی تکرارپذیر)")
+    parser.add_argument('--scale', choices=REPORT_SCALE_PRESETS, help="مقیاس از پیش تعریف شده (تعداد کارمندان و اقلام موجودی)")
+    parser.add_argument('--employees', type=positive_int, default=None, help="تعداد کارمندان فرضی (بر --scale مقدم است)")
+    parser.add_argument('--inventory-items', type=positive_int, default=None, help="تعداد اقلام فرضی موجودی (بر --scale مقدم است)")
+    parser.add_argument('-w', '--workers', type=non_negative_int, default=1, help="تعداد فرایندهای ساخت موازی شیت‌ها (0: تعداد هسته‌ها)")
+    parser.add_argument('--streaming', action='store_true', help="ذخیره شیت‌های بزرگ ردیفی در حالت write-only")
+    parser.add_argument('--backend', choices=OUTPUT_BACKENDS, default='openpyxl', help="روش ذخیره فایل xlsx")
+    parser.add_argument('--build-cache', help="فایل کش ساخت برای استفاده مجدد از مراحل تغییر نکرده (pickle؛ فقط فایلی که متعلق به "
+                                              "خودتان است و دیگران در آن نمی‌نویسند بارگذاری می‌شود)")
+    parser.add_argument('--projection-years', type=non_negative_int, default=0, help="تعداد سال‌های شیت پیش‌بینی چندساله")
+    parser.add_argument('--monte-carlo', type=non_negative_int, default=0, help="تعداد نمونه‌های تحلیل ریسک مونت‌کارلو")
+    parser.add_argument('--evaluate', action='store_true', help="محاسبه و گزارش مقادیر کلیدی (کنترل تراز و نسبت‌ها)")
+    parser.add_argument('--values-only', action='store_true',
+                        help="نوشتن مقادیر محاسبه شده به جای فرمول‌ها (فایل بدون نیاز به محاسبه مجدد هنگام باز شدن)")
+    parser.add_argument('--keep-statement-formulas', action='store_true',
+                        help="با --values-only فرمول‌های صورت‌های اصلی نگه داشته شوند")
+    parser.add_argument('--strict-references', action='store_true',
+                        help="ارجاع به شیت ناموجود، سلول خالی یا سلول متنی خطا باشد (پیش‌فرض: هشدار)")
+    parser.add_argument('--export', help="خروجی ستونی مقادیر محاسبه شده (.csv، .json، .jsonl یا .parquet)")
+    parser.add_argument('--inventory-movements', help="فایل CSV گردش کالا برای بهای میانگین موزون")
+    parser.add_argument('--journal', help="فایل اسناد دفتر کل (CSV یا Parquet)")
+    parser.add_argument('--chart-of-accounts', help="جدول حساب‌ها (CSV) برای --journal")
+    parser.add_argument('-q', '--quiet', action='store_true', help="بدون پیام‌های پیشرفت (خطاها و مقادیر --evaluate نوشته می‌شوند)")
+    parser.add_argument('--log-format', choices=LOG_FORMATS, default='text', help="قالب پیام‌ها در stderr")
+    return parser
+
+
+def report_options(args):
+    """تبدیل آرگومان‌های خط فرمان به پارامترهای create_full_financial_report (بدون بارگذاری openpyxl)."""
+    employees, items = REPORT_SCALE_PRESETS[args.scale] if args.scale else (100, None)
+    employees = args.employees if args.employees is not None else employees
+    items = args.inventory_items if args.inventory_items is not None else items
+    return {
+        'num_employees': employees,
+        'inventory_item_count': items,
+        'seed': args.seed,
+        'streaming': args.streaming,
+        'workers': args.workers or None,
+        'output_backend': args.backend,
+        'projection_years': args.projection_years,
+        'monte_carlo_draws': args.monte_carlo,
+        'evaluate': args.evaluate,
+        'export_path': args.export,
+        'values_only': args.values_only,
+        'keep_statement_formulas': args.keep_statement_formulas,
+        'strict_references': args.strict_references,
+        'inventory_movements': args.inventory_movements,
+        'journal': args.journal,
+        'chart_of_accounts': args.chart_of_accounts,
+        'assumption_overrides': load_assumption_overrides(args.assumptions) if args.assumptions else None,
+    }
+
+
+def run_report(options, output, build_cache_path=None, stdout=None):
+    """
+    ساخت و ذخیره گزارش؛ با output='-' فایل xlsx مستقیماً در stdout (جریان دودویی؛ پیش‌فرض sys.stdout.buffer)
+    نوشته می‌شود.
+    """
+    import generate_financial_report as report
+
+    options = report.report_build_options(options)
+    if build_cache_path:
+        options['build_cache'] = report.ReportBuildCache(build_cache_path)
+
+    if output == '-':
+        stdout = stdout or sys.stdout.buffer
+        key_values = report.write_financial_report(stdout, **options)
+        stdout.flush()
+        return key_values
+    output = os.path.abspath(output)
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    key_values = report.write_financial_report(output, **options)
+    print(f"فایل اکسل در '{output}' ذخیره شد.")
+    return key_values
+
+
+def main(argv=None):
+    """اجرای خط فرمان؛ کد خروج 0 موفق، 1 خطای ساخت یا ذخیره و 2 ورودی نامعتبر."""
+    argv = sys.argv[1:] if argv is None else list(argv)
+    if argv[:1] == ['scenarios']:
+        from generate_financial_report import scenario_batch_main
+        return scenario_batch_main(argv[1:])
+    if argv[:1] == ['jobs']:
+        from generate_financial_report import report_jobs_main
+        return report_jobs_main(argv[1:])
+    if argv[:1] == ['serve']:
+        from financial_report_service import main as serve_main
+        return serve_main(argv[1:])
+
+    args = build_parser().parse_args(argv)
+    # پیام‌های پیشرفت هیچ‌گاه در stdout نوشته نمی‌شوند تا خروجی '-' سالم بماند
+    log_stream = io.StringIO() if args.quiet else JsonLogStream(sys.stderr) if args.log_format == 'json' else sys.stderr
+
+    def fail(message, code):
+        if args.log_format == 'json':
+            JsonLogStream(sys.stderr).emit(message, level='error')
+        else:
+            print(f"خطا: {message}", file=sys.stderr)
+        return code
+
+    try:
+        options = report_options(args)
+    except (OSError, ValueError) as e:
+        return fail(str(e), 2)
+    # بررسی ترکیب گزینه‌ها پیش از ساخت: فقط همین خطاها ورودی نامعتبرند (کد 2)
+    try:
+        from generate_financial_report import check_report_options
+        check_report_options(**options)
+    except ImportError as e:
+        return fail(str(e), 1)
+    except ValueError as e:
+        return fail(str(e), 2)
+
+    started = time.perf_counter()
+    stdout = sys.stdout.buffer # پیش از هدایت پیام‌ها به stderr
+    try:
+        with contextlib.redirect_stdout(log_stream):
+            key_values = run_report(options, args.output, args.build_cache, stdout)
+            log_stream.flush()
+    except (OSError, ImportError, ValueError) as e: # ValueError: شکست ساخت (مثلاً ارجاع چرخشی یا داده ورودی نامعتبر)
+        return fail(str(e), 1)
+
+    if args.quiet:
+        # -q فقط پیام‌های پیشرفت را حذف می‌کند؛ مقادیر کلیدی خواسته شده با --evaluate همچنان در stderr نوشته می‌شوند
+        if key_values and args.log_format == 'json':
+            JsonLogStream(sys.stderr).emit("مقادیر کلیدی", key_values=key_values)
+        elif key_values:
+            for label, value in key_values.items():
+                print(f"{label}: {value}", file=sys.stderr)
+    elif args.log_format == 'json':
+        JsonLogStream(sys.stderr).emit("پایان", seconds=round(time.perf_counter() - started, 3),
+                                       output=args.output, key_values=key_values)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,72 @@
+# ثابت‌ها و بررسی مشترک گزینه‌های ساخت گزارش
+# این ماژول هیچ وابستگی‌ای ندارد تا خط فرمان (که generate_financial_report را فقط هنگام ساخت بارگذاری می‌کند)
+# و خود generate_financial_report هر دو از یک منبع بخوانند.
+
+import argparse
+
+# مقیاس‌های از پیش تعریف شده: (تعداد کارمندان، تعداد اقلام موجودی فرضی)؛ None یعنی اقلام پیش‌فرض
+REPORT_SCALE_PRESETS = {
+    'small': (100, None),
+    'medium': (10_000, 1_000),
+    'large': (100_000, 100_000),
+}
+# روش‌های ذخیره فایل xlsx: 'openpyxl' (wb.save) و 'direct' (DirectXlsxWriter)
+OUTPUT_BACKENDS = ('openpyxl', 'direct')
+
+
+def positive_int(text):
+    """نوع argparse برای عدد صحیح مثبت (مثل تعداد کارمندان و اقلام)."""
+    value = int(text)
+    if value <= 0:
+        raise argparse.ArgumentTypeError(f"باید عدد صحیح مثبت باشد: {text}")
+    return value
+
+
+def non_negative_int(text):
+    """نوع argparse برای عدد صحیح نامنفی (مثل تعداد فرایندها که 0 یعنی همه هسته‌ها)."""
+    value = int(text)
+    if value < 0:
+        raise argparse.ArgumentTypeError(f"نمی‌تواند منفی باشد: {text}")
+    return value
+
+
+# کلیدهای گزینه‌های یک گزارش در ورودی‌های JSON (کارهای JSONL و بدنه درخواست سرویس) -> (پارامتر write_financial_report، نوع)
+REPORT_OPTION_FIELDS = {
+    'assumptions': ('assumption_overrides', dict),
+    'seed': ('seed', int),
+    'num_employees': ('num_employees', int),
+    'inventory_items': ('inventory_item_count', int),
+    'streaming': ('streaming', bool),
+    'backend': ('output_backend', str),
+    'projection_years': ('projection_years', int),
+    'monte_carlo_draws': ('monte_carlo_draws', int),
+    'evaluate': ('evaluate', bool),
+    'values_only': ('values_only', bool),
+    'keep_statement_formulas': ('keep_statement_formulas', bool),
+    'strict_references': ('strict_references', bool),
+}
+# گزینه‌های شمارشی که در صورت داده شدن باید مثبت باشند -> شرح در پیام خطا
+POSITIVE_REPORT_OPTIONS = {'num_employees': "تعداد کارمندان", 'inventory_item_count': "تعداد اقلام موجودی"}
+
+
+def parse_report_options(spec, fields=None, skip=(), options=None):
+    """
+    بررسی کلیدها و نوع مقادیر یک شیء JSON گزینه‌ها و افزودن آن‌ها به options (پیش‌فرض‌ها)؛
+    کلیدهای skip (مثل id و output کارها) نادیده گرفته می‌شوند. ValueError برای کلید، نوع یا مقدار نامعتبر.
+    """
+    fields = REPORT_OPTION_FIELDS if fields is None else fields
+    options = dict(options or {})
+    for key, value in spec.items():
+        if key in skip:
+            continue
+        if key not in fields:
+            raise ValueError(f"کلید ناشناخته '{key}' (کلیدهای مجاز: {', '.join(fields)})")
+        name, kind = fields[key]
+        # bool زیرنوع int است و نباید به جای عدد پذیرفته شود
+        if value is not None and (not isinstance(value, kind) or (kind is int and isinstance(value, bool))):
+            raise ValueError(f"مقدار '{key}' باید از نوع {kind.__name__} باشد.")
+        options[name] = value
+    for name, label in POSITIVE_REPORT_OPTIONS.items():
+        if options.get(name) is not None and options[name] <= 0:
+            raise ValueError(f"{label} باید مثبت باشد.")
+    return options
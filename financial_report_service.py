@@ -0,0 +1,266 @@
+# سرویس محلی ساخت صورت‌های مالی (HTTP روی asyncio)
+# چند فرایند کارگر گرم (openpyxl و numpy از قبل بارگذاری شده) درخواست‌ها را می‌سازند و فایل xlsx بدون فایل موقت
+# مستقیماً در پاسخ HTTP فرستاده می‌شود. هر درخواست مهلت مشخصی دارد؛ کارگری که از مهلت بگذرد kill و با یک کارگر
+# تازه جایگزین می‌شود.
+#
+# نمونه اجرا:
+#   python financial_report_cli.py serve --port 8765 -w 4 --timeout 60
+#   curl -X POST localhost:8765/report -d '{"seed": 1402, "assumptions": {"درصد رشد درآمدهای عملیاتی": 0.2}}' -o report.xlsx
+#   curl localhost:8765/health
+
+import io
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import contextlib
+import multiprocessing
+
+from financial_report_options import REPORT_OPTION_FIELDS, parse_report_options, non_negative_int
+
+SERVICE_MAX_BODY_BYTES = 1024 * 1024
+SERVICE_CHUNK_SIZE = 64 * 1024
+XLSX_MEDIA_TYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+HTTP_REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 413: 'Payload Too Large',
+                500: 'Internal Server Error', 504: 'Gateway Timeout'}
+# کلیدهای مجاز بدنه درخواست: همان طرح کارهای JSONL بدون evaluate (پاسخ فقط فایل xlsx است)؛
+# مسیر فایل (دفتر کل، کش و ...) عمداً پذیرفته نمی‌شود
+SERVICE_REPORT_OPTIONS = {key: field for key, field in REPORT_OPTION_FIELDS.items() if key != 'evaluate'}
+
+
+class ReportTimeoutError(TimeoutError):
+    """ساخت گزارش در مهلت درخواست تمام نشد."""
+
+
+class ReportWorkerError(RuntimeError):
+    """خطای داخلی فرایند کارگر (یا از کار افتادن آن)."""
+
+
+def payload_report_options(payload):
+    """تبدیل بدنه JSON درخواست به پارامترهای write_financial_report (ValueError برای کلید یا نوع نامعتبر)."""
+    if not isinstance(payload, dict):
+        raise ValueError("بدنه درخواست باید یک شیء JSON باشد.")
+    return parse_report_options(payload, SERVICE_REPORT_OPTIONS)
+
+
+def _service_worker(conn):
+    """
+    فرایند کارگر: یک بار generate_financial_report را بارگذاری و یک گزارش کوچک گرم‌کننده می‌سازد، سپس برای هر
+    پیام (پارامترها) پاسخ ('ok', bytes)، ('invalid', پیام) یا ('error', پیام) می‌فرستد.
+    """
+    import generate_financial_report as report
+
+    def build(options):
+        with contextlib.redirect_stdout(io.StringIO()):
+            return report.financial_report_bytes(**report.report_build_options(options))
+
+    build({'num_employees': 1, 'seed': 0})
+    conn.send(('ready', os.getpid()))
+    while True:
+        try:
+            options = conn.recv()
+        except EOFError:
+            return
+        try:
+            conn.send(('ok', build(options)))
+        except ValueError as e:
+            conn.send(('invalid', str(e)))
+        except Exception as e:
+            conn.send(('error', f"{type(e).__name__}: {e}"))
+
+
+class WarmWorker:
+    """یک فرایند کارگر و سر Pipe ارتباط با آن."""
+
+    def __init__(self, context):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(target=_service_worker, args=(child_conn,), daemon=True)
+        self.process.start()
+        child_conn.close()
+
+    def kill(self):
+        self.process.kill()
+        self.process.join()
+        self.conn.close()
+
+
+class ReportWorkerPool:
+    """
+    مجموعه‌ای از کارگرهای گرم با صف کارگرهای بیکار. هر درخواست یک کارگر را برای خود برمی‌دارد؛ اگر کل درخواست
+    (انتظار در صف و ساخت) از timeout بگذرد کارگر kill و یک کارگر تازه در پس‌زمینه جایگزین آن می‌شود.
+    """
+
+    def __init__(self, size, timeout):
+        self.size = size
+        self.timeout = timeout
+        self.context = multiprocessing.get_context('spawn')
+        self.idle = asyncio.Queue()
+        self.workers = set()
+        self.replacements = set()
+
+    async def _spawn(self):
+        worker = WarmWorker(self.context)
+        self.workers.add(worker)
+        try:
+            status, _ = await asyncio.to_thread(worker.conn.recv)
+        except (EOFError, OSError):
+            self.workers.discard(worker)
+            worker.kill()
+            raise ReportWorkerError("فرایند کارگر هنگام راه‌اندازی از کار افتاد.")
+        self.idle.put_nowait(worker)
+
+    def _replace(self, worker):
+        self.workers.discard(worker)
+        worker.kill()
+        task = asyncio.create_task(self._spawn())
+        self.replacements.add(task)
+        task.add_done_callback(self.replacements.discard)
+
+    async def start(self):
+        await asyncio.gather(*(self._spawn() for _ in range(self.size)))
+
+    async def generate(self, options):
+        """ساخت یک گزارش و برگرداندن bytes فایل xlsx."""
+        deadline = time.monotonic() + self.timeout
+        try:
+            worker = await asyncio.wait_for(self.idle.get(), self.timeout)
+        except asyncio.TimeoutError:
+            raise ReportTimeoutError(f"کارگر بیکاری در مهلت {self.timeout} ثانیه پیدا نشد.")
+        try:
+            worker.conn.send(options)
+            if not await asyncio.to_thread(worker.conn.poll, max(0.0, deadline - time.monotonic())):
+                raise ReportTimeoutError(f"ساخت گزارش در مهلت {self.timeout} ثانیه تمام نشد.")
+            status, value = await asyncio.to_thread(worker.conn.recv)
+        except ReportTimeoutError:
+            self._replace(worker)
+            raise
+        except (EOFError, OSError):
+            self._replace(worker)
+            raise ReportWorkerError("فرایند کارگر از کار افتاد.")
+        self.idle.put_nowait(worker)
+        if status == 'invalid':
+            raise ValueError(value)
+        if status == 'error':
+            raise ReportWorkerError(value)
+        return value
+
+    def close(self):
+        for task in self.replacements:
+            task.cancel()
+        for worker in list(self.workers):
+            worker.kill()
+        self.workers.clear()
+
+
+async def write_http_response(writer, status, body=b'', content_type='application/json; charset=utf-8', headers=()):
+    """نوشتن پاسخ HTTP/1.1؛ بدنه در قطعه‌های SERVICE_CHUNK_SIZE با رعایت back-pressure (drain) فرستاده می‌شود."""
+    head = [f"HTTP/1.1 {status} {HTTP_REASONS[status]}", f"Content-Type: {content_type}",
+            f"Content-Length: {len(body)}", "Connection: close", *headers]
+    writer.write(('\r\n'.join(head) + '\r\n\r\n').encode('ascii'))
+    for start in range(0, len(body), SERVICE_CHUNK_SIZE):
+        writer.write(body[start:start + SERVICE_CHUNK_SIZE])
+        await writer.drain()
+    await writer.drain()
+
+
+def json_body(data):
+    return json.dumps(data, ensure_ascii=False).encode('utf-8')
+
+
+async def read_http_request(reader):
+    """خواندن خط درخواست، سرآیندها و بدنه؛ خروجی (method، path، body) یا خطای (وضعیت، پیام)."""
+    head = await reader.readuntil(b'\r\n\r\n')
+    request_line, *header_lines = head.decode('latin-1').split('\r\n')
+    method, path, _ = request_line.split(' ', 2)
+    headers = {}
+    for line in header_lines:
+        if ':' in line:
+            key, value = line.split(':', 1)
+            headers[key.strip().lower()] = value.strip()
+    length = int(headers.get('content-length') or 0)
+    if length > SERVICE_MAX_BODY_BYTES:
+        return method, path, None
+    body = await reader.readexactly(length) if length else b''
+    return method, path.split('?', 1)[0], body
+
+
+async def handle_report_request(pool, reader, writer):
+    """پاسخ به یک اتصال: GET /health وضعیت کارگرها و POST /report فایل xlsx."""
+    started = time.perf_counter()
+    status, path = 500, '?'
+    try:
+        try:
+            method, path, body = await read_http_request(reader)
+        except (ValueError, asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+            status = 400
+            await write_http_response(writer, status, json_body({'error': "درخواست HTTP نامعتبر"}))
+            return
+        if path == '/health':
+            status = 200 if method == 'GET' else 405
+            await write_http_response(writer, status, json_body({'workers': len(pool.workers), 'idle': pool.idle.qsize()}))
+            return
+        if path != '/report':
+            status = 404
+            await write_http_response(writer, status, json_body({'error': f"مسیر '{path}' وجود ندارد"}))
+            return
+        if method != 'POST':
+            status = 405
+            await write_http_response(writer, status, json_body({'error': "فقط POST"}), headers=["Allow: POST"])
+            return
+        if body is None:
+            status = 413
+            await write_http_response(writer, status, json_body({'error': f"حداکثر اندازه بدنه {SERVICE_MAX_BODY_BYTES} بایت است"}))
+            return
+        try:
+            options = payload_report_options(json.loads(body or b'{}'))
+            content = await pool.generate(options)
+        except ValueError as e: # شامل JSONDecodeError
+            status, content = 400, json_body({'error': str(e)})
+        except ReportTimeoutError as e:
+            status, content = 504, json_body({'error': str(e)})
+        except ReportWorkerError as e:
+            status, content = 500, json_body({'error': str(e)})
+        else:
+            status = 200
+            await write_http_response(writer, status, content, XLSX_MEDIA_TYPE,
+                                      ['Content-Disposition: attachment; filename="financial_report.xlsx"'])
+            return
+        await write_http_response(writer, status, content)
+    except ConnectionError:
+        pass # کلاینت اتصال را بسته است
+    finally:
+        print(f"{path} -> {status} ({time.perf_counter() - started:.2f} ثانیه)", file=sys.stderr)
+        writer.close()
+
+
+async def serve(host='127.0.0.1', port=8765, workers=None, timeout=120.0):
+    """راه‌اندازی کارگرها و سرور HTTP تا زمان توقف (Ctrl+C)."""
+    pool = ReportWorkerPool(workers or os.cpu_count() or 1, timeout)
+    await pool.start()
+    server = await asyncio.start_server(lambda reader, writer: handle_report_request(pool, reader, writer), host, port)
+    print(f"سرویس گزارش مالی روی http://{host}:{port} با {pool.size} کارگر آماده است.", file=sys.stderr)
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        pool.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="سرویس HTTP ساخت صورت‌های مالی با کارگرهای گرم")
+    parser.add_argument('--host', default='127.0.0.1', help="نشانی شنود (پیش‌فرض فقط محلی)")
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('-w', '--workers', type=non_negative_int, default=0, help="تعداد فرایندهای کارگر (0: تعداد هسته‌ها)")
+    parser.add_argument('--timeout', type=float, default=120.0, help="مهلت هر درخواست به ثانیه")
+    args = parser.parse_args(argv)
+    try:
+        asyncio.run(serve(args.host, args.port, args.workers or None, args.timeout))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -2,13 +2,90 @@
 # می‌توانید با دستور زیر در ترمینال یا Command Prompt آن را نصب کنید:
 # pip install openpyxl
 
-from openpyxl import Workbook
-from openpyxl.styles import Font, Border, Side, Alignment, PatternFill
-from openpyxl.utils import get_column_letter
+from openpyxl import Workbook, __version__ as OPENPYXL_VERSION
+from openpyxl.cell import Cell, WriteOnlyCell
+from openpyxl.styles import Font, Border, Side, Alignment, PatternFill, NamedStyle
+from openpyxl.styles.builtins import styles as builtin_styles
+from openpyxl.styles.fonts import DEFAULT_FONT
+from openpyxl.utils import get_column_letter, column_index_from_string
+from openpyxl.utils.cell import coordinate_from_string
 from openpyxl.worksheet.hyperlink import Hyperlink
+from openpyxl.styles.stylesheet import write_stylesheet
+from openpyxl.xml.functions import tostring
 import os
-import random # برای نام های فرضی کارمندان
+import sys
+import io
+import csv
+import itertools
+import json
+import time
+import argparse
+import contextlib
+import hashlib
+import functools
+import pickle
+import stat
+import weakref
+import bisect
+import numbers
+import tempfile
+import zipfile
+import re # برای استخراج ارجاع‌های بین شیتی از فرمول‌ها
+import inspect # برای خواندن کد توابع populate_* در برنامه‌ریز ساخت
+import importlib.util # برای بررسی نصب بودن pyarrow بدون بارگذاری آن
 import math # برای محاسبات ریاضی
+import numpy as np # برای تولید ستونی و برداری داده‌های فرضی
+from collections import namedtuple, defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed, wait, FIRST_COMPLETED
+from copy import copy
+from types import SimpleNamespace, FunctionType, CodeType
+from xml.sax.saxutils import escape, quoteattr
+from financial_report_options import (REPORT_SCALE_PRESETS, OUTPUT_BACKENDS, REPORT_OPTION_FIELDS, parse_report_options,
+                                      positive_int, non_negative_int)
+
+# --- سبک‌های نام‌دار مشترک ---
+# هر قالب یک بار به صورت سبک نام‌دار در کارپوشه ثبت می‌شود و سلول‌ها فقط با نام به آن ارجاع می‌دهند
+# (به جای ساختن Font/Alignment/PatternFill جدید برای هر سلول).
+def _solid_fill(color):
+    return PatternFill(start_color=color, end_color=color, fill_type="solid")
+
+RTL_WRAPPED_ALIGNMENT = Alignment(wrapText=True, horizontal='right')
+
+REPORT_STYLE_SPECS = {
+    'report_title': {'font': Font(bold=True, size=14)},             # نام شرکت در سربرگ
+    'bold_total': {'font': Font(bold=True)},                         # جمع‌ها و عناوین
+    'section_header': {'font': Font(bold=True, color="000080")},     # عنوان گروه مفروضات
+    'note_text': {'font': Font(italic=True)},
+    'percent': {'number_format': '0.00%'},
+    'ratio': {'number_format': '0.00'},
+    'rtl_wrapped_text': {'alignment': RTL_WRAPPED_ALIGNMENT},        # متن‌های طولانی راست‌چین
+    'warning_fill': {'font': Font(bold=True), 'fill': _solid_fill("FFCCCC")},    # کنترل تراز
+    'highlight_total': {'font': Font(bold=True), 'fill': _solid_fill("FFFF00")}, # مغایرت موجودی
+    'analysis_text_yellow': {'alignment': RTL_WRAPPED_ALIGNMENT, 'fill': _solid_fill("FFF2CC")},
+    'analysis_text_green': {'alignment': RTL_WRAPPED_ALIGNMENT, 'fill': _solid_fill("D9EAD3")},
+    'analysis_text_blue': {'alignment': RTL_WRAPPED_ALIGNMENT, 'fill': _solid_fill("CCE0F5")},
+    'analysis_text_grey': {'alignment': RTL_WRAPPED_ALIGNMENT, 'fill': _solid_fill("F2F2F2")},
+}
+
+
+def register_report_styles(wb):
+    """ثبت سبک‌های نام‌دار گزارش (و سبک داخلی Hyperlink) در کارپوشه؛ تکرار آن بی‌اثر است."""
+    registered = set(wb.named_styles)
+    for name, attributes in REPORT_STYLE_SPECS.items():
+        if name not in registered:
+            wb.add_named_style(NamedStyle(name=name, **{'font': copy(DEFAULT_FONT), **attributes}))
+    if 'Hyperlink' not in registered:
+        wb.add_named_style(copy(builtin_styles['Hyperlink']))
+
+
+def apply_style(cell, name):
+    """اعمال سبک نام‌دار به سلول (در صورت نیاز سبک‌ها ابتدا در کارپوشه سلول ثبت می‌شوند)."""
+    try:
+        cell.style = name
+    except ValueError:
+        register_report_styles(cell.parent.parent)
+        cell.style = name
+    return cell
 
 # --- توابع کمکی عمومی ---
 def set_rtl_and_column_widths(ws, col_widths):
@@ -17,490 +94,1358 @@ def set_rtl_and_column_widths(ws, col_widths):
     for col, width in col_widths.items():
         ws.column_dimensions[col].width = width
 
+# نام شرکت در سربرگ همه شیت‌ها و متن شیت‌های ثابت (تغییر آن قالب شیت‌های ثابت را نامعتبر می‌کند)
+COMPANY_NAME = "شرکت نمونه (سهامی عام)"
+
+
 def add_header(ws, company_name, statement_name, date_line, currency_line=None):
     """افزودن سربرگ استاندارد به شیت های صورت مالی."""
     ws['A1'] = company_name
-    ws['A1'].font = Font(bold=True, size=14)
+    apply_style(ws['A1'], 'report_title')
     ws['A2'] = statement_name
-    ws['A2'].font = Font(bold=True)
+    apply_style(ws['A2'], 'bold_total')
     ws['A3'] = date_line
     if currency_line:
         ws['A5'] = currency_line
 
-# --- تابع تولید داده کارمندان (بدون تغییر) ---
-def generate_all_employees_data(num_employees=100):
+# --- توابع کمکی خروجی جریانی (write-only) ---
+def styled_write_only_cell(ws, value, font=None, fill=None, alignment=None, number_format=None, hyperlink=None, style=None):
+    """ساخت سلول write-only با قالب‌بندی؛ سلول‌های بدون قالب را مستقیم به append بدهید."""
+    cell = WriteOnlyCell(ws, value=value)
+    if style:
+        cell.style = style
+    if font:
+        cell.font = font
+    if fill:
+        cell.fill = fill
+    if alignment:
+        cell.alignment = alignment
+    if number_format:
+        cell.number_format = number_format
+    if hyperlink:
+        cell.hyperlink = hyperlink
+    return cell
+
+
+def rows_from_cells(cells, first_row=1, last_row=None):
+    """تبدیل {آدرس: مقدار} به ردیف‌های پیوسته برای append (ردیف‌های خالی به صورت [])."""
+    by_row = {}
+    for coordinate, value in cells.items():
+        col_letter, row_idx = coordinate_from_string(coordinate)
+        by_row.setdefault(row_idx, {})[column_index_from_string(col_letter)] = value
+    last_row = last_row if last_row is not None else max(by_row, default=first_row - 1)
+    for row_idx in range(first_row, last_row + 1):
+        row_cells = by_row.get(row_idx, {})
+        yield [row_cells.get(col_idx) for col_idx in range(1, max(row_cells, default=0) + 1)]
+
+
+# فرمول تکراری یک ستون در ردیف‌های first_row تا last_row: template با {r} به جای ردیف ارجاع (ردیف سلول + row_offset).
+# DirectXlsxSheet آن را به صورت shared formula اکسل (فرمول اصلی در ردیف اول و بقیه فقط با شماره گروه) می‌نویسد؛
+# برای شیت‌های openpyxl متن فرمول هر ردیف با shared_formula_text ساخته می‌شود.
+# --- دسترسی به سلول‌های موجود شیت ---
+# openpyxl برای پیمایش فقط سلول‌های موجود API عمومی ندارد (iter_rows همه خانه‌های محدوده را می‌سازد)؛ دیکشنری
+# داخلی ws._cells {(ردیف، ستون): Cell} فقط در نسخه‌های آزموده شده زیر و فقط از طریق دو تابع زیر خوانده می‌شود.
+OPENPYXL_CELL_STORE_VERSIONS = ('3.0', '3.1')
+OPENPYXL_CELL_STORE = '.'.join(OPENPYXL_VERSION.split('.')[:2]) in OPENPYXL_CELL_STORE_VERSIONS
+
+
+def worksheet_cell_items(ws):
+    """((ردیف، ستون)، سلول) سلول‌های موجود شیت؛ در نسخه‌های دیگر openpyxl از iter_rows (کندتر) ساخته می‌شود."""
+    if OPENPYXL_CELL_STORE:
+        return ws._cells.items()
+    return (((cell.row, cell.column), cell) for row in ws.iter_rows() for cell in row)
+
+
+def worksheet_cell(ws, row_idx, col_idx):
+    """سلول موجود (ردیف، ستون) یا None، بدون ساختن سلول خالی در نسخه‌های آزموده شده."""
+    if OPENPYXL_CELL_STORE:
+        return ws._cells.get((row_idx, col_idx))
+    if row_idx > ws.max_row or col_idx > ws.max_column:
+        return None
+    return ws.cell(row=row_idx, column=col_idx)
+
+
+SharedFormula = namedtuple('SharedFormula', ['template', 'first_row', 'last_row', 'row_offset'], defaults=(0,))
+
+
+def shared_formula_text(formula, row_idx):
+    """متن فرمول SharedFormula در ردیف row_idx."""
+    return formula.template.format(r=row_idx + formula.row_offset)
+
+
+def write_only_header_rows(ws, company_name, statement_name, date_line, currency_line, back_link_column, back_link_text, back_link_sheet):
+    """ردیف‌های 1 تا 5 معادل add_header به همراه لینک بازگشت در ردیف 1 برای شیت write-only."""
+    header_cells = {
+        'A1': styled_write_only_cell(ws, company_name, style='report_title'),
+        'A2': styled_write_only_cell(ws, statement_name, style='bold_total'),
+        'A3': date_line,
+        f'{get_column_letter(back_link_column)}1': styled_write_only_cell(ws, back_link_text, hyperlink=f"#'{back_link_sheet}'!A1", style="Hyperlink"),
+    }
+    if currency_line:
+        header_cells['A5'] = currency_line
+    return rows_from_cells(header_cells, last_row=5)
+
+
+def copy_sheet_to_write_only(source_ws, target_ws):
+    """کپی محتوا، قالب‌بندی، عرض ستون‌ها و لینک‌های یک شیت عادی به شیت write-only."""
+    target_ws.sheet_view.rightToLeft = source_ws.sheet_view.rightToLeft
+    for col_letter, dimension in source_ws.column_dimensions.items():
+        if dimension.width:
+            target_ws.column_dimensions[col_letter].width = dimension.width
+    for merged_range in source_ws.merged_cells.ranges:
+        target_ws.merged_cells.add(str(merged_range))
+    for row in source_ws.iter_rows():
+        values = []
+        for cell in row:
+            if not (cell.has_style or cell.hyperlink):
+                values.append(cell.value)
+                continue
+            values.append(styled_write_only_cell(
+                target_ws, cell.value,
+                font=copy(cell.font), fill=copy(cell.fill), alignment=copy(cell.alignment),
+                number_format=cell.number_format,
+                hyperlink=cell.hyperlink.target if cell.hyperlink else None,
+                style=cell.style if cell.style != 'Normal' else None,
+            ))
+        target_ws.append(values)
+
+
+# --- نشانی‌های نمادین خروجی‌های کلیدی ---
+# هر تابع populate_* خروجی‌های کلیدی خود را (مثل سود خالص یا جمع بهای تمام شده) با یک نام ثبت می‌کند
+# و شیت‌های مصرف‌کننده به جای آدرس ثابت با cells.ref('net_profit', '1403') به آن ارجاع می‌دهند.
+# coordinates: {'1403': 'F21', '1402': 'G21'} یا {None: 'D10'} برای خروجی‌های بدون سال
+# rows: تعداد ردیف‌های پشت سر هم (مثلاً یک ردیف به ازای هر قلم کالا) که با offset قابل دسترسی‌اند
+ReportCell = namedtuple('ReportCell', ['sheet', 'coordinates', 'rows'], defaults=(1,))
+
+
+class ReportCellRegistry:
+    """ثبت نام نمادین خروجی‌های شیت‌ها و تبدیل آن به ارجاع فرمول."""
+
+    def __init__(self):
+        self.cells = {}
+
+    def register(self, name, sheet, coordinates, rows=1):
+        if isinstance(coordinates, str):
+            coordinates = {None: coordinates}
+        if name in self.cells and self.cells[name].sheet != sheet:
+            raise ValueError(f"نام '{name}' قبلاً برای شیت '{self.cells[name].sheet}' ثبت شده است.")
+        self.cells[name] = ReportCell(sheet, dict(coordinates), rows)
+
+    def address(self, name, year=None, offset=0):
+        """(شیت، آدرس) یک خروجی ثبت شده؛ offset ردیف‌های بعدی یک خروجی چندردیفی را برمی‌گرداند."""
+        if name not in self.cells:
+            raise KeyError(f"خروجی '{name}' توسط هیچ شیتی ثبت نشده است.")
+        cell = self.cells[name]
+        if year not in cell.coordinates:
+            raise KeyError(f"خروجی '{name}' برای سال {year} ثبت نشده است.")
+        if not 0 <= offset < cell.rows:
+            raise IndexError(f"ردیف {offset} خارج از {cell.rows} ردیف خروجی '{name}' است.")
+        col_letter, row_idx = coordinate_from_string(cell.coordinates[year])
+        return cell.sheet, f"{col_letter}{row_idx + offset}"
+
+    def ref(self, name, year=None, offset=0):
+        """ارجاع فرمولی به یک خروجی ثبت شده، مثل 'سودوزیان'!F21."""
+        sheet_name, coordinate = self.address(name, year, offset)
+        return f"'{sheet_name}'!{coordinate}"
+
+    def rows(self, name):
+        return self.cells[name].rows
+
+    def sheet_of(self, name):
+        return self.cells[name].sheet if name in self.cells else None
+
+
+# --- تولید داده کارمندان (ستونی و تکه به تکه) ---
+EMPLOYEE_FIRST_NAMES = np.array(["علی", "رضا", "محمد", "حسین", "فاطمه", "زهرا", "مریم", "سعید", "امین", "نازنین", "کیارش", "سارا", "نیما", "آرزو", "بهروز", "کمال", "پریسا", "دانیال", "زینب", "مهرناز"], dtype=object)
+EMPLOYEE_LAST_NAMES = np.array(["احمدی", "کریمی", "محمدی", "رضایی", "قاسمی", "نوروزی", "حسینی", "صادقی", "موسوی", "رحیمی", "یزدانی", "بهرامی", "فلاح", "شجاعی", "مظفری", "امیری", "جهانی", "هاشمی", "مختاری", "پورمحمدی"], dtype=object)
+
+MIN_WAGE_DAILY_1403 = 2_388_728 # حداقل دستمزد روزانه 1403 (ریال)
+
+# مشخصات یک گروه واحد سازمانی:
+# count: تعداد واحدها (مثلاً 10 فارم)؛ None یعنی واحد «باقیمانده» که بقیه پرسنل تا سقف تعداد بین آن‌ها پخش می‌شوند
+# staff_range: بازه تعداد نفرات هر واحد (فقط برای واحدهای شمارش‌دار)
+# roles: فهرست سمت‌ها (تکرار یک سمت یعنی وزن بیشتر در انتخاب تصادفی)
+# max_children: حداکثر تعداد فرزندان
+EmployeeUnitSpec = namedtuple('EmployeeUnitSpec', ['name', 'count', 'staff_range', 'roles', 'max_children'])
+
+DEFAULT_EMPLOYEE_UNIT_LAYOUT = [
+    EmployeeUnitSpec("فارم", 10, (6, 10), ["مدیر فارم", "دامپزشک", "نگهبان", "کارگر", "کارگر", "کارگر", "کارگر", "کارگر", "کارگر", "کارگر"], 3), # 10 کارگر برای فارم های بزرگ
+    EmployeeUnitSpec("انبار", 5, (3, 5), ["مدیر انبار", "انباردار", "کارگر", "کارگر"], 3),
+    EmployeeUnitSpec("اداری", None, None, ["مدیرعامل", "مدیر مالی", "حسابدار", "مدیر منابع انسانی", "منشی", "کارشناس"], 2), # معمولا اداری/فروش فرزندان کمتری دارند
+    EmployeeUnitSpec("فروش", None, None, ["مدیر فروش", "کارشناس فروش", "کارشناس فروش", "کارشناس فروش"], 2),
+]
+
+
+def role_base_salary_range(role):
+    """بازه حقوق پایه ماهانه (ریال) بر اساس سمت."""
+    # <<-- کاهش بازه حقوق برای کنترل هزینه
+    if "مدیر" in role:
+        return 130_000_000, 200_000_000
+    if "دامپزشک" in role:
+        return 100_000_000, 160_000_000
+    if "کارشناس" in role or "حسابدار" in role or "انباردار" in role:
+        return 80_000_000, 130_000_000
+    return MIN_WAGE_DAILY_1403 * 30, 120_000_000
+
+
+EMPLOYEE_CHUNK_SIZE = 4096 # تعداد کارمندان هر تکه تولید؛ جزئی از جریان تصادفی seed است (با تغییر آن کارمندان تغییر می‌کنند)
+
+
+def iter_employee_column_chunks(num_employees=100, seed=None, unit_layout=None):
+    """
+    تولید ستونی کارمندان تکه به تکه: هر تکه {ستون: آرایه numpy} برای حداکثر EMPLOYEE_CHUNK_SIZE کارمند است
+    (نام، واحد، سمت، فرزندان، حقوق پایه، کد ملی، شماره بیمه و کسورات)، پس حافظه به تعداد کارمندان بستگی ندارد.
+    ابتدا واحدهای شمارش‌دار به ترتیب پر می‌شوند و بقیه نفرات به تصادف بین واحدهای «باقیمانده» پخش می‌شوند؛
+    با seed یکسان خروجی تکرارپذیر است.
+    """
+    rng = np.random.default_rng(seed)
+    unit_layout = DEFAULT_EMPLOYEE_UNIT_LAYOUT if unit_layout is None else unit_layout
+    counted_specs = [i for i, spec in enumerate(unit_layout) if spec.count is not None]
+    remainder_specs = [i for i, spec in enumerate(unit_layout) if spec.count is None]
+
+    # جدول برچسب واحدها و سمت‌ها؛ هر ردیف فقط اندیس این جدول‌ها را نگه می‌دارد
+    unit_labels, unit_spec_ids, unit_offsets = [], [], {}
+    for spec_id, spec in enumerate(unit_layout):
+        unit_offsets[spec_id] = len(unit_labels)
+        names = [spec.name] if spec.count is None else [f"{spec.name} {i}" for i in range(1, spec.count + 1)]
+        unit_labels.extend(names)
+        unit_spec_ids.extend([spec_id] * len(names))
+    unit_labels = np.array(unit_labels, dtype=object)
+    unit_spec_ids = np.array(unit_spec_ids, dtype=np.int64)
+
+    role_labels = [role for spec in unit_layout for role in spec.roles]
+    role_offsets = np.cumsum([0] + [len(spec.roles) for spec in unit_layout])[:-1]
+    role_counts = np.array([len(spec.roles) for spec in unit_layout], dtype=np.int64)
+    max_children = np.array([spec.max_children for spec in unit_layout], dtype=np.int64)
+    salary_ranges = np.array([role_base_salary_range(role) for role in role_labels], dtype=np.int64)
+    role_labels = np.array(role_labels, dtype=object)
+
+    # واحدهای شمارش‌دار: تعداد نفرات هر واحد تصادفی و سپس تکرار اندیس واحد (ابتدای فهرست کارمندان)
+    unit_codes = []
+    for spec_id in counted_specs:
+        low, high = unit_layout[spec_id].staff_range
+        staff = rng.integers(low, high + 1, size=unit_layout[spec_id].count)
+        unit_codes.append(np.repeat(np.arange(unit_offsets[spec_id], unit_offsets[spec_id] + len(staff)), staff))
+    counted_units = np.concatenate(unit_codes) if unit_codes else np.empty(0, dtype=np.int64)
+    if num_employees > len(counted_units) and not remainder_specs:
+        raise ValueError(f"چیدمان واحدها فقط {len(counted_units)} نفر ظرفیت دارد و واحد باقیمانده‌ای تعریف نشده است.")
+    remainder_units = np.array([unit_offsets[i] for i in remainder_specs], dtype=np.int64)
+
+    for start in range(0, num_employees, EMPLOYEE_CHUNK_SIZE):
+        size = min(EMPLOYEE_CHUNK_SIZE, num_employees - start)
+        unit_code = counted_units[start:start + size]
+        if len(unit_code) < size:
+            chosen = rng.integers(0, len(remainder_units), size=size - len(unit_code))
+            unit_code = np.concatenate([unit_code, remainder_units[chosen]])
+
+        spec_id = unit_spec_ids[unit_code]
+        role_code = role_offsets[spec_id] + (rng.random(size) * role_counts[spec_id]).astype(np.int64)
+        salary_low, salary_high = salary_ranges[role_code, 0], salary_ranges[role_code, 1]
+        yield {
+            "id": np.arange(start + 1, start + size + 1, dtype=np.int64),
+            "first_name": EMPLOYEE_FIRST_NAMES[rng.integers(0, len(EMPLOYEE_FIRST_NAMES), size=size)],
+            "last_name": EMPLOYEE_LAST_NAMES[rng.integers(0, len(EMPLOYEE_LAST_NAMES), size=size)],
+            "unit": unit_labels[unit_code],
+            "role": role_labels[role_code],
+            "num_children": rng.integers(0, max_children[spec_id] + 1),
+            "base_salary": rng.integers(salary_low, salary_high + 1),
+            "national_id": rng.integers(1_000_000_000, 9_999_999_999 + 1, size=size, dtype=np.int64),
+            "insurance_number": rng.integers(10_000_000_000, 99_999_999_999 + 1, size=size, dtype=np.int64),
+            "other_deductions": rng.integers(500_000, 2_000_000 + 1, size=size),
+        }
+
+
+def generate_employee_columns(num_employees=100, seed=None, unit_layout=None):
+    """همه کارمندان به صورت {ستون: آرایه numpy} (به هم چسباندن تکه‌های iter_employee_column_chunks)."""
+    if num_employees < 1:
+        raise ValueError(f"تعداد کارمندان باید مثبت باشد (مقدار داده شده: {num_employees}).")
+    chunks = list(iter_employee_column_chunks(num_employees, seed, unit_layout))
+    return {key: np.concatenate([chunk[key] for chunk in chunks]) for key in chunks[0]}
+
+
+def iter_employee_records(column_chunks):
+    """تبدیل تکه‌های ستونی کارمندان به دیکشنری‌های ردیفی (هر بار فقط ردیف‌های یک تکه به صورت اشیای پایتون)."""
+    for columns in column_chunks:
+        keys = list(columns)
+        for values in zip(*(columns[key].tolist() for key in keys)):
+            yield dict(zip(keys, values))
+
+
+def iter_all_employees_data(num_employees=100, seed=None, unit_layout=None):
     """
-    تولید لیست 100 کارمند با نام، واحد، سمت و تعداد فرزندان تصادفی.
+    تولید تدریجی کارمندان با نام، واحد، سمت و تعداد فرزندان تصادفی (بدون نگهداری کل لیست در حافظه).
     """
-    employee_list = []
-    first_names = ["علی", "رضا", "محمد", "حسین", "فاطمه", "زهرا", "مریم", "سعید", "امین", "نازنین", "کیارش", "سارا", "نیما", "آرزو", "بهروز", "کمال", "پریسا", "دانیال", "زینب", "مهرناز"]
-    last_names = ["احمدی", "کریمی", "محمدی", "رضایی", "قاسمی", "نوروزی", "حسینی", "صادقی", "موسوی", "رحیمی", "یزدانی", "بهرامی", "فلاح", "شجاعی", "مظفری", "امیری", "جهانی", "هاشمی", "مختاری", "پورمحمدی"]
+    return iter_employee_records(iter_employee_column_chunks(num_employees, seed, unit_layout))
 
-    units_and_roles_distribution = {
-        "فارم": ["مدیر فارم", "دامپزشک", "نگهبان", "کارگر", "کارگر", "کارگر", "کارگر", "کارگر", "کارگر", "کارگر"], # 10 کارگر برای فارم های بزرگ
-        "انبار": ["مدیر انبار", "انباردار", "کارگر", "کارگر"],
-        "اداری": ["مدیرعامل", "مدیر مالی", "حسابدار", "مدیر منابع انسانی", "منشی", "کارشناس"],
-        "فروش": ["مدیر فروش", "کارشناس فروش", "کارشناس فروش", "کارشناس فروش"]
-    }
-    
-    current_employee_id = 1
-    
-    # پرسنل فارم
-    for i in range(1, 11): # 10 فارم
-        num_farm_employees = random.randint(6, 10) # 6 تا 10 نفر در هر فارم
-        for _ in range(num_farm_employees):
-            if current_employee_id > num_employees: break
-            role_choice = random.choice(units_and_roles_distribution["فارم"])
-            employee_list.append({
-                "id": current_employee_id,
-                "first_name": random.choice(first_names),
-                "last_name": random.choice(last_names),
-                "unit": f"فارم {i}",
-                "role": role_choice,
-                "num_children": random.randint(0, 3)
-            })
-            current_employee_id += 1
-
-    # پرسنل انبار
-    for i in range(1, 6): # 5 انبار
-        num_warehouse_employees = random.randint(3, 5) # 3 تا 5 نفر در هر انبار
-        for _ in range(num_warehouse_employees):
-            if current_employee_id > num_employees: break
-            role_choice = random.choice(units_and_roles_distribution["انبار"])
-            employee_list.append({
-                "id": current_employee_id,
-                "first_name": random.choice(first_names),
-                "last_name": random.choice(last_names),
-                "unit": f"انبار {i}",
-                "role": role_choice,
-                "num_children": random.randint(0, 3)
-            })
-            current_employee_id += 1
-            
-    # پرسنل اداری و فروش (بقیه تا 100 نفر)
-    while current_employee_id <= num_employees:
-        is_admin_or_sales = random.choice(["اداری", "فروش"])
-        role_choice = random.choice(units_and_roles_distribution[is_admin_or_sales])
-        employee_list.append({
-            "id": current_employee_id,
-            "first_name": random.choice(first_names),
-            "last_name": random.choice(last_names),
-            "unit": is_admin_or_sales,
-            "role": role_choice,
-            "num_children": random.randint(0, 2) # معمولا اداری/فروش فرزندان کمتری دارند
-        })
-        current_employee_id += 1
-        
-    return employee_list[:num_employees] # اطمینان از دقیقاً 100 نفر
+
+def generate_all_employees_data(num_employees=100, seed=None, unit_layout=None):
+    """
+    لیست num_employees کارمند با نام، واحد، سمت و تعداد فرزندان تصادفی (برای تعداد زیاد iter_all_employees_data).
+    """
+    return list(iter_all_employees_data(num_employees, seed, unit_layout))
 
 # ==============================================================================
 # تابع جدید: populate_starting_balance_sheet (با مقادیر کاملاً جدید و تراز شده)
 # ==============================================================================
-def populate_starting_balance_sheet(ws):
-    """ایجاد و پر کردن شیت ترازنامه افتتاحیه برای سال پایه (پایان 1401 / ابتدای 1402)."""
+# مانده‌های ترازنامه افتتاحیه (پایان 1401، میلیون ریال)؛ سود انباشته رقم تراز کننده است.
+# هم شیت «ترازنامه پایه» و هم موتور پیش‌بینی چندساله از این مقادیر شروع می‌کنند.
+OPENING_BALANCE_SHEET = {
+    'cash': 800_000,
+    'receivables': 515_068,
+    'inventory': 200_000,
+    'prepayments': 50_000,
+    'fixed_asset_cost': 3_000_000,
+    'accumulated_depreciation': 300_000,
+    'other_non_current_assets': 120_000,
+    'accounts_payable': 380_000,
+    'tax_payable': 25_000,
+    'dividends_payable': 75_000,
+    'current_portion_of_debt': 60_000,
+    'long_term_debt': 700_000,
+    'end_of_service_benefits': 150_000,
+    'capital': 1_000_000,
+    'legal_reserve': 120_000,
+    'other_reserves': 60_000,
+}
+
+
+def populate_starting_balance_sheet(ws, opening_balance=None):
+    """
+    ایجاد و پر کردن شیت ترازنامه افتتاحیه برای سال پایه (پایان 1401 / ابتدای 1402).
+    opening_balance (مثلاً ledger_opening_balance) جایگزین مانده‌های OPENING_BALANCE_SHEET می‌شود.
+    """
+    opening_balance = opening_balance or OPENING_BALANCE_SHEET
     ws.title = "ترازنامه پایه"
     col_widths = {'A': 5, 'B': 40, 'C': 45, 'D': 18} # تعیین عرض ستون‌ها
     set_rtl_and_column_widths(ws, col_widths) # تنظیم راست به چپ و عرض ستون‌ها
-    add_header(ws, "شرکت نمونه (سهامی عام)", "ترازنامه افتتاحیه (پایه)", "در تاریخ 29 اسفند 1401 / 1 فروردین 1402", "(ارقام به میلیون ریال)")
+    add_header(ws, COMPANY_NAME, "ترازنامه افتتاحیه (پایه)", "در تاریخ 29 اسفند 1401 / 1 فروردین 1402", "(ارقام به میلیون ریال)")
 
     # --- دارایی‌ها ---
-    ws.cell(row=8, column=2, value="دارایی ها").font = Font(bold=True)
+    apply_style(ws.cell(row=8, column=2, value="دارایی ها"), 'bold_total')
     ws.cell(row=9, column=2, value="دارایی‌های جاری")
     ws.cell(row=10, column=3, value="موجودی نقد")
-    ws.cell(row=10, column=4, value=800000) # موجودی نقد ابتدای 1402 (اصلاح شده برای تراز و جریان نقد مثبت)
+    ws.cell(row=10, column=4, value=opening_balance['cash']) # موجودی نقد ابتدای 1402 (اصلاح شده برای تراز و جریان نقد مثبت)
 
     ws.cell(row=11, column=3, value="حساب‌ها و اسناد دریافتنی")
-    ws.cell(row=11, column=4, value=515068) # بر اساس (95/365)*2,100,000 - دقیقاً متناسب با درآمد و دوره وصول 1402
+    ws.cell(row=11, column=4, value=opening_balance['receivables']) # بر اساس (95/365)*2,100,000 - دقیقاً متناسب با درآمد و دوره وصول 1402
 
     ws.cell(row=12, column=3, value="موجودی کالا")
-    ws.cell(row=12, column=4, value=200000) # (فرضی - متناسب با COGS سال قبل)
+    ws.cell(row=12, column=4, value=opening_balance['inventory']) # (فرضی - متناسب با COGS سال قبل)
 
     ws.cell(row=13, column=3, value="پیش‌پرداخت‌ها و سایر دارایی‌های جاری")
-    ws.cell(row=13, column=4, value=50000)
+    ws.cell(row=13, column=4, value=opening_balance['prepayments'])
 
     ws.cell(row=14, column=2, value="جمع دارایی‌های جاری")
     ws.cell(row=14, column=4, value="=SUM(D10:D13)")
-    ws.cell(row=14, column=4).font = Font(bold=True)
+    apply_style(ws.cell(row=14, column=4), 'bold_total')
 
     ws.append([]) # فاصله
-    ws.cell(row=16, column=2, value="دارایی‌های غیرجاری").font = Font(bold=True)
+    apply_style(ws.cell(row=16, column=2, value="دارایی‌های غیرجاری"), 'bold_total')
     ws.cell(row=17, column=3, value="بهای تمام شده ناخالص دارایی‌های ثابت")
-    ws.cell(row=17, column=4, value=3000000) # بهای تمام شده ناخالص در 1401/12/29
+    ws.cell(row=17, column=4, value=opening_balance['fixed_asset_cost']) # بهای تمام شده ناخالص در 1401/12/29
     ws.cell(row=18, column=3, value="کسر می‌شود: استهلاک انباشته")
-    ws.cell(row=18, column=4, value=300000) # استهلاک انباشته در 1401/12/29 (مثبت وارد می‌شود)
+    ws.cell(row=18, column=4, value=opening_balance['accumulated_depreciation']) # استهلاک انباشته در 1401/12/29 (مثبت وارد می‌شود)
     ws.cell(row=19, column=3, value="دارایی‌های ثابت مشهود (ارزش دفتری)")
     ws.cell(row=19, column=4, value="=D17-D18") # (ناخالص - استهلاک)
 
     ws.cell(row=20, column=3, value="سایر دارایی‌های غیرجاری")
-    ws.cell(row=20, column=4, value=120000)
+    ws.cell(row=20, column=4, value=opening_balance['other_non_current_assets'])
 
     ws.cell(row=21, column=2, value="جمع دارایی‌های غیرجاری")
     ws.cell(row=21, column=4, value="=SUM(D19:D20)")
-    ws.cell(row=21, column=4).font = Font(bold=True)
+    apply_style(ws.cell(row=21, column=4), 'bold_total')
 
     ws.append([]) # فاصله
-    ws.cell(row=23, column=2, value="جمع کل دارایی‌ها").font = Font(bold=True)
+    apply_style(ws.cell(row=23, column=2, value="جمع کل دارایی‌ها"), 'bold_total')
     ws.cell(row=23, column=4, value="=D14+D21")
-    ws.cell(row=23, column=4).font = Font(bold=True)
+    apply_style(ws.cell(row=23, column=4), 'bold_total')
 
     # --- بدهی‌ها و حقوق مالکانه ---
     ws.append([]) # فاصله
-    ws.cell(row=25, column=2, value="بدهی‌ها و حقوق مالکانه").font = Font(bold=True)
+    apply_style(ws.cell(row=25, column=2, value="بدهی‌ها و حقوق مالکانه"), 'bold_total')
     ws.cell(row=26, column=2, value="بدهی‌های جاری")
     ws.cell(row=27, column=3, value="حساب‌ها و اسناد پرداختنی")
-    ws.cell(row=27, column=4, value=380000) # (فرضی - متناسب با COGS سال قبل)
+    ws.cell(row=27, column=4, value=opening_balance['accounts_payable']) # (فرضی - متناسب با COGS سال قبل)
 
     ws.cell(row=28, column=3, value="مالیات پرداختنی")
-    ws.cell(row=28, column=4, value=25000)
+    ws.cell(row=28, column=4, value=opening_balance['tax_payable'])
 
     ws.cell(row=29, column=3, value="سود سهام پرداختنی")
-    ws.cell(row=29, column=4, value=75000)
+    ws.cell(row=29, column=4, value=opening_balance['dividends_payable'])
 
     ws.cell(row=30, column=3, value="بخش جاری تسهیلات بلندمدت")
-    ws.cell(row=30, column=4, value=60000) # بخش جاری وامی که در مفروضات هم بازپرداخت میشه
+    ws.cell(row=30, column=4, value=opening_balance['current_portion_of_debt']) # بخش جاری وامی که در مفروضات هم بازپرداخت میشه
 
     ws.cell(row=31, column=2, value="جمع بدهی‌های جاری")
     ws.cell(row=31, column=4, value="=SUM(D27:D30)")
-    ws.cell(row=31, column=4).font = Font(bold=True)
+    apply_style(ws.cell(row=31, column=4), 'bold_total')
 
     ws.append([]) # فاصله
     ws.cell(row=33, column=2, value="بدهی‌های غیرجاری")
     ws.cell(row=34, column=3, value="تسهیلات مالی بلندمدت")
-    ws.cell(row=34, column=4, value=700000) # مانده تسهیلات بلندمدت 1401 (غیرجاری)
+    ws.cell(row=34, column=4, value=opening_balance['long_term_debt']) # مانده تسهیلات بلندمدت 1401 (غیرجاری)
 
     ws.cell(row=35, column=3, value="مزایای پایان خدمت کارکنان")
-    ws.cell(row=35, column=4, value=150000)
+    ws.cell(row=35, column=4, value=opening_balance['end_of_service_benefits'])
 
     ws.cell(row=36, column=2, value="جمع بدهی‌های غیرجاری")
     ws.cell(row=36, column=4, value="=SUM(D34:D35)")
-    ws.cell(row=36, column=4).font = Font(bold=True)
+    apply_style(ws.cell(row=36, column=4), 'bold_total')
 
-    ws.cell(row=37, column=2, value="جمع کل بدهی‌ها").font = Font(bold=True)
+    apply_style(ws.cell(row=37, column=2, value="جمع کل بدهی‌ها"), 'bold_total')
     ws.cell(row=37, column=4, value="=D31+D36")
-    ws.cell(row=37, column=4).font = Font(bold=True)
+    apply_style(ws.cell(row=37, column=4), 'bold_total')
 
     ws.append([]) # فاصله
-    ws.cell(row=39, column=2, value="حقوق مالکانه").font = Font(bold=True)
+    apply_style(ws.cell(row=39, column=2, value="حقوق مالکانه"), 'bold_total')
     ws.cell(row=40, column=3, value="سرمایه")
-    ws.cell(row=40, column=4, value=1000000) # همان مقدار قبلی
+    ws.cell(row=40, column=4, value=opening_balance['capital']) # همان مقدار قبلی
 
     ws.cell(row=41, column=3, value="اندوخته قانونی")
-    ws.cell(row=41, column=4, value=120000) # همان مقدار قبلی
+    ws.cell(row=41, column=4, value=opening_balance['legal_reserve']) # همان مقدار قبلی
 
     ws.cell(row=42, column=3, value="سایر اندوخته‌ها")
-    ws.cell(row=42, column=4, value=60000) # همان مقدار قبلی
+    ws.cell(row=42, column=4, value=opening_balance['other_reserves']) # همان مقدار قبلی
 
     ws.cell(row=43, column=3, value="سود انباشته")
     # این فرمول سود انباشته رو تراز می‌کنه: جمع دارایی‌ها - جمع بدهی‌ها - سرمایه - اندوخته‌ها
     ws.cell(row=43, column=4, value="=D23-D37-D40-D41-D42") # D23 (جمع دارایی‌ها) - D37 (جمع بدهی‌ها) - D40 (سرمایه) - D41 (اندوخته قانونی) - D42 (سایر اندوخته‌ها)
 
-    ws.cell(row=44, column=2, value="جمع کل حقوق مالکانه").font = Font(bold=True)
+    apply_style(ws.cell(row=44, column=2, value="جمع کل حقوق مالکانه"), 'bold_total')
     ws.cell(row=44, column=4, value="=SUM(D40:D43)")
-    ws.cell(row=44, column=4).font = Font(bold=True)
+    apply_style(ws.cell(row=44, column=4), 'bold_total')
 
     ws.append([]) # فاصله
-    ws.cell(row=46, column=2, value="جمع کل بدهی‌ها و حقوق مالکانه").font = Font(bold=True)
+    apply_style(ws.cell(row=46, column=2, value="جمع کل بدهی‌ها و حقوق مالکانه"), 'bold_total')
     ws.cell(row=46, column=4, value="=D37+D44")
-    ws.cell(row=46, column=4).font = Font(bold=True)
+    apply_style(ws.cell(row=46, column=4), 'bold_total')
 
     ws.append([]) # فاصله
-    ws.cell(row=48, column=2, value="کنترل تراز (باید صفر باشد)").font = Font(bold=True)
+    apply_style(ws.cell(row=48, column=2, value="کنترل تراز (باید صفر باشد)"), 'bold_total')
     ws.cell(row=48, column=4, value="=D23-D46") # D23 (جمع دارایی‌ها) - D46 (جمع بدهی‌ها و حقوق مالکانه)
-    ws.cell(row=48, column=4).font = Font(bold=True)
-    ws.cell(row=48, column=4).fill = PatternFill(start_color="FFCCCC", end_color="FFCCCC", fill_type="solid") # برای نمایش راحت‌تر تراز
+    apply_style(ws.cell(row=48, column=4), 'warning_fill') # برای نمایش راحت‌تر تراز
 
     ws.cell(row=1, column=max(1, ws.max_column - 1), value="بازگشت به وضعیت مالی").hyperlink = f"#'وضعیت مالی'!A1"
     ws.cell(row=1, column=max(1, ws.max_column - 1)).style = "Hyperlink"
 
 
+def register_starting_balance_cells(cells):
+    """خروجی‌های ترازنامه افتتاحیه (مانده‌های ابتدای 1402)."""
+    for name, coordinate in [
+        ('opening_cash', 'D10'), ('opening_inventory', 'D12'),
+        ('opening_fixed_asset_cost', 'D17'), ('opening_accumulated_depreciation', 'D18'),
+        ('opening_current_portion_of_debt', 'D30'), ('opening_long_term_debt', 'D34'), ('opening_end_of_service_benefits', 'D35'),
+        ('opening_capital', 'D40'), ('opening_legal_reserve', 'D41'),
+        ('opening_other_reserves', 'D42'), ('opening_retained_earnings', 'D43'),
+        ('opening_balance_check', 'D48'),
+    ]:
+        cells.register(name, 'ترازنامه پایه', coordinate)
+
+
 # ==============================================================================
 # تابع ۱ (اصلاح شده): populate_assumptions_sheet
 # ==============================================================================
-def populate_assumptions_sheet(ws):
-    """ایجاد و پر کردن شیت مفروضات نهایی مدل مالی و بازگرداندن نقشه آدرس ها."""
+DEFAULT_ASSUMPTIONS = {
+    "مفروضات صورت سود و زیان": [
+        ("درصد رشد درآمدهای عملیاتی", 0.50, 0.15),  # <<-- افزایش به 50%
+        ("بهای تمام شده به درصد از درآمد", 0.65, 0.68), # این دیگر در سود و زیان استفاده نمیشود
+        ("هزینه‌های فروش، اداری و عمومی به درصد از درآمد", 0.12, 0.13), # این دیگر در سود و زیان استفاده نمیشود
+        ("نرخ مالیات بر درآمد", 0.25, 0.25)
+    ],
+    "مفروضات ترازنامه (سرمایه در گردش)": [
+        ("دوره وصول مطالبات (روز)", 90, 95),
+        ("دوره گردش موجودی کالا (روز)", 120, 125),
+        ("دوره پرداخت بدهی‌ها (روز)", 75, 80)
+    ],
+    "مفروضات دارایی ثابت و استهلاک": [
+        ("سرمایه‌گذاری ثابت سالانه (CAPEX)", 600000, 450000),
+        ("نرخ استهلاک سالانه (نسبت به بهای تمام شده اول دوره)", 0.10, 0.10)
+    ],
+    "مفروضات تامین مالی": [
+        ("نرخ سود تسهیلات (بر میانگین مانده)", 0.18, 0.18), # هزینه مالی = نرخ × میانگین مانده اول و پایان دوره تسهیلات
+        ("نرخ سود سپرده بانکی (بر میانگین مانده نقد)", 0.08, 0.08), # درآمد مالی؛ با سود سهام چرخه دارد (حل بسته)
+        ("سود سهام پرداختی (درصد از سود خالص)", 0.40, 0.45),
+        ("مبلغ وام جدید دریافتی طی سال", 850000, 300000),
+        ("مبلغ بازپرداخت اصل وام طی سال", 50000, 40000),
+        ("مانده اولیه تسهیلات بلندمدت (1402)", 0, 0), # این مقدار دیگر از اینجا خوانده نمیشود
+    ]
+}
+
+ASSUMPTION_YEARS = ('1403', '1402')
+ASSUMPTION_OVERRIDE_KEY_PATTERN = re.compile(r"^(.*?)\s*\[(1402|1403)\]$")
+
+
+def apply_assumption_overrides(assumptions, overrides=None):
+    """
+    برگرداندن نسخه‌ای از مفروضات با مقادیر جایگزین.
+    کلید هر جایگزین شرح مفروض است؛ «شرح» مقدار سال 1403 و «شرح [1402]» مقدار سال 1402 را عوض می‌کند.
+    مقدار می‌تواند یک دیکشنری {'1403': ..., '1402': ...} هم باشد. شرح ناشناخته خطا می‌دهد.
+    """
+    changes = {}
+    for key, value in (overrides or {}).items():
+        match = ASSUMPTION_OVERRIDE_KEY_PATTERN.match(key)
+        desc, year = (match.group(1), match.group(2)) if match else (key, '1403')
+        values = value if isinstance(value, dict) else {year: value}
+        for year_key, year_value in values.items():
+            if year_key not in ASSUMPTION_YEARS:
+                raise ValueError(f"سال نامعتبر '{year_key}' برای مفروض '{desc}'")
+            changes.setdefault(desc, {})[year_key] = year_value
+
+    known = {desc for items in assumptions.values() for desc, _, _ in items}
+    unknown = sorted(set(changes) - known)
+    if unknown:
+        raise ValueError("مفروضات ناشناخته در سناریو: " + "، ".join(unknown))
+
+    result = {}
+    for category, items in assumptions.items():
+        result[category] = []
+        for desc, val_1403, val_1402 in items:
+            change = changes.get(desc, {})
+            result[category].append((desc, change.get('1403', val_1403), change.get('1402', val_1402)))
+    return result
+
+
+def iter_assumption_rows(assumptions):
+    """ردیف هر گروه و هر مفروض در شیت مفروضات: (ردیف، گروه، (شرح، 1403، 1402) یا None برای عنوان گروه)."""
+    current_row = 5
+    for category, items in assumptions.items():
+        yield current_row, category, None
+        current_row += 1
+        for item in items:
+            yield current_row, category, item
+            current_row += 1
+        current_row += 1
+
+
+def populate_assumptions_sheet(ws, overrides=None):
+    """
+    ایجاد و پر کردن شیت مفروضات نهایی مدل مالی و بازگرداندن نقشه آدرس ها.
+    overrides: مقادیر جایگزین یک سناریو (ر.ک. apply_assumption_overrides).
+    """
     ws.title = "مفروضات"
     set_rtl_and_column_widths(ws, {'A': 40, 'B': 18, 'C': 18})
-    add_header(ws, "شرکت نمونه (سهامی عام)", "شیت مفروضات مدل مالی (سناریو سوددهی)", "")
+    add_header(ws, COMPANY_NAME, "شیت مفروضات مدل مالی (سناریو سوددهی)", "")
 
     headers = ["شرح مفروضات", "مقدار (سال 1403)", "مقدار (سال 1402)"]
     ws.append(headers)
     for cell in ws[4]:
-        cell.font = Font(bold=True)
-
-    assumptions = {
-        "مفروضات صورت سود و زیان": [
-            ("درصد رشد درآمدهای عملیاتی", 0.50, 0.15),  # <<-- افزایش به 50%
-            ("بهای تمام شده به درصد از درآمد", 0.65, 0.68), # این دیگر در سود و زیان استفاده نمیشود
-            ("هزینه‌های فروش، اداری و عمومی به درصد از درآمد", 0.12, 0.13), # این دیگر در سود و زیان استفاده نمیشود
-            ("نرخ مالیات بر درآمد", 0.25, 0.25)
-        ],
-        "مفروضات ترازنامه (سرمایه در گردش)": [
-            ("دوره وصول مطالبات (روز)", 90, 95),
-            ("دوره گردش موجودی کالا (روز)", 120, 125),
-            ("دوره پرداخت بدهی‌ها (روز)", 75, 80)
-        ],
-        "مفروضات دارایی ثابت و استهلاک": [
-            ("سرمایه‌گذاری ثابت سالانه (CAPEX)", 600000, 450000),
-            ("نرخ استهلاک سالانه (نسبت به بهای تمام شده اول دوره)", 0.10, 0.10)
-        ],
-        "مفروضات تامین مالی": [
-            ("هزینه مالی ثابت", 50000, 60000), # <<-- کاهش به 50,000
-            ("سود سهام پرداختی (درصد از سود خالص)", 0.40, 0.45),
-            ("مبلغ وام جدید دریافتی طی سال", 850000, 300000),
-            ("مبلغ بازپرداخت اصل وام طی سال", 50000, 40000),
-            ("مانده اولیه تسهیلات بلندمدت (1402)", 0, 0), # این مقدار دیگر از اینجا خوانده نمیشود
-        ]
-    }
+        apply_style(cell, 'bold_total')
+
+    assumptions = apply_assumption_overrides(DEFAULT_ASSUMPTIONS, overrides)
 
     assumption_map = {}
-    current_row = 5
-    for category, items in assumptions.items():
-        ws.cell(row=current_row, column=1, value=category).font = Font(bold=True, color="000080")
-        current_row += 1
-        for desc, val_1403, val_1402 in items:
-            ws.cell(row=current_row, column=1, value=desc)
-            ws.cell(row=current_row, column=2, value=val_1403)
-            ws.cell(row=current_row, column=3, value=val_1402)
-            if "درصد" in desc or "نرخ" in desc:
-                ws.cell(row=current_row, column=2).number_format = '0.00%'
-                ws.cell(row=current_row, column=3).number_format = '0.00%'
-            
-            assumption_map[desc] = {'1403': f'B{current_row}', '1402': f'C{current_row}'}
-            current_row += 1
-        current_row += 1
+    for current_row, category, item in iter_assumption_rows(assumptions):
+        if item is None:
+            apply_style(ws.cell(row=current_row, column=1, value=category), 'section_header')
+            continue
+        desc, val_1403, val_1402 = item
+        ws.cell(row=current_row, column=1, value=desc)
+        ws.cell(row=current_row, column=2, value=val_1403)
+        ws.cell(row=current_row, column=3, value=val_1402)
+        if "درصد" in desc or "نرخ" in desc:
+            apply_style(ws.cell(row=current_row, column=2), 'percent')
+            apply_style(ws.cell(row=current_row, column=3), 'percent')
+
+        assumption_map[desc] = {'1403': f'B{current_row}', '1402': f'C{current_row}'}
     
     ws.cell(row=1, column=max(1, ws.max_column - 1), value="بازگشت به وضعیت مالی").hyperlink = f"#'وضعیت مالی'!A1"
     ws.cell(row=1, column=max(1, ws.max_column - 1)).style = "Hyperlink"
 
     return assumption_map
 
+
+def register_assumption_cells(cells, assumptions=None):
+    """هر مفروض با شرح خودش ثبت می‌شود (جایگزین‌های سناریو ردیف‌ها را تغییر نمی‌دهند)."""
+    for current_row, _, item in iter_assumption_rows(assumptions or DEFAULT_ASSUMPTIONS):
+        if item is not None:
+            cells.register(item[0], 'مفروضات', {'1403': f'B{current_row}', '1402': f'C{current_row}'})
+
 # ==============================================================================
-# تابع ۲ (بدون تغییر): populate_payroll_list_sheet
+# تابع ۲: populate_payroll_list_sheet (تولید ردیف به ردیف برای حالت عادی و جریانی)
 # ==============================================================================
-def populate_payroll_list_sheet(ws):
-    """پر کردن شیت لیست حقوق و دستمزد با آدرس‌دهی دقیق خروجی‌ها و هزینه کنترل شده."""
-    col_widths = { 'A': 5, 'B': 15, 'C': 15, 'D': 15, 'E': 20, 'F': 20, 'G': 15, 'H': 15, 'I': 20, 'J': 20, 'K': 20, 'L': 20, 'M': 20, 'N': 20, 'O': 20, 'P': 20, 'Q': 20, 'R': 20, 'S': 20, 'T': 25, 'U': 25, 'V': 25, 'W': 25 }
-    set_rtl_and_column_widths(ws, col_widths)
-    add_header(ws, "شرکت نمونه (سهامی عام)", "لیست حقوق و دستمزد (سال 1403)", "تفکیک بر اساس واحد تولیدی", "(ارقام به ریال)")
+PAYROLL_SHEET_TITLE = "لیست حقوق و دستمزد"
+PAYROLL_COL_WIDTHS = { 'A': 5, 'B': 15, 'C': 15, 'D': 15, 'E': 20, 'F': 20, 'G': 15, 'H': 15, 'I': 20, 'J': 20, 'K': 20, 'L': 20, 'M': 20, 'N': 20, 'O': 20, 'P': 20, 'Q': 20, 'R': 20, 'S': 20, 'T': 25, 'U': 25, 'V': 25, 'W': 25 }
+PAYROLL_HEADERS = [
+    "ردیف", "نام", "نام خانوادگی", "واحد", "سمت", "کد ملی", "شماره بیمه", "تعداد اولاد", 
+    "حقوق پایه", "حق مسکن", "حق بن", "حق اولاد", "جمع مزایا", "حقوق ناخالص", "حقوق مشمول بیمه", 
+    "بیمه سهم کارمند (7%)", "حقوق مشمول مالیات", "مالیات حقوق", "کسورات متفرقه", "جمع کسورات", 
+    "حقوق خالص (پرداختنی)", "بیمه سهم کارفرما (23%)", "کل هزینه برای کارفرما"
+]
+
+
+def payroll_sheet_layout(num_employees=100):
+    """آدرس ردیف‌های شیت حقوق؛ فقط به تعداد کارمندان بستگی دارد (برای ارجاع سایر شیت‌ها)."""
+    data_start = 7 # سربرگ در ردیف‌های 1 تا 5 و عنوان ستون‌ها در ردیف 6
+    data_end = data_start + num_employees - 1
+    total_monthly = data_end + 2
+    output_start = total_monthly + 4
+    return {
+        'data_start': data_start,
+        'data_end': data_end,
+        'total_monthly': total_monthly,
+        'total_yearly_rial': total_monthly + 1,
+        'total_yearly_million': total_monthly + 2,
+        'output_start': output_start,
+    }
+
 
-    headers = [
-        "ردیف", "نام", "نام خانوادگی", "واحد", "سمت", "کد ملی", "شماره بیمه", "تعداد اولاد", 
-        "حقوق پایه", "حق مسکن", "حق بن", "حق اولاد", "جمع مزایا", "حقوق ناخالص", "حقوق مشمول بیمه", 
-        "بیمه سهم کارمند (7%)", "حقوق مشمول مالیات", "مالیات حقوق", "کسورات متفرقه", "جمع کسورات", 
-        "حقوق خالص (پرداختنی)", "بیمه سهم کارفرما (23%)", "کل هزینه برای کارفرما"
+def payroll_row_formulas(layout):
+    """فرمول ستون‌های M تا R و T تا W ردیف‌های کارمندان، یک SharedFormula به ازای هر ستون."""
+    tax_exemption_monthly_1403 = PAYROLL_RATES[1403].tax_exemption_monthly
+    templates = [
+        "=SUM(J{r}:L{r})",
+        "=I{r}+M{r}",
+        "=I{r}+J{r}+K{r}",
+        f"=O{{r}}*{PAYROLL_EMPLOYEE_INSURANCE_RATE}",
+        f"=MAX(0, N{{r}}-P{{r}}-{tax_exemption_monthly_1403})",
+        f"=ROUND(Q{{r}}*{PAYROLL_TAX_RATE},0)",
+        # ستون S: کسورات متفرقه (مقدار)
+        "=SUM(P{r},R{r},S{r})",
+        "=N{r}-T{r}",
+        f"=O{{r}}*{PAYROLL_EMPLOYER_INSURANCE_RATE}",
+        "=N{r}+V{r}",
     ]
-    ws.append(headers)
+    return [SharedFormula(template, layout['data_start'], layout['data_end']) for template in templates]
 
-    min_wage_daily_1403 = 2_388_728
-    housing_allowance_1403 = 9_000_000
-    consumer_basket_allowance_1403 = 14_000_000
-    tax_exemption_monthly_1403 = 120_000_000
-    
-    # ضریب تبدیل برای سال 1402
-    min_wage_daily_1402 = 1_769_428
-    base_1402_ratio = 0.8 # ضریب کاهشی برای حقوق 1402
-    
-    tax_rate_excess = 0.10
-    ins_employee_share_rate = 0.07
-    ins_employer_share_rate = 0.23
-
-    employees_data_list = generate_all_employees_data(100)
-    initial_data_row_start = ws.max_row + 1 
-    min_wage_monthly_1403 = min_wage_daily_1403 * 30
-
-    for i, emp in enumerate(employees_data_list):
-        current_row = initial_data_row_start + i
-
-        # <<-- کاهش بازه حقوق برای کنترل هزینه
-        base_salary_per_employee = random.randint(min_wage_monthly_1403, 120_000_000)
-        if "مدیر" in emp["role"]:
-            base_salary_per_employee = random.randint(130_000_000, 200_000_000)
-        elif "دامپزشک" in emp["role"]:
-            base_salary_per_employee = random.randint(100_000_000, 160_000_000)
-        elif "کارشناس" in emp["role"] or "حسابدار" in emp["role"] or "انباردار" in emp["role"]:
-            base_salary_per_employee = random.randint(80_000_000, 130_000_000)
-
-        child_benefit_amount_1403 = emp["num_children"] * 3 * min_wage_daily_1403
-        
-        ws.cell(row=current_row, column=1, value=emp["id"])
-        ws.cell(row=current_row, column=2, value=emp["first_name"])
-        ws.cell(row=current_row, column=3, value=emp["last_name"])
-        ws.cell(row=current_row, column=4, value=emp["unit"])
-        ws.cell(row=current_row, column=5, value=emp["role"])
-        ws.cell(row=current_row, column=6, value=random.randint(1000000000, 9999999999))
-        ws.cell(row=current_row, column=7, value=random.randint(10000000000, 99999999999))
-        ws.cell(row=current_row, column=8, value=emp["num_children"])
-        ws.cell(row=current_row, column=9, value=base_salary_per_employee)
-        ws.cell(row=current_row, column=10, value=housing_allowance_1403)
-        ws.cell(row=current_row, column=11, value=consumer_basket_allowance_1403)
-        ws.cell(row=current_row, column=12, value=child_benefit_amount_1403)
-        
-        ws.cell(row=current_row, column=13, value=f"=SUM(J{current_row}:L{current_row})")
-        ws.cell(row=current_row, column=14, value=f"=I{current_row}+M{current_row}")
-        ws.cell(row=current_row, column=15, value=f"=I{current_row}+J{current_row}+K{current_row}")
-        ws.cell(row=current_row, column=16, value=f"=O{current_row}*{ins_employee_share_rate}")
-        ws.cell(row=current_row, column=17, value=f"=MAX(0, N{current_row}-P{current_row}-{tax_exemption_monthly_1403})")
-        ws.cell(row=current_row, column=18, value=f"=ROUND(Q{current_row}*{tax_rate_excess},0)") 
-        ws.cell(row=current_row, column=19, value=random.randint(500_000, 2_000_000))
-        ws.cell(row=current_row, column=20, value=f"=SUM(P{current_row},R{current_row},S{current_row})") 
-        ws.cell(row=current_row, column=21, value=f"=N{current_row}-T{current_row}") 
-        ws.cell(row=current_row, column=22, value=f"=O{current_row}*{ins_employer_share_rate}")
-        ws.cell(row=current_row, column=23, value=f"=N{current_row}+V{current_row}")
-
-    final_data_row = ws.max_row
-    total_monthly_row_idx = final_data_row + 2
-    total_yearly_rial_idx = total_monthly_row_idx + 1
-    total_yearly_million_idx = total_monthly_row_idx + 2
-
-    ws[f'A{total_monthly_row_idx}'] = "جمع کل ماهانه (ریال)"
-    for col_idx in range(9, 24):
-        col_letter = get_column_letter(col_idx)
-        ws[f'{col_letter}{total_monthly_row_idx}'] = f'=SUM({col_letter}{initial_data_row_start}:{col_letter}{final_data_row})'
-    
-    ws[f'A{total_yearly_rial_idx}'] = "جمع کل سالانه (ریال)"
-    for col_idx in range(9, 24):
-        col_letter = get_column_letter(col_idx)
-        ws[f'{col_letter}{total_yearly_rial_idx}'] = f'={col_letter}{total_monthly_row_idx}*12'
 
-    ws[f'A{total_yearly_million_idx}'] = "جمع کل سالانه (میلیون ریال)"
+def payroll_formula_families(layout):
+    """خانواده‌های فرمول ردیف‌های حقوق برای FormulaIndex: {ستون: [SharedFormula]} (ستون‌های M تا R و T تا W)."""
+    columns = [*range(13, 19), *range(20, 24)]
+    return {col_idx: [formula] for col_idx, formula in zip(columns, payroll_row_formulas(layout))}
+
+
+def iter_payroll_rows(employees, layout, shared_formulas=False):
+    """
+    تولید ردیف‌های 23 ستونی حقوق به ازای هر کارمند (مقادیر و فرمول‌ها).
+    با shared_formulas=True ستون‌های فرمولی همان اشیای SharedFormula هستند (بدون ساختن متن فرمول هر ردیف).
+    """
+    rates = PAYROLL_RATES[1403]
+    housing_allowance_1403 = rates.housing
+    consumer_basket_allowance_1403 = rates.consumer_basket
+    formulas = payroll_row_formulas(layout)
+
+    for current_row, emp in enumerate(employees, layout['data_start']):
+        child_benefit_amount_1403 = emp["num_children"] * 3 * MIN_WAGE_DAILY_1403
+        row_formulas = formulas if shared_formulas else [formula.template.format(r=current_row) for formula in formulas]
+
+        yield [
+            emp["id"], emp["first_name"], emp["last_name"], emp["unit"], emp["role"],
+            emp["national_id"],
+            emp["insurance_number"],
+            emp["num_children"], emp["base_salary"],
+            housing_allowance_1403, consumer_basket_allowance_1403, child_benefit_amount_1403,
+            *row_formulas[:6],
+            emp["other_deductions"],
+            *row_formulas[6:],
+        ]
+
+
+# ستون‌های شیت حقوق که جمع سالانه‌شان از دفتر حقوق ماهانه خوانده می‌شود (با استخدام، ترک کار و افزایش حقوق)
+PAYROLL_YEARLY_LEDGER_COLUMNS = {'N': 'gross', 'P': 'employee_insurance', 'R': 'tax', 'U': 'net',
+                                 'V': 'employer_insurance', 'W': 'employer_cost'}
+
+
+def payroll_footer_cells(layout):
+    """
+    سلول‌های جمع ماهانه/سالانه و خروجی‌های کلیدی شیت حقوق به صورت {آدرس: مقدار}.
+    جمع ماهانه همین فهرست (ماه اول 1403) است؛ جمع‌های سالانه و هزینه پرسنل هر دو سال از دفتر حقوق ماهانه می‌آید.
+    """
+    first, last = layout['data_start'], layout['data_end']
+    total_monthly_row_idx = layout['total_monthly']
+    total_yearly_rial_idx = layout['total_yearly_rial']
+    total_yearly_million_idx = layout['total_yearly_million']
+    cells = {}
+
+    cells[f'A{total_monthly_row_idx}'] = "جمع کل ماهانه (ریال)"
     for col_idx in range(9, 24):
         col_letter = get_column_letter(col_idx)
-        ws[f'{col_letter}{total_yearly_million_idx}'] = f'={col_letter}{total_yearly_rial_idx}/1000000'
-    
+        cells[f'{col_letter}{total_monthly_row_idx}'] = f'=SUM({col_letter}{first}:{col_letter}{last})'
+
+    cells[f'A{total_yearly_rial_idx}'] = "جمع کل سالانه 1403 از دفتر حقوق ماهانه (ریال)"
+    cells[f'A{total_yearly_million_idx}'] = "جمع کل سالانه 1403 از دفتر حقوق ماهانه (میلیون ریال)"
+    for col_letter, key in PAYROLL_YEARLY_LEDGER_COLUMNS.items():
+        cells[f'{col_letter}{total_yearly_million_idx}'] = f'={payroll_ledger_total_ref(key, 1403)}'
+        cells[f'{col_letter}{total_yearly_rial_idx}'] = f'={col_letter}{total_yearly_million_idx}*1000000'
+
     # *** خروجی‌های کلیدی برای سایر شیت‌ها ***
-    output_start_row = total_yearly_million_idx + 2
-    ws[f'A{output_start_row}'] = "خروجی برای سایر شیت‌ها (ارقام به میلیون ریال):"
-    
-    # هزینه کل پرسنل فروش (برای یادداشت 8)
-    ws[f'B{output_start_row + 1}'] = "کل هزینه سالانه پرسنل فروش - 1403:"
-    ws[f'E{output_start_row + 1}'] = f"""=ROUND(SUMIF(D{initial_data_row_start}:D{final_data_row},"*فروش*",W{initial_data_row_start}:W{final_data_row})*12/1000000,0)"""
-    ws[f'B{output_start_row + 2}'] = "کل هزینه سالانه پرسنل فروش - 1402:"
-    ws[f'F{output_start_row + 1}'] = f"""=ROUND(E{output_start_row + 1}*{base_1402_ratio},0)"""
-
-    # هزینه کل پرسنل اداری (برای یادداشت 8)
-    ws[f'B{output_start_row + 3}'] = "کل هزینه سالانه پرسنل اداری - 1403:"
-    ws[f'E{output_start_row + 3}'] = f"""=ROUND(SUMIF(D{initial_data_row_start}:D{final_data_row},"*اداری*",W{initial_data_row_start}:W{final_data_row})*12/1000000,0)"""
-    ws[f'B{output_start_row + 4}'] = "کل هزینه سالانه پرسنل اداری - 1402:"
-    ws[f'F{output_start_row + 3}'] = f"""=ROUND(E{output_start_row + 3}*{base_1402_ratio},0)"""
-
-    # هزینه کل پرسنل تولید (برای یادداشت 9 - بهای تمام شده)
-    ws[f'B{output_start_row + 5}'] = "کل هزینه سالانه پرسنل تولید - 1403:"
-    ws[f'E{output_start_row + 5}'] = f"""=ROUND(SUMIFS(W{initial_data_row_start}:W{final_data_row}, D{initial_data_row_start}:D{final_data_row}, "<>*فروش*", D{initial_data_row_start}:D{final_data_row}, "<>*اداری*")*12/1000000, 0)"""
-    ws[f'B{output_start_row + 6}'] = "کل هزینه سالانه پرسنل تولید - 1402:"
-    ws[f'F{output_start_row + 5}'] = f"""=ROUND(E{output_start_row + 5}*{base_1402_ratio},0)"""
-    
+    output_start_row = layout['output_start']
+    cells[f'A{output_start_row}'] = "خروجی برای سایر شیت‌ها (ارقام به میلیون ریال):"
+    for offset, (key, label) in zip((1, 3, 5), [('selling', "فروش"), ('admin', "اداری"), ('production', "تولید")]):
+        cells[f'B{output_start_row + offset}'] = f"کل هزینه سالانه پرسنل {label} - 1403:"
+        cells[f'B{output_start_row + offset + 1}'] = f"کل هزینه سالانه پرسنل {label} - 1402:"
+        cells[f'E{output_start_row + offset}'] = f'={payroll_ledger_summary_ref(key, 1403)}'
+        cells[f'F{output_start_row + offset}'] = f'={payroll_ledger_summary_ref(key, 1402)}'
+    return cells
+
+
+def populate_payroll_list_sheet(ws, num_employees=100, seed=None):
+    """پر کردن شیت لیست حقوق و دستمزد با آدرس‌دهی دقیق خروجی‌ها و هزینه کنترل شده."""
+    set_rtl_and_column_widths(ws, PAYROLL_COL_WIDTHS)
+    add_header(ws, COMPANY_NAME, "لیست حقوق و دستمزد (سال 1403)", "تفکیک بر اساس واحد تولیدی", "(ارقام به ریال)")
+    ws.append(PAYROLL_HEADERS)
+
+    layout = payroll_sheet_layout(num_employees)
+    for row in iter_payroll_rows(iter_all_employees_data(num_employees, seed), layout):
+        ws.append(row)
+
+    for coordinate, value in payroll_footer_cells(layout).items():
+        ws[coordinate] = value
+
     ws.cell(row=1, column=max(1, ws.max_column - 1), value="بازگشت به سود و زیان").hyperlink = f"#'سودوزیان'!A1"
     ws.cell(row=1, column=max(1, ws.max_column - 1)).style = "Hyperlink"
 
 
+def stream_payroll_list_sheet(ws, num_employees=100, seed=None):
+    """
+    نوشتن شیت حقوق در کارپوشه write-only: هر ردیف بلافاصله پس از تولید نوشته و از حافظه خارج می‌شود.
+    آدرس خروجی‌ها دقیقاً مشابه populate_payroll_list_sheet است. روی DirectXlsxSheet فرمول ردیف‌ها به صورت
+    shared formula (یک فرمول اصلی به ازای هر ستون) نوشته می‌شود.
+    """
+    set_rtl_and_column_widths(ws, PAYROLL_COL_WIDTHS)
+    layout = payroll_sheet_layout(num_employees)
+    for row in write_only_header_rows(ws, COMPANY_NAME, "لیست حقوق و دستمزد (سال 1403)", "تفکیک بر اساس واحد تولیدی", "(ارقام به ریال)",
+                                      len(PAYROLL_HEADERS) - 1, "بازگشت به سود و زیان", 'سودوزیان'):
+        ws.append(row)
+    ws.append(PAYROLL_HEADERS)
+    for row in iter_payroll_rows(iter_all_employees_data(num_employees, seed), layout, isinstance(ws, DirectXlsxSheet)):
+        ws.append(row)
+    for row in rows_from_cells(payroll_footer_cells(layout), first_row=layout['data_end'] + 1):
+        ws.append(row)
+
+
+def register_payroll_cells(cells, layout):
+    """خروجی‌های شیت حقوق (جمع‌ها و هزینه پرسنل هر بخش به میلیون ریال)."""
+    total_monthly, total_yearly_million = layout['total_monthly'], layout['total_yearly_million']
+    output_start = layout['output_start']
+    cells.register('payroll_monthly_gross', PAYROLL_SHEET_TITLE, f'N{total_monthly}')
+    cells.register('payroll_yearly_gross', PAYROLL_SHEET_TITLE, f'N{total_yearly_million}')
+    cells.register('payroll_yearly_employer_insurance', PAYROLL_SHEET_TITLE, f'V{total_yearly_million}')
+    for name, offset in [('payroll_selling_cost', 1), ('payroll_admin_cost', 3), ('payroll_production_cost', 5)]:
+        cells.register(name, PAYROLL_SHEET_TITLE, {'1403': f'E{output_start + offset}', '1402': f'F{output_start + offset}'})
+
+
 # ==============================================================================
-# تابع ۳ (بدون تغییر): populate_detailed_inventory_sheet
+# دفتر حقوق ماهانه: محاسبه برداری 12 ماه × کارمندان برای هر سال و انتقال جمع‌ها به یادداشت‌های 8 و 9
 # ==============================================================================
-def populate_detailed_inventory_sheet(ws):
-    col_widths = {'A': 5, 'B': 20, 'C': 10, 'D': 15, 'E': 15, 'F': 15, 'G': 15, 
-                  'H': 15, 'I': 15, 'J': 15, 'K': 15, 'L': 15}
-    set_rtl_and_column_widths(ws, col_widths)
-    ws['A1'] = "شرکت نمونه (سهامی عام)"
-    ws['A1'].font = Font(bold=True, size=14)
-    ws['A2'] = "موجودی تفصیلی انبار (مقدار و ریال)"
-    ws['A2'].font = Font(bold=True)
-    ws['A3'] = "برای سال مالی منتهی به 29 اسفند 1403 و 1402"
-    ws['A5'] = "(ارقام به ریال برای قیمت واحد و میلیون ریال برای مقادیر)"
-
-    ws.cell(row=7, column=1, value="ردیف")
-    ws.cell(row=7, column=2, value="نام کالا")
-    ws.cell(row=7, column=3, value="واحد")
-    ws.cell(row=7, column=4, value="ابتدای دوره 1403 (مقدار)")
-    ws.cell(row=7, column=5, value="ورود 1403 (مقدار)")
-    ws.cell(row=7, column=6, value="خروج 1403 (مقدار)")
-    ws.cell(row=7, column=7, value="پایان دوره 1403 (مقدار)")
-    ws.cell(row=7, column=8, value="ابتدای دوره 1402 (مقدار)")
-    ws.cell(row=7, column=9, value="ورود 1402 (مقدار)")
-    ws.cell(row=7, column=10, value="خروج 1402 (مقدار)")
-    ws.cell(row=7, column=11, value="پایان دوره 1402 (مقدار)")
-    ws.cell(row=7, column=12, value="قیمت واحد میانگین (ریال)")
-
-
-    inventory_items = [
-        (1, "جوجه یک روزه", "عدد", 800000, 4500000, 4300000, 600000, 3800000, 3400000, 150),
-        (2, "خوراک (دان)", "کیلوگرم", 8000000, 25000000, 24000000, 6000000, 22000000, 20000000, 390), # <<-- کاهش قیمت
-        (3, "مرغ در حال رشد", "عدد", 200000, 900000, 850000, 150000, 750000, 700000, 3600),
-        (4, "دارو و واکسن", "بسته", 10000, 40000, 38000, 8000, 30000, 28000, 25),
-        (5, "مرغ آماده فروش", "کیلوگرم", 50000, 900000, 880000, 40000, 750000, 720000, 140)
-    ]
+PAYROLL_LEDGER_SHEET_TITLE = "دفتر حقوق ماهانه"
+PERSIAN_MONTHS = ["فروردین", "اردیبهشت", "خرداد", "تیر", "مرداد", "شهریور",
+                  "مهر", "آبان", "آذر", "دی", "بهمن", "اسفند"]
+
+# نرخ‌های قانونی هر سال (ریال): حداقل دستمزد روزانه، حق مسکن، حق بن، سقف معافیت مالیاتی ماهانه
+# salary_ratio: نسبت حقوق پایه آن سال به حقوق پایه 1403 همان کارمند
+PayrollRates = namedtuple('PayrollRates', ['min_wage_daily', 'housing', 'consumer_basket', 'tax_exemption_monthly', 'salary_ratio'])
+PAYROLL_RATES = {
+    1403: PayrollRates(MIN_WAGE_DAILY_1403, 9_000_000, 14_000_000, 120_000_000, 1.0),
+    1402: PayrollRates(1_769_428, 9_000_000, 11_000_000, 100_000_000, 0.8),
+}
+PAYROLL_TAX_RATE = 0.10 # نرخ مالیات مازاد بر معافیت
+PAYROLL_EMPLOYEE_INSURANCE_RATE = 0.07
+PAYROLL_EMPLOYER_INSURANCE_RATE = 0.23
+# جابجایی پرسنل در طول سال: سهم استخدام‌های میان‌سال، ترک کار و افزایش حقوق شایستگی
+PAYROLL_HIRE_SHARE = 0.10
+PAYROLL_LEAVE_SHARE = 0.08
+PAYROLL_RAISE_SHARE = 0.25
+PAYROLL_RAISE_RANGE = (0.05, 0.15)
+
+# گروه‌های هزینه پرسنل مثل SUMIF شیت حقوق: فروش، اداری و بقیه (تولید)
+PAYROLL_COST_GROUPS = ('production', 'selling', 'admin')
+PAYROLL_LEDGER_COLUMNS = [
+    ('headcount', "تعداد پرسنل"), ('gross', "حقوق ناخالص"), ('employee_insurance', "بیمه سهم کارمند"),
+    ('tax', "مالیات حقوق"), ('net', "حقوق خالص"), ('employer_insurance', "بیمه سهم کارفرما"),
+    ('employer_cost', "کل هزینه کارفرما"), ('production', "هزینه پرسنل تولید"),
+    ('selling', "هزینه پرسنل فروش"), ('admin', "هزینه پرسنل اداری"),
+]
+
+# یک دفتر: years: سال‌ها، totals: {سال: {ستون PAYROLL_LEDGER_COLUMNS: آرایه 12 ماهه}} (مبالغ به ریال)
+PayrollLedger = namedtuple('PayrollLedger', ['years', 'totals'])
+
+
+def payroll_events_rng(seed=None, year=1403):
+    """جریان تصادفی رویدادهای یک سال؛ جدا از داده‌های کارمندان تا افزودن رویدادها آن داده‌ها را تغییر ندهد."""
+    return np.random.default_rng(None if seed is None else (seed, year))
+
+
+def generate_payroll_events(num_employees, seed=None, year=1403, rng=None):
+    """
+    رویدادهای سال هر کارمند به صورت آرایه: ماه شروع و پایان کار (1 تا 12) و ماه و نرخ افزایش حقوق.
+    با rng (از payroll_events_rng) رویدادهای تکه بعدی همان جریان سال ساخته می‌شود.
+    """
+    rng = payroll_events_rng(seed, year) if rng is None else rng
+    hired = rng.random(num_employees) < PAYROLL_HIRE_SHARE
+    leaving = rng.random(num_employees) < PAYROLL_LEAVE_SHARE
+    raised = rng.random(num_employees) < PAYROLL_RAISE_SHARE
+    hire_month = np.where(hired, rng.integers(2, 13, size=num_employees), 1)
+    # ماه ترک کار از ماه شروع کار به بعد انتخاب می‌شود تا کسی پیش از استخدام ترک نکند
+    leave_month = np.where(leaving, rng.integers(hire_month, 13), 12)
+    return {
+        'hire_month': hire_month,
+        'leave_month': leave_month,
+        'raise_month': np.where(raised, rng.integers(2, 13, size=num_employees), 13),
+        'raise_rate': rng.uniform(*PAYROLL_RAISE_RANGE, size=num_employees),
+    }
 
-    start_row_data = 8
-    for item in inventory_items:
-        row_idx = start_row_data + inventory_items.index(item)
-        ws.cell(row=row_idx, column=1, value=item[0])
-        ws.cell(row=row_idx, column=2, value=item[1])
-        ws.cell(row=row_idx, column=3, value=item[2])
-        ws.cell(row=row_idx, column=4, value=item[3])
-        ws.cell(row=row_idx, column=5, value=item[4])
-        ws.cell(row=row_idx, column=6, value=item[5])
-        ws.cell(row=row_idx, column=7, value=f'=D{row_idx}+E{row_idx}-F{row_idx}')
-        ws.cell(row=row_idx, column=8, value=item[6])
-        ws.cell(row=row_idx, column=9, value=item[7])
-        ws.cell(row=row_idx, column=10, value=item[8])
-        ws.cell(row=row_idx, column=11, value=f'=H{row_idx}+I{row_idx}-J{row_idx}')
-        ws.cell(row=row_idx, column=12, value=item[9])
-
-
-    value_header_row = 17
-    ws.cell(row=value_header_row, column=2, value="اطلاعات ریالی (میلیون ریال)")
-    ws.cell(row=value_header_row, column=4, value="ابتدای دوره 1403")
-    ws.cell(row=value_header_row, column=5, value="ورود 1403")
-    ws.cell(row=value_header_row, column=6, value="خروج (بهای تمام شده) 1403")
-    ws.cell(row=value_header_row, column=7, value="پایان دوره 1403")
-    ws.cell(row=value_header_row, column=8, value="ابتدای دوره 1402")
-    ws.cell(row=value_header_row, column=9, value="ورود 1402")
-    ws.cell(row=value_header_row, column=10, value="خروج (بهای تمام شده) 1402")
-    ws.cell(row=value_header_row, column=11, value="پایان دوره 1402")
-
-    value_start_row = 18
-    for i in range(len(inventory_items)):
-        data_row = start_row_data + i
-        value_row = value_start_row + i
-        ws.cell(row=value_row, column=1, value=f'=A{data_row}')
-        ws.cell(row=value_row, column=2, value=f'=B{data_row}')
-        ws.cell(row=value_row, column=3, value='م.ر')
-        ws.cell(row=value_row, column=4, value=f'=ROUND(D{data_row}*L{data_row}/1000000,0)')
-        ws.cell(row=value_row, column=5, value=f'=ROUND(E{data_row}*L{data_row}/1000000,0)')
-        ws.cell(row=value_row, column=6, value=f'=ROUND(F{data_row}*L{data_row}/1000000,0)')
-        ws.cell(row=value_row, column=7, value=f'=ROUND(G{data_row}*L{data_row}/1000000,0)')
-        ws.cell(row=value_row, column=8, value=f'=ROUND(H{data_row}*L{data_row}/1000000,0)')
-        ws.cell(row=value_row, column=9, value=f'=ROUND(I{data_row}*L{data_row}/1000000,0)')
-        ws.cell(row=value_row, column=10, value=f'=ROUND(J{data_row}*L{data_row}/1000000,0)')
-        ws.cell(row=value_row, column=11, value=f'=ROUND(K{data_row}*L{data_row}/1000000,0)')
-
-    total_row_value = value_start_row + len(inventory_items) + 4
-    ws.cell(row=total_row_value, column=2, value="جمع کل (میلیون ریال)").font = Font(bold=True)
-    for col_idx in range(4, 12):
-        col_letter = get_column_letter(col_idx)
-        ws[f'{col_letter}{total_row_value}'] = f'=SUM({col_letter}{value_start_row}:{col_letter}{value_start_row + len(inventory_items) - 1})'
-        ws[f'{col_letter}{total_row_value}'].font = Font(bold=True)
 
-    output_row_start = total_row_value + 2
-    ws.cell(row=output_row_start, column=2, value="**خروجی‌ها برای سایر شیت‌ها**").font = Font(bold=True)
-    ws.cell(row=output_row_start+1, column=2, value="بهای تمام شده سال 1403 (برای سود و زیان):")
-    ws.cell(row=output_row_start+1, column=6, value=f"=F{total_row_value}").font = Font(bold=True)
+def payroll_cost_groups(units):
+    """اندیس گروه هزینه (ترتیب PAYROLL_COST_GROUPS) برای آرایه نام واحدها."""
+    labels, codes = np.unique(units.astype(str), return_inverse=True)
+    label_groups = np.array([1 if "فروش" in label else 2 if "اداری" in label else 0 for label in labels], dtype=np.int64)
+    return label_groups[codes]
+
+
+def compute_monthly_payroll(columns, events, rates):
+    """
+    محاسبه یکجای اجزای حقوق برای 12 ماه × کارمندان (آرایه‌های 12×n به ریال) همان فرمول‌های شیت حقوق:
+    مزایا فقط در ماه‌های اشتغال، حقوق پایه پس از ماه افزایش بالاتر و مالیات روی مازاد معافیت ماهانه.
+    """
+    month = np.arange(1, 13)[:, None]
+    active = (month >= events['hire_month']) & (month <= events['leave_month'])
+    raise_factor = np.where(month >= events['raise_month'], 1 + events['raise_rate'], 1.0)
+    base = np.floor(columns['base_salary'] * rates.salary_ratio * raise_factor + 0.5) * active
+    housing = rates.housing * active
+    basket = rates.consumer_basket * active
+    child = (columns['num_children'] * 3 * rates.min_wage_daily) * active
+    gross = base + housing + basket + child
+    insured = base + housing + basket
+    employee_insurance = insured * PAYROLL_EMPLOYEE_INSURANCE_RATE
+    # ROUND اکسل (نیم به بالا) برای مقادیر نامنفی
+    tax = np.floor(np.maximum(0, gross - employee_insurance - rates.tax_exemption_monthly) * PAYROLL_TAX_RATE + 0.5)
+    deductions = employee_insurance + tax + columns['other_deductions'] * active
+    employer_insurance = insured * PAYROLL_EMPLOYER_INSURANCE_RATE
+    return {
+        'active': active,
+        'gross': gross,
+        'employee_insurance': employee_insurance,
+        'tax': tax,
+        'net': gross - deductions,
+        'employer_insurance': employer_insurance,
+        'employer_cost': gross + employer_insurance,
+    }
+
+
+def build_payroll_ledger(num_employees=100, seed=None, years=(1403, 1402)):
+    """
+    دفتر حقوق ماهانه همه سال‌ها از همان کارمندان شیت حقوق؛ کارمندان تکه به تکه (iter_employee_column_chunks)
+    محاسبه می‌شوند و فقط جمع ماهانه هر ستون نگه داشته می‌شود، پس حافظه به تعداد کارمندان بستگی ندارد.
+    """
+    totals = {year: {key: np.zeros(12) for key, _ in PAYROLL_LEDGER_COLUMNS} for year in years}
+    event_rngs = {year: payroll_events_rng(seed, year) for year in years}
+    for columns in iter_employee_column_chunks(num_employees, seed):
+        groups = payroll_cost_groups(columns['unit'])
+        for year in years:
+            events = generate_payroll_events(len(groups), year=year, rng=event_rngs[year])
+            monthly = compute_monthly_payroll(columns, events, PAYROLL_RATES[year])
+            year_totals = totals[year]
+            year_totals['headcount'] += monthly['active'].sum(axis=1)
+            for key in ('gross', 'employee_insurance', 'tax', 'net', 'employer_insurance', 'employer_cost'):
+                year_totals[key] += monthly[key].sum(axis=1)
+            for group_id, group in enumerate(PAYROLL_COST_GROUPS):
+                year_totals[group] += monthly['employer_cost'][:, groups == group_id].sum(axis=1)
+    return PayrollLedger(tuple(years), totals)
+
+
+def payroll_ledger_layout(years=(1403, 1402)):
+    """آدرس‌های شیت دفتر حقوق: جدول خلاصه سالانه بالای شیت و یک جدول 12 ماهه به ازای هر سال."""
+    summary_header = 7
+    summary_rows = {key: summary_header + i for i, key in enumerate(('production', 'selling', 'admin', 'employer_cost',
+                                                                     'gross', 'employer_insurance'), 1)}
+    tables, title_row = {}, max(summary_rows.values()) + 2
+    for year in years:
+        tables[year] = {'title': title_row, 'header': title_row + 1, 'first': title_row + 2,
+                        'last': title_row + 13, 'total': title_row + 14}
+        title_row += 16
+    return {'summary_header': summary_header, 'summary_rows': summary_rows, 'tables': tables}
+
+
+def payroll_ledger_total_ref(key, year, years=(1403, 1402)):
+    """آدرس جمع سالانه یک ستون دفتر حقوق (ردیف «جمع سال» جدول همان سال، میلیون ریال)."""
+    col_letter = get_column_letter(3 + [column for column, _ in PAYROLL_LEDGER_COLUMNS].index(key))
+    return f"'{PAYROLL_LEDGER_SHEET_TITLE}'!{col_letter}{payroll_ledger_layout(years)['tables'][year]['total']}"
+
+
+def payroll_ledger_summary_ref(key, year, years=(1403, 1402)):
+    """آدرس یک ردیف خلاصه سالانه دفتر حقوق (گرد شده، میلیون ریال)."""
+    col_letter = get_column_letter(3 + years.index(year))
+    return f"'{PAYROLL_LEDGER_SHEET_TITLE}'!{col_letter}{payroll_ledger_layout(years)['summary_rows'][key]}"
+
+
+PAYROLL_LEDGER_SUMMARY_LABELS = {
+    'production': "هزینه پرسنل تولید (یادداشت 9)",
+    'selling': "هزینه پرسنل فروش (یادداشت 8)",
+    'admin': "هزینه پرسنل اداری (یادداشت 8)",
+    'employer_cost': "جمع کل هزینه پرسنل",
+    'gross': "حقوق و مزایای ناخالص",
+    'employer_insurance': "بیمه سهم کارفرما",
+}
+
+
+def populate_payroll_ledger_sheet(ws, num_employees=100, seed=None, ledger=None):
+    """
+    نوشتن دفتر حقوق ماهانه (میلیون ریال): جدول ماه به ماه هر سال و خلاصه سالانه که با فرمول
+    به ردیف جمع همان جدول‌ها وصل است و یادداشت‌های 8 و 9 از آن می‌خوانند.
+    """
+    ledger = ledger or build_payroll_ledger(num_employees, seed)
+    layout = payroll_ledger_layout(ledger.years)
+    set_rtl_and_column_widths(ws, {'A': 5, 'B': 30, **{get_column_letter(i): 18 for i in range(3, 3 + len(PAYROLL_LEDGER_COLUMNS))}})
+    add_header(ws, COMPANY_NAME, "دفتر حقوق و دستمزد ماهانه", "با احتساب استخدام، ترک کار و افزایش حقوق در طول سال",
+               "(ارقام به میلیون ریال؛ تعداد پرسنل به نفر)")
+    column_of = {key: get_column_letter(i) for i, (key, _) in enumerate(PAYROLL_LEDGER_COLUMNS, 3)}
+
+    summary_header = layout['summary_header']
+    apply_style(ws.cell(row=summary_header, column=2, value="شرح"), 'bold_total')
+    for col_idx, year in enumerate(ledger.years, 3):
+        apply_style(ws.cell(row=summary_header, column=col_idx, value=str(year)), 'bold_total')
+    for key, row_idx in layout['summary_rows'].items():
+        ws.cell(row=row_idx, column=2, value=PAYROLL_LEDGER_SUMMARY_LABELS[key])
+        for col_idx, year in enumerate(ledger.years, 3):
+            cell = ws.cell(row=row_idx, column=col_idx, value=f"=ROUND({column_of[key]}{layout['tables'][year]['total']},0)")
+            cell.number_format = '#,##0'
+
+    for year in ledger.years:
+        table = layout['tables'][year]
+        apply_style(ws.cell(row=table['title'], column=1, value=f"سال {year}"), 'bold_total')
+        apply_style(ws.cell(row=table['header'], column=2, value="ماه"), 'bold_total')
+        for key, label in PAYROLL_LEDGER_COLUMNS:
+            apply_style(ws[f"{column_of[key]}{table['header']}"], 'bold_total').value = label
+        for month_idx, month_name in enumerate(PERSIAN_MONTHS):
+            row_idx = table['first'] + month_idx
+            ws.cell(row=row_idx, column=2, value=month_name)
+            for key, _ in PAYROLL_LEDGER_COLUMNS:
+                value = ledger.totals[year][key][month_idx]
+                cell = ws[f"{column_of[key]}{row_idx}"]
+                cell.value = int(value) if key == 'headcount' else round(value / 1_000_000, 2)
+                cell.number_format = '#,##0'
+        apply_style(ws.cell(row=table['total'], column=2, value=f"جمع سال {year}"), 'bold_total')
+        for key, _ in PAYROLL_LEDGER_COLUMNS:
+            col_letter = column_of[key]
+            # تعداد پرسنل: میانگین ماهانه؛ بقیه: جمع سالانه
+            function = 'AVERAGE' if key == 'headcount' else 'SUM'
+            cell = ws[f"{col_letter}{table['total']}"]
+            cell.value = f"={function}({col_letter}{table['first']}:{col_letter}{table['last']})"
+            apply_style(cell, 'bold_total')
+            cell.number_format = '#,##0'
+
+    ws.cell(row=1, column=max(1, ws.max_column - 1), value="بازگشت به سود و زیان").hyperlink = f"#'سودوزیان'!A1"
+    ws.cell(row=1, column=max(1, ws.max_column - 1)).style = "Hyperlink"
+
+
+def register_payroll_ledger_cells(cells, years=(1403, 1402)):
+    """خروجی‌های دفتر حقوق: هزینه پرسنل هر گروه، حقوق ناخالص و بیمه کارفرما به تفکیک سال."""
+    layout = payroll_ledger_layout(years)
+    for key, row_idx in layout['summary_rows'].items():
+        cells.register(f'payroll_ledger_{key}', PAYROLL_LEDGER_SHEET_TITLE,
+                       {str(year): f'{get_column_letter(col_idx)}{row_idx}' for col_idx, year in enumerate(years, 3)})
+
+
+# ==============================================================================
+# تابع ۳: populate_detailed_inventory_sheet (تولید ردیف به ردیف برای حالت عادی و جریانی)
+# ==============================================================================
+INVENTORY_COL_WIDTHS = {'A': 5, 'B': 20, 'C': 10, 'D': 15, 'E': 15, 'F': 15, 'G': 15, 
+                        'H': 15, 'I': 15, 'J': 15, 'K': 15, 'L': 15}
+INVENTORY_QUANTITY_HEADERS = [
+    "ردیف", "نام کالا", "واحد", "ابتدای دوره 1403 (مقدار)", "ورود 1403 (مقدار)", "خروج 1403 (مقدار)",
+    "پایان دوره 1403 (مقدار)", "ابتدای دوره 1402 (مقدار)", "ورود 1402 (مقدار)", "خروج 1402 (مقدار)",
+    "پایان دوره 1402 (مقدار)", "قیمت واحد میانگین (ریال)"
+]
+DEFAULT_INVENTORY_ITEMS = [
+    (1, "جوجه یک روزه", "عدد", 800000, 4500000, 4300000, 600000, 3800000, 3400000, 150),
+    (2, "خوراک (دان)", "کیلوگرم", 8000000, 25000000, 24000000, 6000000, 22000000, 20000000, 390), # <<-- کاهش قیمت
+    (3, "مرغ در حال رشد", "عدد", 200000, 900000, 850000, 150000, 750000, 700000, 3600),
+    (4, "دارو و واکسن", "بسته", 10000, 40000, 38000, 8000, 30000, 28000, 25),
+    (5, "مرغ آماده فروش", "کیلوگرم", 50000, 900000, 880000, 40000, 750000, 720000, 140)
+]
+# اقلام محاسبه شده با cost_inventory_movements پس از قیمت واحد، 8 ارزش ریالی (میلیون ریال) هم دارند:
+# ابتدا، ورود، خروج و پایان 1403 و سپس همین چهار ستون برای 1402 (ستون‌های D تا K جدول ریالی)
+COSTED_INVENTORY_VALUE_COLUMNS = 'DEFGHIJK'
+
+
+def generate_inventory_items(num_items=5, seed=None):
+    """
+    تولید برداری اقلام فرضی موجودی با همان ساختار DEFAULT_INVENTORY_ITEMS برای آزمون بار
+    (موجودی ابتدای 1403 برابر پایان 1402 است).
+    """
+    rng = np.random.default_rng(seed)
+    templates = DEFAULT_INVENTORY_ITEMS
+    template = rng.integers(0, len(templates), size=num_items)
+    scale = rng.uniform(0.5, 1.5, size=num_items)
+    base = np.array([item[3:10] for item in templates], dtype=float)[template] * scale[:, None]
+    opening_1402, in_1402 = base[:, 3], base[:, 4]
+    out_1402 = np.minimum(base[:, 5], opening_1402 + in_1402)
+    opening_1403 = opening_1402 + in_1402 - out_1402
+    in_1403 = base[:, 1]
+    out_1403 = np.minimum(base[:, 2], opening_1403 + in_1403)
+    columns = [np.rint(column).astype(np.int64).tolist()
+               for column in (opening_1403, in_1403, out_1403, opening_1402, in_1402, out_1402)]
+    prices = np.maximum(1, np.rint(base[:, 6])).astype(np.int64).tolist()
+    return [(i + 1, f"{templates[t][1]} {i + 1}", templates[t][2], *values, price)
+            for i, (t, *values, price) in enumerate(zip(template.tolist(), *columns, prices))]
+
+
+def detailed_inventory_layout(num_items=len(DEFAULT_INVENTORY_ITEMS)):
+    """آدرس ردیف‌های شیت موجودی تفصیلی؛ با 5 قلم کالا همان ردیف‌های 17، 18، 27 و 29 قبلی."""
+    data_start = 8
+    value_header = data_start + num_items + 4
+    value_start = value_header + 1
+    total = value_start + num_items + 4
+    return {
+        'data_start': data_start,
+        'data_end': data_start + num_items - 1,
+        'value_header': value_header,
+        'value_start': value_start,
+        'value_end': value_start + num_items - 1,
+        'total': total,
+        'output_start': total + 2,
+    }
+
 
-    ws.cell(row=output_row_start+2, column=2, value="بهای تمام شده سال 1402 (برای سود و زیان):")
-    ws.cell(row=output_row_start+2, column=6, value=f"=J{total_row_value}").font = Font(bold=True)
+def detailed_inventory_shared_formulas(layout):
+    """فرمول‌های ردیفی موجودی تفصیلی: (پایان دوره 1403، پایان دوره 1402، ستون‌های A و B ریالی، ارزش‌های ریالی D تا K)."""
+    data_start, data_end = layout['data_start'], layout['data_end']
+    value_start, value_end = layout['value_start'], layout['value_end']
+    value_offset = data_start - value_start # ردیف ریالی هر کالا به ردیف مقداری همان کالا ارجاع می‌دهد
+    closing_1403 = SharedFormula('=D{r}+E{r}-F{r}', data_start, data_end)
+    closing_1402 = SharedFormula('=H{r}+I{r}-J{r}', data_start, data_end)
+    item_columns = [SharedFormula(f'={col}{{r}}', value_start, value_end, value_offset) for col in 'AB']
+    value_columns = [SharedFormula(f'=ROUND({col}{{r}}*L{{r}}/1000000,0)', value_start, value_end, value_offset)
+                     for col in COSTED_INVENTORY_VALUE_COLUMNS]
+    return closing_1403, closing_1402, item_columns, value_columns
 
-    ws.cell(row=output_row_start+3, column=2, value="موجودی پایان دوره 1403 (برای ترازنامه):")
-    ws.cell(row=output_row_start+3, column=6, value=f"=G{total_row_value}").font = Font(bold=True)
 
-    ws.cell(row=output_row_start+4, column=2, value="موجودی پایان دوره 1402 (برای ترازنامه):")
-    ws.cell(row=output_row_start+4, column=6, value=f"=K{total_row_value}").font = Font(bold=True)
+def detailed_inventory_formula_families(layout, costed=False):
+    """
+    خانواده‌های فرمول ردیفی موجودی تفصیلی برای FormulaIndex: {ستون: [SharedFormula]}؛ با costed (اقلام
+    cost_inventory_movements) ارزش‌های ریالی مقدار ثابت‌اند و خانواده نیستند.
+    """
+    closing_1403, closing_1402, item_columns, value_columns = detailed_inventory_shared_formulas(layout)
+    families = defaultdict(list)
+    families[7].append(closing_1403)
+    families[11].append(closing_1402)
+    for col_idx, formula in enumerate(item_columns, 1):
+        families[col_idx].append(formula)
+    if not costed:
+        for col_idx, formula in enumerate(value_columns, 4):
+            families[col_idx].append(formula)
+    return dict(families)
+
+
+def iter_detailed_inventory_rows(inventory_items, layout, shared_formulas=False):
+    """
+    ردیف‌های شیت موجودی تفصیلی از ردیف 7 (عنوان ستون‌ها) تا آخرین خروجی.
+    با shared_formulas=True فرمول‌های تکراری هر ستون (مقدار پایان دوره، ارجاع به شرح کالا و ارزش ریالی)
+    همان اشیای SharedFormula هستند.
+    """
+    data_start = layout['data_start']
+    value_start = layout['value_start']
+    closing_1403, closing_1402, item_columns, value_columns = detailed_inventory_shared_formulas(layout)
+
+    def formula_cells(formulas, row_idx):
+        return formulas if shared_formulas else [shared_formula_text(formula, row_idx) for formula in formulas]
+
+    yield INVENTORY_QUANTITY_HEADERS
+    for row_idx, item in enumerate(inventory_items, data_start):
+        closing = formula_cells((closing_1403, closing_1402), row_idx)
+        yield [item[0], item[1], item[2], item[3], item[4], item[5], closing[0],
+               item[6], item[7], item[8], closing[1], item[9]]
+
+    for _ in range(layout['value_header'] - layout['data_end'] - 1):
+        yield []
+    yield [None, "اطلاعات ریالی (میلیون ریال)", None, "ابتدای دوره 1403", "ورود 1403", "خروج (بهای تمام شده) 1403",
+           "پایان دوره 1403", "ابتدای دوره 1402", "ورود 1402", "خروج (بهای تمام شده) 1402", "پایان دوره 1402"]
+
+    for row_idx, item in enumerate(inventory_items, value_start):
+        if len(item) > 10: # ارزش‌های بهای میانگین موزون از دفتر گردش کالا
+            yield [*formula_cells(item_columns, row_idx), 'م.ر', *item[10:10 + len(COSTED_INVENTORY_VALUE_COLUMNS)]]
+        else:
+            yield [*formula_cells(item_columns, row_idx), 'م.ر', *formula_cells(value_columns, row_idx)]
+
+    total_row_value = layout['total']
+    for _ in range(total_row_value - layout['value_end'] - 1):
+        yield []
+    yield [None, "جمع کل (میلیون ریال)", None] + [f"=SUM({col}{layout['value_start']}:{col}{layout['value_end']})" for col in 'DEFGHIJK']
+
+    yield []
+    yield [None, "**خروجی‌ها برای سایر شیت‌ها**"]
+    yield [None, "بهای تمام شده سال 1403 (برای سود و زیان):", None, None, None, f"=F{total_row_value}"]
+    yield [None, "بهای تمام شده سال 1402 (برای سود و زیان):", None, None, None, f"=J{total_row_value}"]
+    yield [None, "موجودی پایان دوره 1403 (برای ترازنامه):", None, None, None, f"=G{total_row_value}"]
+    yield [None, "موجودی پایان دوره 1402 (برای ترازنامه):", None, None, None, f"=K{total_row_value}"]
+
+
+def detailed_inventory_bold_cells(layout):
+    """آدرس سلول‌های پررنگ شیت موجودی تفصیلی (جمع کل و خروجی‌ها)."""
+    total_row_value, output_row_start = layout['total'], layout['output_start']
+    return ([f'{col}{total_row_value}' for col in 'BDEFGHIJK'] + [f'B{output_row_start}'] +
+            [f'F{output_row_start + offset}' for offset in range(1, 5)])
+
+
+def populate_detailed_inventory_sheet(ws, inventory_items=None):
+    inventory_items = inventory_items or DEFAULT_INVENTORY_ITEMS
+    layout = detailed_inventory_layout(len(inventory_items))
+    set_rtl_and_column_widths(ws, INVENTORY_COL_WIDTHS)
+    add_header(ws, COMPANY_NAME, "موجودی تفصیلی انبار (مقدار و ریال)", "برای سال مالی منتهی به 29 اسفند 1403 و 1402",
+               "(ارقام به ریال برای قیمت واحد و میلیون ریال برای مقادیر)")
+
+    ws.append([]) # ردیف 6 خالی؛ عنوان ستون‌ها در ردیف 7
+    for row in iter_detailed_inventory_rows(inventory_items, layout):
+        ws.append(row)
+    for coordinate in detailed_inventory_bold_cells(layout):
+        apply_style(ws[coordinate], 'bold_total')
 
     ws.cell(row=1, column=max(1, ws.max_column - 1), value="بازگشت به وضعیت مالی").hyperlink = f"#'وضعیت مالی'!A1"
     ws.cell(row=1, column=max(1, ws.max_column - 1)).style = "Hyperlink"
 
+
+def stream_detailed_inventory_sheet(ws, inventory_items=None):
+    """
+    نوشتن شیت موجودی تفصیلی در کارپوشه write-only با همان آدرس‌های حالت عادی (روی DirectXlsxSheet با
+    shared formula مثل stream_payroll_list_sheet).
+    """
+    inventory_items = inventory_items or DEFAULT_INVENTORY_ITEMS
+    layout = detailed_inventory_layout(len(inventory_items))
+    set_rtl_and_column_widths(ws, INVENTORY_COL_WIDTHS)
+    for row in write_only_header_rows(ws, COMPANY_NAME, "موجودی تفصیلی انبار (مقدار و ریال)", "برای سال مالی منتهی به 29 اسفند 1403 و 1402",
+                                      "(ارقام به ریال برای قیمت واحد و میلیون ریال برای مقادیر)",
+                                      len(INVENTORY_QUANTITY_HEADERS) - 1, "بازگشت به وضعیت مالی", 'وضعیت مالی'):
+        ws.append(row)
+    ws.append([])
+    bold_cells = set(detailed_inventory_bold_cells(layout))
+    shared_formulas = isinstance(ws, DirectXlsxSheet)
+    for row_idx, row in enumerate(iter_detailed_inventory_rows(inventory_items, layout, shared_formulas), 7):
+        ws.append([styled_write_only_cell(ws, value, style='bold_total')
+                   if value is not None and f'{get_column_letter(col_idx)}{row_idx}' in bold_cells else value
+                   for col_idx, value in enumerate(row, 1)])
+
+
+def register_detailed_inventory_cells(cells, layout):
+    """جمع‌های ریالی موجودی تفصیلی و ارزش پایان دوره هر قلم (یک ردیف به ازای هر کالا)."""
+    total = layout['total']
+    for name, col_1403, col_1402 in [('inventory_opening_value', 'D', 'H'), ('inventory_purchases_value', 'E', 'I'),
+                                     ('inventory_cogs', 'F', 'J'), ('inventory_closing_value', 'G', 'K')]:
+        cells.register(name, 'موجودی_تفصیلی', {'1403': f'{col_1403}{total}', '1402': f'{col_1402}{total}'})
+    cells.register('inventory_item_closing_value', 'موجودی_تفصیلی',
+                   {'1403': f"G{layout['value_start']}", '1402': f"K{layout['value_start']}"},
+                   rows=layout['value_end'] - layout['value_start'] + 1)
+
+# ==============================================================================
+# دفتر گردش موجودی: بهای میانگین موزون متحرک از فایل تراکنش‌ها (به صورت جریانی)
+# ==============================================================================
+# ستون‌های فایل CSV گردش کالا؛ unit اختیاری است و unit_cost فقط برای ورود لازم است.
+# date به صورت 1403/05/12 و مرتب صعودی؛ تراکنش‌های پیش از اولین سال، موجودی افتتاحیه‌اند.
+INVENTORY_MOVEMENT_COLUMNS = ('date', 'item', 'unit', 'location', 'type', 'quantity', 'unit_cost')
+INVENTORY_MOVEMENT_TYPES = {'in': 1, 'ورود': 1, 'out': -1, 'خروج': -1}
+INVENTORY_LEDGER_YEARS = (1402, 1403)
+INVENTORY_LOCATIONS = [f"فارم {i}" for i in range(1, 11)] + [f"انبار {i}" for i in range(1, 6)]
+
+
+def _inventory_period_totals(slot_item, num_items, *columns):
+    """جمع ستون‌های سطح (کالا، محل) به سطح کالا."""
+    return [np.bincount(slot_item, weights=np.asarray(column, dtype=float), minlength=num_items) for column in columns]
+
+
+def cost_inventory_movements(path):
+    """
+    خواندن جریانی گردش کالا و محاسبه بهای میانگین موزون متحرک به ازای هر (کالا، محل).
+    مانده هر (کالا، محل) در چند لیست فشرده با اندیس ثابت نگه داشته می‌شود و فقط جمع ورود/خروج هر سال
+    ذخیره می‌شود، پس حافظه به تعداد تراکنش‌ها بستگی ندارد.
+    خروجی به قالب اقلام موجودی_تفصیلی است (مقادیر 1403 و 1402، بهای واحد میانگین پایان دوره) و
+    ارزش ریالی هر ستون (میلیون ریال) به انتهای هر قلم اضافه می‌شود.
+    """
+    years = INVENTORY_LEDGER_YEARS
+    first_year, last_year = years[0], years[-1]
+    slots, slot_item, items = {}, [], {}
+    quantity, value = [], []
+    # [دوره][نوع] -> لیست به ازای هر slot؛ دوره‌ها به ترتیب years
+    received_q = [[] for _ in years]
+    received_v = [[] for _ in years]
+    issued_q = [[] for _ in years]
+    issued_v = [[] for _ in years]
+    opening = {}
+    period, last_date = None, ''
+
+    with open(path, encoding='utf-8-sig', newline='') as f:
+        reader = csv.reader(f)
+        header = [name.strip() for name in next(reader, [])]
+        missing = [name for name in INVENTORY_MOVEMENT_COLUMNS if name not in header and name != 'unit']
+        if missing:
+            raise ValueError(f"ستون‌های لازم در فایل گردش کالا وجود ندارد: {', '.join(missing)}")
+        index = {name: header.index(name) for name in INVENTORY_MOVEMENT_COLUMNS if name in header}
+        date_i, item_i, location_i = index['date'], index['item'], index['location']
+        type_i, quantity_i, cost_i, unit_i = index['type'], index['quantity'], index['unit_cost'], index.get('unit')
+
+        for line_no, row in enumerate(reader, 2):
+            if not row:
+                continue
+            date = row[date_i].strip()
+            if date < last_date:
+                raise ValueError(f"تاریخ‌های گردش کالا مرتب نیستند (سطر {line_no}: {date} پس از {last_date})")
+            last_date = date
+            try:
+                year = int(date[:4])
+                direction = INVENTORY_MOVEMENT_TYPES[row[type_i].strip()]
+                moved = float(row[quantity_i])
+                unit_cost = float(row[cost_i]) if direction > 0 else 0.0
+            except (ValueError, KeyError):
+                raise ValueError(f"تراکنش نامعتبر در سطر {line_no}: {row}")
+            if year > last_year:
+                raise ValueError(f"تاریخ {date} (سطر {line_no}) پس از آخرین سال گزارش ({last_year}) است.")
+
+            # شروع دوره جدید: مانده فعلی همه slotها موجودی ابتدای دوره است
+            row_period = year - first_year if year >= first_year else None
+            while row_period is not None and (period is None or period < row_period):
+                period = 0 if period is None else period + 1
+                opening[period] = (list(quantity), list(value))
+
+            key = (row[item_i].strip(), row[location_i].strip())
+            slot = slots.get(key)
+            if slot is None:
+                slot = slots[key] = len(quantity)
+                item_key = key[0]
+                if item_key not in items:
+                    items[item_key] = (len(items), row[unit_i].strip() if unit_i is not None else '')
+                slot_item.append(items[item_key][0])
+                quantity.append(0.0)
+                value.append(0.0)
+                for totals in (*received_q, *received_v, *issued_q, *issued_v):
+                    totals.append(0.0)
+
+            if direction > 0:
+                quantity[slot] += moved
+                value[slot] += moved * unit_cost
+                if period is not None:
+                    received_q[period][slot] += moved
+                    received_v[period][slot] += moved * unit_cost
+            else:
+                on_hand = quantity[slot]
+                if moved > on_hand + 1e-9:
+                    raise ValueError(f"خروج {moved:,} بیش از موجودی {on_hand:,} برای {key[0]} در {key[1]} (سطر {line_no})")
+                cost = value[slot] * moved / on_hand if on_hand else 0.0
+                quantity[slot] = on_hand - moved
+                value[slot] -= cost
+                if period is not None:
+                    issued_q[period][slot] += moved
+                    issued_v[period][slot] += cost
+
+    # دوره‌هایی که هیچ تراکنشی ندارند همان مانده قبلی را ابتدای دوره دارند
+    while period is None or period < len(years) - 1:
+        period = 0 if period is None else period + 1
+        opening[period] = (list(quantity), list(value))
+
+    slot_item = np.asarray(slot_item, dtype=np.int64)
+    num_items, num_slots = len(items), len(quantity)
+    per_year = {}
+    for p, year in enumerate(years):
+        open_q, open_v = (column + [0.0] * (num_slots - len(column)) for column in opening[p])
+        per_year[year] = _inventory_period_totals(slot_item, num_items, open_q, received_q[p], issued_q[p],
+                                                  open_v, received_v[p], issued_v[p])
+    closing_q, closing_v = _inventory_period_totals(slot_item, num_items, quantity, value)
+
+    def qty(x):
+        x = round(float(x), 3)
+        return int(x) if x.is_integer() else x
+
+    def millions(x):
+        return round(float(x) / 1_000_000, 0)
+
+    costed_items = []
+    for name, (i, unit) in items.items():
+        q_1403 = per_year[last_year][:3]
+        q_1402 = per_year[first_year][:3]
+        v_1403 = per_year[last_year][3:]
+        v_1402 = per_year[first_year][3:]
+        average_cost = round(float(closing_v[i] / closing_q[i]), 2) if closing_q[i] else 0
+        costed_items.append((
+            i + 1, name, unit,
+            *(qty(column[i]) for column in q_1403), *(qty(column[i]) for column in q_1402), average_cost,
+            *(millions(column[i]) for column in v_1403), millions(v_1403[0][i] + v_1403[1][i] - v_1403[2][i]),
+            *(millions(column[i]) for column in v_1402), millions(v_1402[0][i] + v_1402[1][i] - v_1402[2][i]),
+        ))
+    return costed_items
+
+
+def _jalali_dates(day_index, first_year=INVENTORY_LEDGER_YEARS[0]):
+    """تبدیل برداری شماره روز (از ابتدای first_year، سال 365 روزه) به رشته تاریخ 1403/05/12."""
+    month_starts = np.cumsum([0] + [31] * 6 + [30] * 5)
+    year = first_year + day_index // 365
+    day_of_year = day_index % 365
+    month = np.searchsorted(month_starts, day_of_year, side='right')
+    day = day_of_year - month_starts[month - 1] + 1
+    return [f"{y}/{m:02d}/{d:02d}" for y, m, d in zip(year.tolist(), month.tolist(), day.tolist())]
+
+
+def generate_inventory_movements(path, num_movements=1_000_000, seed=None, locations=None, chunk_size=200_000):
+    """
+    تولید فایل فرضی گردش کالا (برای آزمون بار) برای اقلام DEFAULT_INVENTORY_ITEMS در فارم‌ها و انبارها:
+    یک ردیف موجودی افتتاحیه به ازای هر (کالا، محل) و سپس جفت‌های ورود/خروج مرتب بر اساس تاریخ.
+    مقدار هر خروج از ورود همان جفت بیشتر نیست تا موجودی هیچ‌گاه منفی نشود.
+    """
+    rng = np.random.default_rng(seed)
+    locations = locations or INVENTORY_LOCATIONS
+    templates = DEFAULT_INVENTORY_ITEMS
+    num_keys = len(templates) * len(locations)
+    key_item = np.repeat(np.arange(len(templates)), len(locations))
+    key_location = np.tile(np.arange(len(locations)), len(templates))
+    prices = np.array([item[9] for item in templates], dtype=float)
+    yearly_in = np.array([item[7] for item in templates], dtype=float) / len(locations)
+
+    num_pairs = max(0, num_movements - num_keys) // 2
+    pair_key = rng.integers(0, num_keys, size=num_pairs)
+    pair_day = rng.integers(0, 365 * len(INVENTORY_LEDGER_YEARS), size=num_pairs)
+    order = np.lexsort((np.arange(num_pairs), pair_day))
+    pair_key, pair_day = pair_key[order], pair_day[order]
+    # مقدار ورود طوری که جمع سالانه هر (کالا، محل) نزدیک ورود سالانه قالب باشد
+    pairs_per_year = max(1.0, num_pairs / (num_keys * len(INVENTORY_LEDGER_YEARS)))
+    received = np.maximum(1, np.rint(yearly_in[key_item[pair_key]] / pairs_per_year * rng.uniform(0.5, 1.5, size=num_pairs)))
+    issued = np.rint(received * rng.uniform(0.85, 1.0, size=num_pairs))
+    inflation = 1 + 0.4 * pair_day / (365 * len(INVENTORY_LEDGER_YEARS))
+    unit_cost = np.round(prices[key_item[pair_key]] * inflation * rng.uniform(0.9, 1.1, size=num_pairs), 2)
+
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(INVENTORY_MOVEMENT_COLUMNS)
+        opening_date = f"{INVENTORY_LEDGER_YEARS[0] - 1}/12/29"
+        writer.writerows(
+            (opening_date, templates[i][1], templates[i][2], locations[l], 'in',
+             int(templates[i][6] / len(locations)), templates[i][9])
+            for i, l in zip(key_item.tolist(), key_location.tolist()))
+        for start in range(0, num_pairs, chunk_size // 2):
+            part = slice(start, start + chunk_size // 2)
+            dates = _jalali_dates(pair_day[part])
+            keys = pair_key[part].tolist()
+            rows = []
+            for date, key, q_in, q_out, cost in zip(dates, keys, received[part].tolist(), issued[part].tolist(),
+                                                    unit_cost[part].tolist()):
+                item = templates[key_item[key]]
+                location = locations[key_location[key]]
+                rows.append((date, item[1], item[2], location, 'in', int(q_in), cost))
+                rows.append((date, item[1], item[2], location, 'out', int(q_out), ''))
+            writer.writerows(rows)
+    return num_keys + 2 * num_pairs
+
+
 # ==============================================================================
 # تابع اصلاح شده ۱: populate_note_8_and_9 (یادداشت‌های هزینه)
 # ==============================================================================
-def populate_note_8_and_9(wb):
+def expense_notes_layout(num_cogs_items=4, num_sales_items=2, num_admin_items=4):
+    """آدرس ردیف‌های یادداشت 9 (بهای تمام شده) و یادداشت 8 (هزینه‌های فروش، اداری و عمومی)؛ عنوان ستون‌ها در ردیف 6."""
+    sales_start = 8 # ردیف 7 عنوان «هزینه‌های فروش و توزیع»
+    sales_total = sales_start + num_sales_items
+    admin_start = sales_total + 2 # یک ردیف عنوان «هزینه‌های اداری و عمومی»
+    admin_total = admin_start + num_admin_items
+    return {
+        'cogs_start': 7,
+        'cogs_end': 6 + num_cogs_items,
+        'cogs_total': 7 + num_cogs_items,
+        'sales_start': sales_start,
+        'sales_end': sales_total - 1,
+        'sales_total': sales_total,
+        'admin_start': admin_start,
+        'admin_end': admin_total - 1,
+        'admin_total': admin_total,
+        'sga_total': admin_total + 2,
+    }
+
+
+def populate_note_8_and_9(wb, cells=None, trial_balance=None):
+    cells = cells if cells is not None else report_cell_registry()
     ## یادداشت 9: بهای تمام شده
     ws9 = wb['9']
     # Clear existing content to avoid duplicates on re-run if sheet already exists
@@ -512,17 +1457,30 @@ def populate_note_8_and_9(wb):
     add_header(ws9, "شرکت نمونه", "یادداشت 9: بهای تمام شده", "سال مالی منتهی به 29 اسفند 1403 و 1402", "(مبالغ به میلیون ریال)")
     ws9.append(['', 'شرح', '1403', '1402'])
     cogs_items = [
-        ("بهای تمام شده کالای فروش رفته", "='موجودی_تفصیلی'!F27", "='موجودی_تفصیلی'!J27"),
-        ("حقوق و دستمزد مستقیم تولید", 450000, 400000),
-        ("هزینه استهلاک دارایی‌های تولیدی (80%)", "='گردش دارایی ثابت'!D11*0.8", "='گردش دارایی ثابت'!D6*0.8"),
+        ("بهای تمام شده کالای فروش رفته", f"={cells.ref('inventory_cogs', '1403')}", f"={cells.ref('inventory_cogs', '1402')}"),
+        ("حقوق و دستمزد مستقیم تولید", f"={cells.ref('payroll_ledger_production', '1403')}", f"={cells.ref('payroll_ledger_production', '1402')}"),
+        ("هزینه استهلاک دارایی‌های تولیدی (80%)", f"={cells.ref('depreciation_expense', '1403')}*0.8", f"={cells.ref('depreciation_expense', '1402')}*0.8"),
         ("سایر هزینه‌های مستقیم تولید (سربار)", 50000, 45000)
     ]
-    start_row = ws9.max_row + 1
+    sga_sales_items = [
+        ("هزینه پرسنل فروش", f"={cells.ref('payroll_ledger_selling', '1403')}", f"={cells.ref('payroll_ledger_selling', '1402')}"),
+        ("هزینه تبلیغات و بازاریابی", 50000, 40000)
+    ]
+    sga_admin_items = [
+        ("هزینه پرسنل اداری", f"={cells.ref('payroll_ledger_admin', '1403')}", f"={cells.ref('payroll_ledger_admin', '1402')}"),
+        ("هزینه استهلاک دارایی‌های اداری (20%)", f"={cells.ref('depreciation_expense', '1403')}*0.2", f"={cells.ref('depreciation_expense', '1402')}*0.2"),
+        ("هزینه ذخیره مزایای پایان خدمت کارکنان", 80000, 75000), ## <-- فرض ثابت و شفاف برای هزینه
+        ("سایر هزینه‌های اداری", 30000, 25000)
+    ]
+    cogs_items = ledger_note_items(trial_balance, '9', cogs_items)
+    sga_sales_items = ledger_note_items(trial_balance, '8', sga_sales_items)
+    sga_admin_items = ledger_note_items(trial_balance, '8', sga_admin_items)
+    layout = expense_notes_layout(len(cogs_items), len(sga_sales_items), len(sga_admin_items))
+
     for item in cogs_items:
         ws9.append(['', item[0], item[1], item[2]])
-    end_row = ws9.max_row
-    total_row = end_row + 1
-    ws9.cell(row=total_row, column=2, value="جمع کل بهای تمام شده").font = Font(bold=True)
+    start_row, end_row, total_row = layout['cogs_start'], layout['cogs_end'], layout['cogs_total']
+    apply_style(ws9.cell(row=total_row, column=2, value="جمع کل بهای تمام شده"), 'bold_total')
     ws9[f'C{total_row}'] = f"=SUM(C{start_row}:C{end_row})"
     ws9[f'D{total_row}'] = f"=SUM(D{start_row}:D{end_row})"
     ws9.cell(row=1, column=max(1, ws9.max_column - 1), value="بازگشت به سود و زیان").hyperlink = f"#'سودوزیان'!A1"
@@ -539,52 +1497,109 @@ def populate_note_8_and_9(wb):
     add_header(ws8, "شرکت نمونه", "یادداشت 8: هزینه‌های فروش، اداری و عمومی", "سال مالی منتهی به 29 اسفند 1403 و 1402", "(مبالغ به میلیون ریال)")
     ws8.append(['', 'شرح', '1403', '1402'])
     ws8.append(['', 'الف) هزینه‌های فروش و توزیع:'])
-    sga_sales_items = [
-        ("هزینه پرسنل فروش", 250000, 220000),
-        ("هزینه تبلیغات و بازاریابی", 50000, 40000)
-    ]
-    start_row_s = ws8.max_row + 1
     for item in sga_sales_items:
         ws8.append(['', item[0], item[1], item[2]])
-    end_row_s = ws8.max_row
-    total_row_s = end_row_s + 1
-    ws8.cell(row=total_row_s, column=2, value="جمع هزینه‌های فروش").font = Font(bold=True)
+    start_row_s, end_row_s, total_row_s = layout['sales_start'], layout['sales_end'], layout['sales_total']
+    apply_style(ws8.cell(row=total_row_s, column=2, value="جمع هزینه‌های فروش"), 'bold_total')
     ws8[f'C{total_row_s}'] = f"=SUM(C{start_row_s}:C{end_row_s})"
     ws8[f'D{total_row_s}'] = f"=SUM(D{start_row_s}:D{end_row_s})"
 
     ws8.append(['', 'ب) هزینه‌های اداری و عمومی:'])
-    sga_admin_items = [
-        ("هزینه پرسنل اداری", 350000, 320000),
-        ("هزینه استهلاک دارایی‌های اداری (20%)", "='گردش دارایی ثابت'!D11*0.2", "='گردش دارایی ثابت'!D6*0.2"),
-        ("هزینه ذخیره مزایای پایان خدمت کارکنان", 80000, 75000), ## <-- فرض ثابت و شفاف برای هزینه
-        ("سایر هزینه‌های اداری", 30000, 25000)
-    ]
-    start_row_a = ws8.max_row + 1
     for item in sga_admin_items:
         ws8.append(['', item[0], item[1], item[2]])
-    end_row_a = ws8.max_row
-    total_row_a = end_row_a + 1
-    ws8.cell(row=total_row_a, column=2, value="جمع هزینه‌های اداری").font = Font(bold=True)
+    start_row_a, end_row_a, total_row_a = layout['admin_start'], layout['admin_end'], layout['admin_total']
+    apply_style(ws8.cell(row=total_row_a, column=2, value="جمع هزینه‌های اداری"), 'bold_total')
     ws8[f'C{total_row_a}'] = f"=SUM(C{start_row_a}:C{end_row_a})"
     ws8[f'D{total_row_a}'] = f"=SUM(D{start_row_a}:D{end_row_a})"
      
     ws8.append([''])
-    total_row_all = ws8.max_row + 1
-    ws8.cell(row=total_row_all, column=2, value="جمع کل هزینه‌های فروش، اداری و عمومی").font = Font(bold=True)
+    total_row_all = layout['sga_total']
+    apply_style(ws8.cell(row=total_row_all, column=2, value="جمع کل هزینه‌های فروش، اداری و عمومی"), 'bold_total')
     ws8[f'C{total_row_all}'] = f"=C{total_row_s}+C{total_row_a}"
     ws8[f'D{total_row_all}'] = f"=D{total_row_s}+D{total_row_a}"
     ws8.cell(row=1, column=max(1, ws8.max_column - 1), value="بازگشت به سود و زیان").hyperlink = f"#'سودوزیان'!A1"
     ws8.cell(row=1, column=max(1, ws8.max_column - 1)).style = "Hyperlink"
 
 
+def register_expense_note_cells(cells, layout=None):
+    """خروجی‌های یادداشت 9 (جمع بهای تمام شده) و یادداشت 8 (اقلام و جمع‌های هزینه‌های فروش، اداری و عمومی)."""
+    layout = layout or expense_notes_layout()
+    cells.register('cost_of_sales_total', '9', {'1403': f"C{layout['cogs_total']}", '1402': f"D{layout['cogs_total']}"})
+    for name, row_idx in [
+        ('selling_personnel_expense', layout['sales_start']), ('selling_expenses', layout['sales_total']),
+        ('admin_personnel_expense', layout['admin_start']), ('admin_depreciation', layout['admin_start'] + 1),
+        ('end_of_service_expense', layout['admin_start'] + 2), ('admin_expenses', layout['admin_total']),
+        ('sga_expenses', layout['sga_total']),
+    ]:
+        cells.register(name, '8', {'1403': f'C{row_idx}', '1402': f'D{row_idx}'})
+
+
+# ==============================================================================
+# حل چرخه‌های تامین مالی: درآمد مالی بر میانگین مانده نقد، سود خالص و سود سهام
+# ==============================================================================
+# هزینه مالی (نرخ × میانگین مانده تسهیلات) فقط به مفروضات وابسته است، اما درآمد مالی بر میانگین مانده نقد
+# چرخه واقعی دارد: درآمد مالی -> سود خالص -> سود سهام پرداختی -> موجودی نقد پایان دوره -> درآمد مالی.
+# این چرخه خطی است (با یک شکست در صفر به خاطر مالیات)؛ در صورت‌ها با فرمول بسته و در پیش‌بینی چندساله
+# با تکرار نقطه ثابت حل می‌شود، پس به محاسبه تکراری اکسل نیازی نیست.
+FIXED_POINT_TOLERANCE = 1e-6 # حداکثر |g(x) - x| در جواب (میلیون ریال)
+FIXED_POINT_MAX_ITERATIONS = 50
+
+# value: جواب (عدد یا آرایه)، iterations: تعداد تکرار تا همگرایی، residual: حداکثر |g(x) - x| در جواب
+FixedPointSolution = namedtuple('FixedPointSolution', ['value', 'iterations', 'residual'])
+
+
+class ConvergenceError(ValueError):
+    """تکرار نقطه ثابت در حداکثر تعداد تکرار به دقت خواسته شده نرسید."""
+
+
+def solve_fixed_point(update, initial, tolerance=FIXED_POINT_TOLERANCE, max_iterations=FIXED_POINT_MAX_ITERATIONS):
+    """
+    حل x = update(x) برای یک عدد یا آرایه numpy؛ تکرار تا وقتی حداکثر تغییر از tolerance کمتر شود.
+    چرخه‌های تامین مالی انقباضی‌اند (ضریب حدود نرخ سود سپرده × سهم سود نگه داشته شده / 2)، پس هر تکرار
+    چند رقم دقت اضافه می‌کند. باقیمانده جواب جداگانه بررسی می‌شود؛ در صورت واگرایی ConvergenceError.
+    """
+    value = np.asarray(initial, dtype=float)
+    change = math.inf
+    for iteration in range(1, max_iterations + 1):
+        updated = np.asarray(update(value), dtype=float)
+        # تغییر نسبی برای مقادیر بزرگ‌تر از 1 (تا دقت با بزرگی ارقام سال‌های دور پیش‌بینی متناسب باشد)
+        change = float(np.max(np.abs(updated - value) / np.maximum(np.abs(updated), 1.0), initial=0.0))
+        value = updated
+        if change <= tolerance:
+            residual = float(np.max(np.abs(np.asarray(update(value), dtype=float) - value) / np.maximum(np.abs(value), 1.0),
+                                    initial=0.0))
+            if residual <= tolerance:
+                return FixedPointSolution(value if value.ndim else float(value), iteration, residual)
+    raise ConvergenceError(f"حل نقطه ثابت پس از {max_iterations} تکرار همگرا نشد (آخرین تغییر {change:,.6g}).")
+
+
+def finance_income_formula(profit_before_finance_income, deposit_rate, tax_rate, payout_ratio, opening_cash, cash_before_profit):
+    """
+    فرمول بسته درآمد مالی بر میانگین مانده نقد، بدون ارجاع چرخشی (ورودی‌ها متن فرمول یا آدرس سلول‌اند).
+    با B سود قبل از مالیات بدون درآمد مالی، C0 نقد اول دوره، K نقد پایان دوره پیش از سود خالص و سود سهام،
+    r نرخ سود سپرده، p نسبت تقسیم سود و t نرخ مالیات: درآمد مالی = r(C0 + K + (1-p)X)/2 که X سود خالص است.
+    با Bp = B + r(C0+K)/2 و k = r(1-p)/2 سود قبل از مالیات Bp/(1-(1-t)k) (اگر Bp مثبت باشد) و وگرنه Bp/(1-k) است.
+    """
+    base = f"({profit_before_finance_income})"
+    adjusted = f"({base}+{deposit_rate}*({opening_cash}+{cash_before_profit})/2)"
+    retained = f"({deposit_rate}*(1-{payout_ratio})/2)"
+    return f"=IF({adjusted}>0,{adjusted}/(1-(1-{tax_rate})*{retained}),{adjusted}/(1-{retained}))-{base}"
+
 # ==============================================================================
 # تابع اصلاح شده ۳: populate_profit_loss_sheet (کاملاً یکپارچه)
 # ==============================================================================
-def populate_profit_loss_sheet(ws, assumption_map):
-    """ایجاد صورت سود و زیان یکپارچه که هزینه‌ها را از یادداشت‌ها می‌خواند."""
+BASE_REVENUE_1402 = 2_100_000 # درآمد عملیاتی سال 1402 (میلیون ریال)؛ سال‌های بعد با درصد رشد مفروضات
+
+
+def populate_profit_loss_sheet(ws, cells=None, trial_balance=None):
+    """
+    ایجاد صورت سود و زیان یکپارچه که هزینه‌ها را از یادداشت‌ها می‌خواند.
+    با trial_balance درآمد و سایر درآمدها/هزینه‌ها از اقلام pl: دفتر کل خوانده می‌شوند.
+    """
+    cells = cells if cells is not None else report_cell_registry()
     col_widths = {'A': 5, 'B': 40, 'C': 12, 'D': 18, 'E': 10, 'F': 18, 'G': 18}
     set_rtl_and_column_widths(ws, col_widths)
-    add_header(ws, "شرکت نمونه (سهامی عام)", "صورت سود و زیان (یکپارچه)", "سال مالی منتهی به 29 اسفند 1403 و 1402", "(ارقام به میلیون ریال)")
+    add_header(ws, COMPANY_NAME, "صورت سود و زیان (یکپارچه)", "سال مالی منتهی به 29 اسفند 1403 و 1402", "(ارقام به میلیون ریال)")
     # Clear existing content to avoid duplicates on re-run if sheet already exists
     for row in ws.iter_rows(min_row=7): # Start clearing from row 7 to keep header
         for cell in row:
@@ -592,37 +1607,49 @@ def populate_profit_loss_sheet(ws, assumption_map):
 
     ws.append(["", "", "", "", "یادداشت", "سال 1403", "سال 1402"])
 
-    base_revenue_1402 = 2100000
-    ws['G8'] = base_revenue_1402
+    ws['G8'] = ledger_value(trial_balance, 'pl:revenue', 1402, BASE_REVENUE_1402)
     
-    ws['F8'] = f"=G8*(1+'مفروضات'!{assumption_map['درصد رشد درآمدهای عملیاتی']['1403']})"
+    ws['F8'] = ledger_value(trial_balance, 'pl:revenue', 1403, f"=G8*(1+{cells.ref('درصد رشد درآمدهای عملیاتی', '1403')})")
     
-    # <<-- اصلاح: لینک به ردیف صحیح 13 در یادداشت‌های هزینه
-    ws['F9'] = "=-'9'!C13"
-    ws['G9'] = "=-'9'!D13"
+    # جمع یادداشت‌های هزینه از طریق نشانی نمادین (نه ردیف ثابت)
+    ws['F9'] = f"=-{cells.ref('cost_of_sales_total', '1403')}"
+    ws['G9'] = f"=-{cells.ref('cost_of_sales_total', '1402')}"
     
-    ws['F12'] = "=-'8'!C23"
-    ws['G12'] = "=-'8'!D23"
+    ws['F12'] = f"=-{cells.ref('sga_expenses', '1403')}"
+    ws['G12'] = f"=-{cells.ref('sga_expenses', '1402')}"
 
     ws['F10'] = '=SUM(F8:F9)'
     ws['G10'] = '=SUM(G8:G9)'
     
-    ws['F13'] = 150000 
-    ws['G13'] = 120000
-    ws['F14'] = -10000
-    ws['G14'] = -30000
+    ws['F13'] = ledger_value(trial_balance, 'pl:other_income', 1403, 150000)
+    ws['G13'] = ledger_value(trial_balance, 'pl:other_income', 1402, 120000)
+    ws['F14'] = ledger_value(trial_balance, 'pl:other_expense', 1403, -10000)
+    ws['G14'] = ledger_value(trial_balance, 'pl:other_expense', 1402, -30000)
     
     ws['F15'] = '=SUM(F10,F12:F14)'
     ws['G15'] = '=SUM(G10,G12:G14)'
     
-    ws['F17'] = f"=-'مفروضات'!{assumption_map['هزینه مالی ثابت']['1403']}"
-    ws['G17'] = f"=-'مفروضات'!{assumption_map['هزینه مالی ثابت']['1402']}"
-    
-    ws['F18'] = '=SUM(F15,F17)'
-    ws['G18'] = '=SUM(G15,G17)'
+    # هزینه مالی: نرخ سود تسهیلات × میانگین مانده اول و پایان دوره (بخش جاری و بلندمدت)
+    ws['F17'] = (f"=-{cells.ref('نرخ سود تسهیلات (بر میانگین مانده)', '1403')}*"
+                 f"({cells.ref('current_portion_of_debt', '1402')}+{cells.ref('long_term_debt', '1402')}"
+                 f"+{cells.ref('current_portion_of_debt', '1403')}+{cells.ref('long_term_debt', '1403')})/2")
+    ws['G17'] = (f"=-{cells.ref('نرخ سود تسهیلات (بر میانگین مانده)', '1402')}*"
+                 f"({cells.ref('opening_current_portion_of_debt')}+{cells.ref('opening_long_term_debt')}"
+                 f"+{cells.ref('current_portion_of_debt', '1402')}+{cells.ref('long_term_debt', '1402')})/2")
+
+    # درآمد مالی بر میانگین مانده نقد: حل بسته چرخه با سود خالص و سود سهام (finance_income_formula)
+    for col_letter, year in (('F', '1403'), ('G', '1402')):
+        ws[f'{col_letter}16'] = finance_income_formula(
+            f"{col_letter}15+{col_letter}17", f"{cells.ref('نرخ سود سپرده بانکی (بر میانگین مانده نقد)', year)}",
+            f"{cells.ref('نرخ مالیات بر درآمد', year)}",
+            f"{cells.ref('سود سهام پرداختی (درصد از سود خالص)', year)}",
+            cells.ref('period_opening_cash', year), cells.ref('cash_before_profit', year))
+
+    ws['F18'] = '=SUM(F15:F17)'
+    ws['G18'] = '=SUM(G15:G17)'
     
-    ws['F20'] = f"=IF(F18>0, F18*(-'مفروضات'!{assumption_map['نرخ مالیات بر درآمد']['1403']}), 0)"
-    ws['G20'] = f"=IF(G18>0, G18*(-'مفروضات'!{assumption_map['نرخ مالیات بر درآمد']['1402']}), 0)"
+    ws['F20'] = f"=IF(F18>0, F18*(-{cells.ref('نرخ مالیات بر درآمد', '1403')}), 0)"
+    ws['G20'] = f"=IF(G18>0, G18*(-{cells.ref('نرخ مالیات بر درآمد', '1402')}), 0)"
     
     ws['F21'] = '=F18+F20'
     ws['G21'] = '=G18+G20'
@@ -631,7 +1658,7 @@ def populate_profit_loss_sheet(ws, assumption_map):
         (8, "درآمدهای عملیاتی", '5'), (9, "بهای تمام شده درآمدهای عملیاتی", '9'),
         (10, "سود ناخالص", None), (12, "هزینه‌های فروش ، اداری و عمومی", '8'),
         (13, "سایر درآمدها", '26.27'), (14, "سایر هزینه‌ها", '26.27'),
-        (15, "سود عملیاتی", None), (17, "هزینه‌های مالی", '26.27'),
+        (15, "سود عملیاتی", None), (16, "درآمدهای مالی", '26.27'), (17, "هزینه‌های مالی", '26.27'),
         (18, "سود قبل از مالیات", None), (20, "مالیات بر درآمد", '34'),
         (21, "سود خالص", None)
     ]
@@ -639,7 +1666,7 @@ def populate_profit_loss_sheet(ws, assumption_map):
         ws[f'B{row_num}'] = text
         if "سود" in text or "زیان" in text:
             for col in ['B', 'F', 'G']:
-                ws[f'{col}{row_num}'].font = Font(bold=True)
+                apply_style(ws[f'{col}{row_num}'], 'bold_total')
         if note_name:
             ws.cell(row=row_num, column=5, value=note_name).hyperlink = f"#'{note_name}'!A1"
             ws.cell(row=row_num, column=5).style = "Hyperlink"
@@ -647,13 +1674,22 @@ def populate_profit_loss_sheet(ws, assumption_map):
     ws.cell(row=1, column=max(1, ws.max_column - 1), value="بازگشت به وضعیت مالی").hyperlink = f"#'وضعیت مالی'!A1"
     ws.cell(row=1, column=max(1, ws.max_column - 1)).style = "Hyperlink"
 
+
+def register_profit_loss_cells(cells):
+    """ردیف‌های اصلی صورت سود و زیان (ستون F برای 1403 و G برای 1402)."""
+    for name, row_idx in [('revenue', 8), ('cost_of_revenue', 9), ('gross_profit', 10), ('sga_expense', 12),
+                          ('operating_profit', 15), ('finance_income', 16), ('finance_cost', 17), ('profit_before_tax', 18),
+                          ('income_tax', 20), ('net_profit', 21)]:
+        cells.register(name, 'سودوزیان', {'1403': f'F{row_idx}', '1402': f'G{row_idx}'})
+
 # ==============================================================================
 # تابع اصلاح شده ۴: populate_balance_sheet (با ارجاعات جدید به ترازنامه پایه)
 # ==============================================================================
-def populate_balance_sheet(ws, assumption_map):
+def populate_balance_sheet(ws, cells=None):
+    cells = cells if cells is not None else report_cell_registry()
     col_widths = {'A': 5, 'B': 40, 'C': 45, 'D': 12, 'E': 18, 'F': 18}
     set_rtl_and_column_widths(ws, col_widths)
-    add_header(ws, "شرکت نمونه (سهامی عام)", "صورت وضعیت مالی (پویا)", "در تاریخ 29 اسفند 1403 و 1402", "(ارقام به میلیون ریال)")
+    add_header(ws, COMPANY_NAME, "صورت وضعیت مالی (پویا)", "در تاریخ 29 اسفند 1403 و 1402", "(ارقام به میلیون ریال)")
 
     for row in ws.iter_rows(min_row=7):
         for cell in row:
@@ -666,23 +1702,22 @@ def populate_balance_sheet(ws, assumption_map):
     
     ws.cell(row=10, column=3, value="موجودی نقد")
     ws.cell(row=10, column=4, value=6)
-    ws.cell(row=10, column=5, value="='جریان های نقدی'!C31") # پایان دوره 1403 از جریان نقد
-    ws.cell(row=10, column=6, value="='ترازنامه پایه'!D10") # ابتدای دوره 1402 از ترازنامه پایه
+    ws.cell(row=10, column=5, value=f"={cells.ref('closing_cash', '1403')}") # پایان دوره 1403 از جریان نقد
+    ws.cell(row=10, column=6, value=f"={cells.ref('opening_cash')}") # ابتدای دوره 1402 از ترازنامه پایه
     ws.cell(row=10, column=4).hyperlink = f"#'6'!A1"
     ws.cell(row=10, column=4).style = "Hyperlink"
 
     ws.cell(row=11, column=3, value="حساب‌ها و اسناد دریافتنی")
-    ws.cell(row=11, column=5, value=f"=('مفروضات'!{assumption_map['دوره وصول مطالبات (روز)']['1403']}/365)*'سودوزیان'!F8")
-    ws.cell(row=11, column=6, value=f"=('مفروضات'!{assumption_map['دوره وصول مطالبات (روز)']['1402']}/365)*'سودوزیان'!G8")
+    ws.cell(row=11, column=5, value=f"=({cells.ref('دوره وصول مطالبات (روز)', '1403')}/365)*{cells.ref('revenue', '1403')}")
+    ws.cell(row=11, column=6, value=f"=({cells.ref('دوره وصول مطالبات (روز)', '1402')}/365)*{cells.ref('revenue', '1402')}")
     ws.cell(row=11, column=4, value="42.43")
     ws.cell(row=11, column=4).hyperlink = f"#'42.43'!A1"
     ws.cell(row=11, column=4).style = "Hyperlink"
 
     ws.cell(row=12, column=3, value="موجودی کالا")
     ws.cell(row=12, column=4, value=9)
-    # <<-- اصلاح شده: لینک به ردیف صحیح 27 در شیت موجودی تفصیلی
-    ws.cell(row=12, column=5, value="='موجودی_تفصیلی'!G27")
-    ws.cell(row=12, column=6, value="='ترازنامه پایه'!D12") # ابتدای دوره 1402 از ترازنامه پایه
+    ws.cell(row=12, column=5, value=f"={cells.ref('inventory_closing_value', '1403')}") # جمع پایان دوره در موجودی تفصیلی
+    ws.cell(row=12, column=6, value=f"={cells.ref('opening_inventory')}") # ابتدای دوره 1402 از ترازنامه پایه
     ws.cell(row=12, column=4).hyperlink = f"#'موجودی'!A1"
     ws.cell(row=12, column=4).style = "Hyperlink"
 
@@ -702,8 +1737,8 @@ def populate_balance_sheet(ws, assumption_map):
     
     ws.cell(row=17, column=3, value="دارایی‌های ثابت مشهود (ارزش دفتری)")
     ws.cell(row=17, column=4, value="گردش دارایی ثابت")
-    ws.cell(row=17, column=5, value="='گردش دارایی ثابت'!E13") # پایان دوره 1403 از گردش دارایی
-    ws.cell(row=17, column=6, value="='گردش دارایی ثابت'!E8") # ابتدای دوره 1402 از گردش دارایی
+    ws.cell(row=17, column=5, value=f"={cells.ref('fixed_assets_net_book_value', '1403')}") # پایان دوره 1403 از گردش دارایی
+    ws.cell(row=17, column=6, value=f"={cells.ref('fixed_assets_net_book_value', '1402')}") # پایان دوره 1402 از گردش دارایی
     ws.cell(row=17, column=4).hyperlink = f"#'گردش دارایی ثابت'!A1"
     ws.cell(row=17, column=4).style = "Hyperlink"
 
@@ -727,16 +1762,16 @@ def populate_balance_sheet(ws, assumption_map):
     ws.cell(row=23, column=2, value="بدهی‌ها و حقوق مالکانه")
     ws.cell(row=24, column=2, value="بدهی‌های جاری")
     ws.cell(row=25, column=3, value="حساب‌ها و اسناد پرداختنی")
-    ws.cell(row=25, column=5, value=f"=('مفروضات'!{assumption_map['دوره پرداخت بدهی‌ها (روز)']['1403']}/365)*-'9'!C13") # Updated to use COGS from Note 9
-    ws.cell(row=25, column=6, value=f"=('مفروضات'!{assumption_map['دوره پرداخت بدهی‌ها (روز)']['1402']}/365)*-'9'!D13") # Updated to use COGS from Note 9
+    ws.cell(row=25, column=5, value=f"=({cells.ref('دوره پرداخت بدهی‌ها (روز)', '1403')}/365)*-{cells.ref('cost_of_sales_total', '1403')}") # بهای تمام شده از یادداشت 9
+    ws.cell(row=25, column=6, value=f"=({cells.ref('دوره پرداخت بدهی‌ها (روز)', '1402')}/365)*-{cells.ref('cost_of_sales_total', '1402')}") # بهای تمام شده از یادداشت 9
     ws.cell(row=25, column=4, value="28.29.30.31")
     ws.cell(row=25, column=4).hyperlink = f"#'28.29.30.31'!A1"
     ws.cell(row=25, column=4).style = "Hyperlink"
 
     ws.cell(row=26, column=3, value="مالیات پرداختنی")
     ws.cell(row=26, column=4, value=17)
-    ws.cell(row=26, column=5, value="='سودوزیان'!F20*-1")
-    ws.cell(row=26, column=6, value="='سودوزیان'!G20*-1")
+    ws.cell(row=26, column=5, value=f"={cells.ref('income_tax', '1403')}*-1")
+    ws.cell(row=26, column=6, value=f"={cells.ref('income_tax', '1402')}*-1")
     ws.cell(row=26, column=4).hyperlink = f"#'17'!A1"
     ws.cell(row=26, column=4).style = "Hyperlink"
 
@@ -749,8 +1784,8 @@ def populate_balance_sheet(ws, assumption_map):
     ws.cell(row=27, column=4).style = "Hyperlink"
 
     ws.cell(row=28, column=3, value="بخش جاری تسهیلات بلندمدت")
-    ws.cell(row=28, column=5, value=f"='مفروضات'!{assumption_map['مبلغ بازپرداخت اصل وام طی سال']['1403']}")
-    ws.cell(row=28, column=6, value=f"='مفروضات'!{assumption_map['مبلغ بازپرداخت اصل وام طی سال']['1402']}")
+    ws.cell(row=28, column=5, value=f"={cells.ref('مبلغ بازپرداخت اصل وام طی سال', '1403')}")
+    ws.cell(row=28, column=6, value=f"={cells.ref('مبلغ بازپرداخت اصل وام طی سال', '1402')}")
     ws.cell(row=28, column=4, value=30)
     ws.cell(row=28, column=4).hyperlink = f"#'16'!A1"
     ws.cell(row=28, column=4).style = "Hyperlink"
@@ -764,15 +1799,15 @@ def populate_balance_sheet(ws, assumption_map):
     
     ws.cell(row=32, column=3, value="تسهیلات مالی بلندمدت")
     ws.cell(row=32, column=4, value=19)
-    ws.cell(row=32, column=5, value=f"=F32+'مفروضات'!{assumption_map['مبلغ وام جدید دریافتی طی سال']['1403']}-E28") # E28 is current portion of long-term debt repaid
-    ws.cell(row=32, column=6, value="='ترازنامه پایه'!D34")
+    ws.cell(row=32, column=5, value=f"=F32+{cells.ref('مبلغ وام جدید دریافتی طی سال', '1403')}-E28") # E28 is current portion of long-term debt repaid
+    ws.cell(row=32, column=6, value=f"={cells.ref('opening_long_term_debt')}")
     ws.cell(row=32, column=4).hyperlink = f"#'19'!A1"
     ws.cell(row=32, column=4).style = "Hyperlink"
 
     ws.cell(row=33, column=3, value="مزایای پایان خدمت کارکنان")
     ws.cell(row=33, column=4, value=20)
-    ws.cell(row=33, column=5, value="=F33+'8'!C14") # F33 is prior year balance, '8'!C14 is the current year expense from note 8
-    ws.cell(row=33, column=6, value="='ترازنامه پایه'!D35")
+    ws.cell(row=33, column=5, value=f"=F33+{cells.ref('end_of_service_expense', '1403')}") # مانده سال قبل به علاوه هزینه سال جاری از یادداشت 8
+    ws.cell(row=33, column=6, value=f"={cells.ref('opening_end_of_service_benefits')}")
     ws.cell(row=33, column=4).hyperlink = f"#'20'!A1"
     ws.cell(row=33, column=4).style = "Hyperlink"
 
@@ -785,8 +1820,8 @@ def populate_balance_sheet(ws, assumption_map):
     ws.cell(row=35, column=6, value="=F29+F34")
     ws.append([]);
     ws.cell(row=37, column=2, value="حقوق مالکانه")
-    ws.cell(row=37, column=5, value="='حقوق مالکانه'!F18")
-    ws.cell(row=37, column=6, value="='حقوق مالکانه'!F12")
+    ws.cell(row=37, column=5, value=f"={cells.ref('total_equity', '1403')}")
+    ws.cell(row=37, column=6, value=f"={cells.ref('total_equity', '1402')}")
     ws.cell(row=37, column=4, value="21")
     ws.cell(row=37, column=4).hyperlink = f"#'21'!A1"
     ws.cell(row=37, column=4).style = "Hyperlink"
@@ -799,14 +1834,25 @@ def populate_balance_sheet(ws, assumption_map):
     ws.cell(row=40, column=5, value='=IF(ROUND(E21-E38,0)=0,"تراز","عدم تراز")')
     ws.cell(row=40, column=6, value='=IF(ROUND(F21-F38,0)=0,"تراز","عدم تراز")')
 
+
+def register_balance_sheet_cells(cells):
+    """اقلام و جمع‌های صورت وضعیت مالی (ستون E برای 1403 و F برای 1402)."""
+    for name, row_idx in [('cash', 10), ('receivables', 11), ('inventory', 12), ('prepayments', 13), ('current_assets', 14),
+                          ('fixed_assets', 17), ('other_non_current_assets', 18), ('total_assets', 21), ('accounts_payable', 25),
+                          ('tax_payable', 26), ('dividends_payable', 27), ('current_portion_of_debt', 28), ('current_liabilities', 29),
+                          ('long_term_debt', 32), ('end_of_service_benefits', 33), ('total_liabilities', 35),
+                          ('equity', 37), ('total_liabilities_and_equity', 38), ('balance_check', 40)]:
+        cells.register(name, 'وضعیت مالی', {'1403': f'E{row_idx}', '1402': f'F{row_idx}'})
+
 # ==============================================================================
 # تابع اصلاح شده ۵: populate_fixed_asset_roll_forward_sheet
 # ==============================================================================
-def populate_fixed_asset_roll_forward_sheet(ws, assumption_map):
+def populate_fixed_asset_roll_forward_sheet(ws, cells=None):
     """ایجاد و پر کردن شیت گردش دارایی‌های ثابت مشهود (پویا)."""
+    cells = cells if cells is not None else report_cell_registry()
     col_widths = {'A': 35, 'B': 20, 'C': 20, 'D': 20, 'E': 20}
     set_rtl_and_column_widths(ws, col_widths)
-    add_header(ws, "شرکت نمونه (سهامی عام)", "گردش دارایی‌های ثابت مشهود (پویا)", "برای سال مالی منتهی به 29 اسفند 1403", "(ارقام به میلیون ریال)")
+    add_header(ws, COMPANY_NAME, "گردش دارایی‌های ثابت مشهود (پویا)", "برای سال مالی منتهی به 29 اسفند 1403", "(ارقام به میلیون ریال)")
     # Clear existing content to avoid duplicates on re-run if sheet already exists
     for row in ws.iter_rows(min_row=7): # Start clearing from row 7 to keep header
         for cell in row:
@@ -815,45 +1861,45 @@ def populate_fixed_asset_roll_forward_sheet(ws, assumption_map):
     headers = ["شرح", "مانده اول دوره", "افزایش (CAPEX)", "کاهش (استهلاک)", "مانده پایان دوره"]
     ws.append(headers)
     for cell in ws[4]: # Headers are at row 4
-        cell.font = Font(bold=True)
+        apply_style(cell, 'bold_total')
 
     # محاسبات سال 1402
     ws['A5'] = "بهای تمام شده دارایی"
-    ws['B5'] = "='ترازنامه پایه'!D17" # بهای تمام شده دارایی ابتدای 1402 از ترازنامه پایه (ناخالص)
-    ws['B5'].font = Font(bold=True)
-    ws['C5'] = f"='مفروضات'!{assumption_map['سرمایه‌گذاری ثابت سالانه (CAPEX)']['1402']}" # افزایش (CAPEX) از مفروضات
+    ws['B5'] = f"={cells.ref('opening_fixed_asset_cost')}" # بهای تمام شده دارایی ابتدای 1402 از ترازنامه پایه (ناخالص)
+    apply_style(ws['B5'], 'bold_total')
+    ws['C5'] = f"={cells.ref('سرمایه‌گذاری ثابت سالانه (CAPEX)', '1402')}" # افزایش (CAPEX) از مفروضات
     ws['D5'] = 0 # فرض عدم فروش دارایی
     ws['E5'] = "=SUM(B5:D5)"
 
     ws['A6'] = "استهلاک انباشته"
-    ws['B6'] = "='ترازنامه پایه'!D18" # استهلاک انباشته ابتدای 1402 از ترازنامه پایه (مقدار **مثبت** خوانده می‌شود)
-    ws['B6'].font = Font(bold=True)
+    ws['B6'] = f"={cells.ref('opening_accumulated_depreciation')}" # استهلاک انباشته ابتدای 1402 از ترازنامه پایه (مقدار **مثبت** خوانده می‌شود)
+    apply_style(ws['B6'], 'bold_total')
     ws['C6'] = 0
-    ws['D6'] = f"=B5*'مفروضات'!{assumption_map['نرخ استهلاک سالانه (نسبت به بهای تمام شده اول دوره)']['1402']}"  
+    ws['D6'] = f"=B5*{cells.ref('نرخ استهلاک سالانه (نسبت به بهای تمام شده اول دوره)', '1402')}"  
     ws['E6'] = "=B6+D6" # جمع اولیه + هزینه استهلاک
 
     ws.append([])
     ws['A8'] = "ارزش دفتری خالص"
-    ws['A8'].font = Font(bold=True)
+    apply_style(ws['A8'], 'bold_total')
     ws['B8'] = "=B5-B6"
     ws['E8'] = "=E5-E6"
 
     # محاسبات سال 1403
     ws['A10'] = "بهای تمام شده دارایی"
     ws['B10'] = "=E5" # مانده اول دوره از پایان دوره سال قبل (1402)
-    ws['C10'] = f"='مفروضات'!{assumption_map['سرمایه‌گذاری ثابت سالانه (CAPEX)']['1403']}" # افزایش (CAPEX) از مفروضات
+    ws['C10'] = f"={cells.ref('سرمایه‌گذاری ثابت سالانه (CAPEX)', '1403')}" # افزایش (CAPEX) از مفروضات
     ws['D10'] = 0
     ws['E10'] = "=SUM(B10:D10)"
 
     ws['A11'] = "استهلاک انباشته"
     ws['B11'] = "=E6" # مانده اول دوره از پایان دوره سال قبل (1402)
     ws['C11'] = 0
-    ws['D11'] = f"=B10*'مفروضات'!{assumption_map['نرخ استهلاک سالانه (نسبت به بهای تمام شده اول دوره)']['1403']}"  
+    ws['D11'] = f"=B10*{cells.ref('نرخ استهلاک سالانه (نسبت به بهای تمام شده اول دوره)', '1403')}"  
     ws['E11'] = "=B11+D11"
 
     ws.append([])
     ws['A13'] = "ارزش دفتری خالص"
-    ws['A13'].font = Font(bold=True)
+    apply_style(ws['A13'], 'bold_total')
     ws['B13'] = "=B10-B11"
     ws['E13'] = "=E10-E11"
 
@@ -861,14 +1907,23 @@ def populate_fixed_asset_roll_forward_sheet(ws, assumption_map):
     ws.cell(row=1, column=max(1, ws.max_column - 1), value="بازگشت به وضعیت مالی").hyperlink = f"#'وضعیت مالی'!A1"
     ws.cell(row=1, column=max(1, ws.max_column - 1)).style = "Hyperlink"
 
+
+def register_fixed_asset_cells(cells):
+    """خروجی‌های گردش دارایی ثابت (ردیف‌های 10 تا 13 برای 1403 و 5 تا 8 برای 1402)."""
+    cells.register('fixed_asset_cost', 'گردش دارایی ثابت', {'1403': 'E10', '1402': 'E5'})
+    cells.register('accumulated_depreciation', 'گردش دارایی ثابت', {'1403': 'E11', '1402': 'E6'})
+    cells.register('depreciation_expense', 'گردش دارایی ثابت', {'1403': 'D11', '1402': 'D6'})
+    cells.register('fixed_assets_net_book_value', 'گردش دارایی ثابت', {'1403': 'E13', '1402': 'E8'})
+
 # ==============================================================================
 # تابع اصلاح شده ۶: populate_equity_sheet
 # ==============================================================================
-def populate_equity_sheet(ws):
+def populate_equity_sheet(ws, cells=None):
     """پر کردن شیت حقوق مالکانه با ساختار استاندارد و فرمول‌های صحیح."""
+    cells = cells if cells is not None else report_cell_registry()
     col_widths = {'A': 30, 'B': 18, 'C': 18, 'D': 18, 'E': 18, 'F': 20}
     set_rtl_and_column_widths(ws, col_widths)
-    add_header(ws, "شرکت نمونه (سهامی عام)", "صورت تغییرات در حقوق مالکانه", "برای سال مالی منتهی به 29 اسفند 1403 و 1402", "(ارقام به میلیون ریال)")
+    add_header(ws, COMPANY_NAME, "صورت تغییرات در حقوق مالکانه", "برای سال مالی منتهی به 29 اسفند 1403 و 1402", "(ارقام به میلیون ریال)")
     
     # Clear existing data
     for row in ws.iter_rows(min_row=7): # Start clearing from row 7 to keep header
@@ -879,24 +1934,24 @@ def populate_equity_sheet(ws):
 
     # Data for 1402 (starting from row 8)
     ws.cell(row=8, column=1, value="مانده در ابتدای 1402")
-    ws.cell(row=8, column=2, value="='ترازنامه پایه'!D40") # سرمایه از ترازنامه پایه (ردیف D40 در ترازنامه پایه جدید)
-    ws.cell(row=8, column=3, value="='ترازنامه پایه'!D41") # اندوخته قانونی از ترازنامه پایه (ردیف D41 در ترازنامه پایه جدید)
-    ws.cell(row=8, column=4, value="='ترازنامه پایه'!D42") # سایر اندوخته‌ها از ترازنامه پایه (ردیف D42 در ترازنامه پایه جدید)
-    ws.cell(row=8, column=5, value="='ترازنامه پایه'!D43") # سود انباشته از ترازنامه پایه (ردیف D43 در ترازنامه پایه جدید)
+    ws.cell(row=8, column=2, value=f"={cells.ref('opening_capital')}") # سرمایه از ترازنامه پایه
+    ws.cell(row=8, column=3, value=f"={cells.ref('opening_legal_reserve')}") # اندوخته قانونی از ترازنامه پایه
+    ws.cell(row=8, column=4, value=f"={cells.ref('opening_other_reserves')}") # سایر اندوخته‌ها از ترازنامه پایه
+    ws.cell(row=8, column=5, value=f"={cells.ref('opening_retained_earnings')}") # سود انباشته از ترازنامه پایه
     ws.cell(row=8, column=6, value="=SUM(B8:E8)")
 
     ws.cell(row=9, column=1, value="سود خالص 1402")
-    ws.cell(row=9, column=5, value="='سودوزیان'!G21") # لینک به سود خالص 1402 در سود و زیان (G21)
+    ws.cell(row=9, column=5, value=f"={cells.ref('net_profit', '1402')}") # لینک به سود خالص 1402 در سود و زیان
     ws.cell(row=9, column=6, value="=E9")
 
     ws.cell(row=10, column=1, value="انتقال به اندوخته قانونی")
-    ws.cell(row=10, column=3, value="=MAX(0,'سودوزیان'!G21)*0.05") # MAX(0,...) ensures no negative reserve
+    ws.cell(row=10, column=3, value=f"=MAX(0,{cells.ref('net_profit', '1402')})*0.05") # MAX(0,...) ensures no negative reserve
     ws.cell(row=10, column=5, value="=-C10")
     ws.cell(row=10, column=6, value="0")
 
     ws.cell(row=11, column=1, value="تقسیم سود مصوب")
     # <<-- اصلاح شده: محاسبه سود سهام بر اساس درصد از سود خالص و مفروضات
-    ws.cell(row=11, column=5, value="=-('سودوزیان'!G21*'مفروضات'!C19)")
+    ws.cell(row=11, column=5, value=f"=-({cells.ref('net_profit', '1402')}*{cells.ref('سود سهام پرداختی (درصد از سود خالص)', '1402')})")
     ws.cell(row=11, column=6, value="=E11")
 
     ws.cell(row=12, column=1, value="مانده در پایان 1402")
@@ -917,17 +1972,17 @@ def populate_equity_sheet(ws):
     ws.cell(row=14, column=6, value="=F12")
 
     ws.cell(row=15, column=1, value="سود خالص 1403")
-    ws.cell(row=15, column=5, value="='سودوزیان'!F21") # لینک به سود خالص 1403 در سود و زیان (F21)
+    ws.cell(row=15, column=5, value=f"={cells.ref('net_profit', '1403')}") # لینک به سود خالص 1403 در سود و زیان
     ws.cell(row=15, column=6, value="=E15")
 
     ws.cell(row=16, column=1, value="انتقال به اندوخته قانونی")
-    ws.cell(row=16, column=3, value="=MAX(0,'سودوزیان'!F21)*0.05") # MAX(0,...) ensures no negative reserve
+    ws.cell(row=16, column=3, value=f"=MAX(0,{cells.ref('net_profit', '1403')})*0.05") # MAX(0,...) ensures no negative reserve
     ws.cell(row=16, column=5, value="=-C16")
     ws.cell(row=16, column=6, value="0")
 
     ws.cell(row=17, column=1, value="تقسیم سود مصوب")
     # <<-- اصلاح شده: محاسبه سود سهام بر اساس درصد از سود خالص و مفروضات
-    ws.cell(row=17, column=5, value="=-('سودوزیان'!F21*'مفروضات'!B19)")
+    ws.cell(row=17, column=5, value=f"=-({cells.ref('net_profit', '1403')}*{cells.ref('سود سهام پرداختی (درصد از سود خالص)', '1403')})")
     ws.cell(row=17, column=6, value="=E17")
 
     ws.cell(row=18, column=1, value="مانده در پایان 1403")
@@ -941,13 +1996,26 @@ def populate_equity_sheet(ws):
     ws.cell(row=1, column=max(1, ws.max_column - 1), value="بازگشت به وضعیت مالی").hyperlink = f"#'وضعیت مالی'!A1"
     ws.cell(row=1, column=max(1, ws.max_column - 1)).style = "Hyperlink"
 
+
+def register_equity_cells(cells):
+    """خروجی‌های صورت تغییرات در حقوق مالکانه (ردیف‌های 14 تا 18 برای 1403 و 8 تا 12 برای 1402)."""
+    cells.register('retained_earnings_opening', 'حقوق مالکانه', {'1403': 'E14', '1402': 'E8'})
+    cells.register('legal_reserve_transfer', 'حقوق مالکانه', {'1403': 'C16', '1402': 'C10'})
+    cells.register('dividends', 'حقوق مالکانه', {'1403': 'E17', '1402': 'E11'})
+    cells.register('total_equity', 'حقوق مالکانه', {'1403': 'F18', '1402': 'F12'})
+    cells.register('capital', 'حقوق مالکانه', {'1403': 'B18', '1402': 'B12'})
+    cells.register('legal_reserve', 'حقوق مالکانه', {'1403': 'C18', '1402': 'C12'})
+    cells.register('other_reserves', 'حقوق مالکانه', {'1403': 'D18', '1402': 'D12'})
+    cells.register('retained_earnings', 'حقوق مالکانه', {'1403': 'E18', '1402': 'E12'})
+
 # ==============================================================================
 # تابع اصلاح شده ۷: populate_cash_flow_sheet
 # ==============================================================================
-def populate_cash_flow_sheet(ws, assumption_map):
+def populate_cash_flow_sheet(ws, cells=None):
+    cells = cells if cells is not None else report_cell_registry()
     col_widths = {'A': 5, 'B': 55, 'C': 18, 'D': 18}
     set_rtl_and_column_widths(ws, col_widths)
-    add_header(ws, "شرکت نمونه (سهامی عام)", "صورت جریان‌های نقدی (نهایی و پویا)", "برای سال مالی منتهی به 29 اسفند 1403", "(ارقام به میلیون ریال)")
+    add_header(ws, COMPANY_NAME, "صورت جریان‌های نقدی (نهایی و پویا)", "برای سال مالی منتهی به 29 اسفند 1403", "(ارقام به میلیون ریال)")
     # Clear existing content to avoid duplicates on re-run if sheet already exists
     for row in ws.iter_rows(min_row=7): # Clear from row 7 to preserve header
         for cell in row:
@@ -958,28 +2026,28 @@ def populate_cash_flow_sheet(ws, assumption_map):
     # فعالیت‌های عملیاتی (starting from row 8)
     ws.cell(row=8, column=2, value="جریان‌های نقدی ناشی از فعالیت‌های عملیاتی")
     ws.cell(row=9, column=2, value="سود خالص")
-    ws.cell(row=9, column=3, value="='سودوزیان'!F21") # لینک به سود خالص 1403
-    ws.cell(row=9, column=4, value="='سودوزیان'!G21") # لینک به سود خالص 1402
+    ws.cell(row=9, column=3, value=f"={cells.ref('net_profit', '1403')}") # لینک به سود خالص 1403
+    ws.cell(row=9, column=4, value=f"={cells.ref('net_profit', '1402')}") # لینک به سود خالص 1402
     ws.cell(row=10, column=2, value="تعدیلات بابت اقلام غیرنقدی:")
     ws.cell(row=11, column=2, value="هزینه استهلاک")
-    ws.cell(row=11, column=3, value="='گردش دارایی ثابت'!D11")
-    ws.cell(row=11, column=4, value="='گردش دارایی ثابت'!D6")
+    ws.cell(row=11, column=3, value=f"={cells.ref('depreciation_expense', '1403')}")
+    ws.cell(row=11, column=4, value=f"={cells.ref('depreciation_expense', '1402')}")
     ws.cell(row=11, column=1, value="12") # Note 12 for Fixed Assets
     ws.cell(row=11, column=1).hyperlink = f"#'10.11.12'!A1" # Link to general fixed assets note
     ws.cell(row=11, column=1).style = "Hyperlink"
 
     ## <-- اصلاح نهایی: اضافه کردن هزینه غیرنقدی مزایای پایان خدمت
     ws.cell(row=12, column=2, value="هزینه مزایای پایان خدمت")
-    ws.cell(row=12, column=3, value="='8'!C14") # Link to the expense from Note 8
-    ws.cell(row=12, column=4, value="='8'!D14") # Link to the expense from Note 8
+    ws.cell(row=12, column=3, value=f"={cells.ref('end_of_service_expense', '1403')}") # هزینه سال از یادداشت 8
+    ws.cell(row=12, column=4, value=f"={cells.ref('end_of_service_expense', '1402')}") # هزینه سال از یادداشت 8
     
     ws.cell(row=13, column=2, value="تغییرات در سرمایه در گردش:")
     ws.cell(row=14, column=2, value="کاهش(افزایش) در دریافتنی‌ها")
-    ws.cell(row=14, column=3, value="='وضعیت مالی'!F11-'وضعیت مالی'!E11") # F11: دریافتنی 1402, E11: دریافتنی 1403
+    ws.cell(row=14, column=3, value=f"={cells.ref('receivables', '1402')}-{cells.ref('receivables', '1403')}")
     ws.cell(row=15, column=2, value="کاهش(افزایش) در موجودی کالا")
-    ws.cell(row=15, column=3, value="='وضعیت مالی'!F12-'وضعیت مالی'!E12") # F12: موجودی کالا 1402, E12: موجودی کالا 1403
+    ws.cell(row=15, column=3, value=f"={cells.ref('inventory', '1402')}-{cells.ref('inventory', '1403')}")
     ws.cell(row=16, column=2, value="افزایش(کاهش) در پرداختنی‌ها")
-    ws.cell(row=16, column=3, value="='وضعیت مالی'!E25-'وضعیت مالی'!F25") # E25: پرداختنی 1403, F25: پرداختنی 1402
+    ws.cell(row=16, column=3, value=f"={cells.ref('accounts_payable', '1403')}-{cells.ref('accounts_payable', '1402')}")
     ws.cell(row=17, column=2, value="خالص جریان نقد عملیاتی")
     ws.cell(row=17, column=3, value="=SUM(C9,C11,C12,C14:C16)") # C9: سود خالص, C11: استهلاک, C12: مزایای پایان خدمت, C14-C16: تغییرات سرمایه در گردش
     ws.cell(row=17, column=4, value="=SUM(D9,D11,D12,D14:D16)")
@@ -988,8 +2056,8 @@ def populate_cash_flow_sheet(ws, assumption_map):
     ws.append([]) # row 18
     ws.cell(row=19, column=2, value="جریان‌های نقدی ناشی از فعالیت‌های سرمایه‌گذاری")
     ws.cell(row=20, column=2, value="پرداخت بابت خرید دارایی ثابت (CAPEX)")
-    ws.cell(row=20, column=3, value=f"=-'مفروضات'!{assumption_map['سرمایه‌گذاری ثابت سالانه (CAPEX)']['1403']}") # لینک به CAPEX 1403
-    ws.cell(row=20, column=4, value=f"=-'مفروضات'!{assumption_map['سرمایه‌گذاری ثابت سالانه (CAPEX)']['1402']}") # لینک به CAPEX 1402
+    ws.cell(row=20, column=3, value=f"=-{cells.ref('سرمایه‌گذاری ثابت سالانه (CAPEX)', '1403')}") # لینک به CAPEX 1403
+    ws.cell(row=20, column=4, value=f"=-{cells.ref('سرمایه‌گذاری ثابت سالانه (CAPEX)', '1402')}") # لینک به CAPEX 1402
     ws.cell(row=20, column=1, value="12") # Note 12 for Fixed Assets
     ws.cell(row=20, column=1).hyperlink = f"#'10.11.12'!A1" # Link to general fixed assets note
     ws.cell(row=20, column=1).style = "Hyperlink"
@@ -1002,18 +2070,18 @@ def populate_cash_flow_sheet(ws, assumption_map):
     ws.append([]) # row 22
     ws.cell(row=23, column=2, value="جریان‌های نقدی ناشی از فعالیت‌های تامین مالی")
     ws.cell(row=24, column=2, value="دریافت اصل تسهیلات")
-    ws.cell(row=24, column=3, value=f"='مفروضات'!{assumption_map['مبلغ وام جدید دریافتی طی سال']['1403']}") # لینک به وام جدید 1403
-    ws.cell(row=24, column=4, value=f"='مفروضات'!{assumption_map['مبلغ وام جدید دریافتی طی سال']['1402']}") # لینک به وام جدید 1402
+    ws.cell(row=24, column=3, value=f"={cells.ref('مبلغ وام جدید دریافتی طی سال', '1403')}") # لینک به وام جدید 1403
+    ws.cell(row=24, column=4, value=f"={cells.ref('مبلغ وام جدید دریافتی طی سال', '1402')}") # لینک به وام جدید 1402
     ws.cell(row=24, column=1, value="19") # Note 19 for LT Debt
     ws.cell(row=24, column=1).hyperlink = f"#'19'!A1"
     ws.cell(row=24, column=1).style = "Hyperlink"
 
     ws.cell(row=25, column=2, value="بازپرداخت اصل تسهیلات")
-    ws.cell(row=25, column=3, value=f"=-'مفروضات'!{assumption_map['مبلغ بازپرداخت اصل وام طی سال']['1403']}") # لینک به بازپرداخت 1403
-    ws.cell(row=25, column=4, value=f"=-'مفروضات'!{assumption_map['مبلغ بازپرداخت اصل وام طی سال']['1402']}") # لینک به بازپرداخت 1402
+    ws.cell(row=25, column=3, value=f"=-{cells.ref('مبلغ بازپرداخت اصل وام طی سال', '1403')}") # لینک به بازپرداخت 1403
+    ws.cell(row=25, column=4, value=f"=-{cells.ref('مبلغ بازپرداخت اصل وام طی سال', '1402')}") # لینک به بازپرداخت 1402
     ws.cell(row=26, column=2, value="سود سهام پرداخت شده")
-    ws.cell(row=26, column=3, value=f"='حقوق مالکانه'!E17") # لینک به سود خالص و درصد سود سهام 1403 (E17 is already negative)
-    ws.cell(row=26, column=4, value=f"='حقوق مالکانه'!E11") # لینک به سود خالص و درصد سود سهام 1402 (E11 is already negative)
+    ws.cell(row=26, column=3, value=f"={cells.ref('dividends', '1403')}") # سود سهام مصوب 1403 (با علامت منفی)
+    ws.cell(row=26, column=4, value=f"={cells.ref('dividends', '1402')}") # سود سهام مصوب 1402 (با علامت منفی)
     ws.cell(row=26, column=1, value="18") # Note 18 for Dividends
     ws.cell(row=26, column=1).hyperlink = f"#'18'!A1"
     ws.cell(row=26, column=1).style = "Hyperlink"
@@ -1027,27 +2095,47 @@ def populate_cash_flow_sheet(ws, assumption_map):
     ws.cell(row=29, column=2, value="خالص افزایش (کاهش) در موجودی نقد")
     ws.cell(row=29, column=3, value="=C17+C21+C27") # جمع خالص جریان نقد عملیاتی, سرمایه گذاری, تامین مالی برای 1403
     ws.cell(row=29, column=4, value="=D17+D21+D27") # جمع خالص جریان نقد عملیاتی, سرمایه گذاری, تامین مالی برای 1402
-    ws.cell(row=29, column=3).font = Font(bold=True)
-    ws.cell(row=29, column=4).font = Font(bold=True)
+    apply_style(ws.cell(row=29, column=3), 'bold_total')
+    apply_style(ws.cell(row=29, column=4), 'bold_total')
     
     ws.cell(row=30, column=2, value="موجودی نقد ابتدای دوره")
-    ws.cell(row=30, column=3, value="='وضعیت مالی'!F10")  # Existing cash balance from prior year
-    ws.cell(row=30, column=4, value="='ترازنامه پایه'!D10") # موجودی نقد ابتدای 1402 از ترازنامه پایه
+    ws.cell(row=30, column=3, value=f"={cells.ref('cash', '1402')}")  # مانده نقد سال قبل در وضعیت مالی
+    ws.cell(row=30, column=4, value=f"={cells.ref('opening_cash')}") # موجودی نقد ابتدای 1402 از ترازنامه پایه
     ws.cell(row=31, column=2, value="موجودی نقد در پایان دوره")
     ws.cell(row=31, column=3, value="=C29+C30")  
     ws.cell(row=31, column=4, value="=D29+D30")  
 
+    # مبنای درآمد مالی: همه اقلام جز سود خالص و سود سهام (تا درآمد مالی بدون ارجاع چرخشی محاسبه شود)
+    ws.cell(row=33, column=2, value="موجودی نقد پایان دوره پیش از سود خالص و سود سهام")
+    ws.cell(row=33, column=3, value="=C30+SUM(C11,C12,C14:C16)+C21+SUM(C24:C25)")
+    ws.cell(row=33, column=4, value="=D30+SUM(D11,D12,D14:D16)+D21+SUM(D24:D25)")
+    ws.cell(row=34, column=2, value="کنترل درآمد مالی بر میانگین مانده نقد (باید صفر باشد)")
+    ws.cell(row=34, column=3, value=f"={cells.ref('finance_income', '1403')}-{cells.ref('نرخ سود سپرده بانکی (بر میانگین مانده نقد)', '1403')}*(C30+C31)/2")
+    ws.cell(row=34, column=4, value=f"={cells.ref('finance_income', '1402')}-{cells.ref('نرخ سود سپرده بانکی (بر میانگین مانده نقد)', '1402')}*(D30+D31)/2")
+    apply_style(ws.cell(row=34, column=3), 'warning_fill')
+    apply_style(ws.cell(row=34, column=4), 'warning_fill')
+
     # اضافه کردن هایپرلینک برای بازگشت به وضعیت مالی
     ws.cell(row=1, column=max(1, ws.max_column - 1), value="بازگشت به وضعیت مالی").hyperlink = f"#'وضعیت مالی'!A1"
     ws.cell(row=1, column=max(1, ws.max_column - 1)).style = "Hyperlink"
 
 
+def register_cash_flow_cells(cells):
+    """جریان نقد عملیاتی، موجودی نقد اول و پایان دوره و مبنای درآمد مالی (ستون C برای 1403 و D برای 1402)."""
+    cells.register('operating_cash_flow', 'جریان های نقدی', {'1403': 'C17', '1402': 'D17'})
+    cells.register('period_opening_cash', 'جریان های نقدی', {'1403': 'C30', '1402': 'D30'})
+    cells.register('closing_cash', 'جریان های نقدی', {'1403': 'C31', '1402': 'D31'})
+    cells.register('cash_before_profit', 'جریان های نقدی', {'1403': 'C33', '1402': 'D33'})
+    cells.register('finance_income_check', 'جریان های نقدی', {'1403': 'C34', '1402': 'D34'})
+
+
 # --- بقیه توابع (بدون تغییر) ---
 
-def populate_comprehensive_income_sheet(ws):
+def populate_comprehensive_income_sheet(ws, cells=None):
+    cells = cells if cells is not None else report_cell_registry()
     col_widths = {'A': 5, 'B': 40, 'C': 18, 'D': 18}
     set_rtl_and_column_widths(ws, col_widths)
-    add_header(ws, "شرکت نمونه (سهامی عام)", "صورت سود و زیان جامع", "برای سال مالی منتهی به 29 اسفند 1403 و 1402", "(ارقام به میلیون ریال)")
+    add_header(ws, COMPANY_NAME, "صورت سود و زیان جامع", "برای سال مالی منتهی به 29 اسفند 1403 و 1402", "(ارقام به میلیون ریال)")
     # Clear existing content to avoid duplicates on re-run if sheet already exists
     for row in ws.iter_rows(min_row=7): # Start clearing from row 7 to keep header
         for cell in row:
@@ -1057,8 +2145,8 @@ def populate_comprehensive_income_sheet(ws):
     ws['D7'] = "1402"
 
     ws['B9'] = "سود خالص دوره"
-    ws['C9'] = "='سودوزیان'!F21" # لینک به سود خالص از صورت سود و زیان 1403
-    ws['D9'] = "='سودوزیان'!G21" # لینک به سود خالص از صورت سود و زیان 1402
+    ws['C9'] = f"={cells.ref('net_profit', '1403')}" # لینک به سود خالص از صورت سود و زیان 1403
+    ws['D9'] = f"={cells.ref('net_profit', '1402')}" # لینک به سود خالص از صورت سود و زیان 1402
 
     ws['B11'] = "سایر اقلام سود و زیان جامع:"
     ws['B12'] = "تعدیلات تسعیر ارز عملیات خارجی (بعد از مالیات)" # <--- اصلاح: از C12 به B12 منتقل شد
@@ -1076,14 +2164,14 @@ def populate_comprehensive_income_sheet(ws):
 
 def populate_history_sheet(ws):
     ws.sheet_view.rightToLeft = True
-    add_header(ws, "شرکت نمونه (سهامی عام)", "تاریخچه شرکت نمونه (سهامی عام)", "")
+    add_header(ws, COMPANY_NAME, f"تاریخچه {COMPANY_NAME}", "")
     # Clear existing content to avoid duplicates on re-run if sheet already exists
     for row in ws.iter_rows(min_row=7): # Start clearing from row 7 to keep header
         for cell in row:
             cell.value = None
 
     ws['A4'] = "مقدمه:"
-    ws['B5'] = "شرکت نمونه (سهامی عام) در سال 1375 با هدف سرمایه‌گذاری و فعالیت در صنعت مرغداری و زنجیره تامین گوشت مرغ تاسیس گردید. این شرکت با بهره‌گیری از دانش روز و تکنولوژی‌های پیشرفته در زمینه پرورش جوجه یک روزه اجداد، تولید جوجه گوشتی و عرضه به کشتارگاه، به یکی از پیشگامان صنعت در کشور تبدیل شده است."
+    ws['B5'] = f"{COMPANY_NAME} در سال 1375 با هدف سرمایه‌گذاری و فعالیت در صنعت مرغداری و زنجیره تامین گوشت مرغ تاسیس گردید. این شرکت با بهره‌گیری از دانش روز و تکنولوژی‌های پیشرفته در زمینه پرورش جوجه یک روزه اجداد، تولید جوجه گوشتی و عرضه به کشتارگاه، به یکی از پیشگامان صنعت در کشور تبدیل شده است."
     ws['A7'] = "اهداف و استراتژی‌ها:"
     ws['B8'] = "هدف اصلی شرکت، تولید پروتئین با کیفیت بالا، افزایش بهره‌وری در تمامی مراحل زنجیره تامین، توسعه پایدار و ایفای نقش مسئولانه در تامین امنیت غذایی کشور است. استراتژی‌های شرکت شامل توسعه فارم‌های جدید، بهبود نژادهای پرورشی، بهینه‌سازی مصرف خوراک و کاهش ضایعات می‌باشد."
     ws['A10'] = "فعالیت‌های اصلی:"
@@ -1093,12 +2181,12 @@ def populate_history_sheet(ws):
     ws.column_dimensions['A'].width = 15
     ws.column_dimensions['B'].width = 80
     ws.merge_cells('A1:B1')
-    ws['A4'].font = Font(bold=True)
-    ws['A7'].font = Font(bold=True)
-    ws['A10'].font = Font(bold=True)
-    ws['A13'].font = Font(bold=True)
+    apply_style(ws['A4'], 'bold_total')
+    apply_style(ws['A7'], 'bold_total')
+    apply_style(ws['A10'], 'bold_total')
+    apply_style(ws['A13'], 'bold_total')
     for row in ws['B']: # wrap text in column B
-        row.alignment = Alignment(wrapText=True, horizontal='right')
+        row.alignment = RTL_WRAPPED_ALIGNMENT # روی قالب فعلی سلول (مثلاً پررنگ) اعمال می‌شود
     
     # اضافه کردن هایپرلینک برای بازگشت به صفحه اصلی (مثلاً وضعیت مالی)
     ws.cell(row=1, column=max(1, ws.max_column - 1), value="بازگشت به وضعیت مالی").hyperlink = f"#'وضعیت مالی'!A1"
@@ -1107,7 +2195,7 @@ def populate_history_sheet(ws):
 
 def populate_significant_accounting_policy_sheet(ws, policy_number):
     ws.sheet_view.rightToLeft = True
-    add_header(ws, "شرکت نمونه (سهامی عام)", f"یادداشت {policy_number}: اهم رویه های حسابداری", "")
+    add_header(ws, COMPANY_NAME, f"یادداشت {policy_number}: اهم رویه های حسابداری", "")
     # Clear existing content to avoid duplicates on re-run if sheet already exists
     for row in ws.iter_rows(min_row=7): # Start clearing from row 7 to keep header
         for cell in row:
@@ -1127,14 +2215,14 @@ def populate_significant_accounting_policy_sheet(ws, policy_number):
     
     policy_text = policies.get(policy_number, "توضیحات رویه حسابداری برای این یادداشت موجود نیست.")
     ws['A7'] = f"رویه حسابداری شماره {policy_number}:"
-    ws['A7'].font = Font(bold=True)
+    apply_style(ws['A7'], 'bold_total')
     ws['B8'] = policy_text
     
     ws.column_dimensions['A'].width = 25
     ws.column_dimensions['B'].width = 80
-    ws['A4'].font = Font(bold=True)
+    apply_style(ws['A4'], 'bold_total')
     for row in ws['B']: # wrap text in column B
-        row.alignment = Alignment(wrapText=True, horizontal='right')
+        row.alignment = RTL_WRAPPED_ALIGNMENT # روی قالب فعلی سلول (مثلاً پررنگ) اعمال می‌شود
 
     # اضافه کردن هایپرلینک برای بازگشت به صفحه اصلی (وضعیت مالی)
     ws.cell(row=1, column=max(1, ws.max_column - 1), value="بازگشت به وضعیت مالی").hyperlink = f"#'وضعیت مالی'!A1"
@@ -1143,9 +2231,10 @@ def populate_significant_accounting_policy_sheet(ws, policy_number):
 # ==============================================================================
 # تابع (بدون تغییر): populate_inventory_note
 # ==============================================================================
-def populate_inventory_note(ws):
+def populate_inventory_note(ws, cells=None):
+    cells = cells if cells is not None else report_cell_registry()
     ws.sheet_view.rightToLeft = True
-    add_header(ws, "شرکت نمونه (سهامی عام)", "یادداشت 9: موجودی مواد و کالا (خلاصه)", "در تاریخ 29 اسفند 1403 و 1402", "(ارقام به میلیون ریال)")
+    add_header(ws, COMPANY_NAME, "یادداشت 9: موجودی مواد و کالا (خلاصه)", "در تاریخ 29 اسفند 1403 و 1402", "(ارقام به میلیون ریال)")
     # Clear existing content to avoid duplicates on re-run if sheet already exists
     for row in ws.iter_rows(min_row=7): # Start clearing from row 7 to keep header
         for cell in row:
@@ -1161,55 +2250,41 @@ def populate_inventory_note(ws):
     ws.cell(row=1, column=max(1, ws.max_column - 1)).style = "Hyperlink"
 
     ws['A9'] = "ترکیب موجودی مواد و کالا:"
-    # مقادیر ریالی در شیت تفصیلی از ردیف ۱۸ شروع می شوند
-    ws['B10'] = "جوجه یک روزه (ریالی)"
-    ws['F10'] = "='موجودی_تفصیلی'!G18"
-    ws['G10'] = "='موجودی_تفصیلی'!K18"
-
-    ws['B11'] = "خوراک (دان) (ریالی)"
-    ws['F11'] = "='موجودی_تفصیلی'!G19"
-    ws['G11'] = "='موجودی_تفصیلی'!K19"
-
-    ws['B12'] = "مرغ در حال رشد (فارم) (ریالی)"
-    ws['F12'] = "='موجودی_تفصیلی'!G20"
-    ws['G12'] = "='موجودی_تفصیلی'!K20"
-
-    ws['B13'] = "دارو و واکسن (ریالی)"
-    ws['F13'] = "='موجودی_تفصیلی'!G21"
-    ws['G13'] = "='موجودی_تفصیلی'!K21"
-
-    ws['B14'] = "مرغ آماده فروش (انبار) (ریالی)"
-    ws['F14'] = "='موجودی_تفصیلی'!G22"
-    ws['G14'] = "='موجودی_تفصیلی'!K22"
+    # ارزش پایان دوره هر قلم از ردیف‌های ریالی شیت تفصیلی (یک ردیف به ازای هر کالا)
+    item_texts = ["جوجه یک روزه (ریالی)", "خوراک (دان) (ریالی)", "مرغ در حال رشد (فارم) (ریالی)",
+                  "دارو و واکسن (ریالی)", "مرغ آماده فروش (انبار) (ریالی)"]
+    for offset, text in enumerate(item_texts[:cells.rows('inventory_item_closing_value')]):
+        row_idx = 10 + offset
+        ws[f'B{row_idx}'] = text
+        ws[f'F{row_idx}'] = f"={cells.ref('inventory_item_closing_value', '1403', offset)}"
+        ws[f'G{row_idx}'] = f"={cells.ref('inventory_item_closing_value', '1402', offset)}"
 
     ws['B15'] = "سایر موجودی‌ها (لوازم بسته بندی و...)"
     ws['F15'] = 50000
     ws['G15'] = 50000
 
     ws['B16'] = "جمع کل موجودی مواد و کالا (پایان دوره)"
-    ws['F16'] = f"='موجودی_تفصیلی'!G{18+5+4+3}" # لینک به خروجی نهایی برای ترازنامه
-    ws['G16'] = f"='موجودی_تفصیلی'!K{18+5+4+4}" # لینک به خروجی نهایی برای ترازنامه
+    ws['F16'] = f"={cells.ref('inventory_closing_value', '1403')}" # همان جمعی که ترازنامه می‌خواند
+    ws['G16'] = f"={cells.ref('inventory_closing_value', '1402')}"
     ws.cell(row=16, column=2).hyperlink = f"#'موجودی_تفصیلی'!A1"
     ws.cell(row=16, column=2).style = "Hyperlink"
 
-    total_row_value_detailed = 18 + 5 + 4
     ws['A18'] = "مغایرت‌گیری موجودی مواد و کالا (سال 1403):"
     ws['B19'] = "موجودی ابتدای دوره (1403)"
-    ws['C19'] = f"='موجودی_تفصیلی'!D{total_row_value_detailed}"
+    ws['C19'] = f"={cells.ref('inventory_opening_value', '1403')}"
 
     ws['B20'] = "خرید طی دوره (دان، جوجه، دارو، ...) و هزینه‌های مستقیم پرورش"
-    ws['C20'] = f"='موجودی_تفصیلی'!E{total_row_value_detailed}"
+    ws['C20'] = f"={cells.ref('inventory_purchases_value', '1403')}"
 
     ws['B21'] = "بهای تمام شده کالای فروش رفته (COGS)"
-    ws['C21'] = f"='موجودی_تفصیلی'!F{total_row_value_detailed}"
+    ws['C21'] = f"={cells.ref('inventory_cogs', '1403')}"
 
     ws['B22'] = "موجودی پایان دوره (1403 - محاسبه شده)"
-    ws['C22'] = f"='موجودی_تفصیلی'!G{total_row_value_detailed}"
+    ws['C22'] = f"={cells.ref('inventory_closing_value', '1403')}"
 
     ws['B23'] = "تفاوت مغایرت (اضافه/کسری)"
     ws['C23'] = f'=C19+C20-C21-C22'
-    ws['C23'].font = Font(bold=True)
-    ws.cell(row=23, column=3).fill = PatternFill(start_color="FFFF00", end_color="FFFF00", fill_type="solid")
+    apply_style(ws['C23'], 'highlight_total')
 
 
     ws['A25'] = "روش ارزیابی موجودی و اطلاعات انبار:"
@@ -1224,12 +2299,12 @@ def populate_inventory_note(ws):
     ws.column_dimensions['G'].width = 18
 
     for row in ws['B']: # wrap text
-        row.alignment = Alignment(wrapText=True, horizontal='right')
+        row.alignment = RTL_WRAPPED_ALIGNMENT # روی قالب فعلی سلول (مثلاً پررنگ) اعمال می‌شود
 
 
 def populate_management_judgment_sheet(ws):
     ws.sheet_view.rightToLeft = True
-    add_header(ws, "شرکت نمونه (سهامی عام)", "یادداشت: قضاوت مدیریت در فرایند بکارگیری رویه های حسابداری", "")
+    add_header(ws, COMPANY_NAME, "یادداشت: قضاوت مدیریت در فرایند بکارگیری رویه های حسابداری", "")
     # Clear existing content to avoid duplicates on re-run if sheet already exists
     for row in ws.iter_rows(min_row=7): # Start clearing from row 7 to keep header
         for cell in row:
@@ -1249,12 +2324,12 @@ def populate_management_judgment_sheet(ws):
 
     ws.column_dimensions['A'].width = 40
     ws.column_dimensions['B'].width = 80
-    ws['A4'].font = Font(bold=True)
-    ws['A7'].font = Font(bold=True)
-    ws['A10'].font = Font(bold=True)
-    ws['A13'].font = Font(bold=True)
+    apply_style(ws['A4'], 'bold_total')
+    apply_style(ws['A7'], 'bold_total')
+    apply_style(ws['A10'], 'bold_total')
+    apply_style(ws['A13'], 'bold_total')
     for row in ws['B']: # wrap text
-        row.alignment = Alignment(wrapText=True, horizontal='right')
+        row.alignment = RTL_WRAPPED_ALIGNMENT # روی قالب فعلی سلول (مثلاً پررنگ) اعمال می‌شود
 
     # اضافه کردن هایپرلینک برای بازگشت به صفحه اصلی (مثلاً وضعیت مالی)
     ws.cell(row=1, column=max(1, ws.max_column - 1), value="بازگشت به وضعیت مالی").hyperlink = f"#'وضعیت مالی'!A1"
@@ -1263,7 +2338,7 @@ def populate_management_judgment_sheet(ws):
 
 def populate_attachment_sheet(ws):
     ws.sheet_view.rightToLeft = True
-    add_header(ws, "شرکت نمونه (سهامی عام)", "پیوست صورت‌های مالی", "")
+    add_header(ws, COMPANY_NAME, "پیوست صورت‌های مالی", "")
     # Clear existing content to avoid duplicates on re-run if sheet already exists
     for row in ws.iter_rows(min_row=7): # Start clearing from row 7 to keep header
         for cell in row:
@@ -1272,9 +2347,9 @@ def populate_attachment_sheet(ws):
     ws['A4'] = "این بخش شامل هرگونه اطلاعات تکمیلی و جداول تفصیلی است که برای درک کامل‌تر صورت‌های مالی ضروری است."
     ws['A6'] = "مثال: جدول تفصیلی دارایی‌های ثابت مشهود، جداول تفصیلی سرمایه‌گذاری‌ها، تفکیک درآمدها بر حسب نوع محصول و منطقه جغرافیایی، گزارش کامل حقوق و دستمزد تفکیکی."
     ws.column_dimensions['A'].width = 80
-    ws['A4'].font = Font(bold=True)
+    apply_style(ws['A4'], 'bold_total')
     for row in ws['A']: # wrap text
-        row.alignment = Alignment(wrapText=True, horizontal='right')
+        row.alignment = RTL_WRAPPED_ALIGNMENT # روی قالب فعلی سلول (مثلاً پررنگ) اعمال می‌شود
 
     # اضافه کردن هایپرلینک برای بازگشت به صفحه اصلی (مثلاً وضعیت مالی)
     ws.cell(row=1, column=max(1, ws.max_column - 1), value="بازگشت به وضعیت مالی").hyperlink = f"#'وضعیت مالی'!A1"
@@ -1283,20 +2358,20 @@ def populate_attachment_sheet(ws):
 
 def populate_page_header_sheet(ws):
     ws.sheet_view.rightToLeft = True
-    add_header(ws, "شرکت نمونه (سهامی عام)", "سر برگ صفحات (برای چاپ و ارائه)", "")
+    add_header(ws, COMPANY_NAME, "سر برگ صفحات (برای چاپ و ارائه)", "")
     # Clear existing content to avoid duplicates on re-run if sheet already exists
     for row in ws.iter_rows(min_row=7): # Start clearing from row 7 to keep header
         for cell in row:
             cell.value = None
 
     ws['A3'] = "این شیت می‌تواند شامل اطلاعات تکراری در بالای هر صفحه چاپی باشد."
-    ws['A5'] = "نام شرکت: شرکت نمونه (سهامی عام)"
+    ws['A5'] = f"نام شرکت: {COMPANY_NAME}"
     ws['A6'] = "صورت مالی: صورت سود و زیان / صورت وضعیت مالی و غیره"
     ws['A7'] = "سال مالی: منتهی به 29 اسفند 1403"
     ws.column_dimensions['A'].width = 80
-    ws['A3'].font = Font(italic=True)
+    apply_style(ws['A3'], 'note_text')
     for row in ws['A']: # wrap text
-        row.alignment = Alignment(wrapText=True, horizontal='right')
+        row.alignment = RTL_WRAPPED_ALIGNMENT # روی قالب فعلی سلول (مثلاً پررنگ) اعمال می‌شود
 
     # اضافه کردن هایپرلینک برای بازگشت به صفحه اصلی (مثلاً وضعیت مالی)
     ws.cell(row=1, column=max(1, ws.max_column - 1), value="بازگشت به وضعیت مالی").hyperlink = f"#'وضعیت مالی'!A1"
@@ -1305,7 +2380,7 @@ def populate_page_header_sheet(ws):
 
 def populate_signature_sheet(ws):
     ws.sheet_view.rightToLeft = True
-    add_header(ws, "شرکت نمونه (سهامی عام)", "صفحه امضا کنندگان صورت‌های مالی", "")
+    add_header(ws, COMPANY_NAME, "صفحه امضا کنندگان صورت‌های مالی", "")
     # Clear existing content to avoid duplicates on re-run if sheet already exists
     for row in ws.iter_rows(min_row=7): # Start clearing from row 7 to keep header
         for cell in row:
@@ -1322,16 +2397,17 @@ def populate_signature_sheet(ws):
     ws['A14'] = "سمت: حسابرس مستقل"
     ws['A15'] = "تاریخ: 1404/03/22"
     ws.column_dimensions['A'].width = 40
-    ws['A3'].font = Font(bold=True)
+    apply_style(ws['A3'], 'bold_total')
     
     # اضافه کردن هایپرلینک برای بازگشت به صفحه اصلی (مثلاً وضعیت مالی)
     ws.cell(row=1, column=max(1, ws.max_column - 1), value="بازگشت به وضعیت مالی").hyperlink = f"#'وضعیت مالی'!A1"
     ws.cell(row=1, column=max(1, ws.max_column - 1)).style = "Hyperlink"
 
 
-def populate_management_comparative_report(ws):
+def populate_management_comparative_report(ws, cells=None):
+    cells = cells if cells is not None else report_cell_registry()
     ws.sheet_view.rightToLeft = True
-    add_header(ws, "شرکت نمونه (سهامی عام)", "گزارش مدیریتی تطبیقی", "برای سال مالی منتهی به 29 اسفند 1403 و 1402", "(ارقام به میلیون ریال)")
+    add_header(ws, COMPANY_NAME, "گزارش مدیریتی تطبیقی", "برای سال مالی منتهی به 29 اسفند 1403 و 1402", "(ارقام به میلیون ریال)")
     # Clear existing content to avoid duplicates on re-run if sheet already exists
     for row in ws.iter_rows(min_row=7): # Start clearing from row 7 to keep header
         for cell in row:
@@ -1344,118 +2420,120 @@ def populate_management_comparative_report(ws):
     ws['A9'] = "خلاصه‌ای از شاخص‌های کلیدی عملکرد (KPIs):"
     
     ws['B10'] = "درآمدهای عملیاتی"
-    ws['C10'] = "='سودوزیان'!F8" # لینک به درآمد عملیاتی 1403 (F8)
-    ws['D10'] = "='سودوزیان'!G8" # لینک به درآمد عملیاتی 1402 (G8)
+    ws['C10'] = f"={cells.ref('revenue', '1403')}"
+    ws['D10'] = f"={cells.ref('revenue', '1402')}"
     ws['E10'] = '=IF(D10<>0,(C10-D10)/D10,"N/A")'
-    ws.cell(row=10, column=5).number_format = '0.00%'
+    apply_style(ws.cell(row=10, column=5), 'percent')
 
     ws['B11'] = "سود ناخالص"
-    ws['C11'] = "='سودوزیان'!F10" # لینک به سود ناخالص 1403 (F10)
-    ws['D11'] = "='سودوزیان'!G10" # لینک به سود ناخالص 1402 (G10)
+    ws['C11'] = f"={cells.ref('gross_profit', '1403')}"
+    ws['D11'] = f"={cells.ref('gross_profit', '1402')}"
     ws['E11'] = '=IF(D11<>0,(C11-D11)/D11,"N/A")'
-    ws.cell(row=11, column=5).number_format = '0.00%'
+    apply_style(ws.cell(row=11, column=5), 'percent')
 
     ws['B12'] = "سود عملیاتی"
-    ws['C12'] = "='سودوزیان'!F15" # لینک به سود عملیاتی 1403 (F15)
-    ws['D12'] = "='سودوزیان'!G15" # لینک به سود عملیاتی 1402 (G15)
+    ws['C12'] = f"={cells.ref('operating_profit', '1403')}"
+    ws['D12'] = f"={cells.ref('operating_profit', '1402')}"
     ws['E12'] = '=IF(D12<>0,(C12-D12)/D12,"N/A")'
-    ws.cell(row=12, column=5).number_format = '0.00%'
+    apply_style(ws.cell(row=12, column=5), 'percent')
 
     ws['B13'] = "سود خالص"
-    ws['C13'] = "='سودوزیان'!F21" # لینک به سود خالص 1403 (F21)
-    ws['D13'] = "='سودوزیان'!G21" # لینک به سود خالص 1402 (G21)
+    ws['C13'] = f"={cells.ref('net_profit', '1403')}"
+    ws['D13'] = f"={cells.ref('net_profit', '1402')}"
     ws['E13'] = '=IF(D13<>0,(C13-D13)/D13,"N/A")'
-    ws.cell(row=13, column=5).number_format = '0.00%'
+    apply_style(ws.cell(row=13, column=5), 'percent')
 
     ws['B15'] = "جمع کل دارایی‌ها"
-    ws['C15'] = "='وضعیت مالی'!E21"
-    ws['D15'] = "='وضعیت مالی'!F21"
+    ws['C15'] = f"={cells.ref('total_assets', '1403')}"
+    ws['D15'] = f"={cells.ref('total_assets', '1402')}"
     ws['E15'] = '=IF(D15<>0,(C15-D15)/D15,"N/A")'
-    ws.cell(row=15, column=5).number_format = '0.00%'
+    apply_style(ws.cell(row=15, column=5), 'percent')
 
     ws['B16'] = "جمع کل بدهی‌ها"
-    ws['C16'] = "='وضعیت مالی'!E35"
-    ws['D16'] = "='وضعیت مالی'!F35"
+    ws['C16'] = f"={cells.ref('total_liabilities', '1403')}"
+    ws['D16'] = f"={cells.ref('total_liabilities', '1402')}"
     ws['E16'] = '=IF(D16<>0,(C16-D16)/D16,"N/A")'
-    ws.cell(row=16, column=5).number_format = '0.00%'
+    apply_style(ws.cell(row=16, column=5), 'percent')
     
     ws['A18'] = "نسبت‌های مالی کلیدی:"
     ws['B19'] = "نسبت جاری (Current Ratio)"
-    ws['C19'] = "=IFERROR('وضعیت مالی'!E14/'وضعیت مالی'!E29,0)"
-    ws['D19'] = "=IFERROR('وضعیت مالی'!F14/'وضعیت مالی'!F29,0)"
-    ws.cell(row=19, column=3).number_format = '0.00'  
-    ws.cell(row=19, column=4).number_format = '0.00'  
+    ws['C19'] = f"=IFERROR({cells.ref('current_assets', '1403')}/{cells.ref('current_liabilities', '1403')},0)"
+    ws['D19'] = f"=IFERROR({cells.ref('current_assets', '1402')}/{cells.ref('current_liabilities', '1402')},0)"
+    apply_style(ws.cell(row=19, column=3), 'ratio')
+    apply_style(ws.cell(row=19, column=4), 'ratio')
 
     ws['B20'] = "نسبت بدهی (Debt Ratio)"
-    ws['C20'] = "=IFERROR('وضعیت مالی'!E35/'وضعیت مالی'!E21,0)"
-    ws['D20'] = "=IFERROR('وضعیت مالی'!F35/'وضعیت مالی'!F21,0)"
-    ws.cell(row=20, column=3).number_format = '0.00'
-    ws.cell(row=20, column=4).number_format = '0.00'
+    ws['C20'] = "=IFERROR(C16/C15,0)" # جمع بدهی‌ها / جمع دارایی‌ها (ردیف‌های 16 و 15 همین شیت)
+    ws['D20'] = "=IFERROR(D16/D15,0)"
+    apply_style(ws.cell(row=20, column=3), 'ratio')
+    apply_style(ws.cell(row=20, column=4), 'ratio')
     
     ws['B21'] = "حاشیه سود خالص (Net Profit Margin)"
-    ws['C21'] = "=IFERROR('سودوزیان'!F21/'سودوزیان'!F8,0)" # لینک به سود خالص و درآمد عملیاتی
-    ws['D21'] = "=IFERROR('سودوزیان'!G21/'سودوزیان'!G8,0)" # لینک به سود خالص و درآمد عملیاتی
-    ws.cell(row=21, column=3).number_format = '0.00%'
-    ws.cell(row=21, column=4).number_format = '0.00%'
+    ws['C21'] = "=IFERROR(C13/C10,0)" # سود خالص / درآمد عملیاتی (ردیف‌های 13 و 10 همین شیت)
+    ws['D21'] = "=IFERROR(D13/D10,0)"
+    apply_style(ws.cell(row=21, column=3), 'percent')
+    apply_style(ws.cell(row=21, column=4), 'percent')
 
     ws.column_dimensions['A'].width = 5
     ws.column_dimensions['B'].width = 30
     ws.column_dimensions['C'].width = 18
     ws.column_dimensions['D'].width = 18
     ws.column_dimensions['E'].width = 18
-    ws['A9'].font = Font(bold=True)
-    ws['A18'].font = Font(bold=True)
+    apply_style(ws['A9'], 'bold_total')
+    apply_style(ws['A18'], 'bold_total')
 
     # اضافه کردن هایپرلینک برای بازگشت به صفحه اصلی (مثلاً وضعیت مالی)
     ws.cell(row=1, column=max(1, ws.max_column - 1), value="بازگشت به وضعیت مالی").hyperlink = f"#'وضعیت مالی'!A1"
     ws.cell(row=1, column=max(1, ws.max_column - 1)).style = "Hyperlink"
 
 
-def populate_business_analytical_report(ws):
+def register_management_report_cells(cells):
+    """شاخص‌های گزارش مدیریتی تطبیقی (ستون C برای 1403 و D برای 1402)."""
+    cells.register('revenue_growth', 'گزارش مدیریتی تطبیقی', {'1403': 'E10'})
+    for name, row_idx in [('current_ratio', 19), ('debt_ratio', 20), ('net_profit_margin', 21)]:
+        cells.register(name, 'گزارش مدیریتی تطبیقی', {'1403': f'C{row_idx}', '1402': f'D{row_idx}'})
+
+def populate_business_analytical_report(ws, cells=None):
+    cells = cells if cells is not None else report_cell_registry()
     ws.sheet_view.rightToLeft = True
-    add_header(ws, "شرکت نمونه (سهامی عام)", "گزارش تحلیلی کسب و کار", "برای سال مالی منتهی به 29 اسفند 1403", "")
+    add_header(ws, COMPANY_NAME, "گزارش تحلیلی کسب و کار", "برای سال مالی منتهی به 29 اسفند 1403", "")
     # Clear existing content to avoid duplicates on re-run if sheet already exists
     for row in ws.iter_rows(min_row=7): # Start clearing from row 7 to keep header
         for cell in row:
             cell.value = None
 
     ws['A5'] = "1. تحلیل عملکرد عملیاتی:"
-    ws['B6'] = '''=CONCATENATE("شرکت در سال 1403 شاهد رشد ",TEXT('گزارش مدیریتی تطبیقی'!E10,"0.00%")," درآمدهای عملیاتی نسبت به سال قبل بوده است. این رشد عمدتاً ناشی از افزایش ظرفیت تولید و تقاضا در بازار مرغ گوشتی می‌باشد. با این حال، بهای تمام شده درآمدهای عملیاتی نیز ",TEXT(IFERROR(('سودوزیان'!F9/'سودوزیان'!G9)-1,"0.00%"),"0.00%")," افزایش یافته که نیاز به کنترل بیشتر هزینه‌ها در زنجیره تامین دارد.")'''
-    ws.cell(row=6, column=2).alignment = Alignment(wrapText=True, horizontal='right')
-    ws.cell(row=6, column=2).fill = PatternFill(start_color="FFF2CC", end_color="FFF2CC", fill_type="solid")  
+    ws['B6'] = f'''=CONCATENATE("شرکت در سال 1403 شاهد رشد ",TEXT({cells.ref('revenue_growth', '1403')},"0.00%")," درآمدهای عملیاتی نسبت به سال قبل بوده است. این رشد عمدتاً ناشی از افزایش ظرفیت تولید و تقاضا در بازار مرغ گوشتی می‌باشد. با این حال، بهای تمام شده درآمدهای عملیاتی نیز ",TEXT(IFERROR(({cells.ref('cost_of_revenue', '1403')}/{cells.ref('cost_of_revenue', '1402')})-1,"0.00%"),"0.00%")," افزایش یافته که نیاز به کنترل بیشتر هزینه‌ها در زنجیره تامین دارد.")'''
+    apply_style(ws.cell(row=6, column=2), 'analysis_text_yellow')
 
     ws['A8'] = "2. تحلیل سودآوری:"
-    ws['B9'] = '''=CONCATENATE("حاشیه سود خالص شرکت در سال 1403 به ",TEXT('گزارش مدیریتی تطبیقی'!C21,"0.00%")," رسیده که نشان‌دهنده توانایی شرکت در مدیریت هزینه‌های مستقیم تولید است. با این حال، هزینه‌های اداری و عمومی نیز رشد قابل توجهی داشته‌اند که می‌بایست مورد بررسی قرار گیرند.")'''
-    ws.cell(row=9, column=2).alignment = Alignment(wrapText=True, horizontal='right')
-    ws.cell(row=9, column=2).fill = PatternFill(start_color="D9EAD3", end_color="D9EAD3", fill_type="solid")  
+    ws['B9'] = f'''=CONCATENATE("حاشیه سود خالص شرکت در سال 1403 به ",TEXT({cells.ref('net_profit_margin', '1403')},"0.00%")," رسیده که نشان‌دهنده توانایی شرکت در مدیریت هزینه‌های مستقیم تولید است. با این حال، هزینه‌های اداری و عمومی نیز رشد قابل توجهی داشته‌اند که می‌بایست مورد بررسی قرار گیرند.")'''
+    apply_style(ws.cell(row=9, column=2), 'analysis_text_green')
 
     ws['A11'] = "3. تحلیل وضعیت نقدینگی:"
-    ws['B12'] = '''=CONCATENATE("جریان‌های نقدی عملیاتی شرکت مثبت بوده که نشان‌دهنده توانایی شرکت در تامین نقدینگی از محل عملیات اصلی خود است. نسبت جاری شرکت در سال 1403 برابر با ",TEXT('گزارش مدیریتی تطبیقی'!C19,"0.00")," است که نشان‌دهنده وضعیت نقدینگی مطلوب و توانایی ایفای تعهدات جاری است.")'''  
-    ws.cell(row=12, column=2).alignment = Alignment(wrapText=True, horizontal='right')
-    ws.cell(row=12, column=2).fill = PatternFill(start_color="CCE0F5", end_color="CCE0F5", fill_type="solid")  
+    ws['B12'] = f'''=CONCATENATE("جریان‌های نقدی عملیاتی شرکت مثبت بوده که نشان‌دهنده توانایی شرکت در تامین نقدینگی از محل عملیات اصلی خود است. نسبت جاری شرکت در سال 1403 برابر با ",TEXT({cells.ref('current_ratio', '1403')},"0.00")," است که نشان‌دهنده وضعیت نقدینگی مطلوب و توانایی ایفای تعهدات جاری است.")'''  
+    apply_style(ws.cell(row=12, column=2), 'analysis_text_blue')
 
     ws['A14'] = "4. پیشنهادها:"
     ws['B15'] = "- بررسی دقیق‌تر هزینه‌های اداری و عمومی و شناسایی فرصت‌های صرفه‌جویی.\n- سرمایه‌گذاری در تکنولوژی‌های جدید برای افزایش بهره‌وری در فارم‌ها و کاهش بهای تمام شده تولید.\n- توسعه بازارهای جدید برای محصولات شرکت."
-    ws.cell(row=15, column=2).alignment = Alignment(wrapText=True, horizontal='right')
-    ws.cell(row=15, column=2).fill = PatternFill(start_color="F2F2F2", end_color="F2F2F2", fill_type="solid")  
+    apply_style(ws.cell(row=15, column=2), 'analysis_text_grey')
 
     ws.column_dimensions['A'].width = 25
     ws.column_dimensions['B'].width = 80
-    ws['A5'].font = Font(bold=True)
-    ws['A8'].font = Font(bold=True)
-    ws['A11'].font = Font(bold=True)
-    ws['A14'].font = Font(bold=True)
+    apply_style(ws['A5'], 'bold_total')
+    apply_style(ws['A8'], 'bold_total')
+    apply_style(ws['A11'], 'bold_total')
+    apply_style(ws['A14'], 'bold_total')
     
     # اضافه کردن هایپرلینک برای بازگشت به صفحه اصلی (مثلاً وضعیت مالی)
     ws.cell(row=1, column=max(1, ws.max_column - 1), value="بازگشت به وضعیت مالی").hyperlink = f"#'وضعیت مالی'!A1"
     ws.cell(row=1, column=max(1, ws.max_column - 1)).style = "Hyperlink"
 
 
-def populate_numeric_note_sheets(wb):
-    """
-    پر کردن شیت های با نام عددی بر اساس شماره یادداشت آنها در صورت های مالی.
-    """
-    numeric_sheet_map = {
+def numeric_note_sheet_map(cells=None, trial_balance=None):
+    """محتوای شیت های با نام عددی (یادداشت‌ها): {نام شیت: مشخصات}؛ مبالغ ثابت از trial_balance در صورت وجود."""
+    cells = cells if cells is not None else report_cell_registry()
+    notes = {
         # شیت '5': درآمدهای عملیاتی تفکیکی
         '5': {
             'header_name': "یادداشت 5: درآمدهای عملیاتی",
@@ -1646,11 +2724,11 @@ def populate_numeric_note_sheets(wb):
         '24.25': {
             'header_name': "یادداشت 24-25: سود انباشته",
             'data': [
-                ("مانده ابتدای دوره", "='حقوق مالکانه'!E12", "='حقوق مالکانه'!E8"), # لینک به مانده های حقوق مالکانه
-                ("سود خالص دوره", "='سودوزیان'!F21", "='سودوزیان'!G21"), # لینک به سود خالص
-                ("انتقال به اندوخته قانونی", "='حقوق مالکانه'!C16*-1", "='حقوق مالکانه'!C10*-1"),
+                ("مانده ابتدای دوره", f"={cells.ref('retained_earnings_opening', '1403')}", f"={cells.ref('retained_earnings_opening', '1402')}"), # لینک به مانده های حقوق مالکانه
+                ("سود خالص دوره", f"={cells.ref('net_profit', '1403')}", f"={cells.ref('net_profit', '1402')}"), # لینک به سود خالص
+                ("انتقال به اندوخته قانونی", f"={cells.ref('legal_reserve_transfer', '1403')}*-1", f"={cells.ref('legal_reserve_transfer', '1402')}*-1"),
                 ("انتقال به سایر اندوخته‌ها", 0, 0), # فرض شده
-                ("تقسیم سود سهام", "='حقوق مالکانه'!E17", "='حقوق مالکانه'!E11")
+                ("تقسیم سود سهام", f"={cells.ref('dividends', '1403')}", f"={cells.ref('dividends', '1402')}")
             ],
             'total_row_text': "مانده پایان دوره سود انباشته",
             'total_row_formula_1403': '=SUM(F10:F14)',
@@ -1661,10 +2739,11 @@ def populate_numeric_note_sheets(wb):
         '26.27': {
             'header_name': "یادداشت 26-27: درآمدهای مالی و سایر درآمدها و هزینه‌های غیرعملیاتی",
             'sections': [
-                {"title": "الف) هزینه‌های مالی (یادداشت 26)", "data": [
-                    ("سود تسهیلات بانکی", -60_000, -50_000),
-                    ("کارمزد بانکی", -10_000, -10_000)
-                ], "total_text": "جمع هزینه‌های مالی"},
+                {"title": "الف) هزینه‌ها و درآمدهای مالی (یادداشت 26)", "data": [
+                    # از صورت سود و زیان: نرخ سود × میانگین مانده تسهیلات و سپرده (چرخه سود خالص حل شده)
+                    ("سود تسهیلات (بر میانگین مانده)", f"={cells.ref('finance_cost', '1403')}", f"={cells.ref('finance_cost', '1402')}"),
+                    ("سود سپرده بانکی (بر میانگین مانده نقد)", f"={cells.ref('finance_income', '1403')}", f"={cells.ref('finance_income', '1402')}")
+                ], "total_text": "خالص هزینه‌های مالی"},
                 {"title": "ب) سایر درآمدها و هزینه‌های غیرعملیاتی (یادداشت 27)", "data": [
                     ("سود حاصل از تسعیر ارز", 15_000, 10_000),
                     ("سود حاصل از فروش دارایی‌های ثابت", 15_000, 15_000),
@@ -1701,14 +2780,14 @@ def populate_numeric_note_sheets(wb):
             'header_name': "یادداشت 32-33: هزینه‌های فروش و اداری",
             'sections': [
                 {"title": "الف) هزینه‌های فروش (یادداشت 32)", "data": [
-                    ("حقوق و دستمزد فروش", "='8'!C10", "='8'!D10"), # لینک به یادداشت 8
+                    ("حقوق و دستمزد فروش", f"={cells.ref('selling_personnel_expense', '1403')}", f"={cells.ref('selling_personnel_expense', '1402')}"), # لینک به یادداشت 8
                     ("تبلیغات و بازاریابی", 50_000, 40_000),
                     ("حمل و نقل و توزیع", 150_000, 130_000)
                 ], "total_text": "جمع هزینه‌های فروش"},
                 {"title": "ب) هزینه‌های اداری و عمومی (یادداشت 33)", "data": [
-                    ("حقوق و دستمزد اداری", "='8'!C16", "='8'!D16"), # لینک به یادداشت 8
+                    ("حقوق و دستمزد اداری", f"={cells.ref('admin_personnel_expense', '1403')}", f"={cells.ref('admin_personnel_expense', '1402')}"), # لینک به یادداشت 8
                     ("اجاره", 20_000, 18_000),
-                    ("استهلاک", "='8'!C18", "='8'!D18"), # لینک به یادداشت 8
+                    ("استهلاک", f"={cells.ref('admin_depreciation', '1403')}", f"={cells.ref('admin_depreciation', '1402')}"), # لینک به یادداشت 8
                     ("خدمات", 10_000, 9_000),
                     ("سایر", 10_000, 15_000)
                 ], "total_text": "جمع هزینه‌های اداری و عمومی"}
@@ -1756,13 +2835,13 @@ def populate_numeric_note_sheets(wb):
         '35-6': {
             'header_name': "یادداشت 35-6: خلاصه حقوق و دستمزد",
             'data': [
-                ("مجموع حقوق و مزایای پرداختی به پرسنل", "='لیست حقوق و دستمزد'!N108", "='لیست حقوق و دستمزد'!N108*0.9"),  
-                ("بیمه سهم کارفرما", "='لیست حقوق و دستمزد'!V108", "='لیست حقوق و دستمزد'!V108*0.9")  
+                ("مجموع حقوق و مزایای پرداختی به پرسنل", f"={cells.ref('payroll_ledger_gross', '1403')}", f"={cells.ref('payroll_ledger_gross', '1402')}"),
+                ("بیمه سهم کارفرما", f"={cells.ref('payroll_ledger_employer_insurance', '1403')}", f"={cells.ref('payroll_ledger_employer_insurance', '1402')}")
             ],
             'total_row_text': "جمع",
             'total_row_formula_1403': '=SUM(F10:F11)',
             'total_row_formula_1402': '=SUM(G10:G11)',
-            'notes': ["این شیت خلاصه ای از اطلاعات حقوق و دستمزد در شیت 'لیست حقوق و دستمزد' می باشد."],
+            'notes': ["این شیت خلاصه ای از اطلاعات حقوق و دستمزد در شیت 'دفتر حقوق ماهانه' می باشد."],
             'return_sheet': 'سودوزیان'
         },
         # شیت '36-37': مالیات بر درآمد تفصیلی (مالیات)
@@ -1789,7 +2868,7 @@ def populate_numeric_note_sheets(wb):
                     ("ارزش اسمی هر سهم (ریال)", 1_000, 1_000)
                 ], "total_text": "جمع"},
                 {"title": "ج) سود پایه هر سهم (یادداشت 40)", "data": [
-                    ("سود پایه هر سهم (ریال)", "='سودوزیان'!F21/1000000", "='سودوزیان'!G21/1000000")  
+                    ("سود پایه هر سهم (ریال)", f"={cells.ref('net_profit', '1403')}/1000000", f"={cells.ref('net_profit', '1402')}/1000000")  
                 ], "total_text": "جمع"}
             ],
             'return_sheet': 'سودوزیان' # EPS is derived from P&L
@@ -1947,179 +3026,3574 @@ def populate_numeric_note_sheets(wb):
             'return_sheet': '41' # Return to main Note 41
         },
     }
+    return apply_trial_balance_to_notes(notes, trial_balance)
+
+
+def populate_numeric_note_sheet(ws, content):
+    """پر کردن یک شیت یادداشت عددی از روی مشخصات آن در numeric_note_sheet_map."""
+    # Clear existing content to avoid duplicates on re-run if sheet already exists
+    for row in ws.iter_rows(min_row=7): # Start clearing from row 7 to keep header
+        for cell in row:
+            cell.value = None
+
+    set_rtl_and_column_widths(ws, {'A': 5, 'B': 35, 'C': 25, 'D': 12, 'E': 18, 'F': 18, 'G': 18})
+    add_header(ws, COMPANY_NAME, content['header_name'], f"برای سال مالی منتهی به 29 اسفند 1403 و 1402", "(ارقام به میلیون ریال)")
+    ws['E7'] = "یادداشت"
+    ws['F7'] = "1403"
+    ws['G7'] = "1402"
+    ws['F8'] = "میلیون ریال"
+    ws['G8'] = "میلیون ریال"
+
+    current_row = 10
+    if 'data' in content:
+        for item_name, val_1403, val_1402 in content['data']:
+            ws[f'B{current_row}'] = item_name
+            ws[f'F{current_row}'] = val_1403 # فرمول‌ها از قبل با '=' شروع می‌شوند
+            ws[f'G{current_row}'] = val_1402
+            current_row += 1
+
+        ws[f'B{current_row}'] = content['total_row_text']
+        ws[f'F{current_row}'] = content['total_row_formula_1403']
+        ws[f'G{current_row}'] = content['total_row_formula_1402']
+        current_row += 2
+
+        if 'notes' in content:
+            for note in content['notes']:
+                ws[f'B{current_row}'] = note
+                apply_style(ws[f'B{current_row}'], 'rtl_wrapped_text')
+                current_row += 1
+
+    elif 'sections' in content:
+        for section in content['sections']:
+            ws[f'A{current_row}'] = section['title']
+            apply_style(ws[f'A{current_row}'], 'bold_total')
+            current_row += 1
+            start_data_row_for_sum = current_row
+            for item_name, val_1403, val_1402 in section['data']:
+                ws[f'B{current_row}'] = item_name
+                ws[f'F{current_row}'] = val_1403 # فرمول‌ها از قبل با '=' شروع می‌شوند
+                ws[f'G{current_row}'] = val_1402
+                current_row += 1
+            ws[f'B{current_row}'] = section['total_text']
+
+            ws[f'F{current_row}'] = f'=SUM(F{start_data_row_for_sum}:F{current_row-1})'
+            ws[f'G{current_row}'] = f'=SUM(G{start_data_row_for_sum}:G{current_row-1})'
+
+            current_row += 2
+
+    for row_idx in range(1, ws.max_row + 1):
+        if ws[f'B{row_idx}'].value:
+            apply_style(ws[f'B{row_idx}'], 'rtl_wrapped_text')
+        if ws[f'C{row_idx}'].value:
+            apply_style(ws[f'C{row_idx}'], 'rtl_wrapped_text')
+
+    # اضافه کردن هایپرلینک برای بازگشت به شیت اصلی (تعریف شده در map)
+    if 'return_sheet' in content:
+        return_sheet_name = content['return_sheet']
+        ws.cell(row=1, column=max(1, ws.max_column - 1), value=f"بازگشت به {return_sheet_name}").hyperlink = f"#'{return_sheet_name}'!A1"
+        ws.cell(row=1, column=max(1, ws.max_column - 1)).style = "Hyperlink"
+
 
-    for sheet_name, content in numeric_sheet_map.items():
-        if sheet_name in wb.sheetnames:
-            ws = wb[sheet_name]
-            # Clear existing content to avoid duplicates on re-run if sheet already exists
-            for row in ws.iter_rows(min_row=7): # Start clearing from row 7 to keep header
-                for cell in row:
-                    cell.value = None
-
-            set_rtl_and_column_widths(ws, {'A': 5, 'B': 35, 'C': 25, 'D': 12, 'E': 18, 'F': 18, 'G': 18})
-            add_header(ws, "شرکت نمونه (سهامی عام)", content['header_name'], f"برای سال مالی منتهی به 29 اسفند 1403 و 1402", "(ارقام به میلیون ریال)")
-            ws['E7'] = "یادداشت"
-            ws['F7'] = "1403"
-            ws['G7'] = "1402"
-            ws['F8'] = "میلیون ریال"
-            ws['G8'] = "میلیون ریال"
-
-            current_row = 10
-            if 'data' in content:
-                for item_name, val_1403, val_1402 in content['data']:
-                    ws[f'B{current_row}'] = item_name
-                    # Ensure formulas are properly set with '='
-                    ws[f'F{current_row}'] = f"={val_1403}" if isinstance(val_1403, str) and val_1403.startswith('=') else val_1403
-                    ws[f'G{current_row}'] = f"={val_1402}" if isinstance(val_1402, str) and val_1402.startswith('=') else val_1402
-                    current_row += 1
-                
-                ws[f'B{current_row}'] = content['total_row_text']
-                ws[f'F{current_row}'] = content['total_row_formula_1403']
-                ws[f'G{current_row}'] = content['total_row_formula_1402']
-                current_row += 2
-                
-                if 'notes' in content:
-                    for note in content['notes']:
-                        ws[f'B{current_row}'] = note
-                        ws[f'B{current_row}'].alignment = Alignment(wrapText=True, horizontal='right')
-                        current_row += 1
-
-            elif 'sections' in content:
-                for section in content['sections']:
-                    ws[f'A{current_row}'] = section['title']
-                    ws[f'A{current_row}'].font = Font(bold=True)
-                    current_row += 1
-                    start_data_row_for_sum = current_row
-                    for item_name, val_1403, val_1402 in section['data']:
-                        ws[f'B{current_row}'] = item_name
-                        # Ensure formulas are properly set with '='
-                        ws[f'F{current_row}'] = f"={val_1403}" if isinstance(val_1403, str) and val_1403.startswith('=') else val_1403
-                        ws[f'G{current_row}'] = f"={val_1402}" if isinstance(val_1402, str) and val_1402.startswith('=') else val_1402
-                        current_row += 1
-                    ws[f'B{current_row}'] = section['total_text']
-                    
-                    ws[f'F{current_row}'] = f'=SUM(F{start_data_row_for_sum}:F{current_row-1})'
-                    ws[f'G{current_row}'] = f'=SUM(G{start_data_row_for_sum}:G{current_row-1})'
-                    
-                    current_row += 2
-
-            for row_idx in range(1, ws.max_row + 1):
-                if ws[f'B{row_idx}'].value:
-                    ws[f'B{row_idx}'].alignment = Alignment(wrapText=True, horizontal='right')
-                if ws[f'C{row_idx}'].value:
-                    ws[f'C{row_idx}'].alignment = Alignment(wrapText=True, horizontal='right')
-            
-            # اضافه کردن هایپرلینک برای بازگشت به شیت اصلی (تعریف شده در map)
-            if 'return_sheet' in content:
-                return_sheet_name = content['return_sheet']
-                ws.cell(row=1, column=max(1, ws.max_column - 1), value=f"بازگشت به {return_sheet_name}").hyperlink = f"#'{return_sheet_name}'!A1"
-                ws.cell(row=1, column=max(1, ws.max_column - 1)).style = "Hyperlink"
+def populate_numeric_note_sheets(wb, cells=None, sheet_names=None, trial_balance=None):
+    """
+    پر کردن شیت های با نام عددی بر اساس شماره یادداشت آنها در صورت های مالی.
+    با sheet_names فقط همان شیت‌ها ساخته می‌شوند.
+    """
+    for sheet_name, content in numeric_note_sheet_map(cells, trial_balance).items():
+        if sheet_name in wb.sheetnames and (sheet_names is None or sheet_name in sheet_names):
+            populate_numeric_note_sheet(wb[sheet_name], content)
 
 
 # ==============================================================================
-# تابع اصلاح شده ۸: create_full_financial_report (با ترتیب اجرای جدید و حلقه تکرار)
+# ورود دفتر کل: تراز آزمایشی از فایل اسناد حسابداری (CSV/Parquet) به صورت تکه‌تکه
 # ==============================================================================
-def create_full_financial_report(output_folder, output_file_name):
-    wb = Workbook()
-    if 'Sheet' in wb.sheetnames:
-        wb.remove(wb['Sheet'])
+# فایل اسناد: هر سطر یک آرتیکل با تاریخ (1403/05/12)، کد حساب و مبلغ بدهکار/بستانکار به ریال
+JOURNAL_COLUMNS = ('date', 'account', 'debit', 'credit')
+# جدول حساب‌ها: کد حساب (پیشوند؛ طولانی‌ترین پیشوند منطبق انتخاب می‌شود) و قلم صورت مالی.
+# sign ضریب (بدهکار - بستانکار) است تا مبلغ با علامت نمایش در صورت‌ها وارد شود (مثلاً -1 برای درآمد و بدهی)
+# و kind برابر balance (مانده پایان سال) یا flow (گردش سال) است.
+CHART_OF_ACCOUNTS_COLUMNS = ('account', 'line', 'sign', 'kind')
+# دوره‌های تراز آزمایشی: همه اسناد پیش از 1402 در 1401 (افتتاحیه) جمع می‌شوند
+TRIAL_BALANCE_YEARS = (1401, 1402, 1403)
+# اقلام صورت سود و زیان که از دفتر کل قابل تأمین‌اند (ستون‌های F و G ردیف‌های 8، 13 و 14)
+LEDGER_PROFIT_LOSS_LINES = ('revenue', 'other_income', 'other_expense')
+
+# قلم صورت مالی هر حساب به شکل 'opening:cash'، 'pl:revenue'، 'assumption:<شرح مفروض>' یا
+# 'note:<شیت یادداشت>:<شرح ردیف>' است. ChartAccount یک ردیف جدول حساب‌هاست.
+ChartAccount = namedtuple('ChartAccount', ['account', 'line', 'sign', 'kind'])
+# lines: {قلم: {'1401': ..., '1402': ..., '1403': ...}} به میلیون ریال؛ unmapped_accounts: حساب‌های بدون قلم
+TrialBalance = namedtuple('TrialBalance', ['lines', 'unmapped_accounts'])
+
+
+def _validate_ledger_line(line):
+    """بررسی قلم صورت مالی یک ردیف جدول حساب‌ها؛ خروجی kind پیش‌فرض آن قلم."""
+    prefix, _, name = line.partition(':')
+    if prefix == 'opening' and name in OPENING_BALANCE_SHEET:
+        return 'balance'
+    if prefix == 'pl' and name in LEDGER_PROFIT_LOSS_LINES:
+        return 'flow'
+    if prefix == 'assumption' and any(desc == name for items in DEFAULT_ASSUMPTIONS.values() for desc, _, _ in items):
+        return 'flow'
+    if prefix == 'note' and name.partition(':')[0] in (*NUMERIC_NOTE_SHEET_NAMES, '8', '9') and name.partition(':')[2]:
+        return 'flow'
+    raise ValueError(f"قلم صورت مالی نامعتبر '{line}'")
+
+
+def load_chart_of_accounts(path):
+    """خواندن جدول حساب‌ها از CSV؛ خروجی لیست ChartAccount مرتب از طولانی‌ترین کد."""
+    chart = []
+    with open(path, encoding='utf-8-sig', newline='') as f:
+        for line_no, row in enumerate(csv.DictReader(f), 2):
+            account, line = (row.get('account') or '').strip(), (row.get('line') or '').strip()
+            if not account or not line:
+                raise ValueError(f"کد حساب یا قلم صورت مالی خالی است (سطر {line_no})")
+            try:
+                default_kind = _validate_ledger_line(line)
+                sign = float(row.get('sign') or 1)
+            except ValueError as e:
+                raise ValueError(f"{e} (سطر {line_no})")
+            kind = (row.get('kind') or '').strip() or default_kind
+            if kind not in ('balance', 'flow') or (line.startswith('opening:') and kind != 'balance'):
+                raise ValueError(f"نوع نامعتبر '{kind}' برای قلم '{line}' (سطر {line_no})")
+            chart.append(ChartAccount(account, line, sign, kind))
+    return sorted(chart, key=lambda entry: len(entry.account), reverse=True)
+
+
+def iter_journal_chunks(path, chunk_size=1_000_000):
+    """
+    خواندن تکه‌تکه فایل اسناد؛ هر تکه (سال‌ها، کدهای حساب، بدهکار - بستانکار) به صورت آرایه numpy.
+    Parquet به pyarrow نیاز دارد که فقط در همین حالت بارگذاری می‌شود.
+    """
+    def amounts(values):
+        values = np.asarray(values, dtype=object)
+        values[(values == '') | (values == None)] = 0 # سلول خالی یعنی صفر
+        return values.astype(float)
+
+    def chunk(dates, accounts, debit, credit):
+        # سال از چهار نویسه اول تاریخ با کد یونیکد ارقام (بدون تبدیل رشته به رشته)
+        digits = np.asarray(dates, dtype='U4').view(np.uint32).reshape(-1, 4) - ord('0')
+        if (digits > 9).any():
+            raise ValueError("تاریخ نامعتبر در فایل اسناد (قالب مورد انتظار: 1403/05/12)")
+        try:
+            return (digits @ np.array([1000, 100, 10, 1], dtype=np.uint32)).astype(np.int64), np.asarray(accounts, dtype=str), amounts(debit) - amounts(credit)
+        except ValueError as e:
+            raise ValueError(f"مبلغ نامعتبر در فایل اسناد: {e}")
+
+    if path.lower().endswith('.parquet'):
+        try:
+            import pyarrow.parquet
+        except ImportError:
+            raise ImportError("برای خواندن اسناد از Parquet کتابخانه pyarrow لازم است: pip install pyarrow")
+        for batch in pyarrow.parquet.ParquetFile(path).iter_batches(batch_size=chunk_size, columns=list(JOURNAL_COLUMNS)):
+            yield chunk(*(batch.column(batch.schema.get_field_index(name)).to_numpy(zero_copy_only=False).astype(str if i < 2 else object)
+                          for i, name in enumerate(JOURNAL_COLUMNS)))
+        return
+
+    with open(path, encoding='utf-8-sig', newline='') as f:
+        reader = csv.reader(f)
+        header = [name.strip() for name in next(reader, [])]
+        missing = [name for name in JOURNAL_COLUMNS if name not in header]
+        if missing:
+            raise ValueError(f"ستون‌های لازم در فایل اسناد وجود ندارد: {', '.join(missing)}")
+        positions = [header.index(name) for name in JOURNAL_COLUMNS]
+        while True:
+            rows = [row for row in itertools.islice(reader, chunk_size) if row]
+            if not rows:
+                break
+            yield chunk(*([row[i] for row in rows] for i in positions))
+
+
+def aggregate_journal(path, chunk_size=1_000_000):
+    """
+    جمع (بدهکار - بستانکار) هر حساب در هر دوره TRIAL_BALANCE_YEARS با bincount روی هر تکه.
+    خروجی: (کدهای حساب، آرایه حساب × دوره به ریال).
+    """
+    first_year, num_periods = TRIAL_BALANCE_YEARS[1], len(TRIAL_BALANCE_YEARS)
+    account_ids, balances = {}, np.zeros((0, num_periods))
+    for years, accounts, amounts in iter_journal_chunks(path, chunk_size):
+        if years.max(initial=0) > TRIAL_BALANCE_YEARS[-1]:
+            raise ValueError(f"اسناد پس از آخرین سال گزارش ({TRIAL_BALANCE_YEARS[-1]}) در فایل وجود دارد.")
+        period = np.clip(years - first_year + 1, 0, None)
+        unique, inverse = np.unique(accounts, return_inverse=True)
+        ids = np.array([account_ids.setdefault(account, len(account_ids)) for account in unique.tolist()], dtype=np.int64)
+        if len(account_ids) > len(balances):
+            balances = np.vstack([balances, np.zeros((len(account_ids) - len(balances), num_periods))])
+        balances += np.bincount(ids[inverse] * num_periods + period, weights=amounts,
+                                minlength=balances.size).reshape(balances.shape)
+    return list(account_ids), balances
+
+
+def build_trial_balance(journal_path, chart_path, chunk_size=1_000_000):
+    """تراز آزمایشی به تفکیک اقلام صورت‌های مالی (میلیون ریال) از فایل اسناد و جدول حساب‌ها."""
+    chart = load_chart_of_accounts(chart_path)
+    accounts, balances = aggregate_journal(journal_path, chunk_size)
+    imbalance = balances.sum(axis=0)
+    for year, difference in zip(TRIAL_BALANCE_YEARS, imbalance.tolist()):
+        if abs(difference) >= 1:
+            print(f"هشدار: جمع بدهکار و بستانکار اسناد سال {year} برابر نیست (اختلاف {difference:,.0f} ریال).")
+
+    lines, unmapped = {}, []
+    for account, row in zip(accounts, balances):
+        entry = next((entry for entry in chart if account.startswith(entry.account)), None)
+        if entry is None:
+            unmapped.append(account)
+            continue
+        amounts = row * entry.sign / 1_000_000
+        if entry.kind == 'balance':
+            amounts = np.cumsum(amounts) # مانده پایان هر سال
+        lines[entry.line] = lines.get(entry.line, 0) + amounts
+    return TrialBalance({line: {str(year): round(float(value), 0) for year, value in zip(TRIAL_BALANCE_YEARS, amounts)}
+                         for line, amounts in lines.items()}, sorted(unmapped))
+
+
+def ledger_value(trial_balance, line, year, default):
+    """مقدار یک قلم تراز آزمایشی برای سال year، یا default اگر دفتر کل آن قلم را ندارد."""
+    if trial_balance is None or line not in trial_balance.lines:
+        return default
+    return trial_balance.lines[line][str(year)]
+
+
+def ledger_opening_balance(trial_balance):
+    """مانده‌های ترازنامه افتتاحیه: OPENING_BALANCE_SHEET با مانده‌های پایان 1401 دفتر کل."""
+    return {key: ledger_value(trial_balance, f'opening:{key}', TRIAL_BALANCE_YEARS[0], value)
+            for key, value in OPENING_BALANCE_SHEET.items()}
+
+
+def ledger_assumption_overrides(trial_balance, overrides=None):
+    """مفروضات جایگزین از اقلام assumption: دفتر کل؛ جایگزین‌های سناریو (overrides) بر آن‌ها مقدم‌اند."""
+    ledger_overrides = {}
+    for line, values in (trial_balance.lines.items() if trial_balance else ()):
+        if line.startswith('assumption:'):
+            ledger_overrides[line.partition(':')[2]] = {year: values[year] for year in ASSUMPTION_YEARS}
+    return {**ledger_overrides, **(overrides or {})}
+
+
+def ledger_note_items(trial_balance, sheet_name, items):
+    """
+    جایگزینی مبالغ ثابت ردیف‌های یک یادداشت (شرح، 1403، 1402) با اقلام note:<شیت>:<شرح> دفتر کل.
+    فرمول‌ها (ارجاع به سایر شیت‌ها) دست نمی‌خورند.
+    """
+    if trial_balance is None:
+        return items
+    return [(label, *(value if isinstance(value, str) else ledger_value(trial_balance, f'note:{sheet_name}:{label}', year, value)
+                      for year, value in zip(ASSUMPTION_YEARS, values)))
+            for label, *values in items]
+
+
+def unmatched_ledger_note_lines(wb, trial_balance):
+    """اقلام note: دفتر کل که شرح آن‌ها در ستون B شیت یادداشت ساخته شده پیدا نشد (احتمالاً اشتباه تایپی)."""
+    unmatched = []
+    for line in (trial_balance.lines if trial_balance else ()):
+        if line.startswith('note:'):
+            sheet_name, _, label = line[len('note:'):].partition(':')
+            labels = {cell.value for cell in wb[sheet_name]['B']} if sheet_name in wb.sheetnames else set()
+            if label not in labels:
+                unmatched.append(line)
+    return unmatched
+
+
+def apply_trial_balance_to_notes(notes, trial_balance):
+    """اعمال ledger_note_items روی همه ردیف‌های numeric_note_sheet_map."""
+    if trial_balance is None:
+        return notes
+    for sheet_name, content in notes.items():
+        if 'data' in content:
+            content['data'] = ledger_note_items(trial_balance, sheet_name, content['data'])
+        for section in content.get('sections', []):
+            section['data'] = ledger_note_items(trial_balance, sheet_name, section['data'])
+    return notes
 
-    all_sheet_names = [
-        'مفروضات', 'ترازنامه پایه', 'وضعیت مالی', 'سودوزیان', 'جریان های نقدی', 'حقوق مالکانه', 'جامع',
-        'گردش دارایی ثابت', 'موجودی_تفصیلی', 'موجودی', 'لیست حقوق و دستمزد', '8', '9',
-        'سر برگ صفحات', 'ص امضا', 'تاریخچه',
-        'اهم رویه1', 'اهم رویه2', 'اهم رویه3', 'اهم رویه4', 'اهم رویه5', 'اهم رویه6',
-        'قضاوت مدیریت', 'پیوست',
-        '5', '6', '7', '10.11.12', '13', '14', '15', '16', '17', '18', '19', '20',
-        '21', '22.-23', '24.25', '26.27', '28.29.30.31', '32.33', '34',
-        '35', '35-1', '35-6', '36-37', '38.39.40', '41', '42.43', '44',
-        '44-4', '44-6', '45', '46', '46-3', '47.48', '49',
-        'ادامه16', 'ادامه34', 'ادامه41', 'ادامه41..',
-        'گزارش مدیریتی تطبیقی',
-        'گزارش تحلیلی کسب و کار'
+
+# ==============================================================================
+# برنامه‌ریز ساخت: اجرای یک‌باره توابع populate_* به ترتیب وابستگی شیت‌ها
+# ==============================================================================
+NUMERIC_NOTE_SHEET_NAMES = [
+    '5', '6', '7', '10.11.12', '13', '14', '15', '16', '17', '18', '19', '20',
+    '21', '22.-23', '24.25', '26.27', '28.29.30.31', '32.33', '34',
+    '35', '35-1', '35-6', '36-37', '38.39.40', '41', '42.43', '44',
+    '44-4', '44-6', '45', '46', '46-3', '47.48', '49',
+    'ادامه16', 'ادامه34', 'ادامه41', 'ادامه41..',
+]
+
+# ارجاع شیت در کد (مثل "'9'!C13") - لینک‌های داخلی که با # شروع می‌شوند وابستگی محاسباتی نیستند
+SHEET_REFERENCE_PATTERN = re.compile(r"(?<!#)'([^'\"\[\]=\n]+)'!")
+# ارجاع سلول یا محدوده در فرمول (مثل 'وضعیت مالی'!E11 یا SUM(C7:C10))
+CELL_REFERENCE_PATTERN = re.compile(
+    r"(?<![A-Za-z0-9_.])(?:'(?P<quoted>[^']+)'!|(?P<plain>[A-Za-z0-9_.]+)!)?"
+    r"\$?(?P<col1>[A-Z]{1,3})\$?(?P<row1>[0-9]+)(?![A-Za-z0-9_(])"
+    r"(?::\$?(?P<col2>[A-Z]{1,3})\$?(?P<row2>[0-9]+))?"
+)
+FORMULA_STRING_PATTERN = re.compile(r'"[^"]*"')
+# ارجاع نمادین در کد (مثل cells.ref('net_profit', '1403'))
+CELL_NAME_REFERENCE_PATTERN = re.compile(r"cells\.ref\(\s*'([^']+)'")
+
+
+class CircularReferenceError(ValueError):
+    """ارجاع چرخشی واقعی (در سطح سلول) بین شیت‌های گزارش."""
+
+
+# inputs: تابعی از ctx که ورودی‌های مؤثر بر محتوای مرحله را برمی‌گرداند (برای اثر انگشت کش ساخت)؛
+# None یعنی محتوا فقط به کد وابسته است و UNCACHEABLE یعنی هر بار باید ساخته شود.
+# registers: تابعی (cells, ctx) که خروجی‌های کلیدی مرحله را در ReportCellRegistry ثبت می‌کند.
+# reads: نام‌های نمادینی (در ReportCellRegistry) که فرمول‌های مرحله به آن‌ها ارجاع می‌دهند؛ مبنای گراف وابستگی.
+ReportBuildStep = namedtuple('ReportBuildStep', ['name', 'func', 'writes', 'run', 'inputs', 'registers', 'reads'],
+                             defaults=(None, None, ()))
+UNCACHEABLE = 'uncacheable'
+
+# ورودی‌های نمادین یادداشت‌های عددی (شیت‌هایی که اینجا نیستند فقط مبالغ ثابت دارند)
+NUMERIC_NOTE_READS = {
+    '24.25': ('retained_earnings_opening', 'net_profit', 'legal_reserve_transfer', 'dividends'),
+    '26.27': ('finance_cost', 'finance_income'),
+    '32.33': ('selling_personnel_expense', 'admin_personnel_expense', 'admin_depreciation'),
+    '35-6': ('payroll_ledger_gross', 'payroll_ledger_employer_insurance'),
+    '38.39.40': ('net_profit',),
+}
+
+
+def get_report_build_steps():
+    """
+    فهرست مراحل ساخت گزارش؛ هر مرحله یک تابع populate_* و شیت‌هایی که پر می‌کند.
+    ترتیب این فهرست فقط برای شکستن تساوی در مرتب‌سازی توپولوژیک استفاده می‌شود.
+    """
+    def assumptions(ctx):
+        ctx['assumption_map'] = populate_assumptions_sheet(ctx['wb']['مفروضات'], ctx['assumption_overrides'])
+
+    def payroll(ctx):
+        if not ctx['streaming']: # در حالت جریانی این شیت هنگام ذخیره نوشته می‌شود
+            populate_payroll_list_sheet(ctx['wb']['لیست حقوق و دستمزد'], ctx['num_employees'], ctx['seed'])
+
+    def payroll_ledger(ctx):
+        # دفتر ماهانه فقط جمع‌ها را نگه می‌دارد و در حالت جریانی هم ساخته می‌شود
+        populate_payroll_ledger_sheet(ctx['wb'][PAYROLL_LEDGER_SHEET_TITLE], ctx['num_employees'], ctx['seed'])
+
+    def detailed_inventory(ctx):
+        if not ctx['streaming']:
+            populate_detailed_inventory_sheet(ctx['wb']['موجودی_تفصیلی'], ctx['inventory_items'])
+
+    def static_sheets(sheet_names):
+        # شیت‌های متنی از قالب آماده (StaticSheetTemplates) کپی می‌شوند، نه دوباره نوشته
+        return lambda ctx: (ctx.get('static_templates') or STATIC_SHEET_TEMPLATES).restore(ctx['wb'], sheet_names)
+
+    def single(func, sheet_name, needs_cells=False):
+        if needs_cells:
+            return lambda ctx: func(ctx['wb'][sheet_name], ctx['cells'])
+        return lambda ctx: func(ctx['wb'][sheet_name])
+
+    def numeric_note(sheet_name):
+        return lambda ctx: populate_numeric_note_sheets(ctx['wb'], ctx['cells'], [sheet_name], ctx.get('trial_balance'))
+
+    def numeric_note_inputs(sheet_name):
+        return lambda ctx: numeric_note_sheet_map(ctx['cells'], ctx.get('trial_balance')).get(sheet_name)
+
+    def ledger_lines(prefix):
+        # اقلام دفتر کل مؤثر بر یک مرحله (برای اثر انگشت کش ساخت)
+        return lambda ctx: sorted((line, sorted(values.items())) for line, values in
+                                  (ctx.get('trial_balance') or TrialBalance({}, [])).lines.items() if line.startswith(prefix))
+
+    def payroll_inputs(ctx):
+        # بدون seed داده‌های کارمندان تصادفی است و نتیجه قابل استفاده مجدد نیست
+        if ctx['seed'] is None and not ctx['streaming']:
+            return UNCACHEABLE
+        return (ctx['streaming'], ctx['num_employees'], ctx['seed'])
+
+    def payroll_ledger_inputs(ctx):
+        return UNCACHEABLE if ctx['seed'] is None else (ctx['num_employees'], ctx['seed'])
+
+    def static_cells(register):
+        return lambda cells, ctx: register(cells)
+
+    return [
+        ReportBuildStep('مفروضات', populate_assumptions_sheet, ['مفروضات'], assumptions,
+                        lambda ctx: apply_assumption_overrides(DEFAULT_ASSUMPTIONS, ctx['assumption_overrides']),
+                        static_cells(register_assumption_cells)),
+        ReportBuildStep('ترازنامه پایه', populate_starting_balance_sheet, ['ترازنامه پایه'],
+                        lambda ctx: populate_starting_balance_sheet(ctx['wb']['ترازنامه پایه'], ledger_opening_balance(ctx.get('trial_balance'))),
+                        ledger_lines('opening:'), static_cells(register_starting_balance_cells)),
+        ReportBuildStep('لیست حقوق و دستمزد', populate_payroll_list_sheet, ['لیست حقوق و دستمزد'], payroll, payroll_inputs,
+                        lambda cells, ctx: register_payroll_cells(cells, ctx['payroll_layout'])),
+        ReportBuildStep(PAYROLL_LEDGER_SHEET_TITLE, populate_payroll_ledger_sheet, [PAYROLL_LEDGER_SHEET_TITLE],
+                        payroll_ledger, payroll_ledger_inputs,
+                        static_cells(register_payroll_ledger_cells)),
+        ReportBuildStep('موجودی_تفصیلی', populate_detailed_inventory_sheet, ['موجودی_تفصیلی'], detailed_inventory,
+                        lambda ctx: (ctx['streaming'], ctx['inventory_items']),
+                        lambda cells, ctx: register_detailed_inventory_cells(cells, ctx['inventory_layout'])),
+        ReportBuildStep('8 و 9', populate_note_8_and_9, ['8', '9'], lambda ctx: populate_note_8_and_9(ctx['wb'], ctx['cells'], ctx.get('trial_balance')),
+                        ledger_lines('note:'), static_cells(register_expense_note_cells),
+                        reads=('payroll_ledger_production', 'payroll_ledger_selling', 'payroll_ledger_admin',
+                               'inventory_cogs', 'depreciation_expense')),
+        ReportBuildStep('سودوزیان', populate_profit_loss_sheet, ['سودوزیان'],
+                        lambda ctx: populate_profit_loss_sheet(ctx['wb']['سودوزیان'], ctx['cells'], ctx.get('trial_balance')),
+                        ledger_lines('pl:'), static_cells(register_profit_loss_cells),
+                        reads=('cost_of_sales_total', 'sga_expenses', 'period_opening_cash', 'cash_before_profit',
+                               'long_term_debt', 'current_portion_of_debt', 'opening_long_term_debt', 'opening_current_portion_of_debt',
+                               'درصد رشد درآمدهای عملیاتی', 'نرخ سود تسهیلات (بر میانگین مانده)',
+                               'نرخ سود سپرده بانکی (بر میانگین مانده نقد)', 'نرخ مالیات بر درآمد',
+                               'سود سهام پرداختی (درصد از سود خالص)')),
+        ReportBuildStep('حقوق مالکانه', populate_equity_sheet, ['حقوق مالکانه'], single(populate_equity_sheet, 'حقوق مالکانه', needs_cells=True),
+                        registers=static_cells(register_equity_cells),
+                        reads=('net_profit', 'opening_capital', 'opening_legal_reserve', 'opening_other_reserves',
+                               'opening_retained_earnings', 'سود سهام پرداختی (درصد از سود خالص)')),
+        ReportBuildStep('گردش دارایی ثابت', populate_fixed_asset_roll_forward_sheet, ['گردش دارایی ثابت'], single(populate_fixed_asset_roll_forward_sheet, 'گردش دارایی ثابت', needs_cells=True),
+                        registers=static_cells(register_fixed_asset_cells),
+                        reads=('opening_fixed_asset_cost', 'opening_accumulated_depreciation',
+                               'سرمایه‌گذاری ثابت سالانه (CAPEX)', 'نرخ استهلاک سالانه (نسبت به بهای تمام شده اول دوره)')),
+        ReportBuildStep('وضعیت مالی', populate_balance_sheet, ['وضعیت مالی'], single(populate_balance_sheet, 'وضعیت مالی', needs_cells=True),
+                        registers=static_cells(register_balance_sheet_cells),
+                        reads=('closing_cash', 'opening_cash', 'revenue', 'cost_of_sales_total', 'income_tax', 'end_of_service_expense',
+                               'inventory_closing_value', 'opening_inventory', 'fixed_assets_net_book_value', 'total_equity',
+                               'opening_long_term_debt', 'opening_end_of_service_benefits',
+                               'دوره وصول مطالبات (روز)', 'دوره پرداخت بدهی‌ها (روز)',
+                               'مبلغ وام جدید دریافتی طی سال', 'مبلغ بازپرداخت اصل وام طی سال')),
+        ReportBuildStep('جریان های نقدی', populate_cash_flow_sheet, ['جریان های نقدی'], single(populate_cash_flow_sheet, 'جریان های نقدی', needs_cells=True),
+                        registers=static_cells(register_cash_flow_cells),
+                        reads=('net_profit', 'depreciation_expense', 'end_of_service_expense', 'finance_income', 'dividends',
+                               'receivables', 'inventory', 'accounts_payable', 'cash', 'opening_cash',
+                               'سرمایه‌گذاری ثابت سالانه (CAPEX)', 'نرخ سود سپرده بانکی (بر میانگین مانده نقد)',
+                               'مبلغ وام جدید دریافتی طی سال', 'مبلغ بازپرداخت اصل وام طی سال')),
+        ReportBuildStep('موجودی', populate_inventory_note, ['موجودی'], single(populate_inventory_note, 'موجودی', needs_cells=True),
+                        reads=('inventory_opening_value', 'inventory_purchases_value', 'inventory_cogs',
+                               'inventory_closing_value', 'inventory_item_closing_value')),
+        *[ReportBuildStep(sheet_name, numeric_note_sheet_map, [sheet_name], numeric_note(sheet_name), numeric_note_inputs(sheet_name),
+                          reads=NUMERIC_NOTE_READS.get(sheet_name, ()))
+          for sheet_name in NUMERIC_NOTE_SHEET_NAMES],
+        ReportBuildStep('جامع', populate_comprehensive_income_sheet, ['جامع'], single(populate_comprehensive_income_sheet, 'جامع', needs_cells=True),
+                        reads=('net_profit',)),
+        ReportBuildStep('تاریخچه', populate_history_sheet, ['تاریخچه'], static_sheets(['تاریخچه'])),
+        ReportBuildStep('اهم رویه', populate_significant_accounting_policy_sheet, [f'اهم رویه{i}' for i in range(1, 7)],
+                        static_sheets([f'اهم رویه{i}' for i in range(1, 7)])),
+        ReportBuildStep('قضاوت مدیریت', populate_management_judgment_sheet, ['قضاوت مدیریت'], static_sheets(['قضاوت مدیریت'])),
+        ReportBuildStep('پیوست', populate_attachment_sheet, ['پیوست'], static_sheets(['پیوست'])),
+        ReportBuildStep('سر برگ صفحات', populate_page_header_sheet, ['سر برگ صفحات'], static_sheets(['سر برگ صفحات'])),
+        ReportBuildStep('ص امضا', populate_signature_sheet, ['ص امضا'], static_sheets(['ص امضا'])),
+        ReportBuildStep('گزارش مدیریتی تطبیقی', populate_management_comparative_report, ['گزارش مدیریتی تطبیقی'], single(populate_management_comparative_report, 'گزارش مدیریتی تطبیقی', needs_cells=True),
+                        registers=static_cells(register_management_report_cells),
+                        reads=('revenue', 'gross_profit', 'operating_profit', 'net_profit', 'current_assets', 'total_assets',
+                               'current_liabilities', 'total_liabilities')),
+        ReportBuildStep('گزارش تحلیلی کسب و کار', populate_business_analytical_report, ['گزارش تحلیلی کسب و کار'], single(populate_business_analytical_report, 'گزارش تحلیلی کسب و کار', needs_cells=True),
+                        reads=('revenue_growth', 'net_profit_margin', 'current_ratio', 'cost_of_revenue')),
     ]
 
-    for sheet_name in all_sheet_names:
-        if sheet_name not in wb.sheetnames:
-            try:
-                wb.create_sheet(sheet_name)
-            except ValueError:
-                pass
 
-    # --- ترتیب صحیح اجرا برای مدل یکپارچه ---
-    print("شروع ساخت مدل مالی یکپارچه...")
-    
-    # 1. پر کردن شیت مفروضات
-    assumption_map = populate_assumptions_sheet(wb['مفروضات'])
+def report_cell_registry(steps=None, ctx=None):
+    """
+    ساخت ثبت نشانی‌های نمادین از روی مراحل ساخت؛ پیش از اجرای هر مرحله کامل است
+    (آدرس‌ها فقط به چیدمان شیت‌ها بستگی دارند نه به محتوای آن‌ها).
+    بدون ctx چیدمان پیش‌فرض (100 کارمند و اقلام پیش‌فرض موجودی) استفاده می‌شود.
+    """
+    if ctx is None:
+        ctx = {'payroll_layout': payroll_sheet_layout(), 'inventory_layout': detailed_inventory_layout()}
+    cells = ReportCellRegistry()
+    for step in steps or get_report_build_steps():
+        if step.registers:
+            step.registers(cells, ctx)
+    return cells
 
-    # 2. پر کردن شیت ترازنامه پایه (جدید) - باید قبل از تمامی شیت‌هایی که به مانده‌های اولیه نیاز دارند، پر شود.
-    populate_starting_balance_sheet(wb['ترازنامه پایه'])
 
-    # 3. پر کردن شیت‌های پایه و تفصیلی که نیاز به ترازنامه پایه ندارند یا ورودی اولیه هستند.
-    populate_payroll_list_sheet(wb['لیست حقوق و دستمزد'])
-    populate_detailed_inventory_sheet(wb['موجودی_تفصیلی'])
-    
-    # 4. ایجاد یادداشت‌های هزینه‌ای که ورودی سود و زیان هستند (اکنون یکپارچه شده‌اند)
-    populate_note_8_and_9(wb) # این تابع هم 8 و هم 9 را پر می‌کند
-
-    # 5. اجرای حلقه محاسبه تراز برای همگرایی (مهمترین بخش)
-    # این حلقه باید شیت‌های اصلی (سودوزیان، حقوق مالکانه، گردش دارایی ثابت، وضعیت مالی، جریان‌های نقدی) را چندین بار پر کند تا مقادیر همگرا شوند.
-    print("اجرای حلقه محاسبه تراز...")
-    for i in range(20): # تکرار 20 بار برای اطمینان از همگرایی کامل
-        print(f"اجرای حلقه همگرایی - مرحله {i+1}")
-        populate_profit_loss_sheet(wb['سودوزیان'], assumption_map) # سودوزیان
-        populate_equity_sheet(wb['حقوق مالکانه']) # حقوق مالکانه
-        populate_fixed_asset_roll_forward_sheet(wb['گردش دارایی ثابت'], assumption_map) # گردش دارایی ثابت
-        populate_balance_sheet(wb['وضعیت مالی'], assumption_map) # وضعیت مالی
-        populate_cash_flow_sheet(wb['جریان های نقدی'], assumption_map) # جریان های نقدی
-
-    print("مدل مالی پویا با موفقیت ایجاد و تراز شد.")
-
-    # 6. پر کردن بقیه شیت‌ها
-    print("پر کردن شیت‌های جانبی و یادداشت‌ها...")
-    populate_inventory_note(wb['موجودی'])
-    populate_numeric_note_sheets(wb)
-    populate_comprehensive_income_sheet(wb['جامع'])
-    populate_history_sheet(wb['تاریخچه'])
-    for i in range(1, 7):
-        sheet_name = f'اهم رویه{i}'
-        if sheet_name in wb.sheetnames:
-            populate_significant_accounting_policy_sheet(wb[sheet_name], i)
-    populate_management_judgment_sheet(wb['قضاوت مدیریت'])
-    populate_attachment_sheet(wb['پیوست'])
-    populate_page_header_sheet(wb['سر برگ صفحات'])
-    populate_signature_sheet(wb['ص امضا'])
-    populate_management_comparative_report(wb['گزارش مدیریتی تطبیقی'])
-    populate_business_analytical_report(wb['گزارش تحلیلی کسب و کار'])
-    print("تمام شیت‌ها پر شدند.")
+@functools.lru_cache(maxsize=None)
+def find_sheet_references(func):
+    """شیت‌هایی که کد یک تابع populate_* مستقیماً (با آدرس) به آن‌ها ارجاع می‌دهد؛ فقط برای کنترل ReportBuildStep.reads."""
+    return set(SHEET_REFERENCE_PATTERN.findall(inspect.getsource(func)))
 
 
-    output_path = os.path.join(output_folder, output_file_name)
-    try:
-        wb.active = wb['وضعیت مالی']
-        wb.save(output_path)
-        print(f"فایل اکسل '{output_file_name}' با موفقیت در مسیر '{output_folder}' ایجاد و پر شد.")
-    except Exception as e:
-        print(f"خطا در ذخیره فایل اکسل: {e}")
-        print("لطفاً مطمئن شوید فایل اکسل با همین نام باز نیست و دسترسی نوشتن به پوشه مقصد وجود دارد.")
+@functools.lru_cache(maxsize=None)
+def find_cell_references(func):
+    """نام‌هایی که کد یک تابع populate_* با cells.ref(...) به آن‌ها ارجاع می‌دهد؛ فقط برای کنترل ReportBuildStep.reads."""
+    return frozenset(CELL_NAME_REFERENCE_PATTERN.findall(inspect.getsource(func)))
 
 
-# --- تابع اصلی برای اجرا ---
-if __name__ == "__main__":
-    # <<!>> مسیر پوشه خروجی خود را در اینجا وارد کنید
-    # مثال: r'C:\Users\mahinn\Desktop\New folder (14)'
-    # لطفاً 'YourUser' را با نام کاربری خود در ویندوز جایگزین کنید
-    output_directory = r'C:\Users\mahinn\Desktop\New folder (14)'  
-    output_excel_file_name = 'صورت_مالی_کامل_پویا_مرغداری_تراز_شده_نهایی.xlsx'
-
-    # اطمینان از وجود پوشه خروجی
-    if not os.path.exists(output_directory):
-        try:
-            os.makedirs(output_directory)
-            print(f"پوشه '{output_directory}' ایجاد شد.")
-        except OSError as e:
-            print(f"خطا در ایجاد پوشه: {e}. لطفاً یک مسیر معتبر وارد کنید.")
-            exit()
-
-    # اجرای تابع برای ایجاد و پر کردن صورت های مالی
-    create_full_financial_report(output_directory, output_excel_file_name)
+def undeclared_step_references(steps):
+    """
+    کنترل متقابل reads اعلام شده با متن کد: {مرحله: ارجاع‌هایی که در کد هست و اعلام نشده}.
+    یادداشت‌های عددی همه از یک تابع ساخته می‌شوند، پس با اجتماع reads آن‌ها مقایسه می‌شوند.
+    """
+    declared = defaultdict(set)
+    for step in steps:
+        declared[step.func].update(step.reads)
+        declared[step.func].update(step.writes)
+    missing = {}
+    for step in steps:
+        found = find_cell_references(step.func) | find_sheet_references(step.func)
+        undeclared = found - declared[step.func]
+        if undeclared:
+            missing[step.name] = sorted(undeclared)
+    return missing
+
+
+def sheet_dependency_graph(steps, cells):
+    """
+    گراف وابستگی در سطح شیت: {شیت: شیت‌هایی که فرمول‌هایش به آن‌ها ارجاع می‌دهد}.
+    نام‌های اعلام شده در ReportBuildStep.reads از طریق ثبت نشانی‌ها به شیت تولیدکننده نگاشت می‌شوند.
+    """
+    graph = {}
+    for step in steps:
+        referenced = set()
+        for name in step.reads:
+            sheet_name = cells.sheet_of(name)
+            if sheet_name is None:
+                raise KeyError(f"مرحله '{step.name}' به خروجی ثبت نشده '{name}' ارجاع می‌دهد.")
+            referenced.add(sheet_name)
+        for sheet_name in step.writes:
+            graph[sheet_name] = referenced - {sheet_name}
+    return graph
+
+
+def _strongly_connected_components(nodes, edges):
+    """الگوریتم تارجان (غیربازگشتی)؛ خروجی: لیست مؤلفه‌ها به ترتیب پیدا شدن."""
+    index_of, low_of, on_stack, stack, components = {}, {}, set(), [], []
+    counter = 0
+    for root in nodes:
+        if root in index_of:
+            continue
+        work = [(root, iter(edges[root]))]
+        index_of[root] = low_of[root] = counter
+        counter += 1
+        stack.append(root)
+        on_stack.add(root)
+        while work:
+            node, children = work[-1]
+            advanced = False
+            for child in children:
+                if child not in index_of:
+                    index_of[child] = low_of[child] = counter
+                    counter += 1
+                    stack.append(child)
+                    on_stack.add(child)
+                    work.append((child, iter(edges[child])))
+                    advanced = True
+                    break
+                if child in on_stack:
+                    low_of[node] = min(low_of[node], index_of[child])
+            if advanced:
+                continue
+            work.pop()
+            if work:
+                parent = work[-1][0]
+                low_of[parent] = min(low_of[parent], low_of[node])
+            if low_of[node] == index_of[node]:
+                component = []
+                while True:
+                    member = stack.pop()
+                    on_stack.discard(member)
+                    component.append(member)
+                    if member == node:
+                        break
+                components.append(component)
+    return components
+
+
+def report_build_components(steps, cells=None):
+    """
+    گروه‌بندی مراحل ساخت بر اساس گراف وابستگی شیت‌ها (sheet_dependency_graph).
+    خروجی: (مؤلفه‌های قویاً همبند به صورت لیست مرتب اندیس مراحل، {مؤلفه: مؤلفه‌های پیش‌نیاز}).
+    مراحلی که در یک مؤلفه‌اند در سطح شیت به هم ارجاع چرخشی دارند و باید با هم اجرا شوند.
+    """
+    cells = cells if cells is not None else report_cell_registry(steps)
+    graph = sheet_dependency_graph(steps, cells)
+    writer_of = {}
+    for position, step in enumerate(steps):
+        for sheet_name in step.writes:
+            writer_of[sheet_name] = position
+
+    edges = {}
+    for position, step in enumerate(steps):
+        referenced = set().union(*(graph[sheet_name] for sheet_name in step.writes))
+        edges[position] = sorted({writer_of[name] for name in referenced
+                                  if name in writer_of and writer_of[name] != position})
+
+    components = [sorted(component) for component in _strongly_connected_components(range(len(steps)), edges)]
+    component_of = {}
+    for component_id, component in enumerate(components):
+        for position in component:
+            component_of[position] = component_id
+
+    requires = {component_id: set() for component_id in range(len(components))}
+    for position, targets in edges.items():
+        for target in targets:
+            if component_of[target] != component_of[position]:
+                requires[component_of[position]].add(component_of[target])
+    return components, requires
+
+
+def _component_dependents(requires):
+    """وارون گراف پیش‌نیازها: {مؤلفه: مؤلفه‌هایی که منتظر آن هستند}."""
+    dependents = {component_id: set() for component_id in requires}
+    for component_id, targets in requires.items():
+        for target in targets:
+            dependents[target].add(component_id)
+    return dependents
+
+
+def plan_report_build(steps, cells=None):
+    """
+    مرتب‌سازی توپولوژیک مراحل ساخت بر اساس گراف وابستگی شیت‌ها (sheet_dependency_graph).
+    خروجی: (مراحل به ترتیب اجرا، لیست گروه شیت‌هایی که در سطح شیت به هم ارجاع چرخشی دارند).
+    گروه‌های چرخشی با ترتیب اعلام شده اجرا می‌شوند و پس از ساخت در سطح سلول بررسی می‌شوند (validate_workbook_references).
+    """
+    components, requires = report_build_components(steps, cells)
+    dependents = _component_dependents(requires)
+
+    # Kahn روی گراف مؤلفه‌ها؛ در تساوی، مؤلفه‌ای که زودتر اعلام شده اول اجرا می‌شود
+    pending = {component_id: set(targets) for component_id, targets in requires.items()}
+    ready = sorted((components[c][0], c) for c, deps in pending.items() if not deps)
+    ordered_steps, cyclic_groups = [], []
+    while ready:
+        _, component_id = ready.pop(0)
+        members = components[component_id]
+        ordered_steps.extend(steps[position] for position in members)
+        if len(members) > 1:
+            cyclic_groups.append([name for position in members for name in steps[position].writes])
+        for dependent in dependents[component_id]:
+            pending[dependent].discard(component_id)
+            if not pending[dependent]:
+                ready.append((components[dependent][0], dependent))
+        ready.sort()
+    return ordered_steps, cyclic_groups
+
+
+# ==============================================================================
+# اعتبارسنجی ارجاع‌ها: نمایه یک‌باره فرمول‌ها و بررسی ارجاع‌های بین شیتی پس از ساخت
+# ==============================================================================
+# شماره ردیف‌های داخل فرمول (ارقام بلافاصله پس از حرف ستون یا $)؛ بقیه متن فرمول «شکل» آن است.
+# فرمول‌های یک ستون شیت ردیفی بزرگ (مثل =ROUND(D10*L10/1000000,0)) همه یک شکل دارند و فقط یک بار تجزیه می‌شوند.
+FORMULA_ROW_NUMBER_PATTERN = re.compile(r"(?<=[A-Z$])([0-9]+)")
+
+# ارجاع مشکل‌دار: kind کلید REFERENCE_ISSUE_KINDS؛ sheet و cell محل فرمول؛ target ارجاع یا مسیر چرخه
+ReferenceIssue = namedtuple('ReferenceIssue', ['kind', 'sheet', 'cell', 'target'])
+REFERENCE_ISSUE_KINDS = {
+    'missing_sheet': "ارجاع به شیت ناموجود",
+    'empty_cell': "ارجاع به سلول خالی",
+    'text_cell': "محاسبه با سلول متنی",
+    'cycle': "ارجاع چرخشی",
+}
+REFERENCE_ISSUES_PRINTED = 10 # تعداد ارجاع‌های مشکل‌دار که جزئیاتشان چاپ می‌شود
+
+# ارجاع‌های یک شکل فرمول. refs: (شیت، ستون اول، اندیس ردیف اول، ستون آخر، اندیس ردیف آخر) که اندیس‌ها به
+# شماره ردیف‌های جدا شده فرمول اشاره می‌کنند؛ checks: ارجاع‌های تک سلولی به شیت‌های دیگر (شیت، ستون، اندیس ردیف)؛
+# missing: شیت‌های ناموجود؛ bare: فرمول فقط یک ارجاع است (کپی مقدار، مثل ='5'!B10) و ارجاع به متن مجاز است؛
+# fixed: (اندیس، ارقام) ارقامی که شماره ردیف نیستند (مثل LOG10 یا نام شیت 'Q1') و در همه فرمول‌های شکل یکسان‌اند.
+FormulaShape = namedtuple('FormulaShape', ['refs', 'checks', 'missing', 'bare', 'fixed'])
+
+
+class BrokenReferenceError(ValueError):
+    """ارجاع‌های نامعتبر کارپوشه (با strict_references=True)."""
+
+
+def parse_formula_shape(formula, sheet_name, sheet_names):
+    """تجزیه یک فرمول نمونه از یک شکل؛ محل هر شماره ردیف به اندیس آن در FORMULA_ROW_NUMBER_PATTERN.split نگاشت می‌شود."""
+    numbers = list(FORMULA_ROW_NUMBER_PATTERN.finditer(formula))
+    slot_of = {match.start(): slot for slot, match in enumerate(numbers)}
+    # متن داخل "..." با فاصله پوشانده می‌شود تا محل ارقام جابه‌جا نشود
+    masked = FORMULA_STRING_PATTERN.sub(lambda match: '"' + ' ' * (len(match.group()) - 2) + '"', formula)
+    matches = list(CELL_REFERENCE_PATTERN.finditer(masked))
+    refs, checks, missing = [], [], []
+    for match in matches:
+        ref_sheet = match.group('quoted') or match.group('plain') or sheet_name
+        col1, row1 = column_index_from_string(match.group('col1')), slot_of[match.start('row1')]
+        if match.group('col2'):
+            refs.append((ref_sheet, col1, row1, column_index_from_string(match.group('col2')), slot_of[match.start('row2')]))
+        else:
+            refs.append((ref_sheet, col1, row1, col1, row1))
+        if ref_sheet not in sheet_names:
+            missing.append(ref_sheet)
+        elif ref_sheet != sheet_name and not match.group('col2'):
+            checks.append((ref_sheet, col1, row1))
+    bare = len(matches) == 1 and matches[0].start() == 1 and matches[0].end() == len(masked.rstrip())
+    row_slots = {slot for ref in refs for slot in (ref[2], ref[4])}
+    fixed = tuple((slot, match.group()) for slot, match in enumerate(numbers) if slot not in row_slots)
+    return FormulaShape(refs, checks, missing, bare, fixed)
+
+
+class FormulaIndex:
+    """
+    نمایه ارجاع‌های همه فرمول‌های کارپوشه با یک پیمایش: هر فرمول با یک split به (شکل، شماره ردیف‌ها) تبدیل
+    می‌شود و هر شکل فقط یک بار تجزیه می‌شود، پس زمان ساخت با تعداد فرمول‌ها خطی است.
+    families: {شیت: {ستون: [SharedFormula]}} خانواده‌های فرمول ردیفی که سازنده کارپوشه نوشته است (مثل
+    report_formula_families)؛ از هر خانواده فقط ردیف اول و آخر خوانده می‌شود (add_family).
+    nodes: {(شیت، ستون، کلید شکل): ردیف‌های فرمول‌های آن شکل در آن ستون} برای گراف ارجاع در سطح شکل؛
+    targets: {(شیت، ردیف، ستون) مقصد ارجاع تک سلولی بین شیتی: (شیت، ردیف، ستون، bare) اولین فرمول ارجاع دهنده}؛
+    missing: {شیت ناموجود: (شیت، ردیف، ستون) اولین فرمول ارجاع دهنده}.
+    """
+
+    def __init__(self, wb, families=None):
+        self.wb = wb
+        self.shapes = {}
+        self.nodes = defaultdict(list)
+        self.targets = {}
+        self.missing = {}
+        self.formula_count = 0
+        self.sheet_names = set(wb.sheetnames)
+        self.families = {}
+        for ws in wb.worksheets:
+            title = ws.title
+            sheet_families = (families or {}).get(title, {})
+            # ردیف‌های میانی یک خانواده خوانده نمی‌شوند؛ ردیف اول و آخر مثل بقیه نمایه و سپس مقایسه می‌شوند
+            interior = {col_idx: [(family.first_row, family.last_row) for family in column_families]
+                        for col_idx, column_families in sheet_families.items()}
+            edge_keys = {}
+            for (row_idx, col_idx), cell in worksheet_cell_items(ws):
+                spans = interior.get(col_idx)
+                if spans and any(first < row_idx < last for first, last in spans):
+                    continue
+                if cell.data_type != 'f':
+                    continue
+                key = self.add(title, row_idx, col_idx, cell.value)
+                if spans:
+                    edge_keys[(row_idx, col_idx)] = key
+            for col_idx, column_families in sheet_families.items():
+                for family in column_families:
+                    self.add_family(ws, col_idx, family, edge_keys)
+
+    def add(self, title, row_idx, col_idx, value):
+        """نمایه کردن فرمول یک سلول و برگرداندن کلید شکل آن."""
+        formula = getattr(value, 'text', value) # ArrayFormula متن خود را در text دارد
+        parts = FORMULA_ROW_NUMBER_PATTERN.split(formula)
+        key = (title, tuple(parts[0::2]))
+        shape = self.shapes.get(key)
+        if shape is None or shape.fixed:
+            key, shape = self.shape(title, formula, parts)
+        self.formula_count += 1
+        self.nodes[(title, col_idx, key)].append(row_idx)
+        for target_sheet, target_col, slot in shape.checks:
+            target = (target_sheet, int(parts[2 * slot + 1]), target_col)
+            known = self.targets.get(target)
+            if known is None or (known[3] and not shape.bare):
+                self.targets[target] = (title, row_idx, col_idx, shape.bare)
+        for missing_sheet in shape.missing:
+            self.missing.setdefault(missing_sheet, (title, row_idx, col_idx))
+        return key
+
+    def add_family(self, ws, col_idx, family, edge_keys):
+        """
+        ردیف‌های میانی یک SharedFormula (مثل ستون‌های فرمولی ردیف‌های حقوق) بدون خواندن تک تک سلول‌ها به گره شکل
+        ردیف اول اضافه می‌شوند، به شرط آن‌که ردیف اول و آخر همان متن SharedFormula و همان شکل را داشته باشند و
+        شکل ارجاع تک سلولی به شیت دیگر (که باید سلول به سلول بررسی شود) نداشته باشد؛ وگرنه ردیف‌ها یکی یکی نمایه می‌شوند.
+        """
+        first, last = family.first_row, family.last_row
+        key = edge_keys.get((first, col_idx))
+        matches = key is not None and edge_keys.get((last, col_idx)) == key and not self.shapes[key].checks
+        for row_idx in (first, last):
+            if matches:
+                value = worksheet_cell(ws, row_idx, col_idx).value
+                matches = getattr(value, 'text', value) == shared_formula_text(family, row_idx)
+        if matches:
+            self.nodes[(ws.title, col_idx, key)].extend(range(first + 1, last))
+            self.formula_count += max(0, last - first - 1)
+            self.families[(ws.title, col_idx, key)] = (first, last)
+            return
+        for row_idx in range(first + 1, last):
+            cell = worksheet_cell(ws, row_idx, col_idx)
+            if cell is not None and cell.data_type == 'f':
+                self.add(ws.title, row_idx, col_idx, cell.value)
+
+    def shape(self, sheet_name, formula, parts):
+        """(کلید، FormulaShape) فرمول؛ اگر ارقام ثابت شکل با فرمول نخواند، کلید شامل همه ارقام فرمول است."""
+        key = (sheet_name, tuple(parts[0::2]))
+        shape = self.shapes.get(key)
+        if shape is None:
+            shape = self.shapes[key] = parse_formula_shape(formula, sheet_name, self.sheet_names)
+        if any(parts[2 * slot + 1] != digits for slot, digits in shape.fixed):
+            key = (sheet_name, tuple(parts))
+            shape = self.shapes.get(key)
+            if shape is None:
+                shape = self.shapes[key] = parse_formula_shape(formula, sheet_name, self.sheet_names)
+        return key, shape
+
+    def cell_references(self, sheet_name, formula):
+        """ارجاع‌های یک فرمول به صورت (شیت، ستون اول، ردیف اول، ستون آخر، ردیف آخر) از روی شکل نمایه شده."""
+        parts = FORMULA_ROW_NUMBER_PATTERN.split(formula)
+        _, shape = self.shape(sheet_name, formula, parts)
+        return [(ref_sheet, col1, int(parts[2 * row1 + 1]), col2, int(parts[2 * row2 + 1]))
+                for ref_sheet, col1, row1, col2, row2 in shape.refs]
+
+
+def _formula_shape_graph(index):
+    """
+    گراف ارجاع بین گره‌های (شیت، ستون، شکل) نمایه: هر گره به همه گره‌های ستون‌هایی که شکل آن به آن‌ها ارجاع دارد
+    وصل است (بدون توجه به ردیف‌ها، پس هر چرخه سلولی در این گراف هم چرخه است).
+    """
+    nodes_by_column = defaultdict(list)
+    for node in index.nodes:
+        nodes_by_column[node[:2]].append(node)
+    columns_by_sheet = defaultdict(list)
+    for sheet_name, col_idx in nodes_by_column:
+        columns_by_sheet[sheet_name].append(col_idx)
+    for cols in columns_by_sheet.values():
+        cols.sort()
+    edges = {}
+    for node in index.nodes:
+        targets = set()
+        for ref_sheet, col1, _, col2, _ in index.shapes[node[2]].refs:
+            cols = columns_by_sheet.get(ref_sheet, ())
+            for col_idx in cols[bisect.bisect_left(cols, col1):bisect.bisect_right(cols, col2)]:
+                targets.update(nodes_by_column[(ref_sheet, col_idx)])
+        edges[node] = targets
+    return edges
+
+
+def _formula_row_span_graph(index, nodes):
+    """
+    پالایش گراف شکل‌ها برای گره‌های داده شده با ردیف‌ها: یال فقط وقتی می‌ماند که بازه ردیف‌های ارجاع (کمینه و بیشینه
+    روی همه فرمول‌های گره) با بازه ردیف‌های گره مقصد هم‌پوشانی داشته باشد. مثلاً ردیف‌های ارزش ریالی موجودی
+    تفصیلی که به ردیف‌های مقدار همان ستون ارجاع دارند دیگر با آن‌ها چرخه نمی‌سازند.
+    """
+    spans, ref_bounds = {}, {}
+    for node in nodes:
+        sheet_name, col_idx, key = node
+        rows, ws, refs = index.nodes[node], index.wb[sheet_name], index.shapes[key].refs
+        spans[node] = (min(rows), max(rows))
+        if not refs:
+            ref_bounds[node] = []
+            continue
+        # شماره ردیف‌های یک خانواده با ردیف فرمول جابه‌جا می‌شوند، پس کمینه و بیشینه در ردیف اول و آخر آن است
+        family = index.families.get(node)
+        if family:
+            rows = [row_idx for row_idx in rows if not family[0] < row_idx < family[1]]
+        numbers = np.array([FORMULA_ROW_NUMBER_PATTERN.split(getattr(worksheet_cell(ws, row_idx, col_idx).value, 'text',
+                                                                        worksheet_cell(ws, row_idx, col_idx).value))[1::2]
+                            for row_idx in rows], dtype=np.int64)
+        ref_bounds[node] = [(ref_sheet, col1, int(numbers[:, row1].min()), col2, int(numbers[:, row2].max()))
+                            for ref_sheet, col1, row1, col2, row2 in refs]
+    nodes_by_sheet = defaultdict(list)
+    for node in nodes:
+        nodes_by_sheet[node[0]].append(node)
+    edges = {}
+    for node in nodes:
+        edges[node] = {target for ref_sheet, col1, min_row, col2, max_row in ref_bounds[node]
+                       for target in nodes_by_sheet.get(ref_sheet, ())
+                       if col1 <= target[1] <= col2 and spans[target][0] <= max_row and min_row <= spans[target][1]}
+    return edges
+
+
+def _cyclic_nodes(edges):
+    """گره‌های عضو یک مؤلفه قویاً همبند چند عضوی یا دارای یال به خود."""
+    nodes = []
+    for component in _strongly_connected_components(list(edges), edges):
+        if len(component) > 1 or component[0] in edges[component[0]]:
+            nodes.extend(component)
+    return nodes
+
+
+def find_reference_cycles(index):
+    """
+    چرخه‌های واقعی بین سلول‌های فرمولی کارپوشه (لیست مسیرها به صورت لیست آدرس‌ها).
+    ابتدا گره‌های چرخشی گراف شکل‌ها (_formula_shape_graph) و سپس از میان آن‌ها گره‌های چرخشی با بازه ردیف‌ها
+    (_formula_row_span_graph) پیدا می‌شوند؛ فقط سلول‌های همین گره‌ها در سطح سلول بررسی می‌شوند.
+    """
+    suspicious = _cyclic_nodes(_formula_shape_graph(index))
+    if suspicious:
+        suspicious = _cyclic_nodes(_formula_row_span_graph(index, suspicious))
+    if not suspicious:
+        return []
+
+    rows_by_column = defaultdict(list)
+    formulas = {}
+    for sheet_name, col_idx, key in suspicious:
+        ws = index.wb[sheet_name]
+        rows_by_column[(sheet_name, col_idx)].extend(index.nodes[(sheet_name, col_idx, key)])
+        for row_idx in index.nodes[(sheet_name, col_idx, key)]:
+            value = worksheet_cell(ws, row_idx, col_idx).value
+            formulas[(sheet_name, row_idx, col_idx)] = getattr(value, 'text', value)
+    for rows in rows_by_column.values():
+        rows.sort()
+    suspicious_by_sheet = defaultdict(list)
+    for sheet_name, col_idx in rows_by_column:
+        suspicious_by_sheet[sheet_name].append(col_idx)
+
+    edges = {}
+    for node, formula in formulas.items():
+        targets = edges[node] = []
+        for ref_sheet, col1, row1, col2, row2 in index.cell_references(node[0], formula):
+            for col_idx in suspicious_by_sheet.get(ref_sheet, ()):
+                if col1 <= col_idx <= col2:
+                    rows = rows_by_column[(ref_sheet, col_idx)]
+                    targets.extend((ref_sheet, row_idx, col_idx)
+                                   for row_idx in rows[bisect.bisect_left(rows, row1):bisect.bisect_right(rows, row2)])
+
+    cycles = []
+    for component in _strongly_connected_components(list(formulas), edges):
+        start = component[0]
+        if len(component) == 1 and start not in edges[start]:
+            continue
+        # کوتاه‌ترین مسیر از start به خودش درون مؤلفه (BFS)
+        members, previous, queue = set(component), {}, [start]
+        for node in queue:
+            if start in edges[node]:
+                break
+            for child in edges[node]:
+                if child in members and child not in previous:
+                    previous[child] = node
+                    queue.append(child)
+        path = [node]
+        while path[-1] != start:
+            path.append(previous[path[-1]])
+        cycles.append([f"'{sheet}'!{get_column_letter(c)}{r}" for sheet, r, c in path[::-1] + [start]])
+    return cycles
+
+
+def report_formula_families(build_context):
+    """خانواده‌های فرمول ردیفی شیت‌های حقوق و موجودی تفصیلی (در حالت جریانی این شیت‌ها در کارپوشه خالی‌اند)."""
+    if build_context['streaming']:
+        return {}
+    costed = any(len(item) > 10 for item in build_context['inventory_items'])
+    return {PAYROLL_SHEET_TITLE: payroll_formula_families(build_context['payroll_layout']),
+            'موجودی_تفصیلی': detailed_inventory_formula_families(build_context['inventory_layout'], costed)}
+
+
+def validate_workbook_references(wb, deferred_sheets=(), index=None, families=None):
+    """
+    بررسی ایستای ارجاع‌های کارپوشه ساخته شده (بدون محاسبه فرمول‌ها)؛ خروجی: لیست ReferenceIssue.
+    - ارجاع به شیت ناموجود (اولین فرمول هر شیت)؛
+    - ارجاع تک سلولی بین شیتی به سلول خالی، یا به سلول متنی در فرمولی که فقط کپی آن سلول نیست؛
+    - ارجاع چرخشی بین سلول‌ها (find_reference_cycles).
+    محتوای deferred_sheets (شیت‌هایی که هنگام ذخیره جریانی پر می‌شوند) بررسی نمی‌شود.
+    index (FormulaIndex همین کارپوشه) در صورت وجود دوباره ساخته نمی‌شود؛ families به FormulaIndex داده می‌شود.
+    """
+    index = index or FormulaIndex(wb, families)
+    issues = [ReferenceIssue('missing_sheet', sheet_name, f"{get_column_letter(col_idx)}{row_idx}", missing_sheet)
+              for missing_sheet, (sheet_name, row_idx, col_idx) in index.missing.items()]
+    for (target_sheet, target_row, target_col), (sheet_name, row_idx, col_idx, bare) in sorted(index.targets.items()):
+        if target_sheet in deferred_sheets:
+            continue
+        target_cell = worksheet_cell(wb[target_sheet], target_row, target_col)
+        value = target_cell.value if target_cell is not None else None
+        kind = ('empty_cell' if value is None or value == '' else
+                'text_cell' if not bare and target_cell.data_type == 's' else None)
+        if kind:
+            issues.append(ReferenceIssue(kind, sheet_name, f"{get_column_letter(col_idx)}{row_idx}",
+                                         f"'{target_sheet}'!{get_column_letter(target_col)}{target_row}"))
+    issues.extend(ReferenceIssue('cycle', cycle[0].rsplit('!', 1)[0].strip("'"), cycle[0].rsplit('!', 1)[1], " -> ".join(cycle))
+                  for cycle in find_reference_cycles(index))
+    return issues
+
+
+# ==============================================================================
+# کش ساخت: استفاده مجدد از شیت‌هایی که ورودی‌هایشان تغییر نکرده است
+# ==============================================================================
+# تصویر یک شیت: مقدار، قالب و لینک سلول‌ها به همراه راست‌چین بودن، عرض ستون‌ها و ادغام‌ها.
+# styles جدول قالب‌های یکتای شیت است: (سبک نام‌دار، font، fill، border، alignment، number_format، protection)
+# و هر سلول به صورت (ردیف، ستون، مقدار، اندیس قالب یا None، لینک) ذخیره می‌شود.
+SheetSnapshot = namedtuple('SheetSnapshot', ['title', 'right_to_left', 'column_widths', 'merged_ranges', 'styles', 'cells'])
+
+BUILD_CACHE_FORMAT = 1
+
+
+def snapshot_sheet(ws, style_index=None, styles=None):
+    """
+    گرفتن تصویر قابل pickle از محتوا و قالب یک شیت.
+    با دادن style_index و styles چند شیت یک کارپوشه جدول قالب مشترک خواهند داشت.
+    """
+    style_index = {} if style_index is None else style_index
+    styles = [] if styles is None else styles
+    cells = []
+    for row in ws.iter_rows():
+        for cell in row:
+            if cell.value is None and not cell.has_style and not cell.hyperlink:
+                continue
+            style = None
+            if cell.has_style:
+                key = tuple(cell._style) # اندیس‌های قالب در کارپوشه؛ برای یکتا کردن قالب‌ها
+                if key not in style_index:
+                    style_index[key] = len(styles)
+                    styles.append((cell.style, copy(cell.font), copy(cell.fill), copy(cell.border), copy(cell.alignment),
+                                   cell.number_format, copy(cell.protection)))
+                style = style_index[key]
+            cells.append((cell.row, cell.column, cell.value, style, cell.hyperlink.target if cell.hyperlink else None))
+    column_widths = {col_letter: dimension.width for col_letter, dimension in ws.column_dimensions.items() if dimension.width}
+    return SheetSnapshot(ws.title, ws.sheet_view.rightToLeft, column_widths,
+                         [str(merged_range) for merged_range in ws.merged_cells.ranges], styles, cells)
+
+
+def restore_sheet_snapshot(ws, snapshot, resolved_styles=None):
+    """
+    بازگرداندن تصویر شیت روی یک شیت خالی.
+    هر قالب یکتا فقط یک بار ساخته می‌شود و سلول‌های بعدی آرایه قالب همان سلول را کپی می‌کنند.
+    resolved_styles ({اندیس قالب: آرایه قالب در کارپوشه مقصد}) بین تصویرهایی با جدول قالب مشترک
+    (snapshot_sheet با style_index و styles یکسان) و یک کارپوشه مقصد قابل استفاده مجدد است.
+    """
+    resolved_styles = {} if resolved_styles is None else resolved_styles
+    ws.sheet_view.rightToLeft = snapshot.right_to_left
+    for col_letter, width in snapshot.column_widths.items():
+        ws.column_dimensions[col_letter].width = width
+    # ادغام پیش از نوشتن سلول‌ها تا قالب سلول‌های ادغام شده (MergedCell) هم بازگردانده شود
+    for merged_range in snapshot.merged_ranges:
+        ws.merge_cells(merged_range)
+    for row_idx, col_idx, value, style, hyperlink in snapshot.cells:
+        cell = ws.cell(row=row_idx, column=col_idx, value=value)
+        if style is not None:
+            if style in resolved_styles:
+                cell._style = copy(resolved_styles[style])
+            else:
+                style_name, font, fill, border, alignment, number_format, protection = snapshot.styles[style]
+                if style_name != 'Normal':
+                    apply_style(cell, style_name) # سبک نام‌دار اول و ویژگی‌های خود سلول روی آن
+                cell.font, cell.fill, cell.border, cell.alignment = font, fill, border, alignment
+                cell.number_format, cell.protection = number_format, protection
+                resolved_styles[style] = copy(cell._style)
+        if hyperlink:
+            cell.hyperlink = hyperlink
+
+
+# مقادیر سراسری که با محتوایشان (نه فقط نام) در اثر انگشت کد مراحل ساخت می‌آیند
+FINGERPRINT_DATA_TYPES = (str, bytes, int, float, bool, type(None), tuple, list, dict, set, frozenset, functools.partial)
+
+
+@functools.lru_cache(maxsize=None)
+def _code_source(code):
+    """متن کد یک تابع (بر اساس شیء کد، تا lambdaهای هر بار ساخته شده کش مشترک داشته باشند)."""
+    try:
+        return inspect.getsource(code)
+    except (OSError, TypeError):
+        return code.co_qualname
+
+
+@functools.lru_cache(maxsize=None)
+def _class_source(cls):
+    """
+    متن متدهای یک کلاس این ماژول (inspect.getsource روی خود کلاس کل ماژول را تجزیه می‌کند و کند است)،
+    به همراه نام، کلاس‌های پایه و فیلدهای namedtuple.
+    """
+    members = [getattr(member, '__func__', member) for member in vars(cls).values()] # staticmethod و classmethod
+    methods = [_code_source(member.__code__) for member in members if isinstance(member, FunctionType)]
+    return repr((cls.__qualname__, [base.__qualname__ for base in cls.__bases__], getattr(cls, '_fields', None), methods))
+
+
+@functools.lru_cache(maxsize=None)
+def _code_global_names(code):
+    """نام‌های سراسری (و صفت‌هایی) که کد و توابع تو در توی آن به کار می‌برند."""
+    names = set(code.co_names)
+    for const in code.co_consts:
+        if isinstance(const, CodeType):
+            names |= _code_global_names(const)
+    return frozenset(names)
+
+
+def _stable_repr(value, functions):
+    """
+    repr بدون نشانی حافظه و مستقل از hash رشته‌ها؛ توابع داخل مقدار با نام نوشته و به functions اضافه می‌شوند
+    تا متن آن‌ها هم در اثر انگشت بیاید.
+    """
+    if isinstance(value, (FunctionType, functools.partial)):
+        functions.append(value)
+        func = getattr(value, 'func', value)
+        if value is func:
+            return func.__qualname__
+        return f"partial({func.__qualname__}, {_stable_repr(value.args, functions)}, {_stable_repr(value.keywords, functions)})"
+    if isinstance(value, dict):
+        return '{' + ', '.join(f"{_stable_repr(key, functions)}: {_stable_repr(item, functions)}" for key, item in value.items()) + '}'
+    if isinstance(value, (set, frozenset)):
+        return '{' + ', '.join(sorted(_stable_repr(item, functions) for item in value)) + '}'
+    if isinstance(value, (list, tuple)):
+        return type(value).__name__ + '(' + ', '.join(_stable_repr(item, functions) for item in value) + ')'
+    if isinstance(value, FINGERPRINT_DATA_TYPES) or isinstance(value, np.ndarray):
+        return repr(value.tolist() if isinstance(value, np.ndarray) else value)
+    return type(value).__qualname__
+
+
+@functools.lru_cache(maxsize=None)
+def _global_data_repr(name):
+    """
+    (متن «نام = مقدار»، توابع داخل مقدار) برای یک مقدار داده‌ای سراسری؛ مانند static_sheet_fingerprint مقادیر
+    و کد در طول اجرای فرایند ثابت فرض می‌شوند و هر نام فقط یک بار نوشته می‌شود.
+    """
+    functions = []
+    text = f"{name} = {_stable_repr(globals()[name], functions)}"
+    return text, tuple(functions)
+
+
+def _function_references(func):
+    """
+    (چکیده متن‌های مؤثر بر اثر انگشت، توابع ارجاع شده) برای یک تابع: متن خودش، مقادیر closure و سراسری‌های ماژول.
+    """
+    module_globals = globals()
+    parts, functions = {_code_source(func.__code__)}, []
+    for cell in func.__closure__ or ():
+        try:
+            parts.add(_stable_repr(cell.cell_contents, functions))
+        except ValueError: # متغیر آزادی که هنوز مقدار نگرفته است
+            pass
+    for name in _code_global_names(func.__code__) & module_globals.keys():
+        value = module_globals[name]
+        if isinstance(value, FunctionType):
+            functions.append(value)
+        elif isinstance(value, type) and value.__module__ == __name__:
+            parts.add(_class_source(value))
+        elif isinstance(value, FINGERPRINT_DATA_TYPES):
+            text, data_functions = _global_data_repr(name)
+            parts.add(text)
+            functions.extend(data_functions)
+    return frozenset(hashlib.sha256(part.encode('utf-8')).hexdigest() for part in parts), tuple(functions)
+
+
+# توابع سطح ماژول (بدون closure) در طول اجرای فرایند ثابت‌اند و ارجاع‌هایشان یک بار محاسبه می‌شود
+_module_function_references = functools.lru_cache(maxsize=None)(_function_references)
+
+
+def step_code_fingerprint(step):
+    """
+    اثر انگشت کد یک مرحله ساخت: متن توابع خود مرحله (func، run، inputs و registers) با inspect.getsource،
+    مانند static_sheet_fingerprint، به همراه توابع، کلاس‌ها و مقادیر داده‌ای این ماژول که مستقیم یا
+    غیرمستقیم با نام به آن‌ها ارجاع می‌دهند. پس تغییر کد یک مرحله فقط کش مراحلی را نامعتبر می‌کند که به آن
+    کد می‌رسند، نه کل کش را.
+    """
+    parts, seen = set(), set()
+    pending = [func for func in (step.func, step.run, step.inputs, step.registers) if func is not None]
+    while pending:
+        func = pending.pop()
+        if isinstance(func, functools.partial):
+            parts.add(_stable_repr((func.args, func.keywords), pending))
+            pending.append(func.func)
+            continue
+        if not isinstance(func, FunctionType) or func.__module__ != __name__ or func in seen:
+            continue
+        seen.add(func)
+        func_parts, functions = (_function_references(func) if func.__closure__ else
+                                 _module_function_references(func))
+        parts |= func_parts
+        pending.extend(functions)
+    return hashlib.sha256('\n'.join(sorted(parts)).encode('utf-8')).hexdigest()
+
+
+def build_step_fingerprint(step, ctx):
+    """اثر انگشت یک مرحله از روی کد خودش (step_code_fingerprint) و ورودی‌های آن؛ None برای مراحل غیرقابل کش."""
+    inputs = step.inputs(ctx) if step.inputs else None
+    if isinstance(inputs, str) and inputs == UNCACHEABLE:
+        return None
+    # آدرس خروجی‌هایی که مرحله به آن‌ها ارجاع می‌دهد (مثلاً ردیف جمع موجودی که با تعداد اقلام جابه‌جا می‌شود)
+    addresses = sorted((name, ctx['cells'].cells.get(name)) for name in step.reads)
+    payload = repr((BUILD_CACHE_FORMAT, step_code_fingerprint(step), step.name, tuple(step.writes), inputs, addresses))
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class UntrustedCacheFileError(ValueError):
+    """فایل کش pickle که ممکن است کاربر دیگری نوشته یا تغییر داده باشد."""
+
+
+def load_trusted_pickle(path):
+    """
+    بارگذاری فایل کش pickle فقط اگر متعلق به کاربر جاری باشد و گروه و دیگران اجازه نوشتن در آن را نداشته باشند؛
+    pickle.load می‌تواند کد دلخواه اجرا کند، پس در غیر این صورت UntrustedCacheFileError.
+    در سیستم‌های بدون مالکیت یونیکسی (ویندوز) بررسی ممکن نیست و مسیر باید از جای امن کاربر باشد.
+    """
+    with open(path, 'rb') as f:
+        if hasattr(os, 'getuid'):
+            info = os.fstat(f.fileno())
+            if info.st_uid != os.getuid() or info.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+                raise UntrustedCacheFileError(f"فایل کش '{path}' متعلق به کاربر جاری نیست یا دیگران اجازه نوشتن در آن را "
+                                              "دارند؛ برای امنیت بارگذاری نمی‌شود.")
+        return pickle.load(f)
+
+
+def dump_private_pickle(data, path):
+    """نوشتن فایل کش pickle با دسترسی فقط برای کاربر جاری (0600) تا load_trusted_pickle آن را بپذیرد."""
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'wb') as f:
+        if hasattr(os, 'fchmod'):
+            os.fchmod(f.fileno(), 0o600) # فایل از پیش موجود با دسترسی بازتر
+        pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+class ReportBuildCache:
+    """
+    کش مراحل ساخت: {نام مرحله: (اثر انگشت، تصویر شیت‌ها، مقادیری که مرحله در ctx گذاشته)}.
+    با path روی دیسک (pickle) ذخیره و بارگذاری می‌شود؛ فایل با دسترسی 0600 نوشته می‌شود و فایلی که متعلق به
+    کاربر جاری نیست یا دیگران در آن می‌نویسند UntrustedCacheFileError می‌دهد (load_trusted_pickle).
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.entries = {}
+        self.reused, self.rebuilt = [], []
+        if path and os.path.exists(path):
+            try:
+                stored = load_trusted_pickle(path)
+                if stored.get('format') == BUILD_CACHE_FORMAT:
+                    self.entries = stored['entries']
+            except (OSError, pickle.UnpicklingError, EOFError, AttributeError, KeyError):
+                self.entries = {}  # کش خراب یا قدیمی: ساخت کامل
+
+    def is_cached(self, step, fingerprint):
+        """آیا نتیجه مرحله با همین اثر انگشت در کش هست."""
+        cached = self.entries.get(step.name)
+        return fingerprint is not None and cached is not None and cached[0] == fingerprint
+
+    def restore(self, step, ctx):
+        """بازگرداندن شیت‌ها و مقادیر ctx یک مرحله از کش (پس از بررسی is_cached)."""
+        _, snapshots, ctx_updates = self.entries[step.name]
+        for snapshot in snapshots:
+            restore_sheet_snapshot(ctx['wb'][snapshot.title], snapshot)
+        ctx.update(ctx_updates)
+        self.reused.append(step.name)
+
+    def store(self, step, fingerprint, snapshots, ctx_updates):
+        """ثبت نتیجه یک مرحله ساخته شده؛ مراحل غیرقابل کش (fingerprint=None) حذف می‌شوند."""
+        self.rebuilt.append(step.name)
+        if fingerprint is None:
+            self.entries.pop(step.name, None)
+        else:
+            self.entries[step.name] = (fingerprint, snapshots, ctx_updates)
+
+    def run_step(self, step, ctx):
+        """اجرای مرحله یا بازگرداندن آن از کش در صورت یکسان بودن اثر انگشت."""
+        fingerprint = build_step_fingerprint(step, ctx)
+        if self.is_cached(step, fingerprint):
+            self.restore(step, ctx)
+            return
+
+        before = dict(ctx)
+        step.run(ctx)
+        if fingerprint is None:
+            self.store(step, None, None, None)
+            return
+        ctx_updates = {key: value for key, value in ctx.items() if key not in before or before[key] is not value}
+        self.store(step, fingerprint, [snapshot_sheet(ctx['wb'][name]) for name in step.writes], ctx_updates)
+
+    def save(self):
+        if self.path:
+            dump_private_pickle({'format': BUILD_CACHE_FORMAT, 'entries': self.entries}, self.path)
+
+# ==============================================================================
+# قالب شیت‌های ثابت: شیت‌های متنی یک بار ساخته و در هر ساخت فقط کپی می‌شوند
+# ==============================================================================
+# محتوای این شیت‌ها به هیچ ورودی ساخت وابسته نیست؛ فقط به متن توابع زیر، سبک‌های نام‌دار و نام شرکت.
+STATIC_SHEET_BUILDERS = {
+    'تاریخچه': populate_history_sheet,
+    **{f'اهم رویه{i}': functools.partial(populate_significant_accounting_policy_sheet, policy_number=i) for i in range(1, 7)},
+    'قضاوت مدیریت': populate_management_judgment_sheet,
+    'پیوست': populate_attachment_sheet,
+    'سر برگ صفحات': populate_page_header_sheet,
+    'ص امضا': populate_signature_sheet,
+}
+
+STATIC_TEMPLATE_FORMAT = 1
+
+
+@functools.lru_cache(maxsize=None)
+def static_sheet_fingerprint(company_name):
+    """
+    اثر انگشت شیت‌های ثابت: متن توابع سازنده و add_header، سبک‌های گزارش و نام شرکت.
+    کد و سبک‌ها در طول اجرای فرایند ثابت‌اند، پس برای هر نام شرکت فقط یک بار محاسبه می‌شود.
+    """
+    funcs = {getattr(builder, 'func', builder) for builder in STATIC_SHEET_BUILDERS.values()} | {add_header}
+    payload = repr((STATIC_TEMPLATE_FORMAT, company_name, sorted(STATIC_SHEET_BUILDERS),
+                    sorted(inspect.getsource(func) for func in funcs), repr(REPORT_STYLE_SPECS)))
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class StaticSheetTemplates:
+    """
+    تصویر آماده شیت‌های ثابت با یک جدول قالب مشترک: {نام شیت: SheetSnapshot}.
+    فقط وقتی اثر انگشت (متن یا نام شرکت) تغییر کند دوباره ساخته می‌شود؛ با path روی دیسک (pickle، با همان
+    بررسی مالکیت ReportBuildCache) ذخیره و بارگذاری می‌شود تا فرایندهای بعدی هم آن را نسازند.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.fingerprint = None
+        self.snapshots = {}
+        self.rendered = 0 # تعداد دفعات ساخت دوباره (برای گزارش کارایی)
+        # آرایه قالب‌ها در هر کارپوشه مقصد یک بار ساخته و بین همه شیت‌های ثابت آن مشترک است
+        self._resolved_styles = weakref.WeakKeyDictionary()
+        if path and os.path.exists(path):
+            try:
+                stored = load_trusted_pickle(path)
+                if stored.get('format') == STATIC_TEMPLATE_FORMAT:
+                    self.fingerprint, self.snapshots = stored['fingerprint'], stored['snapshots']
+            except (OSError, pickle.UnpicklingError, EOFError, AttributeError, KeyError):
+                self.fingerprint, self.snapshots = None, {} # فایل خراب یا قدیمی: ساخت دوباره
+
+    def ensure(self):
+        """ساخت دوباره تصویر شیت‌ها در صورت تغییر اثر انگشت؛ خروجی: آیا دوباره ساخته شد."""
+        fingerprint = static_sheet_fingerprint(COMPANY_NAME)
+        if fingerprint == self.fingerprint and set(self.snapshots) == set(STATIC_SHEET_BUILDERS):
+            return False
+        wb = Workbook()
+        wb.remove(wb.active)
+        register_report_styles(wb)
+        style_index, styles, snapshots = {}, [], {}
+        for sheet_name, builder in STATIC_SHEET_BUILDERS.items():
+            ws = wb.create_sheet(sheet_name)
+            builder(ws)
+            snapshots[sheet_name] = snapshot_sheet(ws, style_index, styles)
+        self.fingerprint, self.snapshots = fingerprint, snapshots
+        self._resolved_styles = weakref.WeakKeyDictionary()
+        self.rendered += 1
+        self.save()
+        return True
+
+    def restore(self, wb, sheet_names):
+        """کپی شیت‌های ثابت داده شده از قالب روی شیت‌های خالی کارپوشه."""
+        self.ensure()
+        resolved_styles = self._resolved_styles.setdefault(wb, {})
+        for sheet_name in sheet_names:
+            restore_sheet_snapshot(wb[sheet_name], self.snapshots[sheet_name], resolved_styles)
+
+    def save(self):
+        if self.path:
+            dump_private_pickle({'format': STATIC_TEMPLATE_FORMAT, 'fingerprint': self.fingerprint, 'snapshots': self.snapshots},
+                                self.path)
+
+
+# قالب پیش‌فرض فرایند: در اجرای دسته‌ای (سناریوها، کارهای JSONL، سرویس) فقط یک بار ساخته می‌شود
+STATIC_SHEET_TEMPLATES = StaticSheetTemplates()
+
+# ==============================================================================
+# ساخت موازی: اجرای مراحل مستقل در فرایندهای جداگانه و ادغام تصویر شیت‌ها
+# ==============================================================================
+# مراحلی که در فرایند اصلی اجرا می‌شوند: ادغام تصویر شیت‌های ردیفی بزرگ به اندازه ساختن خودشان طول می‌کشد،
+# پس فرایند اصلی به جای انتظار، آن‌ها را هم‌زمان با کار فرایندهای فرعی می‌سازد. شیت‌های ثابت هم از قالب
+# آماده فرایند اصلی کپی می‌شوند و فرستادن آن‌ها به فرایند فرعی فقط هزینه تصویرگیری و ادغام را اضافه می‌کند.
+MAIN_PROCESS_BUILD_STEPS = {'لیست حقوق و دستمزد', 'موجودی_تفصیلی', 'تاریخچه', 'اهم رویه', 'قضاوت مدیریت', 'پیوست', 'سر برگ صفحات',
+                            'ص امضا'}
+
+_build_worker_context = None
+
+
+def _init_build_worker(base_context):
+    """آماده‌سازی فرایند فرعی؛ ctx پایه (بدون کارپوشه) فقط یک بار به هر فرایند فرستاده می‌شود."""
+    global _build_worker_context
+    _build_worker_context = base_context
+
+
+def run_build_steps_in_worker(step_names, ctx_updates):
+    """
+    اجرای مراحل یک مؤلفه روی کارپوشه خالی در فرایند فرعی.
+    خروجی به ازای هر مرحله: (تصویر شیت‌ها، مقادیر جدید ctx، زمان اجرا).
+    """
+    steps_by_name = {step.name: step for step in get_report_build_steps()}
+    wb = Workbook()
+    wb.remove(wb.active)
+    register_report_styles(wb)
+    ctx = dict(_build_worker_context, **ctx_updates)
+    ctx['wb'] = wb
+    results = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        for name in step_names:
+            step = steps_by_name[name]
+            for sheet_name in step.writes:
+                wb.create_sheet(sheet_name)
+            before = dict(ctx)
+            started = time.perf_counter()
+            step.run(ctx)
+            updates = {key: value for key, value in ctx.items() if key not in before or before[key] is not value}
+            results.append(([snapshot_sheet(wb[sheet_name]) for sheet_name in step.writes], updates,
+                            time.perf_counter() - started))
+    return results
+
+
+def run_build_steps_parallel(steps, build_context, workers=None, build_cache=None, on_step=None):
+    """
+    اجرای مراحل ساخت در یک process pool: هر مؤلفه گراف وابستگی (report_build_components) به محض
+    آماده شدن پیش‌نیازهایش به یک فرایند فرستاده می‌شود و تصویر شیت‌های حاصل در کارپوشه اصلی ادغام می‌شود.
+    مقادیری که مراحل در ctx می‌گذارند (مثل assumption_map) همراه مراحل بعدی فرستاده می‌شوند.
+    با build_cache مؤلفه‌هایی که همه مراحلشان در کش هستند بدون فرایند فرعی بازگردانده می‌شوند.
+    """
+    components, requires = report_build_components(steps, build_context['cells'])
+    dependents = _component_dependents(requires)
+    pending = {component_id: set(targets) for component_id, targets in requires.items()}
+    base_context = {key: value for key, value in build_context.items() if key not in ('wb', 'static_templates')}
+    shared_updates = {}
+
+    def release(component_id):
+        for dependent in dependents[component_id]:
+            pending[dependent].discard(component_id)
+            if not pending[dependent]:
+                ready.append(dependent)
+
+    def restore_from_cache(component_id, fingerprints):
+        if not all(build_cache.is_cached(steps[position], fingerprints[position]) for position in components[component_id]):
+            return False
+        for position in components[component_id]:
+            started = time.perf_counter()
+            build_cache.restore(steps[position], build_context)
+            shared_updates.update(build_cache.entries[steps[position].name][2])
+            if on_step:
+                on_step(steps[position], time.perf_counter() - started)
+        return True
+
+    def merge(component_id, results, fingerprints):
+        for position, (snapshots, updates, seconds) in zip(components[component_id], results):
+            started = time.perf_counter()
+            for snapshot in snapshots:
+                restore_sheet_snapshot(build_context['wb'][snapshot.title], snapshot)
+            build_context.update(updates)
+            shared_updates.update(updates)
+            if build_cache is not None:
+                if fingerprints[position] is None:
+                    build_cache.store(steps[position], None, None, None)
+                else:
+                    build_cache.store(steps[position], fingerprints[position], snapshots, updates)
+            if on_step:
+                on_step(steps[position], seconds + time.perf_counter() - started)
+
+    def run_locally(component_id):
+        for position in components[component_id]:
+            step = steps[position]
+            before = dict(build_context)
+            started = time.perf_counter()
+            if build_cache is None:
+                step.run(build_context)
+            else:
+                build_cache.run_step(step, build_context)
+            shared_updates.update({key: value for key, value in build_context.items()
+                                   if key not in before or before[key] is not value})
+            if on_step:
+                on_step(step, time.perf_counter() - started)
+
+    ready = [component_id for component_id, targets in pending.items() if not targets]
+    local_ready, running = [], {}
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_build_worker, initargs=(base_context,)) as pool:
+        while ready or local_ready or running:
+            ready.sort(key=lambda component_id: components[component_id][0])
+            while ready:
+                component_id = ready.pop(0)
+                if any(steps[position].name in MAIN_PROCESS_BUILD_STEPS for position in components[component_id]):
+                    local_ready.append(component_id)
+                    continue
+                fingerprints = {}
+                if build_cache is not None:
+                    fingerprints = {position: build_step_fingerprint(steps[position], build_context)
+                                    for position in components[component_id]}
+                    if restore_from_cache(component_id, fingerprints):
+                        release(component_id)
+                        continue
+                step_names = [steps[position].name for position in components[component_id]]
+                running[pool.submit(run_build_steps_in_worker, step_names, dict(shared_updates))] = (component_id, fingerprints)
+            if local_ready:
+                component_id = local_ready.pop(0)
+                run_locally(component_id)
+                release(component_id)
+                done = [future for future in running if future.done()]
+            elif running:
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+            else:
+                continue
+            for future in done:
+                component_id, fingerprints = running.pop(future)
+                merge(component_id, future.result(), fingerprints)
+                release(component_id)
+
+
+# ==============================================================================
+# موتور محاسبه فرمول: محاسبه مقادیر کارپوشه بدون نیاز به اکسل
+# ==============================================================================
+class ExcelError(str):
+    """مقدار خطای اکسل (مثل #DIV/0!) که مانند اکسل در فرمول‌ها منتشر می‌شود."""
+
+
+DIV0_ERROR = ExcelError('#DIV/0!')
+VALUE_ERROR = ExcelError('#VALUE!')
+NAME_ERROR = ExcelError('#NAME?')
+CIRCULAR_ERROR = ExcelError('#CIRC!')
+
+FORMULA_TOKEN_PATTERN = re.compile(r"""\s*(?:
+    (?P<string>"(?:[^"]|"")*")
+  | (?P<ref>(?:'(?:[^']|'')+'!|[A-Za-z0-9_.]+!)?\$?[A-Z]{1,3}\$?[0-9]+(?::\$?[A-Z]{1,3}\$?[0-9]+)?)(?![A-Za-z0-9_(])
+  | (?P<number>[0-9]+(?:\.[0-9]*)?(?:[eE][+-]?[0-9]+)?|\.[0-9]+)
+  | (?P<func>[A-Za-z_][A-Za-z0-9_.]*)\s*\(
+  | (?P<bool>TRUE|FALSE)(?![A-Za-z0-9_(])
+  | (?P<op><>|<=|>=|[-+*/^&=<>%])
+  | (?P<lparen>\() | (?P<rparen>\)) | (?P<comma>,)
+)""", re.VERBOSE)
+REFERENCE_PARTS_PATTERN = re.compile(r"\$?([A-Z]{1,3})\$?([0-9]+)")
+
+# اولویت عملگرهای دوتایی (بالاتر = زودتر)
+BINARY_OPERATOR_PRECEDENCE = {'=': 1, '<>': 1, '<': 1, '>': 1, '<=': 1, '>=': 1, '&': 2, '+': 3, '-': 3, '*': 4, '/': 4, '^': 5}
+
+
+def tokenize_formula(formula):
+    """تبدیل متن فرمول (بدون = ابتدایی) به لیست توکن‌های (نوع، مقدار)."""
+    tokens, pos, text = [], 0, formula.rstrip()
+    while pos < len(text):
+        match = FORMULA_TOKEN_PATTERN.match(text, pos)
+        if not match:
+            raise ValueError(f"توکن نامعتبر در فرمول '{formula}' در موقعیت {pos}")
+        kind = match.lastgroup
+        tokens.append((kind, match.group(kind)))
+        pos = match.end()
+    return tokens
+
+
+def _parse_reference(text, current_sheet):
+    """تبدیل متن ارجاع به گره ('ref', ...) یا ('range', ...)."""
+    sheet_name = current_sheet
+    if '!' in text:
+        sheet_part, text = text.rsplit('!', 1)
+        sheet_name = sheet_part[1:-1].replace("''", "'") if sheet_part.startswith("'") else sheet_part
+    parts = [(column_index_from_string(col), int(row)) for col, row in REFERENCE_PARTS_PATTERN.findall(text)]
+    if len(parts) == 1:
+        return ('ref', sheet_name, parts[0][1], parts[0][0])
+    (col1, row1), (col2, row2) = parts
+    return ('range', sheet_name, min(row1, row2), min(col1, col2), max(row1, row2), max(col1, col2))
+
+
+def parse_formula(formula, current_sheet):
+    """تجزیه فرمول به درخت عبارت (تاپل‌های تو در تو) برای محاسبه در FormulaEvaluator."""
+    tokens = tokenize_formula(formula.lstrip('='))
+    position = 0
+
+    def peek():
+        return tokens[position] if position < len(tokens) else (None, None)
+
+    def advance():
+        nonlocal position
+        position += 1
+        return tokens[position - 1]
+
+    def parse_expression(min_precedence=1):
+        left = parse_unary()
+        while True:
+            kind, value = peek()
+            precedence = BINARY_OPERATOR_PRECEDENCE.get(value) if kind == 'op' else None
+            if precedence is None or precedence < min_precedence:
+                return left
+            advance()
+            right = parse_expression(precedence + 1)
+            left = ('binop', value, left, right)
+
+    def parse_unary():
+        kind, value = peek()
+        if kind == 'op' and value in '+-':
+            advance()
+            operand = parse_unary()
+            return ('neg', operand) if value == '-' else operand
+        return parse_postfix()
+
+    def parse_postfix():
+        node = parse_primary()
+        while peek() == ('op', '%'):
+            advance()
+            node = ('binop', '/', node, ('num', 100))
+        return node
+
+    def parse_primary():
+        kind, value = advance() if position < len(tokens) else (None, None)
+        if kind == 'number':
+            return ('num', float(value) if any(ch in value for ch in '.eE') else int(value))
+        if kind == 'string':
+            return ('str', value[1:-1].replace('""', '"'))
+        if kind == 'bool':
+            return ('bool', value == 'TRUE')
+        if kind == 'ref':
+            return _parse_reference(value, current_sheet)
+        if kind == 'func':
+            args = []
+            if peek()[0] != 'rparen':
+                while True:
+                    args.append(parse_expression())
+                    if peek()[0] != 'comma':
+                        break
+                    advance()
+            if advance()[0] != 'rparen':
+                raise ValueError(f"پرانتز بسته نشده در فرمول '{formula}'")
+            return ('func', value.upper(), args)
+        if kind == 'lparen':
+            node = parse_expression()
+            if advance()[0] != 'rparen':
+                raise ValueError(f"پرانتز بسته نشده در فرمول '{formula}'")
+            return node
+        raise ValueError(f"عبارت نامعتبر در فرمول '{formula}'")
+
+    tree = parse_expression()
+    if position != len(tokens):
+        raise ValueError(f"توکن اضافه در فرمول '{formula}'")
+    return tree
+
+
+def _to_number(value):
+    """تبدیل مقدار به عدد با قواعد اکسل (خالی = 0، متن عددی قابل تبدیل)."""
+    if isinstance(value, (ExcelError, np.ndarray)):  # آرایه‌ها در ارزیاب برداری (مونت‌کارلو)
+        return value
+    if value is None:
+        return 0
+    if isinstance(value, bool):
+        return int(value)
+    if isinstance(value, (int, float)):
+        return value
+    try:
+        return float(str(value).replace(',', ''))
+    except ValueError:
+        return VALUE_ERROR
+
+
+def _to_text(value):
+    """تبدیل مقدار به متن با قالب General اکسل."""
+    if value is None:
+        return ''
+    if isinstance(value, bool):
+        return 'TRUE' if value else 'FALSE'
+    if isinstance(value, float):
+        return str(int(value)) if value.is_integer() else repr(round(value, 10))
+    return str(value)
+
+
+def excel_round(number, digits=0):
+    """گرد کردن مانند اکسل (نیمه‌ها به دور از صفر)."""
+    factor = 10 ** digits
+    return math.copysign(math.floor(abs(number) * factor + 0.5 + 1e-9), number) / factor
+
+
+def format_excel_text(value, number_format):
+    """پیاده‌سازی تابع TEXT برای قالب‌های ساده عددی (0، 0.00، #,##0، 0.00%)."""
+    number = _to_number(value)
+    if isinstance(number, ExcelError):
+        return _to_text(value)
+    percent = number_format.endswith('%')
+    pattern = number_format.rstrip('%')
+    if percent:
+        number *= 100
+    decimals = len(pattern.split('.', 1)[1]) if '.' in pattern else 0
+    text = f"{excel_round(number, decimals):,.{decimals}f}" if ',' in pattern else f"{excel_round(number, decimals):.{decimals}f}"
+    return text + ('%' if percent else '')
+
+
+def _compare(left, right, operator):
+    """مقایسه اکسل: متن بزرگتر از عدد، مقایسه متن بدون حساسیت به حروف."""
+    if left is None:
+        left = '' if isinstance(right, str) else 0
+    if right is None:
+        right = '' if isinstance(left, str) else 0
+    left_is_text, right_is_text = isinstance(left, str), isinstance(right, str)
+    if left_is_text != right_is_text:
+        left_key, right_key = (1, 0) if left_is_text else (0, 1)
+    elif left_is_text:
+        left_key, right_key = left.lower(), right.lower()
+    else:
+        left_key, right_key = left, right
+    return {'=': left_key == right_key, '<>': left_key != right_key, '<': left_key < right_key,
+            '>': left_key > right_key, '<=': left_key <= right_key, '>=': left_key >= right_key}[operator]
+
+
+def compile_criteria(criteria):
+    """تبدیل شرط SUMIF/SUMIFS (مثل "*فروش*" یا "<>*اداری*" یا ">0") به تابع بولی."""
+    operator, operand = '=', criteria
+    if isinstance(criteria, str):
+        for candidate in ('<>', '<=', '>=', '=', '<', '>'):
+            if criteria.startswith(candidate):
+                operator, operand = candidate, criteria[len(candidate):]
+                break
+        number = _to_number(operand) if operand else operand
+        if operand and not isinstance(number, ExcelError):
+            operand = number
+    if isinstance(operand, str) and operator in ('=', '<>') and any(ch in operand for ch in '*?'):
+        regex = re.compile(''.join('.*' if ch == '*' else '.' if ch == '?' else re.escape(ch) for ch in operand),
+                           re.IGNORECASE | re.DOTALL)
+        matches = lambda value: value is not None and regex.fullmatch(_to_text(value)) is not None
+        return matches if operator == '=' else (lambda value: not matches(value))
+    if operand == '' and operator in ('=', '<>'):
+        return (lambda value: value in (None, '')) if operator == '=' else (lambda value: value not in (None, ''))
+
+    def check(value):
+        if isinstance(operand, (int, float)) and not isinstance(value, (int, float)) or isinstance(value, bool):
+            return operator == '<>'
+        return _compare(value, operand, operator)
+    return check
+
+
+# عمق محاسبه بازگشتی فرمول‌ها که پس از آن پیشین‌ها با پشته صریح محاسبه می‌شوند (هر سطح چند قاب پایتون است)
+EVALUATION_DEPTH = 100
+
+
+class FormulaEvaluator:
+    """
+    محاسبه مقادیر همه سلول‌های کارپوشه تولید شده با پشتیبانی از ارجاع بین شیتی.
+    نتیجه هر سلول کش می‌شود و با set_value، سلول‌های وابسته بی‌اعتبار می‌شوند.
+    وقتی عمق محاسبه تو در تو به EVALUATION_DEPTH برسد، فرمول‌های پیشین با پشته صریح (مانند
+    _strongly_connected_components) محاسبه می‌شوند تا زنجیره‌های طولانی ارجاع به حد بازگشت پایتون نرسند.
+    توابع پشتیبانی شده: SUM, SUMIF, SUMIFS, ROUND, IF, IFERROR, MAX, AVERAGE, CONCATENATE, TEXT
+    """
+
+    def __init__(self, wb=None):
+        self._cells = {}             # (شیت، ردیف، ستون) -> مقدار یا متن فرمول
+        self._parsed = {}            # کش درخت فرمول
+        self._values = {}            # کش مقدار محاسبه شده
+        self._dependents = {}        # سلول -> سلول‌هایی که مستقیم به آن ارجاع داده‌اند
+        self._range_dependents = {}  # شیت -> {(محدوده، سلول وابسته)}
+        self._in_progress = set()
+        if wb is not None:
+            for ws in wb.worksheets:
+                self.load_worksheet(ws)
+
+    def load_worksheet(self, ws):
+        """بارگذاری یک شیت openpyxl (مثلاً شیتی که پس از ساختن evaluator به کارپوشه اضافه شده)."""
+        self.load_sheet(ws.title, ((cell.row, cell.column, cell.value)
+                                   for row in ws.iter_rows() for cell in row if cell.value is not None))
+
+    def load_sheet(self, sheet_name, cells):
+        """بارگذاری محتوای یک شیت به صورت (ردیف، ستون، مقدار)."""
+        for row_idx, col_idx, value in cells:
+            self._cells[(sheet_name, row_idx, col_idx)] = value
+
+    def _key(self, sheet_name, coordinate):
+        col_letter, row_idx = REFERENCE_PARTS_PATTERN.fullmatch(coordinate).groups()
+        return (sheet_name, int(row_idx), column_index_from_string(col_letter))
+
+    def value(self, sheet_name, coordinate):
+        """مقدار محاسبه شده یک سلول، مثل evaluator.value('وضعیت مالی', 'E21')."""
+        return self._evaluate_cell(self._key(sheet_name, coordinate))
+
+    def set_value(self, sheet_name, coordinate, value):
+        """تغییر ورودی یک سلول و بی‌اعتبار کردن کش همه سلول‌های وابسته."""
+        key = self._key(sheet_name, coordinate)
+        if value is None:
+            self._cells.pop(key, None)
+        else:
+            self._cells[key] = value
+        self._parsed.pop(key, None)
+        self._invalidate(key)
+
+    def _invalidate(self, key):
+        pending = [key]
+        while pending:
+            current = pending.pop()
+            self._values.pop(current, None)
+            affected = self._dependents.pop(current, set())
+            sheet_name, row_idx, col_idx = current
+            remaining = set()
+            for bounds, dependent in self._range_dependents.get(sheet_name, ()):
+                min_row, min_col, max_row, max_col = bounds
+                if min_row <= row_idx <= max_row and min_col <= col_idx <= max_col:
+                    affected.add(dependent)
+                else:
+                    remaining.add((bounds, dependent))
+            if sheet_name in self._range_dependents:
+                self._range_dependents[sheet_name] = remaining
+            pending.extend(dependent for dependent in affected if dependent in self._values)
+
+    def evaluate_all(self):
+        """محاسبه همه سلول‌ها؛ خروجی {شیت: {آدرس: مقدار}}."""
+        results = {}
+        for key in list(self._cells):
+            sheet_name, row_idx, col_idx = key
+            results.setdefault(sheet_name, {})[f"{get_column_letter(col_idx)}{row_idx}"] = self._evaluate_cell(key)
+        return results
+
+    def _formula(self, key):
+        """درخت فرمول (کش شده) سلول key یا None اگر سلول فرمول نباشد."""
+        if key not in self._parsed:
+            raw = self._cells.get(key)
+            if not (isinstance(raw, str) and raw.startswith('=')):
+                return None
+            try:
+                self._parsed[key] = parse_formula(raw, key[0])
+            except ValueError:
+                self._parsed[key] = ('error', NAME_ERROR)
+        return self._parsed[key]
+
+    def _precedent_formulas(self, key):
+        """سلول‌های فرمولی محاسبه نشده‌ای که فرمول key (مستقیم یا داخل محدوده) به آن‌ها ارجاع می‌دهد."""
+        pending, precedents = [self._formula(key)], []
+        while pending:
+            node = pending.pop()
+            kind = node[0]
+            if kind == 'ref':
+                precedents.append(node[1:])
+            elif kind == 'range':
+                _, sheet_name, min_row, min_col, max_row, max_col = node
+                precedents.extend((sheet_name, row_idx, col_idx)
+                                  for row_idx in range(min_row, max_row + 1) for col_idx in range(min_col, max_col + 1))
+            elif kind == 'neg':
+                pending.append(node[1])
+            elif kind == 'binop':
+                pending.extend(node[2:])
+            elif kind == 'func':
+                pending.extend(node[2])
+        return [precedent for precedent in precedents
+                if precedent not in self._values and self._formula(precedent) is not None]
+
+    def _evaluate_precedents(self, key):
+        """
+        محاسبه فرمول‌های پیشین key به ترتیب پس‌ترتیبی با پشته صریح؛ هر سلول وقتی محاسبه می‌شود که پیشین‌هایش
+        در کش باشند، پس بازگشت _eval فقط یک سطح عمیق‌تر می‌شود. سلول‌های در حال محاسبه (و یال برگشتی چرخه)
+        دنبال نمی‌شوند و محاسبه خود سلول آن‌ها را مثل قبل CIRCULAR_ERROR می‌کند.
+        """
+        visiting = {key} | self._in_progress
+        work = [(key, iter(self._precedent_formulas(key)))]
+        while work:
+            node, precedents = work[-1]
+            for precedent in precedents:
+                if precedent not in visiting and precedent not in self._values:
+                    visiting.add(precedent)
+                    work.append((precedent, iter(self._precedent_formulas(precedent))))
+                    break
+            else:
+                work.pop()
+                if work:
+                    self._evaluate_formula(node)
+
+    def _evaluate_cell(self, key):
+        if key in self._values:
+            return self._values[key]
+        raw = self._cells.get(key)
+        if not (isinstance(raw, str) and raw.startswith('=')):
+            return raw
+        if key in self._in_progress:
+            return CIRCULAR_ERROR
+        if len(self._in_progress) >= EVALUATION_DEPTH:
+            self._evaluate_precedents(key)
+        return self._evaluate_formula(key)
+
+    def _evaluate_formula(self, key):
+        if key in self._values:
+            return self._values[key]
+        self._in_progress.add(key)
+        try:
+            result = self._eval(self._formula(key), key)
+            if isinstance(result, list):  # ارجاع محدوده به تنهایی: مقدار اولین سلول
+                result = result[0][0] if result and result[0] else None
+            self._values[key] = result
+            return result
+        finally:
+            self._in_progress.discard(key)
+
+    def _read_ref(self, node, owner):
+        _, sheet_name, row_idx, col_idx = node
+        key = (sheet_name, row_idx, col_idx)
+        self._dependents.setdefault(key, set()).add(owner)
+        return self._evaluate_cell(key)
+
+    def _read_range(self, node, owner):
+        _, sheet_name, min_row, min_col, max_row, max_col = node
+        self._range_dependents.setdefault(sheet_name, set()).add(((min_row, min_col, max_row, max_col), owner))
+        return [[self._evaluate_cell((sheet_name, row_idx, col_idx)) for col_idx in range(min_col, max_col + 1)]
+                for row_idx in range(min_row, max_row + 1)]
+
+    def _eval(self, node, owner):
+        kind = node[0]
+        if kind in ('num', 'str', 'bool'):
+            return node[1]
+        if kind == 'error':
+            return node[1]
+        if kind == 'ref':
+            return self._read_ref(node, owner)
+        if kind == 'range':
+            return self._read_range(node, owner)
+        if kind == 'neg':
+            operand = _to_number(self._scalar(node[1], owner))
+            return operand if isinstance(operand, ExcelError) else -operand
+        if kind == 'binop':
+            return self._binary(node[1], self._scalar(node[2], owner), self._scalar(node[3], owner))
+        if kind == 'func':
+            handler = getattr(self, f"_func_{node[1]}", None)
+            return handler(node[2], owner) if handler else NAME_ERROR
+        raise ValueError(f"گره ناشناخته {kind}")
+
+    def _scalar(self, node, owner):
+        value = self._eval(node, owner)
+        if isinstance(value, list):
+            return value[0][0] if value and value[0] else None
+        return value
+
+    def _binary(self, operator, left, right):
+        for operand in (left, right):
+            if isinstance(operand, ExcelError):
+                return operand
+        if operator == '&':
+            return _to_text(left) + _to_text(right)
+        if operator in ('=', '<>', '<', '>', '<=', '>='):
+            return _compare(left, right, operator)
+        left, right = _to_number(left), _to_number(right)
+        for operand in (left, right):
+            if isinstance(operand, ExcelError):
+                return operand
+        if operator == '+':
+            return left + right
+        if operator == '-':
+            return left - right
+        if operator == '*':
+            return left * right
+        if operator == '/':
+            return DIV0_ERROR if right == 0 else left / right
+        return left ** right
+
+    def _numbers(self, args, owner):
+        """
+        جمع‌آوری اعداد آرگومان‌ها؛ مانند اکسل متن، مقدار منطقی و خالی داخل محدوده یا سلول ارجاع شده نادیده
+        گرفته می‌شود و فقط آرگومان مستقیم (مثل "3") به عدد تبدیل می‌شود.
+        """
+        numbers = []
+        for arg in args:
+            value = self._eval(arg, owner)
+            if arg[0] == 'ref':
+                value = [[value]]
+            if isinstance(value, list):
+                for row in value:
+                    for item in row:
+                        if isinstance(item, ExcelError):
+                            return item
+                        if self._is_number(item):
+                            numbers.append(item)
+            else:
+                number = _to_number(value)
+                if isinstance(number, ExcelError):
+                    return number
+                numbers.append(number)
+        return numbers
+
+    @staticmethod
+    def _is_number(value):
+        return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+    def _func_SUM(self, args, owner):
+        numbers = self._numbers(args, owner)
+        return numbers if isinstance(numbers, ExcelError) else sum(numbers)
+
+    def _func_MAX(self, args, owner):
+        numbers = self._numbers(args, owner)
+        return numbers if isinstance(numbers, ExcelError) else max(numbers, default=0)
+
+    def _func_AVERAGE(self, args, owner):
+        numbers = self._numbers(args, owner)
+        if isinstance(numbers, ExcelError):
+            return numbers
+        return sum(numbers) / len(numbers) if numbers else DIV0_ERROR
+
+    def _func_ROUND(self, args, owner):
+        number = _to_number(self._scalar(args[0], owner))
+        digits = _to_number(self._scalar(args[1], owner)) if len(args) > 1 else 0
+        for operand in (number, digits):
+            if isinstance(operand, ExcelError):
+                return operand
+        return excel_round(number, int(digits))
+
+    def _func_IF(self, args, owner):
+        condition = self._scalar(args[0], owner)
+        if isinstance(condition, ExcelError):
+            return condition
+        if isinstance(condition, str):
+            return VALUE_ERROR
+        if condition:
+            return self._scalar(args[1], owner) if len(args) > 1 else True
+        return self._scalar(args[2], owner) if len(args) > 2 else False
+
+    def _func_IFERROR(self, args, owner):
+        value = self._scalar(args[0], owner)
+        return self._scalar(args[1], owner) if isinstance(value, ExcelError) else value
+
+    def _func_CONCATENATE(self, args, owner):
+        parts = []
+        for arg in args:
+            value = self._scalar(arg, owner)
+            if isinstance(value, ExcelError):
+                return value
+            parts.append(_to_text(value))
+        return ''.join(parts)
+
+    def _func_TEXT(self, args, owner):
+        value, number_format = self._scalar(args[0], owner), self._scalar(args[1], owner)
+        if isinstance(value, ExcelError):
+            return value
+        return format_excel_text(value, _to_text(number_format))
+
+    def _conditional_sum(self, sum_node, criteria_pairs, owner):
+        sum_values = self._eval(sum_node, owner)
+        checks = []
+        for range_node, criteria_node in criteria_pairs:
+            criteria = self._scalar(criteria_node, owner)
+            if isinstance(criteria, ExcelError):
+                return criteria
+            checks.append((self._eval(range_node, owner), compile_criteria(criteria)))
+        total = 0
+        for row_offset, sum_row in enumerate(sum_values):
+            for col_offset, item in enumerate(sum_row):
+                if all(check(values[row_offset][col_offset]) for values, check in checks):
+                    if isinstance(item, ExcelError):
+                        return item
+                    if self._is_number(item):
+                        total += item
+        return total
+
+    def _func_SUMIF(self, args, owner):
+        return self._conditional_sum(args[2] if len(args) > 2 else args[0], [(args[0], args[1])], owner)
+
+    def _func_SUMIFS(self, args, owner):
+        return self._conditional_sum(args[0], list(zip(args[1::2], args[2::2])), owner)
+
+
+# مقادیر کلیدی گزارش برای کنترل‌های خط تولید (تراز و شاخص‌ها): برچسب -> (نام نمادین، سال)
+KEY_REPORT_CELLS = {
+    'کنترل تراز پایه': ('opening_balance_check', None),
+    'جمع کل دارایی‌ها 1403': ('total_assets', '1403'),
+    'جمع کل بدهی‌ها و حقوق مالکانه 1403': ('total_liabilities_and_equity', '1403'),
+    'کنترل تراز 1403': ('balance_check', '1403'),
+    'جمع کل دارایی‌ها 1402': ('total_assets', '1402'),
+    'جمع کل بدهی‌ها و حقوق مالکانه 1402': ('total_liabilities_and_equity', '1402'),
+    'کنترل تراز 1402': ('balance_check', '1402'),
+    'کنترل درآمد مالی 1403': ('finance_income_check', '1403'),
+    'درآمدهای عملیاتی 1403': ('revenue', '1403'),
+    'سود خالص 1403': ('net_profit', '1403'),
+    'سود خالص 1402': ('net_profit', '1402'),
+    'موجودی نقد پایان 1403': ('closing_cash', '1403'),
+    'نسبت جاری 1403': ('current_ratio', '1403'),
+    'نسبت بدهی 1403': ('debt_ratio', '1403'),
+    'حاشیه سود خالص 1403': ('net_profit_margin', '1403'),
+}
+
+
+def evaluate_key_report_values(wb, evaluator=None, cells=None):
+    """محاسبه مقادیر کلیدی (کنترل تراز، جمع‌ها و نسبت‌ها) بدون نیاز به اکسل."""
+    evaluator = evaluator or FormulaEvaluator(wb)
+    cells = cells if cells is not None else report_cell_registry()
+    return {label: evaluator.value(*cells.address(name, year)) for label, (name, year) in KEY_REPORT_CELLS.items()}
+
+
+# ==============================================================================
+# خروجی ستونی: مقادیر محاسبه شده همه اقلام صورت‌ها به صورت جدول بلند (Parquet/CSV/JSON)
+# ==============================================================================
+# یک رکورد به ازای هر قلم و هر سال؛ cell آدرس سلول مبدأ برای ردیابی است.
+StatementRecord = namedtuple('StatementRecord', ['scenario', 'sheet', 'cell', 'line', 'note', 'year', 'value'])
+
+EXPORT_FORMATS = ('parquet', 'csv', 'json', 'jsonl')
+# عنوان ستون سال در شیت‌ها: '1403'، 'سال 1403'، '1402 (پایه)' یا عدد 1405 در شیت پیش‌بینی
+YEAR_HEADER_PATTERN = re.compile(r"(?:سال\s*)?(1[34]\d\d)(?:\s*\(.*\))?")
+NOTE_HEADER = "یادداشت"
+
+
+def statement_sheet_columns(ws, max_header_row=10):
+    """
+    تشخیص ستون‌های سال یک شیت از روی ردیف عنوان: (ردیف عنوان، {ستون: سال}، ستون یادداشت یا None).
+    شیت‌هایی که ستون سال ندارند (مثل گردش دارایی ثابت) None برمی‌گردانند.
+    """
+    for row in ws.iter_rows(min_row=1, max_row=max_header_row):
+        year_columns, note_column = {}, None
+        for cell in row:
+            if cell.value is None:
+                continue
+            text = str(cell.value).strip()
+            match = YEAR_HEADER_PATTERN.fullmatch(text)
+            if match:
+                year_columns[cell.column] = int(match.group(1))
+            elif text == NOTE_HEADER:
+                note_column = cell.column
+        if year_columns:
+            return row[0].row, year_columns, note_column
+    return None
+
+
+def iter_statement_records(wb, evaluator=None, sheet_names=None, scenario=None):
+    """
+    رکوردهای بلند (StatementRecord) همه اقلام عددی شیت‌هایی که ستون سال دارند، با مقدار محاسبه شده.
+    شرح قلم آخرین متن سمت راست ستون‌های سال در همان ردیف است و شماره یادداشت از ستون «یادداشت»
+    یا سلول دارای لینک داخلی همان ردیف خوانده می‌شود.
+    """
+    evaluator = evaluator or FormulaEvaluator(wb)
+    for sheet_name in sheet_names or wb.sheetnames:
+        ws = wb[sheet_name]
+        columns = statement_sheet_columns(ws)
+        if columns is None:
+            continue
+        header_row, year_columns, note_column = columns
+        first_year_column = min(year_columns)
+        for row in ws.iter_rows(min_row=header_row + 1):
+            line, note = None, None
+            for cell in row[:first_year_column - 1]:
+                if cell.value is None or cell.column == note_column:
+                    continue
+                if cell.hyperlink:
+                    note = cell.value
+                elif isinstance(cell.value, str) and not cell.value.startswith('='):
+                    line = cell.value.strip()
+            if note_column is not None and note is None and len(row) >= note_column:
+                note = row[note_column - 1].value
+            if not line:
+                continue
+            for col_idx, year in year_columns.items():
+                if col_idx > len(row) or row[col_idx - 1].value is None:
+                    continue
+                coordinate = row[col_idx - 1].coordinate
+                value = evaluator.value(sheet_name, coordinate)
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    yield StatementRecord(scenario, sheet_name, coordinate, line,
+                                          None if note is None else str(note), year, float(value))
+
+
+def statement_export_format(path, file_format=None):
+    """
+    قالب خروجی ستونی از پسوند فایل؛ ValueError برای قالب ناشناخته و ImportError اگر pyarrow (برای Parquet) نصب
+    نباشد، تا پیش از ساخت کارپوشه معلوم شود که خروجی نوشته نخواهد شد (pyarrow بارگذاری نمی‌شود).
+    """
+    file_format = (file_format or os.path.splitext(path)[1].lstrip('.')).lower()
+    if file_format not in EXPORT_FORMATS:
+        raise ValueError(f"قالب خروجی نامعتبر '{file_format}' (یکی از {', '.join(EXPORT_FORMATS)})")
+    if file_format == 'parquet' and importlib.util.find_spec('pyarrow') is None:
+        raise ImportError("برای خروجی Parquet کتابخانه pyarrow لازم است: pip install pyarrow")
+    return file_format
+
+
+def write_statement_records(records, path, file_format=None):
+    """
+    نوشتن یک‌باره رکوردها؛ قالب از پسوند فایل (یا file_format) تعیین می‌شود.
+    Parquet به pyarrow نیاز دارد که فقط در همین حالت بارگذاری می‌شود.
+    """
+    file_format = statement_export_format(path, file_format)
+    records = list(records)
+    columns = {field: [getattr(record, field) for record in records] for field in StatementRecord._fields}
+
+    if file_format == 'parquet':
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ImportError("برای خروجی Parquet کتابخانه pyarrow لازم است: pip install pyarrow")
+        pyarrow.parquet.write_table(pyarrow.table(columns), path)
+    elif file_format == 'csv':
+        with open(path, 'w', encoding='utf-8-sig', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(StatementRecord._fields)
+            writer.writerows(records)
+    elif file_format == 'jsonl':
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(''.join(json.dumps(record._asdict(), ensure_ascii=False) + '\n' for record in records))
+    else:
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump([record._asdict() for record in records], f, ensure_ascii=False)
+    return len(records)
+
+
+# ==============================================================================
+# خروجی مقادیر ثابت (frozen): فرمول‌ها یک بار در پایتون محاسبه و به جای آن‌ها مقدار نوشته می‌شود
+# ==============================================================================
+# صورت‌های اصلی که با keep_statement_formulas فرمول خود را نگه می‌دارند
+FROZEN_FORMULA_SHEET_NAMES = ('وضعیت مالی', 'سودوزیان', 'جریان های نقدی', 'حقوق مالکانه', 'جامع')
+
+
+def freeze_workbook_values(wb, evaluator=None, keep_formula_sheets=()):
+    """
+    جایگزینی همه فرمول‌های wb با مقدار محاسبه شده (ارجاع به سلول خالی مثل اکسل صفر است).
+    فرمول‌های شیت‌های keep_formula_sheets دست نمی‌خورند و مقدارشان به صورت {شیت: {آدرس: مقدار}} برگردانده
+    می‌شود تا save_direct_workbook آن را به عنوان مقدار کش شده کنار فرمول بنویسد.
+    evaluator باید پیش از تغییر wb ساخته شده باشد (مثلاً FormulaEvaluator مشترک با evaluate).
+    """
+    evaluator = evaluator or FormulaEvaluator(wb)
+    cached_values = {}
+    for ws in wb.worksheets:
+        keep = ws.title in keep_formula_sheets
+        for _, cell in list(worksheet_cell_items(ws)):
+            if cell.data_type != 'f':
+                continue
+            value = evaluator.value(ws.title, cell.coordinate)
+            value = 0 if value is None else value
+            if keep:
+                cached_values.setdefault(ws.title, {})[cell.coordinate] = value
+            else:
+                cell.value = value
+    return cached_values
+
+
+# ==============================================================================
+# تحلیل ریسک: مونت‌کارلو و حساسیت (تورنادو) با ارزیابی برداری همان فرمول‌های کارپوشه
+# ==============================================================================
+# منطق سود و زیان، ترازنامه، جریان نقد و گردش دارایی ثابت فقط در فرمول‌ها تعریف شده است؛
+# به جای بازنویسی آن، فرمول‌ها با آرایه‌های numpy (یک عنصر به ازای هر نمونه) محاسبه می‌شوند.
+
+class VectorFormulaEvaluator(FormulaEvaluator):
+    """
+    ارزیاب فرمول که ورودی‌های آرایه‌ای را می‌پذیرد: هر سلول وابسته به یک ورودی آرایه‌ای،
+    خودش آرایه‌ای هم‌طول می‌شود و بقیه سلول‌ها مثل قبل یک بار به صورت عددی محاسبه و کش می‌شوند.
+    خطای تقسیم بر صفر در آرایه‌ها NaN است.
+    """
+
+    @staticmethod
+    def _is_number(value):
+        return isinstance(value, np.ndarray) or FormulaEvaluator._is_number(value)
+
+    @staticmethod
+    def _nan_for_error(value):
+        return np.nan if isinstance(value, ExcelError) else value
+
+    def _binary(self, operator, left, right):
+        if not (isinstance(left, np.ndarray) or isinstance(right, np.ndarray)):
+            return super()._binary(operator, left, right)
+        if operator == '&':
+            return np.frompyfunc(lambda l, r: super(VectorFormulaEvaluator, self)._binary('&', l, r), 2, 1)(left, right)
+        if operator in ('=', '<>', '<', '>', '<=', '>='):
+            return _compare(left, right, operator)
+        left, right = _to_number(left), _to_number(right)
+        for operand in (left, right):
+            if isinstance(operand, ExcelError):
+                return operand
+        with np.errstate(divide='ignore', invalid='ignore'):
+            if operator == '+':
+                return left + right
+            if operator == '-':
+                return left - right
+            if operator == '*':
+                return left * right
+            if operator == '/':
+                return np.where(right == 0, np.nan, left / np.where(right == 0, 1, right))
+            return np.power(left, right)
+
+    def _func_MAX(self, args, owner):
+        numbers = self._numbers(args, owner)
+        if isinstance(numbers, ExcelError) or not any(isinstance(number, np.ndarray) for number in numbers):
+            return super()._func_MAX(args, owner)
+        result = numbers[0]
+        for number in numbers[1:]:
+            result = np.maximum(result, number)
+        return result
+
+    def _func_ROUND(self, args, owner):
+        number = _to_number(self._scalar(args[0], owner))
+        if not isinstance(number, np.ndarray):
+            return super()._func_ROUND(args, owner)
+        digits = _to_number(self._scalar(args[1], owner)) if len(args) > 1 else 0
+        factor = 10 ** int(digits)
+        return np.copysign(np.floor(np.abs(number) * factor + 0.5 + 1e-9), number) / factor
+
+    def _func_IF(self, args, owner):
+        condition = self._scalar(args[0], owner)
+        if not isinstance(condition, np.ndarray):
+            return super()._func_IF(args, owner)
+        when_true = self._scalar(args[1], owner) if len(args) > 1 else True
+        when_false = self._scalar(args[2], owner) if len(args) > 2 else False
+        return np.where(condition, self._nan_for_error(when_true), self._nan_for_error(when_false))
+
+    def _func_IFERROR(self, args, owner):
+        value = self._scalar(args[0], owner)
+        if not (isinstance(value, np.ndarray) and value.dtype.kind == 'f'):
+            return super()._func_IFERROR(args, owner)
+        fallback = self._nan_for_error(self._scalar(args[1], owner))
+        return np.where(np.isnan(value), fallback, value)
+
+
+# ورودی تصادفی: شرح مفروض، سال، نوع توزیع (normal / uniform / triangular) و پارامترهای آن
+MonteCarloInput = namedtuple('MonteCarloInput', ['description', 'year', 'distribution', 'params'])
+
+DEFAULT_MONTE_CARLO_INPUTS = [
+    MonteCarloInput("درصد رشد درآمدهای عملیاتی", '1403', 'normal', (0.50, 0.10)),
+    MonteCarloInput("نرخ مالیات بر درآمد", '1403', 'uniform', (0.22, 0.28)),
+    MonteCarloInput("دوره وصول مطالبات (روز)", '1403', 'triangular', (70, 90, 120)),
+    MonteCarloInput("دوره پرداخت بدهی‌ها (روز)", '1403', 'triangular', (60, 75, 90)),
+    MonteCarloInput("سرمایه‌گذاری ثابت سالانه (CAPEX)", '1403', 'normal', (600000, 90000)),
+    MonteCarloInput("نرخ استهلاک سالانه (نسبت به بهای تمام شده اول دوره)", '1403', 'uniform', (0.08, 0.12)),
+    MonteCarloInput("مبلغ وام جدید دریافتی طی سال", '1403', 'triangular', (600000, 850000, 1000000)),
+    MonteCarloInput("نرخ سود تسهیلات (بر میانگین مانده)", '1403', 'triangular', (0.15, 0.18, 0.23)),
+]
+
+# خروجی‌های تحلیل ریسک: برچسب -> (نام نمادین، سال)
+MONTE_CARLO_OUTPUTS = {
+    'سود خالص 1403': ('net_profit', '1403'),
+    'موجودی نقد پایان 1403': ('closing_cash', '1403'),
+    'نسبت جاری 1403': ('current_ratio', '1403'),
+}
+
+MONTE_CARLO_PERCENTILES = (5, 10, 50, 90, 95)
+MONTE_CARLO_SHEET_TITLE = "تحلیل ریسک"
+
+
+def sample_monte_carlo_input(rng, spec, draws):
+    """نمونه‌گیری برداری از توزیع یک ورودی."""
+    if spec.distribution == 'normal':
+        return rng.normal(spec.params[0], spec.params[1], size=draws)
+    if spec.distribution == 'uniform':
+        return rng.uniform(spec.params[0], spec.params[1], size=draws)
+    if spec.distribution == 'triangular':
+        return rng.triangular(spec.params[0], spec.params[1], spec.params[2], size=draws)
+    raise ValueError(f"توزیع ناشناخته '{spec.distribution}' برای '{spec.description}'")
+
+
+def find_assumption_cells(ws):
+    """بازسازی نقشه آدرس مفروضات از روی شیت (مشابه خروجی populate_assumptions_sheet)."""
+    assumption_map = {}
+    for row in ws.iter_rows(min_row=5, max_col=1):
+        cell = row[0]
+        if isinstance(cell.value, str) and ws.cell(row=cell.row, column=2).value is not None:
+            assumption_map[cell.value] = {'1403': f'B{cell.row}', '1402': f'C{cell.row}'}
+    return assumption_map
+
+
+def _evaluate_outputs(evaluator, outputs, size, cells):
+    """محاسبه خروجی‌ها و تبدیل نتیجه به آرایه هم‌طول (خطا = NaN)."""
+    results = {}
+    for label, (name, year) in outputs.items():
+        value = evaluator.value(*cells.address(name, year))
+        if isinstance(value, ExcelError) or not (isinstance(value, np.ndarray) or FormulaEvaluator._is_number(value)):
+            value = np.nan
+        results[label] = np.broadcast_to(np.asarray(value, dtype=float), (size,)).copy()
+    return results
+
+
+def run_monte_carlo_analysis(wb, inputs=None, draws=5000, seed=None, outputs=None, cells=None):
+    """
+    اجرای مونت‌کارلو و حساسیت تورنادو روی کارپوشه ساخته شده (در حافظه).
+    همه نمونه‌ها در یک ارزیابی برداری محاسبه می‌شوند؛ برای تورنادو هر ورودی به تنهایی روی صدک 10 و 90
+    نمونه‌هایش قرار می‌گیرد و بقیه روی مقدار پایه می‌مانند (باز هم در یک ارزیابی برداری).
+    خروجی: {'draws', 'samples', 'outputs', 'base', 'statistics', 'tornado'}
+    """
+    inputs = DEFAULT_MONTE_CARLO_INPUTS if inputs is None else inputs
+    outputs = MONTE_CARLO_OUTPUTS if outputs is None else outputs
+    cells = cells if cells is not None else report_cell_registry()
+    rng = np.random.default_rng(seed)
+    assumption_map = find_assumption_cells(wb['مفروضات'])
+    evaluator = VectorFormulaEvaluator(wb)
+
+    input_coordinates = []
+    for spec in inputs:
+        if spec.description not in assumption_map:
+            raise ValueError(f"مفروض '{spec.description}' در شیت مفروضات پیدا نشد.")
+        input_coordinates.append(assumption_map[spec.description][spec.year])
+    base_inputs = [evaluator.value('مفروضات', coordinate) for coordinate in input_coordinates]
+    base_outputs = {label: values[0] for label, values in _evaluate_outputs(evaluator, outputs, 1, cells).items()}
+
+    # --- توزیع خروجی‌ها ---
+    samples = {spec.description: sample_monte_carlo_input(rng, spec, draws) for spec in inputs}
+    for spec, coordinate in zip(inputs, input_coordinates):
+        evaluator.set_value('مفروضات', coordinate, samples[spec.description])
+    output_samples = _evaluate_outputs(evaluator, outputs, draws, cells)
+
+    statistics = {}
+    for label, values in output_samples.items():
+        valid = values[~np.isnan(values)]
+        stats = {'میانگین': valid.mean() if valid.size else np.nan, 'انحراف معیار': valid.std() if valid.size else np.nan,
+                 'حداقل': valid.min() if valid.size else np.nan, 'حداکثر': valid.max() if valid.size else np.nan}
+        for percentile, value in zip(MONTE_CARLO_PERCENTILES, np.percentile(valid, MONTE_CARLO_PERCENTILES) if valid.size else [np.nan] * len(MONTE_CARLO_PERCENTILES)):
+            stats[f'صدک {percentile}'] = value
+        stats['احتمال منفی'] = float((valid < 0).mean()) if valid.size else np.nan
+        stats['نمونه نامعتبر'] = int(draws - valid.size)
+        statistics[label] = stats
+
+    # --- تورنادو: ردیف 2i ورودی i روی صدک 10 و ردیف 2i+1 روی صدک 90 ---
+    size = 2 * len(inputs)
+    for i, (spec, coordinate, base_value) in enumerate(zip(inputs, input_coordinates, base_inputs)):
+        column = np.full(size, float(base_value))
+        column[2 * i], column[2 * i + 1] = np.percentile(samples[spec.description], [10, 90])
+        evaluator.set_value('مفروضات', coordinate, column)
+    swings = _evaluate_outputs(evaluator, outputs, size, cells)
+    tornado = {}
+    for label, values in swings.items():
+        rows = []
+        for i, spec in enumerate(inputs):
+            low, high = values[2 * i], values[2 * i + 1]
+            rows.append({'ورودی': spec.description, 'پایین': low, 'بالا': high, 'دامنه': abs(high - low)})
+        tornado[label] = sorted(rows, key=lambda row: -np.nan_to_num(row['دامنه']))
+
+    for coordinate, base_value in zip(input_coordinates, base_inputs):
+        evaluator.set_value('مفروضات', coordinate, base_value)
+    return {'draws': draws, 'samples': samples, 'outputs': output_samples, 'base': base_outputs,
+            'statistics': statistics, 'tornado': tornado}
+
+
+def populate_risk_analysis_sheet(ws, analysis):
+    """نوشتن خلاصه مونت‌کارلو (آماره‌ها) و جدول تورنادو هر خروجی در شیت تحلیل ریسک."""
+    ws.title = MONTE_CARLO_SHEET_TITLE
+    set_rtl_and_column_widths(ws, {'A': 5, 'B': 45, 'C': 18, 'D': 18, 'E': 18, 'F': 18})
+    add_header(ws, COMPANY_NAME, "تحلیل ریسک (مونت‌کارلو و حساسیت)", f"بر اساس {analysis['draws']:,} نمونه تصادفی از مفروضات 1403")
+
+    current_row = 5
+    labels = list(analysis['statistics'])
+    apply_style(ws.cell(row=current_row, column=1, value="توزیع خروجی‌ها:"), 'bold_total')
+    current_row += 1
+    apply_style(ws.cell(row=current_row, column=2, value="آماره"), 'bold_total')
+    for col_idx, label in enumerate(labels, 3):
+        apply_style(ws.cell(row=current_row, column=col_idx, value=label), 'bold_total')
+    current_row += 1
+    ws.cell(row=current_row, column=2, value="مقدار پایه")
+    for col_idx, label in enumerate(labels, 3):
+        ws.cell(row=current_row, column=col_idx, value=float(analysis['base'][label])).number_format = '#,##0.00'
+    current_row += 1
+    for stat_name in analysis['statistics'][labels[0]]:
+        ws.cell(row=current_row, column=2, value=stat_name)
+        for col_idx, label in enumerate(labels, 3):
+            value = analysis['statistics'][label][stat_name]
+            cell = ws.cell(row=current_row, column=col_idx, value=None if np.isnan(value) else float(value))
+            cell.number_format = '0.00%' if stat_name == 'احتمال منفی' else '#,##0' if stat_name == 'نمونه نامعتبر' else '#,##0.00'
+        current_row += 1
+
+    for label in labels:
+        current_row += 1
+        apply_style(ws.cell(row=current_row, column=1, value=f"حساسیت (تورنادو) - {label}:"), 'bold_total')
+        current_row += 1
+        for col_idx, title in enumerate(["ورودی (صدک 10 و 90)", "خروجی در صدک 10", "خروجی در صدک 90", "دامنه تغییر"], 2):
+            apply_style(ws.cell(row=current_row, column=col_idx, value=title), 'bold_total')
+        current_row += 1
+        for row in analysis['tornado'][label]:
+            ws.cell(row=current_row, column=2, value=row['ورودی'])
+            for col_idx, key in enumerate(['پایین', 'بالا', 'دامنه'], 3):
+                value = row[key]
+                ws.cell(row=current_row, column=col_idx, value=None if np.isnan(value) else float(value)).number_format = '#,##0.00'
+            current_row += 1
+
+    ws.cell(row=1, column=5, value="بازگشت به وضعیت مالی").hyperlink = f"#'وضعیت مالی'!A1"
+    ws.cell(row=1, column=5).style = "Hyperlink"
+
+
+# ==============================================================================
+# پیش‌بینی چندساله: غلتاندن سه صورت مالی از ترازنامه افتتاحیه به صورت برداری
+# ==============================================================================
+PROJECTION_SHEET_TITLE = "پیش‌بینی چندساله"
+# پیش‌بینی از سال بعد از آخرین سال صورت‌های مالی شروع می‌شود و مانده‌های افتتاحیه آن مانده‌های پایان 1403 است
+PROJECTION_BASE_YEAR = '1403'
+PROJECTION_FIRST_YEAR = int(PROJECTION_BASE_YEAR) + 1
+
+# محرک‌های پیش‌بینی: کلید داخلی -> شرح مفروض در شیت مفروضات
+PROJECTION_DRIVERS = {
+    'revenue_growth': "درصد رشد درآمدهای عملیاتی",
+    'cost_of_revenue_ratio': "بهای تمام شده به درصد از درآمد",
+    'sga_ratio': "هزینه‌های فروش، اداری و عمومی به درصد از درآمد",
+    'tax_rate': "نرخ مالیات بر درآمد",
+    'receivable_days': "دوره وصول مطالبات (روز)",
+    'inventory_days': "دوره گردش موجودی کالا (روز)",
+    'payable_days': "دوره پرداخت بدهی‌ها (روز)",
+    'capex': "سرمایه‌گذاری ثابت سالانه (CAPEX)",
+    'depreciation_rate': "نرخ استهلاک سالانه (نسبت به بهای تمام شده اول دوره)",
+    'interest_rate': "نرخ سود تسهیلات (بر میانگین مانده)",
+    'deposit_rate': "نرخ سود سپرده بانکی (بر میانگین مانده نقد)",
+    'payout_ratio': "سود سهام پرداختی (درصد از سود خالص)",
+    'new_borrowing': "مبلغ وام جدید دریافتی طی سال",
+    'debt_repayment': "مبلغ بازپرداخت اصل وام طی سال",
+}
+LEGAL_RESERVE_RATE = 0.05 # مانند صورت تغییرات در حقوق مالکانه
+
+# ردیف‌های شیت پیش‌بینی: (کلید در Projection.lines یا None برای عنوان بخش، شرح، پررنگ)
+PROJECTION_LINES = [
+    (None, "صورت سود و زیان", True),
+    ('revenue', "درآمدهای عملیاتی", False),
+    ('cost_of_revenue', "بهای تمام شده درآمدهای عملیاتی", False),
+    ('gross_profit', "سود ناخالص", True),
+    ('sga_expense', "هزینه‌های فروش، اداری و عمومی", False),
+    ('depreciation_expense', "هزینه استهلاک", False),
+    ('operating_profit', "سود عملیاتی", True),
+    ('finance_income', "درآمدهای مالی", False),
+    ('finance_cost', "هزینه‌های مالی", False),
+    ('profit_before_tax', "سود قبل از مالیات", True),
+    ('income_tax', "مالیات بر درآمد", False),
+    ('net_profit', "سود خالص", True),
+    (None, "صورت وضعیت مالی (پایان سال)", True),
+    ('cash', "موجودی نقد", False),
+    ('receivables', "حساب‌ها و اسناد دریافتنی", False),
+    ('inventory', "موجودی کالا", False),
+    ('prepayments', "پیش‌پرداخت‌ها و سایر دارایی‌های جاری", False),
+    ('fixed_assets_net_book_value', "دارایی‌های ثابت مشهود (ارزش دفتری)", False),
+    ('other_non_current_assets', "سایر دارایی‌های غیرجاری", False),
+    ('total_assets', "جمع کل دارایی‌ها", True),
+    ('accounts_payable', "حساب‌ها و اسناد پرداختنی", False),
+    ('tax_payable', "مالیات پرداختنی", False),
+    ('dividends_payable', "سود سهام پرداختنی", False),
+    ('borrowings', "تسهیلات مالی (جاری و بلندمدت)", False),
+    ('end_of_service_benefits', "مزایای پایان خدمت کارکنان", False),
+    ('total_liabilities', "جمع کل بدهی‌ها", True),
+    ('capital', "سرمایه", False),
+    ('legal_reserve', "اندوخته قانونی", False),
+    ('other_reserves', "سایر اندوخته‌ها", False),
+    ('retained_earnings', "سود انباشته", False),
+    ('total_equity', "جمع کل حقوق مالکانه", True),
+    ('total_liabilities_and_equity', "جمع کل بدهی‌ها و حقوق مالکانه", True),
+    ('opening_imbalance', "عدم تراز منتقل شده از مانده‌های افتتاحیه", False),
+    ('balance_check', "کنترل تراز پس از عدم تراز افتتاحیه (باید صفر باشد)", True),
+    (None, "صورت جریان‌های نقدی", True),
+    ('operating_cash_flow', "خالص جریان نقد عملیاتی", False),
+    ('investing_cash_flow', "خالص جریان نقد سرمایه‌گذاری", False),
+    ('financing_cash_flow', "خالص جریان نقد تامین مالی", False),
+    ('net_change_in_cash', "خالص افزایش (کاهش) در موجودی نقد", True),
+]
+
+# years: سال‌های پیش‌بینی؛ lines: {کلید ردیف: آرایه numpy با محور آخر به طول تعداد سال‌ها}؛
+# solution: FixedPointSolution حل درآمد مالی (تعداد تکرار و باقیمانده)
+Projection = namedtuple('Projection', ['years', 'lines', 'solution'], defaults=(None,))
+
+# کلید مانده‌های افتتاحیه پیش‌بینی (همان کلیدهای OPENING_BALANCE_SHEET) -> نام ثبت شده در صورت‌های مالی
+PROJECTION_OPENING_CELLS = {
+    'cash': 'cash',
+    'receivables': 'receivables',
+    'inventory': 'inventory',
+    'prepayments': 'prepayments',
+    'fixed_asset_cost': 'fixed_asset_cost',
+    'accumulated_depreciation': 'accumulated_depreciation',
+    'other_non_current_assets': 'other_non_current_assets',
+    'accounts_payable': 'accounts_payable',
+    'tax_payable': 'tax_payable',
+    'dividends_payable': 'dividends_payable',
+    'current_portion_of_debt': 'current_portion_of_debt',
+    'long_term_debt': 'long_term_debt',
+    'end_of_service_benefits': 'end_of_service_benefits',
+    'capital': 'capital',
+    'legal_reserve': 'legal_reserve',
+    'other_reserves': 'other_reserves',
+    'retained_earnings': 'retained_earnings',
+}
+
+
+def statement_projection_inputs(evaluator, cells=None, year=PROJECTION_BASE_YEAR):
+    """
+    ورودی‌های پیش‌بینی از مقادیر محاسبه شده صورت‌های مالی همین کارپوشه: (مانده‌های پایان سال year به صورت
+    {کلید OPENING_BALANCE_SHEET: مقدار}، درآمد عملیاتی همان سال).
+    """
+    cells = cells if cells is not None else report_cell_registry()
+    opening_balance = {key: float(evaluator.value(*cells.address(name, year)) or 0)
+                       for key, name in PROJECTION_OPENING_CELLS.items()}
+    return opening_balance, float(evaluator.value(*cells.address('revenue', year)) or 0)
+
+
+def projection_driver_values(assumptions, num_years, first_year=PROJECTION_FIRST_YEAR, overrides=None):
+    """
+    مقدار هر محرک برای هر سال پیش‌بینی: {کلید محرک: آرایه}.
+    سالی که ستون مفروضات دارد (1402 یا 1403) مقدار همان ستون را می‌گیرد و سال‌های بعد آخرین مقدار (1403) را.
+    overrides: {شرح مفروض: یک عدد برای همه سال‌ها یا دنباله‌ای به طول num_years}؛ شرح ناشناخته خطا می‌دهد.
+    """
+    values_by_desc = {desc: {'1403': val_1403, '1402': val_1402}
+                      for items in assumptions.values() for desc, val_1403, val_1402 in items}
+    overrides = dict(overrides or {})
+    unknown = sorted(set(overrides) - set(PROJECTION_DRIVERS.values()))
+    if unknown:
+        raise ValueError("محرک ناشناخته برای پیش‌بینی: " + "، ".join(unknown))
+
+    drivers = {}
+    for key, desc in PROJECTION_DRIVERS.items():
+        if desc in overrides:
+            values = np.broadcast_to(np.asarray(overrides[desc], dtype=float), (num_years,))
+        else:
+            known = values_by_desc[desc]
+            values = np.array([known[str(year)] if str(year) in known else known[ASSUMPTION_YEARS[0]]
+                               for year in range(first_year, first_year + num_years)], dtype=float)
+        drivers[key] = values
+    return drivers
+
+
+def project_financial_statements(num_years, opening_balance, base_revenue, assumptions=None, overrides=None,
+                                 first_year=PROJECTION_FIRST_YEAR):
+    """
+    غلتاندن صورت سود و زیان، وضعیت مالی و جریان‌های نقدی برای num_years سال از first_year.
+    opening_balance مانده‌های پایان سال قبل از first_year (کلیدهای OPENING_BALANCE_SHEET، معمولاً از
+    statement_projection_inputs) و base_revenue درآمد عملیاتی همان سال است؛ رشد درآمد از سال اول اعمال می‌شود.
+    سود انباشته افتتاحیه از opening_balance['retained_earnings'] خوانده می‌شود و اگر نباشد (مانند
+    OPENING_BALANCE_SHEET) رقم تراز کننده مانده‌های افتتاحیه است. اختلاف دارایی‌ها با بدهی‌ها و حقوق مالکانه
+    افتتاحیه جذب نمی‌شود: در ردیف opening_imbalance همه سال‌ها می‌ماند و کنترل تراز پس از کسر آن صفر است.
+    همه ردیف‌ها با cumsum/cumprod روی آرایه سال‌ها محاسبه می‌شوند (بدون فرمول سلول به سلول).
+    بهای تمام شده و هزینه‌های عمومی نسبتی از درآمدند و استهلاک جداگانه از بهای تمام شده اول دوره محاسبه می‌شود؛
+    اقلامی که مفروضی ندارند (پیش‌پرداخت‌ها، سایر دارایی‌ها، سود سهام پرداختنی و مزایای پایان خدمت) ثابت می‌مانند.
+    هزینه مالی بر میانگین مانده تسهیلات و درآمد مالی بر میانگین مانده نقد است؛ درآمد مالی با سود خالص و
+    سود سهام چرخه دارد و با solve_fixed_point حل می‌شود (Projection.solution).
+    موجودی نقد از جریان‌های نقدی به دست می‌آید، پس اختلاف تراز در همه سال‌ها همان اختلاف افتتاحیه است.
+    """
+    if num_years < 1:
+        raise ValueError("تعداد سال‌های پیش‌بینی باید حداقل 1 باشد.")
+    assumptions = assumptions or DEFAULT_ASSUMPTIONS
+    opening = dict(OPENING_BALANCE_SHEET, **opening_balance)
+    d = projection_driver_values(assumptions, num_years, first_year, overrides)
+    constant = lambda value: np.full(num_years, float(value))
+    lines = {}
+
+    # --- سود و زیان تا سود عملیاتی ---
+    revenue = base_revenue * np.cumprod(1 + d['revenue_growth'])
+    cost_of_revenue = -revenue * d['cost_of_revenue_ratio']
+    sga_expense = -revenue * d['sga_ratio']
+    fixed_asset_cost = opening['fixed_asset_cost'] + np.cumsum(d['capex'])
+    depreciation = (fixed_asset_cost - d['capex']) * d['depreciation_rate'] # نسبت به بهای تمام شده اول دوره
+    operating_profit = revenue + cost_of_revenue + sga_expense - depreciation
+
+    # --- سرمایه در گردش، دارایی ثابت و تسهیلات (مستقل از سود خالص) ---
+    previous = lambda values, opening_value: np.concatenate(([opening_value], values[:-1]))
+    receivables = d['receivable_days'] / 365 * revenue
+    inventory = d['inventory_days'] / 365 * -cost_of_revenue
+    accounts_payable = d['payable_days'] / 365 * -cost_of_revenue
+    fixed_assets_net = fixed_asset_cost - (opening['accumulated_depreciation'] + np.cumsum(depreciation))
+    opening_borrowings = opening['current_portion_of_debt'] + opening['long_term_debt']
+    borrowings = opening_borrowings + np.cumsum(d['new_borrowing'] - d['debt_repayment'])
+    finance_cost = d['interest_rate'] * (previous(borrowings, opening_borrowings) + borrowings) / 2
+    cash_flow_before_profit = (depreciation
+                               - (receivables - previous(receivables, opening['receivables']))
+                               - (inventory - previous(inventory, opening['inventory']))
+                               + (accounts_payable - previous(accounts_payable, opening['accounts_payable'])))
+
+    def close_periods(finance_income):
+        """سود خالص، سود سهام و موجودی نقد همه سال‌ها به ازای یک بردار درآمد مالی."""
+        profit_before_tax = operating_profit + finance_income - finance_cost
+        income_tax = -np.maximum(profit_before_tax, 0) * d['tax_rate']
+        net_profit = profit_before_tax + income_tax
+        dividends = np.maximum(net_profit, 0) * d['payout_ratio']
+        tax_payable = -income_tax # مالیات هر سال در سال بعد پرداخت می‌شود
+        operating_cash_flow = (net_profit + cash_flow_before_profit
+                               + (tax_payable - previous(tax_payable, opening['tax_payable'])))
+        financing_cash_flow = d['new_borrowing'] - d['debt_repayment'] - dividends
+        net_change_in_cash = operating_cash_flow - d['capex'] + financing_cash_flow
+        cash = opening['cash'] + np.cumsum(net_change_in_cash)
+        return SimpleNamespace(profit_before_tax=profit_before_tax, income_tax=income_tax, net_profit=net_profit,
+                               dividends=dividends, tax_payable=tax_payable, operating_cash_flow=operating_cash_flow,
+                               financing_cash_flow=financing_cash_flow, net_change_in_cash=net_change_in_cash, cash=cash)
+
+    def deposit_income(finance_income):
+        cash = close_periods(finance_income).cash
+        return d['deposit_rate'] * (previous(cash, opening['cash']) + cash) / 2
+
+    # درآمد مالی بر میانگین مانده نقد به سود خالص و سود سهام همان سال برمی‌گردد: حل نقطه ثابت روی کل بردار سال‌ها
+    solution = solve_fixed_point(deposit_income, np.zeros(num_years))
+    finance_income = solution.value
+    period = close_periods(finance_income)
+    net_profit = period.net_profit
+    lines.update(revenue=revenue, cost_of_revenue=cost_of_revenue, gross_profit=revenue + cost_of_revenue,
+                 sga_expense=sga_expense, depreciation_expense=-depreciation, operating_profit=operating_profit,
+                 finance_income=finance_income, finance_cost=-finance_cost, profit_before_tax=period.profit_before_tax,
+                 income_tax=period.income_tax, net_profit=net_profit)
+
+    # --- حقوق مالکانه ---
+    legal_reserve_transfer = np.maximum(net_profit, 0) * LEGAL_RESERVE_RATE
+    opening_assets = (opening['cash'] + opening['receivables'] + opening['inventory'] + opening['prepayments'] +
+                      opening['fixed_asset_cost'] - opening['accumulated_depreciation'] + opening['other_non_current_assets'])
+    opening_liabilities = (opening['accounts_payable'] + opening['tax_payable'] + opening['dividends_payable'] +
+                           opening_borrowings + opening['end_of_service_benefits'])
+    balancing_retained_earnings = (opening_assets - opening_liabilities - opening['capital'] -
+                                   opening['legal_reserve'] - opening['other_reserves'])
+    opening_retained_earnings = opening.get('retained_earnings', balancing_retained_earnings)
+    opening_imbalance = balancing_retained_earnings - opening_retained_earnings
+    legal_reserve = opening['legal_reserve'] + np.cumsum(legal_reserve_transfer)
+    retained_earnings = opening_retained_earnings + np.cumsum(net_profit - legal_reserve_transfer - period.dividends)
+
+    cash, tax_payable = period.cash, period.tax_payable
+    investing_cash_flow = -d['capex']
+    operating_cash_flow, financing_cash_flow, net_change_in_cash = (period.operating_cash_flow, period.financing_cash_flow,
+                                                                    period.net_change_in_cash)
+
+    total_assets = (cash + receivables + inventory + opening['prepayments'] + fixed_assets_net +
+                    opening['other_non_current_assets'])
+    total_liabilities = (accounts_payable + tax_payable + opening['dividends_payable'] + borrowings +
+                         opening['end_of_service_benefits'])
+    total_equity = opening['capital'] + legal_reserve + opening['other_reserves'] + retained_earnings
+    lines.update(cash=cash, receivables=receivables, inventory=inventory, prepayments=constant(opening['prepayments']),
+                 fixed_assets_net_book_value=fixed_assets_net,
+                 other_non_current_assets=constant(opening['other_non_current_assets']), total_assets=total_assets,
+                 accounts_payable=accounts_payable, tax_payable=tax_payable,
+                 dividends_payable=constant(opening['dividends_payable']), borrowings=borrowings,
+                 end_of_service_benefits=constant(opening['end_of_service_benefits']), total_liabilities=total_liabilities,
+                 capital=constant(opening['capital']), legal_reserve=legal_reserve,
+                 other_reserves=constant(opening['other_reserves']), retained_earnings=retained_earnings,
+                 total_equity=total_equity, total_liabilities_and_equity=total_liabilities + total_equity,
+                 opening_imbalance=constant(opening_imbalance),
+                 balance_check=total_assets - total_liabilities - total_equity - opening_imbalance,
+                 operating_cash_flow=operating_cash_flow, investing_cash_flow=investing_cash_flow,
+                 financing_cash_flow=financing_cash_flow, net_change_in_cash=net_change_in_cash)
+    return Projection(list(range(first_year, first_year + num_years)), lines, solution)
+
+
+def populate_projection_sheet(ws, projection):
+    """نوشتن پیش‌بینی چندساله: یک ستون به ازای هر سال (از ستون C) و یک ردیف به ازای هر قلم PROJECTION_LINES."""
+    ws.title = PROJECTION_SHEET_TITLE
+    year_columns = {year: get_column_letter(col_idx) for col_idx, year in enumerate(projection.years, 3)}
+    set_rtl_and_column_widths(ws, {'A': 5, 'B': 45, **{col_letter: 16 for col_letter in year_columns.values()}})
+    add_header(ws, COMPANY_NAME, f"پیش‌بینی {len(projection.years)} ساله صورت‌های مالی",
+               f"سال‌های {projection.years[0]} تا {projection.years[-1]}", "(ارقام به میلیون ریال)")
+
+    header_row = 7
+    apply_style(ws.cell(row=header_row, column=2, value="شرح"), 'bold_total')
+    for year, col_letter in year_columns.items():
+        apply_style(ws[f'{col_letter}{header_row}'], 'bold_total').value = year
+
+    current_row = header_row
+    for key, label, bold in PROJECTION_LINES:
+        current_row += 1
+        if key is None:
+            current_row += 1 # ردیف خالی پیش از هر بخش
+            apply_style(ws.cell(row=current_row, column=1, value=label), 'bold_total')
+            continue
+        label_cell = ws.cell(row=current_row, column=2, value=label)
+        for (year, col_letter), value in zip(year_columns.items(), projection.lines[key].tolist()):
+            cell = ws[f'{col_letter}{current_row}']
+            cell.value = round(value, 2)
+            if key in ('balance_check', 'opening_imbalance'):
+                apply_style(cell, 'warning_fill')
+            elif bold:
+                apply_style(cell, 'bold_total')
+            cell.number_format = '#,##0'
+        if bold:
+            apply_style(label_cell, 'bold_total')
+
+    ws.cell(row=1, column=max(1, ws.max_column - 1), value="بازگشت به وضعیت مالی").hyperlink = f"#'وضعیت مالی'!A1"
+    ws.cell(row=1, column=max(1, ws.max_column - 1)).style = "Hyperlink"
+
+
+def streamed_report_sheets(num_employees, inventory_items, seed=None):
+    """شیت‌هایی که در ذخیره جریانی مستقیماً از مولد ردیف‌ها نوشته می‌شوند: {نام شیت: تابع(ws)}."""
+    return {
+        PAYROLL_SHEET_TITLE: lambda ws: stream_payroll_list_sheet(ws, num_employees, seed),
+        'موجودی_تفصیلی': lambda ws: stream_detailed_inventory_sheet(ws, inventory_items),
+    }
+
+
+def save_streaming_workbook(wb, output_path, num_employees, inventory_items, seed=None):
+    """
+    ذخیره گزارش با کارپوشه write-only: شیت‌های کوچک از wb کپی و شیت‌های حقوق و موجودی تفصیلی
+    مستقیماً از مولد ردیف‌ها نوشته می‌شوند (ردیف‌ها پس از نوشتن در حافظه نمی‌مانند).
+    """
+    output_wb = Workbook(write_only=True)
+    register_report_styles(output_wb)
+    streamed_sheets = streamed_report_sheets(num_employees, inventory_items, seed)
+    for sheet_name in wb.sheetnames:
+        target_ws = output_wb.create_sheet(sheet_name)
+        if sheet_name in streamed_sheets:
+            streamed_sheets[sheet_name](target_ws)
+        else:
+            copy_sheet_to_write_only(wb[sheet_name], target_ws)
+    output_wb.active = wb.sheetnames.index('وضعیت مالی')
+    output_wb.save(output_path)
+
+
+# ==============================================================================
+# نوشتن مستقیم XLSX: تولید XML شیت‌ها بدون ساختن شیء Cell برای هر مقدار
+# ==============================================================================
+XLSX_MAIN_NAMESPACE = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+XLSX_RELATIONSHIP_NAMESPACE = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+XLSX_RELATIONSHIP_TYPE = "http://schemas.openxmlformats.org/officeDocument/2006/relationships/"
+XLSX_CONTENT_TYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml."
+XML_DECLARATION = '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+
+
+class DirectXlsxSheet:
+    """
+    شیت خروجی DirectXlsxWriter با همان رابط شیت write-only (append، sheet_view، column_dimensions، merged_cells)
+    تا توابع stream_* بدون تغییر روی آن اجرا شوند. هر ردیف بلافاصله به XML تبدیل و در فایل موقت نوشته می‌شود.
+    سلول‌های قالب‌دار (styled_write_only_cell) شیء Cell روی کارپوشه مبدأ هستند؛ بقیه مقادیر خام می‌مانند.
+    مقدار SharedFormula به صورت shared formula نوشته می‌شود: متن کامل فقط در سلول ردیف اول محدوده.
+    """
+
+    def __init__(self, writer, title):
+        self.writer = writer
+        self.title = title
+        self.parent = writer.source_wb # جدول سبک‌های سلول‌های قالب‌دار
+        self.sheet_view = SimpleNamespace(rightToLeft=False)
+        self.column_dimensions = defaultdict(lambda: SimpleNamespace(width=None))
+        self.merged_cells = set()
+        self.hyperlinks = []  # (آدرس، مقصد)
+        self.current_row = 0
+        self.shared_formula_ids = {}  # (ستون، SharedFormula) -> شماره گروه si
+        self._rows = tempfile.TemporaryFile(mode='w+', encoding='utf-8')
+
+    def append(self, row):
+        """نوشتن ردیف بعدی؛ مقدار هر ستون یک مقدار خام یا یک Cell قالب‌دار است."""
+        self.current_row += 1
+        items = []
+        for col_idx, value in enumerate(row, 1):
+            if isinstance(value, Cell):
+                items.append((col_idx, value.value, value.style_id if value.has_style else 0,
+                              value.hyperlink.target if value.hyperlink else None))
+            elif value is not None:
+                items.append((col_idx, value, 0, None))
+        self.write_row(self.current_row, items)
+
+    def write_row(self, row_idx, items):
+        """نوشتن یک ردیف از (ستون، مقدار، شماره قالب، مقصد لینک)؛ ردیف‌ها باید به ترتیب صعودی باشند."""
+        self.current_row = row_idx
+        if not items:
+            return
+        cell_xml = self.writer.cell_xml
+        cached_values = (self.writer.cached_values or {}).get(self.title, {})
+        parts = [f'<row r="{row_idx}">']
+        for col_idx, value, style_id, hyperlink in items:
+            reference = f'{get_column_letter(col_idx)}{row_idx}'
+            if isinstance(value, SharedFormula):
+                parts.append(self.shared_formula_xml(reference, col_idx, row_idx, value, style_id))
+            else:
+                parts.append(cell_xml(reference, value, style_id, cached_values.get(reference)))
+            if hyperlink:
+                self.hyperlinks.append((reference, hyperlink))
+        parts.append('</row>')
+        self._rows.write(''.join(parts))
+
+    def shared_formula_xml(self, reference, col_idx, row_idx, formula, style_id=0):
+        """XML سلول یک SharedFormula: فرمول اصلی با محدوده ref در ردیف اول و بقیه ردیف‌ها فقط با si."""
+        style = f' s="{style_id}"' if style_id else ''
+        index = self.shared_formula_ids.get((col_idx, formula))
+        if index is not None:
+            return f'<c r="{reference}"{style}><f t="shared" si="{index}"/></c>'
+        text = escape(shared_formula_text(formula, row_idx)[1:])
+        if row_idx != formula.first_row or formula.first_row == formula.last_row: # ردیف اول نوشته نشده: فرمول عادی
+            return f'<c r="{reference}"{style}><f>{text}</f></c>'
+        index = self.shared_formula_ids[(col_idx, formula)] = len(self.shared_formula_ids)
+        col_letter = get_column_letter(col_idx)
+        return (f'<c r="{reference}"{style}><f t="shared" ref="{col_letter}{formula.first_row}:{col_letter}{formula.last_row}" '
+                f'si="{index}">{text}</f></c>')
+
+    def copy_from(self, source_ws):
+        """کپی یک شیت عادی openpyxl (مقدار، شماره قالب، لینک، ادغام‌ها، عرض ستون‌ها و جهت)."""
+        self.sheet_view.rightToLeft = source_ws.sheet_view.rightToLeft
+        for col_letter, dimension in source_ws.column_dimensions.items():
+            if dimension.width:
+                self.column_dimensions[col_letter].width = dimension.width
+        self.merged_cells.update(str(merged_range) for merged_range in source_ws.merged_cells.ranges)
+        by_row = {}
+        for (row_idx, col_idx), cell in worksheet_cell_items(source_ws):
+            if cell.value is None and not cell.has_style and not cell.hyperlink:
+                continue
+            by_row.setdefault(row_idx, []).append((col_idx, cell.value, cell.style_id if cell.has_style else 0,
+                                                   cell.hyperlink.target if cell.hyperlink else None))
+        for row_idx in sorted(by_row):
+            self.write_row(row_idx, sorted(by_row[row_idx]))
+
+    def write_to(self, archive, path, selected=False):
+        """نوشتن XML کامل شیت (و روابط لینک‌های بیرونی) در فایل zip."""
+        external_links = []
+        with archive.open(path, 'w') as part:
+            write = lambda text: part.write(text.encode('utf-8'))
+            write(f'{XML_DECLARATION}<worksheet xmlns="{XLSX_MAIN_NAMESPACE}" xmlns:r="{XLSX_RELATIONSHIP_NAMESPACE}">')
+            view_attributes = ' rightToLeft="1"' if self.sheet_view.rightToLeft else ''
+            view_attributes += ' tabSelected="1"' if selected else ''
+            write(f'<sheetViews><sheetView{view_attributes} workbookViewId="0"/></sheetViews>')
+            write('<sheetFormatPr baseColWidth="8" defaultRowHeight="15"/>')
+            widths = sorted((column_index_from_string(col_letter), dimension.width)
+                            for col_letter, dimension in self.column_dimensions.items() if dimension.width)
+            if widths:
+                write('<cols>' + ''.join(f'<col min="{col_idx}" max="{col_idx}" width="{width}" customWidth="1"/>'
+                                         for col_idx, width in widths) + '</cols>')
+            write('<sheetData>')
+            self._rows.seek(0)
+            for chunk in iter(lambda: self._rows.read(1 << 20), ''):
+                write(chunk)
+            self._rows.close()
+            write('</sheetData>')
+            if self.merged_cells:
+                write(f'<mergeCells count="{len(self.merged_cells)}">' +
+                      ''.join(f'<mergeCell ref="{merged_range}"/>' for merged_range in sorted(self.merged_cells)) + '</mergeCells>')
+            if self.hyperlinks:
+                links = []
+                for reference, target in self.hyperlinks:
+                    if target.startswith('#'): # لینک داخلی به سلول شیت دیگر
+                        links.append(f'<hyperlink ref="{reference}" location={quoteattr(target[1:])}/>')
+                    else:
+                        external_links.append(target)
+                        links.append(f'<hyperlink ref="{reference}" r:id="rId{len(external_links)}"/>')
+                write('<hyperlinks>' + ''.join(links) + '</hyperlinks>')
+            write('<pageMargins left="0.75" right="0.75" top="1" bottom="1" header="0.5" footer="0.5"/></worksheet>')
+        if external_links:
+            folder, file_name = path.rsplit('/', 1)
+            archive.writestr(f'{folder}/_rels/{file_name}.rels', relationships_xml(
+                [(f'rId{i}', 'hyperlink', target, True) for i, target in enumerate(external_links, 1)]))
+
+
+def relationships_xml(relationships):
+    """XML فایل .rels از لیست (شناسه، نوع، مقصد، بیرونی بودن)."""
+    items = ''.join(f'<Relationship Id="{rel_id}" Type="{XLSX_RELATIONSHIP_TYPE}{rel_type}" Target={quoteattr(target)}'
+                    + (' TargetMode="External"' if external else '') + '/>'
+                    for rel_id, rel_type, target, external in relationships)
+    return f'{XML_DECLARATION}<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">{items}</Relationships>'
+
+
+class DirectXlsxWriter:
+    """
+    نوشتن مستقیم فایل xlsx: XML شیت‌ها، جدول shared strings و styles.xml مستقیماً در zip نوشته می‌شوند.
+    شماره قالب سلول‌ها همان style_id کارپوشه مبدأ (source_wb) است و styles.xml از همان کارپوشه ساخته می‌شود.
+    cached_values ({شیت: {آدرس: مقدار}}) مقدار محاسبه شده فرمول‌ها را کنار فرمول می‌نویسد؛ در این حالت فایل
+    هنگام باز شدن دوباره محاسبه نمی‌شود (fullCalcOnLoad فقط بدون cached_values).
+    """
+
+    def __init__(self, output_path, source_wb, cached_values=None):
+        self.output_path = output_path
+        self.source_wb = source_wb
+        self.cached_values = cached_values
+        self.sheets = []
+        self.shared_strings = {}
+
+    def create_sheet(self, title):
+        sheet = DirectXlsxSheet(self, title)
+        self.sheets.append(sheet)
+        return sheet
+
+    def shared_string(self, text):
+        index = self.shared_strings.get(text)
+        if index is None:
+            index = self.shared_strings[text] = len(self.shared_strings)
+        return index
+
+    def cell_xml(self, reference, value, style_id=0, cached=None):
+        """
+        XML یک سلول: رشته‌های شروع شده با '=' فرمول (با مقدار محاسبه شده cached در صورت وجود)، بقیه رشته‌ها
+        shared string و اعداد مقدار.
+        """
+        style = f' s="{style_id}"' if style_id else ''
+        if value is None or value == '': # مثل openpyxl، متن خالی سلول خالی است
+            return f'<c r="{reference}"{style}/>'
+        if isinstance(value, str):
+            if len(value) > 1 and value.startswith('='):
+                formula = f'<f>{escape(value[1:])}</f>'
+                if cached is None:
+                    return f'<c r="{reference}"{style}>{formula}</c>'
+                if isinstance(cached, ExcelError):
+                    return f'<c r="{reference}"{style} t="e">{formula}<v>{escape(cached)}</v></c>'
+                if isinstance(cached, str):
+                    return f'<c r="{reference}"{style} t="str">{formula}<v>{escape(cached)}</v></c>'
+                if isinstance(cached, bool):
+                    return f'<c r="{reference}"{style} t="b">{formula}<v>{int(cached)}</v></c>'
+                return f'<c r="{reference}"{style}>{formula}<v>{float(cached)!r}</v></c>'
+            return f'<c r="{reference}"{style} t="s"><v>{self.shared_string(value)}</v></c>'
+        if isinstance(value, bool):
+            return f'<c r="{reference}"{style} t="b"><v>{int(value)}</v></c>'
+        if isinstance(value, numbers.Integral):
+            return f'<c r="{reference}"{style}><v>{int(value)}</v></c>'
+        if isinstance(value, numbers.Real):
+            return f'<c r="{reference}"{style}><v>{float(value)!r}</v></c>'
+        return f'<c r="{reference}"{style} t="s"><v>{self.shared_string(str(value))}</v></c>'
+
+    def _shared_strings_xml(self):
+        items = ''.join(f'<si><t xml:space="preserve">{escape(text)}</t></si>' if text != text.strip()
+                        else f'<si><t>{escape(text)}</t></si>' for text in self.shared_strings)
+        return (f'{XML_DECLARATION}<sst xmlns="{XLSX_MAIN_NAMESPACE}" count="{len(self.shared_strings)}" '
+                f'uniqueCount="{len(self.shared_strings)}">{items}</sst>')
+
+    def save(self, active_sheet=0):
+        """نوشتن همه بخش‌های بسته xlsx؛ active_sheet اندیس شیت فعال هنگام باز شدن فایل است."""
+        with zipfile.ZipFile(self.output_path, 'w', zipfile.ZIP_DEFLATED) as archive:
+            sheet_count = len(self.sheets)
+            archive.writestr('[Content_Types].xml', (
+                f'{XML_DECLARATION}<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+                '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+                '<Default Extension="xml" ContentType="application/xml"/>'
+                f'<Override PartName="/xl/workbook.xml" ContentType="{XLSX_CONTENT_TYPE}sheet.main+xml"/>'
+                + ''.join(f'<Override PartName="/xl/worksheets/sheet{i}.xml" ContentType="{XLSX_CONTENT_TYPE}worksheet+xml"/>'
+                          for i in range(1, sheet_count + 1)) +
+                f'<Override PartName="/xl/styles.xml" ContentType="{XLSX_CONTENT_TYPE}styles+xml"/>'
+                f'<Override PartName="/xl/sharedStrings.xml" ContentType="{XLSX_CONTENT_TYPE}sharedStrings+xml"/>'
+                '</Types>'))
+            archive.writestr('_rels/.rels', relationships_xml([('rId1', 'officeDocument', 'xl/workbook.xml', False)]))
+
+            for i, sheet in enumerate(self.sheets, 1):
+                sheet.write_to(archive, f'xl/worksheets/sheet{i}.xml', selected=(i - 1 == active_sheet))
+            # پس از نوشتن شیت‌ها: سلول‌های قالب‌دار جریانی ممکن است قالب تازه‌ای به کارپوشه مبدأ افزوده باشند
+            archive.writestr('xl/styles.xml', XML_DECLARATION + tostring(write_stylesheet(self.source_wb)).decode('utf-8'))
+            archive.writestr('xl/sharedStrings.xml', self._shared_strings_xml())
+
+            # بدون مقدار کش شده فرمول‌ها، اکسل باید هنگام باز کردن همه چیز را محاسبه کند
+            full_calc = ' fullCalcOnLoad="1"' if self.cached_values is None else ''
+            sheets_xml = ''.join(f'<sheet name={quoteattr(sheet.title)} sheetId="{i}" r:id="rId{i}"/>'
+                                 for i, sheet in enumerate(self.sheets, 1))
+            archive.writestr('xl/workbook.xml', (
+                f'{XML_DECLARATION}<workbook xmlns="{XLSX_MAIN_NAMESPACE}" xmlns:r="{XLSX_RELATIONSHIP_NAMESPACE}">'
+                f'<workbookPr/><bookViews><workbookView activeTab="{active_sheet}"/></bookViews>'
+                f'<sheets>{sheets_xml}</sheets><calcPr calcId="124519"{full_calc}/></workbook>'))
+            archive.writestr('xl/_rels/workbook.xml.rels', relationships_xml(
+                [(f'rId{i}', 'worksheet', f'worksheets/sheet{i}.xml', False) for i in range(1, sheet_count + 1)] +
+                [(f'rId{sheet_count + 1}', 'styles', 'styles.xml', False),
+                 (f'rId{sheet_count + 2}', 'sharedStrings', 'sharedStrings.xml', False)]))
+
+
+def save_direct_workbook(wb, output_path, streamed_sheets=None, cached_values=None):
+    """
+    ذخیره کارپوشه با DirectXlsxWriter. شیت‌های streamed_sheets ({نام: تابع(ws)}، مثل streamed_report_sheets)
+    از مولد ردیف‌ها نوشته و بقیه از wb کپی می‌شوند؛ cached_values مثل DirectXlsxWriter.
+    """
+    streamed_sheets = streamed_sheets or {}
+    writer = DirectXlsxWriter(output_path, wb, cached_values)
+    for sheet_name in wb.sheetnames:
+        target_ws = writer.create_sheet(sheet_name)
+        if sheet_name in streamed_sheets:
+            streamed_sheets[sheet_name](target_ws)
+        else:
+            target_ws.copy_from(wb[sheet_name])
+    writer.save(wb.sheetnames.index('وضعیت مالی'))
+
+
+# ==============================================================================
+# تابع اصلاح شده ۸: create_full_financial_report (ساخت یک‌مرحله‌ای به ترتیب وابستگی)
+# ==============================================================================
+REPORT_SHEET_NAMES = [
+    'مفروضات', 'ترازنامه پایه', 'وضعیت مالی', 'سودوزیان', 'جریان های نقدی', 'حقوق مالکانه', 'جامع',
+    'گردش دارایی ثابت', 'موجودی_تفصیلی', 'موجودی', 'لیست حقوق و دستمزد', PAYROLL_LEDGER_SHEET_TITLE, '8', '9',
+    'سر برگ صفحات', 'ص امضا', 'تاریخچه',
+    'اهم رویه1', 'اهم رویه2', 'اهم رویه3', 'اهم رویه4', 'اهم رویه5', 'اهم رویه6',
+    'قضاوت مدیریت', 'پیوست',
+    *NUMERIC_NOTE_SHEET_NAMES,
+    'گزارش مدیریتی تطبیقی',
+    'گزارش تحلیلی کسب و کار'
+]
+
+
+def build_report_workbook(num_employees=100, inventory_items=None, streaming=False, seed=None, assumption_overrides=None,
+                          build_cache=None, on_step=None, workers=1, trial_balance=None, static_templates=None,
+                          strict_references=False):
+    """
+    ساخت کارپوشه در حافظه (بدون ذخیره) و برگرداندن (wb, build_context).
+    پس از ساخت ارجاع‌های فرمول‌ها بررسی می‌شوند (validate_workbook_references): ارجاع چرخشی همیشه
+    CircularReferenceError است و بقیه موارد در build_context['reference_issues'] و به صورت هشدار گزارش می‌شوند
+    (با strict_references=True خطای BrokenReferenceError).
+    شیت‌های ثابت از static_templates (پیش‌فرض: STATIC_SHEET_TEMPLATES همین فرایند) کپی می‌شوند.
+    on_step(step, seconds) در صورت وجود پس از هر مرحله صدا زده می‌شود (برای بنچمارک).
+    با workers غیر از 1 مراحل مستقل در فرایندهای جداگانه ساخته می‌شوند (None: تعداد هسته‌ها).
+    trial_balance (خروجی build_trial_balance) مانده‌های افتتاحیه، اقلام سود و زیان، مبالغ یادداشت‌ها و
+    مفروضات متناظر را جایگزین مقادیر پیش‌فرض می‌کند.
+    """
+    inventory_items = inventory_items or DEFAULT_INVENTORY_ITEMS
+
+    wb = Workbook()
+    if 'Sheet' in wb.sheetnames:
+        wb.remove(wb['Sheet'])
+    register_report_styles(wb)
+
+    for sheet_name in REPORT_SHEET_NAMES:
+        if sheet_name not in wb.sheetnames:
+            try:
+                wb.create_sheet(sheet_name)
+            except ValueError:
+                pass
+
+    # --- اجرای مراحل به ترتیب توپولوژیک (هر تابع فقط یک بار) ---
+    print("شروع ساخت مدل مالی یکپارچه...")
+    build_context = {
+        'wb': wb,
+        'streaming': streaming,
+        'num_employees': num_employees,
+        'seed': seed,
+        'assumption_overrides': ledger_assumption_overrides(trial_balance, assumption_overrides) if trial_balance else assumption_overrides,
+        'trial_balance': trial_balance,
+        'inventory_items': inventory_items,
+        'payroll_layout': payroll_sheet_layout(num_employees),
+        'inventory_layout': detailed_inventory_layout(len(inventory_items)),
+        'static_templates': static_templates or STATIC_SHEET_TEMPLATES,
+    }
+    steps = get_report_build_steps()
+    build_context['cells'] = report_cell_registry(steps, build_context)
+    build_steps, _ = plan_report_build(steps, build_context['cells'])
+    if build_cache is not None:
+        build_cache.reused, build_cache.rebuilt = [], []
+    if workers != 1:
+        run_build_steps_parallel(build_steps, build_context, workers, build_cache, on_step)
+    else:
+        for step in build_steps:
+            started = time.perf_counter()
+            if build_cache is None:
+                step.run(build_context)
+            else:
+                build_cache.run_step(step, build_context)
+            if on_step:
+                on_step(step, time.perf_counter() - started)
+    if build_cache is not None:
+        build_cache.save()
+        print(f"کش ساخت: {len(build_cache.reused)} مرحله از کش، {len(build_cache.rebuilt)} مرحله ساخته شد.")
+
+    # شیت‌هایی که در سطح شیت به هم ارجاع دارند (مثل وضعیت مالی و جریان های نقدی) باید در سطح سلول بدون چرخه باشند؛
+    # بقیه ارجاع‌های مشکل‌دار هشدارند مگر با strict_references
+    deferred_sheets = streamed_report_sheets(num_employees, inventory_items, seed) if streaming else ()
+    issues = validate_workbook_references(wb, deferred_sheets, families=report_formula_families(build_context))
+    cycles = [issue for issue in issues if issue.kind == 'cycle']
+    if cycles:
+        raise CircularReferenceError("ارجاع چرخشی بین سلول‌ها: " + cycles[0].target)
+    build_context['reference_issues'] = issues
+    if issues:
+        for issue in issues[:REFERENCE_ISSUES_PRINTED]:
+            print(f"هشدار: {REFERENCE_ISSUE_KINDS[issue.kind]} در '{issue.sheet}'!{issue.cell}: {issue.target}")
+        if len(issues) > REFERENCE_ISSUES_PRINTED:
+            print(f"هشدار: {len(issues) - REFERENCE_ISSUES_PRINTED} ارجاع مشکل‌دار دیگر.")
+        if strict_references:
+            raise BrokenReferenceError(f"{len(issues)} ارجاع نامعتبر در کارپوشه (اولین: {REFERENCE_ISSUE_KINDS[issues[0].kind]} "
+                                       f"در '{issues[0].sheet}'!{issues[0].cell}: {issues[0].target}).")
+    print("تمام شیت‌ها پر شدند.")
+    return wb, build_context
+
+
+class ReportSaveError(OSError):
+    """خطای ذخیره کارپوشه در مسیر یا جریان خروجی؛ خطای اصلی در __cause__ است."""
+
+
+def save_report_workbook(wb, output, output_backend='openpyxl', streaming=False, num_employees=100, inventory_items=None, seed=None,
+                         cached_values=None):
+    """
+    ذخیره کارپوشه ساخته شده در output: مسیر فایل یا هر جریان دودویی قابل نوشتن (io.BytesIO، sys.stdout.buffer،
+    پاسخ HTTP و ...). همه روش‌های ذخیره فقط zipfile.ZipFile را به کار می‌برند و جریان غیرقابل seek هم پذیرفته می‌شود.
+    cached_values (خروجی freeze_workbook_values) فقط در روش 'direct' کنار فرمول‌های باقی‌مانده نوشته می‌شود.
+    """
+    try:
+        if output_backend == 'direct':
+            save_direct_workbook(wb, output, streamed_report_sheets(num_employees, inventory_items, seed) if streaming else None,
+                                 cached_values)
+        elif streaming:
+            save_streaming_workbook(wb, output, num_employees, inventory_items, seed)
+        else:
+            wb.active = wb['وضعیت مالی']
+            wb.save(output)
+    except Exception as e:
+        raise ReportSaveError(f"خطا در ذخیره فایل اکسل: {e}") from e
+
+
+class ReportOptionError(ValueError):
+    """ترکیب یا مقدار نامعتبر پارامترهای ساخت گزارش (پیش از شروع ساخت تشخیص داده می‌شود)."""
+
+
+def check_report_options(evaluate=False, num_employees=100, inventory_items=None, streaming=False, assumption_overrides=None,
+                         monte_carlo_draws=0, workers=1, output_backend='openpyxl', projection_years=0, export_path=None,
+                         inventory_movements=None, journal=None, chart_of_accounts=None, values_only=False,
+                         keep_statement_formulas=False, inventory_item_count=None, **build_options):
+    """
+    بررسی پارامترهای write_financial_report بدون ساختن چیزی و بدون خواندن فایل‌های ورودی؛ ReportOptionError برای
+    مقدار یا ترکیب نامعتبر (ImportError اگر pyarrow برای خروجی Parquet نصب نباشد). inventory_item_count (تعداد
+    اقلام فرضی کارها و خط فرمان) هم پذیرفته می‌شود و بقیه پارامترها (seed، build_cache و ...) بررسی نمی‌شوند.
+    خطای ValueError پس از این بررسی یعنی شکست خود ساخت (ارجاع چرخشی، داده ورودی نامعتبر و ...).
+    """
+    if num_employees is None or num_employees <= 0:
+        raise ReportOptionError("تعداد کارمندان باید مثبت باشد.")
+    if inventory_item_count is not None and inventory_item_count <= 0:
+        raise ReportOptionError("تعداد اقلام موجودی باید مثبت باشد.")
+    if workers is not None and workers < 0:
+        raise ReportOptionError("تعداد فرایندها نمی‌تواند منفی باشد.")
+    if monte_carlo_draws < 0 or projection_years < 0:
+        raise ReportOptionError("تعداد نمونه‌های مونت‌کارلو و سال‌های پیش‌بینی نمی‌تواند منفی باشد.")
+    if output_backend not in OUTPUT_BACKENDS:
+        raise ReportOptionError(f"روش ذخیره نامعتبر '{output_backend}' (یکی از {', '.join(OUTPUT_BACKENDS)})")
+    if streaming and (evaluate or monte_carlo_draws or export_path or values_only or projection_years):
+        raise ReportOptionError("محاسبه مقادیر (evaluate / مونت‌کارلو / پیش‌بینی / خروجی ستونی / مقادیر ثابت) در حالت جریانی پشتیبانی نمی‌شود؛ ردیف‌های حقوق در حافظه نگه داشته نمی‌شوند.")
+    if keep_statement_formulas and not values_only:
+        raise ReportOptionError("keep_statement_formulas فقط همراه values_only معنی دارد.")
+    if export_path:
+        try:
+            statement_export_format(export_path)
+        except ValueError as e:
+            raise ReportOptionError(str(e)) from e
+    if inventory_movements and (inventory_items or inventory_item_count):
+        raise ReportOptionError("فقط یکی از inventory_items و inventory_movements را مشخص کنید.")
+    if bool(journal) != bool(chart_of_accounts):
+        raise ReportOptionError("فایل اسناد (journal) و جدول حساب‌ها (chart_of_accounts) باید با هم مشخص شوند.")
+    if assumption_overrides:
+        try:
+            apply_assumption_overrides(DEFAULT_ASSUMPTIONS, assumption_overrides)
+        except ValueError as e:
+            raise ReportOptionError(str(e)) from e
+
+
+def write_financial_report(output, evaluate=False, num_employees=100, inventory_items=None, streaming=False, seed=None, assumption_overrides=None, monte_carlo_draws=0, build_cache=None, workers=1, output_backend='openpyxl', projection_years=0, export_path=None, scenario_name=None, inventory_movements=None, journal=None, chart_of_accounts=None, values_only=False, keep_statement_formulas=False, strict_references=False):
+    """
+    ساخت کارپوشه کامل و نوشتن آن در output (مسیر فایل یا جریان دودویی قابل نوشتن، بدون فایل موقت).
+    خطای ذخیره به صورت ReportSaveError پرتاب می‌شود.
+    با evaluate=True مقادیر کلیدی (کنترل تراز و شاخص‌ها) در پایتون محاسبه و برگردانده می‌شود.
+    با streaming=True شیت‌های بزرگ ردیفی (حقوق و موجودی تفصیلی) در حالت write-only ردیف به ردیف
+    نوشته می‌شوند تا مصرف حافظه با افزایش تعداد کارمندان ثابت بماند.
+    seed داده‌های فرضی کارمندان را تکرارپذیر می‌کند و assumption_overrides مفروضات یک سناریو را جایگزین می‌کند.
+    با monte_carlo_draws > 0 شیت «تحلیل ریسک» (توزیع و حساسیت خروجی‌های کلیدی) اضافه می‌شود.
+    با build_cache (یک ReportBuildCache) فقط مراحلی که ورودی‌هایشان تغییر کرده دوباره ساخته می‌شوند.
+    با workers > 1 (یا None برای همه هسته‌ها) شیت‌های مستقل به صورت موازی ساخته و سپس ادغام می‌شوند.
+    output_backend='direct' فایل را با DirectXlsxWriter (بدون مدل شیء openpyxl هنگام ذخیره) می‌نویسد؛
+    'openpyxl' (پیش‌فرض) همان ذخیره قبلی است.
+    با projection_years > 0 شیت «پیش‌بینی چندساله» (غلتاندن سه صورت مالی برای همان تعداد سال پس از 1403، از
+    مانده‌های پایان 1403 صورت‌های همین کارپوشه) اضافه می‌شود.
+    با export_path مقادیر محاسبه شده همه اقلام به صورت جدول بلند (parquet/csv/json/jsonl بر اساس پسوند)
+    کنار کارپوشه نوشته می‌شود؛ scenario_name در ستون scenario همین جدول قرار می‌گیرد.
+    inventory_movements مسیر فایل CSV گردش کالاست؛ اقلام موجودی تفصیلی، بهای تمام شده و موجودی پایان دوره
+    به جای inventory_items از آن با بهای میانگین موزون متحرک (cost_inventory_movements) محاسبه می‌شوند.
+    journal (فایل اسناد CSV/Parquet) همراه با chart_of_accounts (جدول حساب‌ها) تراز آزمایشی را می‌سازد
+    که ورودی‌های ثابت شیت‌ها را جایگزین می‌کند (build_trial_balance).
+    با values_only=True همه فرمول‌ها در پایتون محاسبه و به جای آن‌ها مقدار ثابت نوشته می‌شود (freeze_workbook_values)؛
+    keep_statement_formulas فرمول‌های صورت‌های اصلی (FROZEN_FORMULA_SHEET_NAMES) را نگه می‌دارد.
+    با strict_references=True ارجاع به شیت ناموجود، سلول خالی یا سلول متنی به جای هشدار خطای BrokenReferenceError است.
+    پارامترهای نامعتبر پیش از ساخت خطای ReportOptionError دارند (check_report_options).
+    """
+    check_report_options(evaluate, num_employees, inventory_items, streaming, assumption_overrides, monte_carlo_draws, workers,
+                         output_backend, projection_years, export_path, inventory_movements, journal, chart_of_accounts,
+                         values_only, keep_statement_formulas)
+    if inventory_movements:
+        inventory_items = cost_inventory_movements(inventory_movements)
+    trial_balance = None
+    if journal:
+        trial_balance = build_trial_balance(journal, chart_of_accounts)
+        print(f"تراز آزمایشی: {len(trial_balance.lines)} قلم صورت مالی از دفتر کل.")
+        if trial_balance.unmapped_accounts:
+            print(f"هشدار: {len(trial_balance.unmapped_accounts)} حساب در جدول حساب‌ها نیست: "
+                  + "، ".join(trial_balance.unmapped_accounts[:10]))
+    inventory_items = inventory_items or DEFAULT_INVENTORY_ITEMS
+    wb, build_context = build_report_workbook(num_employees, inventory_items, streaming, seed, assumption_overrides, build_cache,
+                                              workers=workers, trial_balance=trial_balance, strict_references=strict_references)
+    for line in unmatched_ledger_note_lines(wb, trial_balance):
+        print(f"هشدار: قلم '{line}' دفتر کل در یادداشت متناظر پیدا نشد و استفاده نشد.")
+
+    if monte_carlo_draws:
+        analysis = run_monte_carlo_analysis(wb, draws=monte_carlo_draws, seed=seed, cells=build_context['cells'])
+        populate_risk_analysis_sheet(wb.create_sheet(MONTE_CARLO_SHEET_TITLE), analysis)
+        for label, stats in analysis['statistics'].items():
+            print(f"{label}: میانگین {stats['میانگین']:,.2f}، صدک 5 {stats['صدک 5']:,.2f}، صدک 95 {stats['صدک 95']:,.2f}")
+
+    evaluator = FormulaEvaluator(wb) if evaluate or export_path or values_only or projection_years else None
+    if projection_years:
+        # پیش‌بینی از مانده‌های پایان 1403 همین کارپوشه (پس با صورت‌های مالی آن تناقض ندارد)
+        opening_balance, base_revenue = statement_projection_inputs(evaluator, build_context['cells'])
+        projection = project_financial_statements(projection_years, opening_balance, base_revenue,
+                                                  apply_assumption_overrides(DEFAULT_ASSUMPTIONS, build_context['assumption_overrides']))
+        projection_ws = wb.create_sheet(PROJECTION_SHEET_TITLE)
+        populate_projection_sheet(projection_ws, projection)
+        evaluator.load_worksheet(projection_ws)
+        print(f"پیش‌بینی: درآمد مالی در {projection.solution.iterations} تکرار همگرا شد "
+              f"(باقیمانده {projection.solution.residual:.2e}).")
+        opening_imbalance = projection.lines['opening_imbalance'][0]
+        if round(opening_imbalance) != 0: # همان آزمون ROUND(...,0) ردیف کنترل تراز وضعیت مالی
+            print(f"هشدار: مانده‌های پایان {PROJECTION_BASE_YEAR} تراز نیستند؛ اختلاف {opening_imbalance:,.2f} "
+                  "در ردیف «عدم تراز منتقل شده از مانده‌های افتتاحیه» پیش‌بینی نمایش داده شده است.")
+
+    cached_values = None
+    if values_only:
+        cached_values = freeze_workbook_values(wb, evaluator, FROZEN_FORMULA_SHEET_NAMES if keep_statement_formulas else ())
+        print(f"{sum(map(len, cached_values.values())):,} فرمول صورت‌های اصلی نگه داشته و بقیه فرمول‌ها به مقدار ثابت تبدیل شدند."
+              if keep_statement_formulas else "همه فرمول‌ها به مقدار ثابت تبدیل شدند.")
+    save_report_workbook(wb, output, output_backend, streaming, num_employees, inventory_items, seed, cached_values)
+
+    if export_path:
+        count = write_statement_records(iter_statement_records(wb, evaluator, scenario=scenario_name), export_path)
+        print(f"{count:,} رکورد مقادیر محاسبه شده در '{export_path}' نوشته شد.")
+
+    if evaluate:
+        key_values = evaluate_key_report_values(wb, evaluator, cells=build_context['cells'])
+        for label, value in key_values.items():
+            print(f"{label}: {value}")
+        return key_values
+
+
+def financial_report_bytes(**options):
+    """محتوای فایل xlsx کارپوشه کامل به صورت bytes؛ پارامترها همان write_financial_report."""
+    buffer = io.BytesIO()
+    write_financial_report(buffer, **options)
+    return buffer.getvalue()
+
+
+def create_full_financial_report(output_folder, output_file_name, *args, **kwargs):
+    """
+    ساخت و ذخیره کارپوشه کامل در output_folder/output_file_name؛ پارامترهای دیگر همان write_financial_report.
+    خطای ذخیره (مثلاً فایل باز در اکسل) فقط چاپ می‌شود.
+    """
+    try:
+        key_values = write_financial_report(os.path.join(output_folder, output_file_name), *args, **kwargs)
+    except ReportSaveError as e:
+        print(e)
+        print("لطفاً مطمئن شوید فایل اکسل با همین نام باز نیست و دسترسی نوشتن به پوشه مقصد وجود دارد.")
+        return None
+    print(f"فایل اکسل '{output_file_name}' با موفقیت در مسیر '{output_folder}' ایجاد و پر شد.")
+    return key_values
+
+# ==============================================================================
+# اجرای دسته‌ای سناریوها: یک کارپوشه به ازای هر ردیف جدول مفروضات جایگزین، به صورت موازی
+# ==============================================================================
+SCENARIO_NAME_COLUMN = "سناریو"
+SCENARIO_NAME_ALIASES = (SCENARIO_NAME_COLUMN, "scenario", "name")
+
+ScenarioResult = namedtuple('ScenarioResult', ['name', 'output_path', 'seconds', 'error', 'key_values'])
+
+
+def _parse_scenario_value(text):
+    """تبدیل مقدار متنی جدول سناریو به عدد (درصد مانند '55%' به 0.55)."""
+    text = text.strip().replace(',', '')
+    if text.endswith('%'):
+        return float(text[:-1]) / 100
+    number = float(text)
+    return int(number) if number.is_integer() and '.' not in text else number
+
+
+def load_scenario_table(path):
+    """
+    خواندن جدول سناریوها از CSV: ستون «سناریو» نام سناریو و هر ستون دیگر شرح یک مفروض است
+    (با پسوند [1402] برای مقدار سال 1402). خانه خالی یعنی مقدار پیش‌فرض.
+    مقدار نامعتبر فقط همان سناریو را نامعتبر می‌کند: پیام آن در کلید error سناریو ثبت می‌شود (بقیه error=None).
+    """
+    scenarios = []
+    with open(path, encoding='utf-8-sig', newline='') as f:
+        for line_no, row in enumerate(csv.DictReader(f), 2):
+            name_key = next((key for key in SCENARIO_NAME_ALIASES if key in row), None)
+            name = (row.get(name_key) or '').strip() if name_key else ''
+            overrides, errors = {}, []
+            for key, value in row.items():
+                if key == name_key or key is None or value is None or not value.strip():
+                    continue
+                try:
+                    overrides[key.strip()] = _parse_scenario_value(value)
+                except ValueError:
+                    errors.append(f"مقدار نامعتبر '{value}' در ستون '{key}' (سطر {line_no})")
+            scenarios.append({'name': name or f"سناریو {line_no - 1}", 'overrides': overrides,
+                              'error': "؛ ".join(errors) or None})
+    return scenarios
+
+
+def scenario_file_name(name):
+    """نام فایل امن برای خروجی یک سناریو."""
+    return re.sub(r'[\\/:*?"<>|\s]+', '_', name).strip('_') + '.xlsx'
+
+
+def run_scenario(scenario, output_folder, report_options=None):
+    """
+    ساخت کارپوشه یک سناریو و برگرداندن ScenarioResult (زمان اجرا و خطا به جای پرتاب استثنا).
+    خروجی چاپی create_full_financial_report برای جلوگیری از درهم شدن خروجی فرایندها نگه داشته می‌شود.
+    """
+    report_options = dict(report_options or {})
+    output_path = os.path.join(output_folder, scenario_file_name(scenario['name']))
+    if scenario.get('error'): # مقدار نامعتبر در جدول سناریوها؛ کارپوشه‌ای ساخته نمی‌شود
+        return ScenarioResult(scenario['name'], None, None, scenario['error'], None)
+    # export_format: خروجی ستونی هر سناریو کنار کارپوشه آن با همان نام و پسوند قالب
+    export_format = report_options.pop('export_format', None)
+    if export_format:
+        report_options.update(export_path=os.path.splitext(output_path)[0] + '.' + export_format,
+                              scenario_name=scenario['name'])
+    log = io.StringIO()
+    started = time.perf_counter()
+    try:
+        if os.path.exists(output_path):
+            os.remove(output_path)
+        with contextlib.redirect_stdout(log):
+            key_values = create_full_financial_report(output_folder, os.path.basename(output_path),
+                                                      assumption_overrides=scenario['overrides'], **report_options)
+        # create_full_financial_report خطای ذخیره را فقط چاپ می‌کند
+        error = None if os.path.exists(output_path) else (log.getvalue().strip().splitlines() or ["فایل خروجی ساخته نشد."])[-1]
+    except Exception as e:
+        key_values, error = None, f"{type(e).__name__}: {e}"
+    return ScenarioResult(scenario['name'], output_path, time.perf_counter() - started, error, key_values)
+
+
+def run_scenario_batch(scenarios, output_folder, workers=None, report_options=None, on_result=None):
+    """
+    ساخت یک کارپوشه برای هر سناریو در یک process pool.
+    workers=1 بدون فرایند فرعی اجرا می‌کند. نتایج به ترتیب سناریوها برگردانده می‌شوند و on_result
+    (در صورت وجود) به محض پایان هر سناریو صدا زده می‌شود.
+    """
+    os.makedirs(output_folder, exist_ok=True)
+    names = [scenario['name'] for scenario in scenarios]
+    duplicates = sorted({name for name in names if names.count(name) > 1})
+    if duplicates:
+        raise ValueError("نام سناریوی تکراری: " + "، ".join(duplicates))
+
+    results = [None] * len(scenarios)
+    if workers == 1 or len(scenarios) <= 1:
+        for i, scenario in enumerate(scenarios):
+            results[i] = run_scenario(scenario, output_folder, report_options)
+            if on_result:
+                on_result(results[i])
+        return results
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(run_scenario, scenario, output_folder, report_options): i
+                   for i, scenario in enumerate(scenarios)}
+        for future in as_completed(futures):
+            i = futures[future]
+            try:
+                results[i] = future.result()
+            except Exception as e: # مثلاً از کار افتادن فرایند فرعی
+                results[i] = ScenarioResult(scenarios[i]['name'], None, None, f"{type(e).__name__}: {e}", None)
+            if on_result:
+                on_result(results[i])
+    return results
+
+
+def write_scenario_results(results, path):
+    """ذخیره گزارش زمان و خطای هر سناریو در CSV."""
+    with open(path, 'w', encoding='utf-8-sig', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow([SCENARIO_NAME_COLUMN, "وضعیت", "زمان (ثانیه)", "فایل خروجی", "خطا"])
+        for result in results:
+            writer.writerow([result.name, "ناموفق" if result.error else "موفق",
+                             "" if result.seconds is None else f"{result.seconds:.3f}",
+                             result.output_path or "", result.error or ""])
+
+
+def scenario_batch_main(argv=None):
+    """خط فرمان اجرای دسته‌ای سناریوها؛ کد خروج 1 در صورت شکست هر سناریو."""
+    parser = argparse.ArgumentParser(description="ساخت موازی صورت‌های مالی برای جدول سناریوهای مفروضات")
+    parser.add_argument("scenarios", help="فایل CSV سناریوها (ستون «سناریو» + ستون به ازای هر مفروض)")
+    parser.add_argument("-o", "--output-folder", required=True, help="پوشه خروجی کارپوشه‌ها")
+    parser.add_argument("-w", "--workers", type=non_negative_int, default=None, help="تعداد فرایندها (پیش‌فرض: تعداد هسته‌ها)")
+    parser.add_argument("--employees", type=positive_int, default=100, help="تعداد کارمندان فرضی")
+    parser.add_argument("--seed", type=int, default=None, help="seed داده‌های فرضی (برای قابل مقایسه بودن سناریوها)")
+    parser.add_argument("--streaming", action="store_true", help="ذخیره در حالت write-only")
+    parser.add_argument("--export-format", choices=EXPORT_FORMATS, help="خروجی ستونی مقادیر محاسبه شده هر سناریو")
+    args = parser.parse_args(argv)
+
+    try:
+        scenarios = load_scenario_table(args.scenarios)
+    except (OSError, ValueError) as e:
+        print(f"خطا در خواندن جدول سناریوها: {e}")
+        return 2
+    if args.export_format:
+        try:
+            statement_export_format('', args.export_format)
+        except ImportError as e:
+            print(f"خطا: {e}")
+            return 2
+    report_options = {'num_employees': args.employees, 'seed': args.seed, 'streaming': args.streaming,
+                      'export_format': args.export_format}
+
+    def report(result):
+        if result.error:
+            print(f"[ناموفق] {result.name}: {result.error}")
+        else:
+            print(f"[موفق] {result.name}: {result.seconds:.2f} ثانیه -> {result.output_path}")
+
+    started = time.perf_counter()
+    results = run_scenario_batch(scenarios, args.output_folder, args.workers, report_options, on_result=report)
+    write_scenario_results(results, os.path.join(args.output_folder, "scenario_results.csv"))
+    failed = sum(1 for result in results if result.error)
+    print(f"{len(results) - failed} سناریو موفق، {failed} ناموفق، زمان کل {time.perf_counter() - started:.2f} ثانیه.")
+    return 1 if failed else 0
+
+
+
+# ==============================================================================
+# اجرای دسته‌ای کارها از فایل JSONL: هر سطر یک گزارش (خروجی، مفروضات، seed و مقیاس)، با process pool محدود
+# ==============================================================================
+# کلیدهای مجاز هر کار -> (پارامتر write_financial_report، نوع)؛ همان طرح بدنه درخواست سرویس
+REPORT_JOB_FIELDS = REPORT_OPTION_FIELDS
+REPORT_JOB_META_FIELDS = ('id', 'output', 'scale')
+
+ReportJob = namedtuple('ReportJob', ['line', 'id', 'output', 'options', 'error'])
+
+
+def parse_report_job(line_no, text):
+    """
+    تبدیل یک سطر JSONL به ReportJob. output (مسیر نسبی داخل پوشه خروجی) الزامی است؛ scale یکی از
+    REPORT_SCALE_PRESETS و num_employees / inventory_items بر آن مقدم‌اند. سطر نامعتبر ReportJob با error است.
+    """
+    job_id = line_no
+    try:
+        spec = json.loads(text)
+        if not isinstance(spec, dict):
+            raise ValueError("هر سطر باید یک شیء JSON باشد.")
+        job_id = spec.get('id', line_no)
+        output = spec.get('output')
+        if not isinstance(output, str) or not output.strip():
+            raise ValueError("کلید 'output' (نام فایل خروجی) الزامی است.")
+        output = os.path.normpath(output.strip())
+        if os.path.isabs(output) or output.split(os.sep)[0] == '..':
+            raise ValueError(f"مسیر خروجی '{output}' باید داخل پوشه خروجی باشد.")
+        if not output.lower().endswith('.xlsx'):
+            output += '.xlsx'
+        scale = spec.get('scale')
+        if scale is not None and scale not in REPORT_SCALE_PRESETS:
+            raise ValueError(f"مقیاس نامعتبر '{scale}' (یکی از {', '.join(REPORT_SCALE_PRESETS)})")
+        employees, items = REPORT_SCALE_PRESETS[scale] if scale else (100, None)
+        options = parse_report_options(spec, REPORT_JOB_FIELDS, REPORT_JOB_META_FIELDS,
+                                       {'num_employees': employees, 'inventory_item_count': items})
+        if options['num_employees'] is None:
+            raise ValueError("تعداد کارمندان باید مثبت باشد.")
+    except ValueError as e: # شامل JSONDecodeError
+        return ReportJob(line_no, job_id, None, None, str(e))
+    return ReportJob(line_no, job_id, output, options, None)
+
+
+def report_build_options(options):
+    """
+    گزینه‌های بررسی شده (parse_report_options) -> پارامترهای write_financial_report / financial_report_bytes:
+    inventory_item_count با اقلام فرضی هم‌seed گزارش (generate_inventory_items) جایگزین می‌شود.
+    """
+    options = dict(options)
+    item_count = options.pop('inventory_item_count', None)
+    if item_count is not None:
+        options['inventory_items'] = generate_inventory_items(item_count, seed=options.get('seed'))
+    return options
+
+
+def reject_duplicate_report_outputs(jobs):
+    """
+    مثل نام‌های تکراری run_scenario_batch: کاری که خروجی‌اش (پس از نرمال‌سازی) با کار قبلی یکی است نامعتبر می‌شود
+    تا فایل آن را بازنویسی نکند. فقط مسیرهای دیده شده نگه داشته می‌شوند، پس ورودی همچنان جریانی خوانده می‌شود.
+    """
+    seen = {}
+    for job in jobs:
+        if not job.error:
+            key = os.path.normcase(job.output)
+            if key in seen:
+                job = job._replace(output=None, options=None,
+                                   error=f"خروجی تکراری '{job.output}' (همان خروجی سطر {seen[key]})")
+            else:
+                seen[key] = job.line
+        yield job
+
+
+def iter_report_jobs(path):
+    """خواندن جریانی فایل کارها (سطرهای خالی نادیده گرفته می‌شوند)؛ کل فایل در حافظه نگه داشته نمی‌شود."""
+    with open(path, encoding='utf-8-sig') as f:
+        for line_no, text in enumerate(f, 1):
+            if text.strip():
+                yield parse_report_job(line_no, text)
+
+
+def run_report_job(job, output_folder):
+    """
+    ساخت کارپوشه یک کار و برگرداندن رکورد نتیجه (dict قابل نوشتن در JSONL)؛ خطا به جای پرتاب در رکورد ثبت می‌شود.
+    """
+    record = {'line': job.line, 'id': job.id, 'output': None, 'status': 'invalid', 'seconds': None, 'bytes': None,
+              'error': job.error}
+    if job.error:
+        return record
+    output_path = os.path.join(output_folder, job.output)
+    record['output'] = output_path
+    started = time.perf_counter()
+    try:
+        options = report_build_options(job.options)
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        with contextlib.redirect_stdout(io.StringIO()):
+            key_values = write_financial_report(output_path, **options)
+        record.update(status='ok', bytes=os.path.getsize(output_path))
+        if key_values:
+            record['key_values'] = key_values
+    except Exception as e:
+        record.update(status='error', error=f"{type(e).__name__}: {e}")
+    record['seconds'] = round(time.perf_counter() - started, 3)
+    return record
+
+
+def run_report_jobs(jobs, output_folder, workers=None, max_pending=None, on_result=None):
+    """
+    اجرای کارها (هر iterable، مثلاً iter_report_jobs) در یک process pool با back-pressure: حداکثر max_pending کار
+    (پیش‌فرض دو برابر تعداد فرایندها) همزمان ارسال شده است و کار بعدی فقط پس از پایان یکی از آن‌ها از ورودی خوانده
+    می‌شود. کار با خروجی تکراری نامعتبر ثبت می‌شود. on_result برای هر رکورد به ترتیب پایان صدا زده می‌شود؛
+    خروجی شمار (موفق، ناموفق).
+    """
+    counts = {'ok': 0, 'failed': 0}
+
+    def finish(record):
+        counts['ok' if record['status'] == 'ok' else 'failed'] += 1
+        if on_result:
+            on_result(record)
+
+    os.makedirs(output_folder, exist_ok=True)
+    jobs = reject_duplicate_report_outputs(jobs)
+    if workers == 1:
+        for job in jobs:
+            finish(run_report_job(job, output_folder))
+        return counts['ok'], counts['failed']
+
+    workers = workers or os.cpu_count() or 1
+    max_pending = max_pending or 2 * workers
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = {}
+        for job in jobs:
+            if job.error: # نیازی به فرایند فرعی نیست
+                finish(run_report_job(job, output_folder))
+                continue
+            if len(pending) >= max_pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    finish(_job_future_record(future, pending.pop(future)))
+            pending[pool.submit(run_report_job, job, output_folder)] = job
+        for future in as_completed(pending):
+            finish(_job_future_record(future, pending[future]))
+    return counts['ok'], counts['failed']
+
+
+def _job_future_record(future, job):
+    try:
+        return future.result()
+    except Exception as e: # مثلاً از کار افتادن فرایند فرعی
+        return {'line': job.line, 'id': job.id, 'output': None, 'status': 'error', 'seconds': None, 'bytes': None,
+                'error': f"{type(e).__name__}: {e}"}
+
+
+def report_jobs_main(argv=None):
+    """خط فرمان اجرای کارهای JSONL؛ کد خروج 1 در صورت شکست هر کار و 2 اگر فایل کارها خوانده نشود."""
+    parser = argparse.ArgumentParser(description="ساخت دسته‌ای صورت‌های مالی از فایل کارهای JSONL")
+    parser.add_argument("jobs", help="فایل JSONL کارها: {\"output\": ..., \"assumptions\": {...}, \"seed\": ..., \"scale\": ...}")
+    parser.add_argument("-o", "--output-folder", required=True, help="پوشه خروجی کارپوشه‌ها")
+    parser.add_argument("-w", "--workers", type=non_negative_int, default=None, help="تعداد فرایندها (پیش‌فرض: تعداد هسته‌ها)")
+    parser.add_argument("--max-pending", type=positive_int, default=None, help="حداکثر کارهای ارسال شده همزمان (پیش‌فرض: دو برابر فرایندها)")
+    parser.add_argument("--results", help="فایل JSONL نتایج (پیش‌فرض: report_jobs_results.jsonl در پوشه خروجی)")
+    args = parser.parse_args(argv)
+
+    if not os.path.isfile(args.jobs):
+        print(f"خطا: فایل کارها '{args.jobs}' وجود ندارد.")
+        return 2
+    os.makedirs(args.output_folder, exist_ok=True)
+    results_path = args.results or os.path.join(args.output_folder, "report_jobs_results.jsonl")
+    started = time.perf_counter()
+    # هر رکورد بلافاصله نوشته و flush می‌شود تا با توقف اجرای شبانه نتایج کارهای تمام شده از دست نرود
+    with open(results_path, 'w', encoding='utf-8') as results_file:
+        def report(record):
+            results_file.write(json.dumps(record, ensure_ascii=False, default=str) + '\n')
+            results_file.flush()
+            if record['status'] != 'ok':
+                print(f"[ناموفق] سطر {record['line']} ({record['id']}): {record['error']}")
+
+        ok, failed = run_report_jobs(iter_report_jobs(args.jobs), args.output_folder, args.workers, args.max_pending,
+                                     on_result=report)
+    print(f"{ok} کار موفق، {failed} ناموفق، زمان کل {time.perf_counter() - started:.2f} ثانیه؛ نتایج در '{results_path}'.")
+    return 1 if failed else 0
+
+# --- تابع اصلی برای اجرا ---
+# گزینه‌های خط فرمان (مسیر خروجی، seed، تعداد کارمندان، ...) در financial_report_cli تعریف شده‌اند:
+#   python generate_financial_report.py -o report.xlsx --employees 500
+#   python generate_financial_report.py scenarios <جدول.csv> -o <پوشه>
+#   python generate_financial_report.py jobs <کارها.jsonl> -o <پوشه>
+if __name__ == "__main__":
+    from financial_report_cli import main
+    sys.exit(main())
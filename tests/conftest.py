@@ -0,0 +1,5 @@
+# مسیر ریشه مخزن برای import ماژول‌های گزارش (این مخزن بسته نصبی ندارد)
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,68 @@
+# آزمون‌های کش ساخت: استفاده مجدد از مراحل تغییر نکرده
+import io
+import contextlib
+
+import pytest
+from openpyxl import load_workbook
+
+import generate_financial_report as report
+
+
+def build(folder, name, **kwargs):
+    with contextlib.redirect_stdout(io.StringIO()):
+        key_values = report.create_full_financial_report(str(folder), name, evaluate=True, num_employees=50, seed=7, **kwargs)
+    return key_values, load_workbook(folder / name)
+
+
+def sheet_values(wb):
+    return {ws.title: [[cell.value for cell in row] for row in ws.iter_rows()] for ws in wb.worksheets}
+
+
+def test_build_cache_reuses_unchanged_steps(tmp_path):
+    path = str(tmp_path / 'build.pkl')
+    first = report.ReportBuildCache(path)
+    key_values, wb = build(tmp_path, 'first.xlsx', build_cache=first)
+    assert first.reused == [] and first.rebuilt
+
+    cached = report.ReportBuildCache(path)
+    cached_key_values, cached_wb = build(tmp_path, 'cached.xlsx', build_cache=cached)
+    assert cached.rebuilt == []
+    assert sorted(cached.reused) == sorted(first.rebuilt)
+    assert sheet_values(cached_wb) == sheet_values(wb)
+    assert cached_key_values == key_values
+
+
+def test_build_cache_rebuilds_changed_inputs(tmp_path):
+    path = str(tmp_path / 'build.pkl')
+    build(tmp_path, 'first.xlsx', build_cache=report.ReportBuildCache(path))
+    cache = report.ReportBuildCache(path)
+    build(tmp_path, 'changed.xlsx', build_cache=cache, assumption_overrides={'نرخ مالیات بر درآمد': 0.2})
+    assert 'مفروضات' in cache.rebuilt
+    assert cache.reused
+
+
+def test_build_cache_ignores_corrupt_file(tmp_path):
+    path = tmp_path / 'build.pkl'
+    path.write_bytes(b'not a pickle')
+    assert report.ReportBuildCache(str(path)).entries == {}
+
+
+def test_step_code_fingerprint_follows_own_code(monkeypatch):
+    steps = {step.name: step for step in report.get_report_build_steps()}
+    before = {name: report.step_code_fingerprint(step) for name, step in steps.items()}
+    assert len(set(before.values())) == len(before)
+    # تغییر کد یک مرحله فقط اثر انگشت همان مرحله را عوض می‌کند، نه کل کش را
+    monkeypatch.setattr(report, 'populate_business_analytical_report', lambda ws, cells: None)
+    after = {step.name: report.step_code_fingerprint(step) for step in report.get_report_build_steps()}
+    assert after['گزارش تحلیلی کسب و کار'] != before['گزارش تحلیلی کسب و کار']
+    assert after['مفروضات'] == before['مفروضات'] and after['وضعیت مالی'] == before['وضعیت مالی']
+
+
+def test_build_cache_file_must_be_private(tmp_path):
+    path = tmp_path / 'build.pkl'
+    cache = report.ReportBuildCache(str(path))
+    cache.save()
+    assert path.stat().st_mode & 0o777 == 0o600
+    path.chmod(0o666)
+    with pytest.raises(report.UntrustedCacheFileError):
+        report.ReportBuildCache(str(path))
@@ -0,0 +1,43 @@
+# آزمون‌های خط فرمان: کد خروج 2 فقط برای ورودی نامعتبر و 1 برای شکست ساخت
+import pytest
+
+import financial_report_cli as cli
+import generate_financial_report as report
+
+
+@pytest.mark.parametrize('argv', [
+    ['-w', '-1'],
+    ['--inventory-items', '0'],
+    ['--employees', '0'],
+    ['--projection-years', '-2'],
+])
+def test_invalid_arguments_rejected_by_argparse(tmp_path, argv):
+    with pytest.raises(SystemExit) as exc_info:
+        cli.main(['-o', str(tmp_path / 'r.xlsx'), '-q', *argv])
+    assert exc_info.value.code == 2
+    assert not (tmp_path / 'r.xlsx').exists()
+
+
+@pytest.mark.parametrize('argv', [
+    ['--keep-statement-formulas'],
+    ['--streaming', '--evaluate'],
+    ['--export', 'values.xml'],
+    ['--journal', 'journal.csv'],
+])
+def test_invalid_option_combinations_exit_2(tmp_path, monkeypatch, argv):
+    monkeypatch.setattr(report, 'build_report_workbook', pytest.fail)
+    assert cli.main(['-o', str(tmp_path / 'r.xlsx'), '-q', *argv]) == 2
+
+
+@pytest.mark.parametrize('error', [report.CircularReferenceError, report.BrokenReferenceError, report.ConvergenceError])
+def test_build_failures_exit_1(tmp_path, monkeypatch, error):
+    def failing_build(*args, **kwargs):
+        raise error("خطای ساخت")
+
+    monkeypatch.setattr(report, 'build_report_workbook', failing_build)
+    assert cli.main(['-o', str(tmp_path / 'r.xlsx'), '-q', '--employees', '5']) == 1
+
+
+def test_report_written(tmp_path):
+    assert cli.main(['-o', str(tmp_path / 'r.xlsx'), '-q', '--employees', '5', '--inventory-items', '2', '--seed', '1']) == 0
+    assert (tmp_path / 'r.xlsx').stat().st_size > 0
@@ -0,0 +1,31 @@
+# آزمون رفت و برگشت نویسنده مستقیم xlsx: فایل DirectXlsxWriter با openpyxl خوانده و با wb.save مقایسه می‌شود
+import io
+import contextlib
+
+import pytest
+from openpyxl import load_workbook
+
+import generate_financial_report as report
+
+
+def saved_workbook(folder, name, **kwargs):
+    with contextlib.redirect_stdout(io.StringIO()):
+        report.create_full_financial_report(str(folder), name, num_employees=40, seed=9, **kwargs)
+    return load_workbook(folder / name)
+
+
+def sheet_contents(ws):
+    cells = {cell.coordinate: (cell.value, cell.number_format, cell.font.b, cell.alignment.horizontal)
+             for row in ws.iter_rows() for cell in row if cell.value is not None}
+    widths = {col: dimension.width for col, dimension in ws.column_dimensions.items() if dimension.width}
+    return cells, sorted(str(merged) for merged in ws.merged_cells.ranges), widths, ws.sheet_view.rightToLeft
+
+
+@pytest.mark.parametrize('streaming', [False, True])
+def test_direct_backend_round_trip(tmp_path, streaming):
+    expected = saved_workbook(tmp_path, 'openpyxl.xlsx', streaming=streaming)
+    actual = saved_workbook(tmp_path, 'direct.xlsx', streaming=streaming, output_backend='direct')
+    assert actual.sheetnames == expected.sheetnames
+    assert actual.active.title == expected.active.title
+    for ws in expected.worksheets:
+        assert sheet_contents(actual[ws.title]) == sheet_contents(ws), ws.title
@@ -0,0 +1,62 @@
+# آزمون‌های تولید ستونی کارمندان
+import numpy as np
+import pytest
+
+import generate_financial_report as report
+
+
+def unit_spec(unit):
+    """مشخصات گروه یک برچسب واحد (مثل 'فارم 3' یا 'اداری')."""
+    return next(spec for spec in report.DEFAULT_EMPLOYEE_UNIT_LAYOUT
+                if unit == spec.name or unit.startswith(f"{spec.name} "))
+
+
+def test_columns_are_reproducible():
+    first = report.generate_employee_columns(500, seed=11)
+    second = report.generate_employee_columns(500, seed=11)
+    assert first.keys() == second.keys()
+    for key in first:
+        np.testing.assert_array_equal(first[key], second[key])
+    assert not np.array_equal(report.generate_employee_columns(500, seed=12)['base_salary'], first['base_salary'])
+
+
+def test_columns_follow_unit_layout():
+    columns = report.generate_employee_columns(500, seed=3)
+    assert all(len(values) == 500 for values in columns.values())
+    np.testing.assert_array_equal(columns['id'], np.arange(1, 501))
+    for unit, role, children, salary in zip(columns['unit'], columns['role'], columns['num_children'], columns['base_salary']):
+        spec = unit_spec(unit)
+        assert role in spec.roles
+        assert 0 <= children <= spec.max_children
+        low, high = report.role_base_salary_range(role)
+        assert low <= salary <= high
+    # واحدهای شمارش‌دار اول پر می‌شوند و تعداد نفرات هر واحد در بازه آن است
+    units, counts = np.unique(columns['unit'].astype(str), return_counts=True)
+    staff = dict(zip(units.tolist(), counts.tolist()))
+    for spec in report.DEFAULT_EMPLOYEE_UNIT_LAYOUT:
+        if spec.count is not None:
+            for i in range(1, spec.count + 1):
+                assert spec.staff_range[0] <= staff[f"{spec.name} {i}"] <= spec.staff_range[1]
+    assert unit_spec(columns['unit'][-1]).count is None
+
+
+def test_records_match_columns():
+    columns = report.generate_employee_columns(50, seed=5)
+    records = report.generate_all_employees_data(50, seed=5)
+    assert len(records) == 50
+    for i, record in enumerate(records):
+        assert record == {key: values[i].item() if hasattr(values[i], 'item') else values[i] for key, values in columns.items()}
+
+
+def test_layout_without_remainder_units():
+    layout = [report.EmployeeUnitSpec("فارم", 2, (3, 3), ["کارگر"], 1)]
+    assert len(report.generate_employee_columns(6, seed=1, unit_layout=layout)['id']) == 6
+    with pytest.raises(ValueError):
+        report.generate_employee_columns(7, seed=1, unit_layout=layout)
+
+
+@pytest.mark.parametrize('num_employees', [0, -3])
+def test_non_positive_employee_count(num_employees):
+    with pytest.raises(ValueError, match="مثبت"):
+        report.generate_employee_columns(num_employees, seed=1)
+    assert report.generate_all_employees_data(num_employees, seed=1) == []
@@ -0,0 +1,37 @@
+# آزمون‌های حل نقطه ثابت و فرمول بسته درآمد مالی
+import numpy as np
+import pytest
+from openpyxl import Workbook
+
+import generate_financial_report as report
+
+
+def test_solve_fixed_point_scalar_and_array():
+    solution = report.solve_fixed_point(lambda x: 0.5 * x + 1, 0.0)
+    assert solution.value == pytest.approx(2.0, abs=1e-5)
+    assert solution.residual <= report.FIXED_POINT_TOLERANCE
+    solution = report.solve_fixed_point(lambda x: 0.5 * x + np.array([1.0, 3.0]), np.zeros(2))
+    np.testing.assert_allclose(solution.value, [2.0, 6.0], atol=1e-5)
+
+
+def test_solve_fixed_point_divergence():
+    with pytest.raises(report.ConvergenceError):
+        report.solve_fixed_point(lambda x: 2 * x + 1, 1.0, max_iterations=10)
+
+
+@pytest.mark.parametrize('profit_before_finance_income', [500.0, -800.0])
+def test_finance_income_formula_matches_iteration(profit_before_finance_income):
+    rate, tax_rate, payout, opening_cash, cash_before_profit = 0.2, 0.25, 0.4, 300.0, 200.0
+    wb = Workbook()
+    ws = wb.active
+    ws.title = 'ورودی'
+    ws['A1'] = report.finance_income_formula(profit_before_finance_income, rate, tax_rate, payout, opening_cash, cash_before_profit)
+    closed_form = report.FormulaEvaluator(wb).value('ورودی', 'A1')
+
+    # همان چرخه با تکرار: درآمد مالی روی میانگین نقد، نقد پایان به سود خالص نگه داشته شده وابسته است
+    def update(finance_income):
+        profit = profit_before_finance_income + finance_income
+        net_profit = profit * (1 - tax_rate) if profit > 0 else profit
+        return rate * (opening_cash + cash_before_profit + (1 - payout) * net_profit) / 2
+
+    assert closed_form == pytest.approx(report.solve_fixed_point(update, 0.0).value, rel=1e-6)
@@ -0,0 +1,136 @@
+# آزمون‌های ارزیاب فرمول: مقادیر معلوم روی کارپوشه کوچک و مقادیر کلیدی گزارش ساخته شده
+import io
+import contextlib
+
+import numpy as np
+import pytest
+from openpyxl import Workbook
+
+import generate_financial_report as report
+
+
+def small_workbook():
+    wb = Workbook()
+    data = wb.active
+    data.title = 'داده'
+    for row_idx, (unit, amount) in enumerate([("فروش", 10), ("اداری", 20), ("فروش", 30), ("تولید", 40)], 1):
+        data.cell(row=row_idx, column=1, value=unit)
+        data.cell(row=row_idx, column=2, value=amount)
+    data['C1'] = 0
+    calc = wb.create_sheet('محاسبه')
+    calc['A1'] = "=SUM('داده'!B1:B4)"
+    calc['A2'] = "=SUMIF('داده'!A1:A4,\"فروش\",'داده'!B1:B4)"
+    calc['A3'] = "=IF(A1>50,A1/4,0)"
+    calc['A4'] = "=ROUND(A1/3,2)"
+    calc['A5'] = "=IFERROR('داده'!B1/'داده'!C1,-1)"
+    calc['A6'] = "='داده'!B1/'داده'!C1"
+    calc['A7'] = "=MAX('داده'!B1:B4)-'داده'!B1"
+    calc['A8'] = "=A9+1"
+    calc['A9'] = "=A8+1"
+    return wb
+
+
+def test_formula_values():
+    evaluator = report.FormulaEvaluator(small_workbook())
+    assert evaluator.value('محاسبه', 'A1') == 100
+    assert evaluator.value('محاسبه', 'A2') == 40
+    assert evaluator.value('محاسبه', 'A3') == 25
+    assert evaluator.value('محاسبه', 'A4') == 33.33
+    assert evaluator.value('محاسبه', 'A5') == -1
+    assert evaluator.value('محاسبه', 'A6') == report.DIV0_ERROR
+    assert evaluator.value('محاسبه', 'A7') == 30
+    assert evaluator.value('محاسبه', 'A8') == report.CIRCULAR_ERROR
+
+
+def test_set_value_invalidates_dependents():
+    evaluator = report.FormulaEvaluator(small_workbook())
+    assert evaluator.value('محاسبه', 'A3') == 25
+    evaluator.set_value('داده', 'B4', 0)
+    assert evaluator.value('محاسبه', 'A1') == 60
+    assert evaluator.value('محاسبه', 'A3') == 15
+    evaluator.set_value('داده', 'C1', 5)
+    assert evaluator.value('محاسبه', 'A6') == 2
+
+
+def test_long_reference_chain():
+    # زنجیره 5,000 سلولی (و چرخه 3,000 سلولی) نباید به حد بازگشت پایتون برسد
+    wb = Workbook()
+    ws = wb.active
+    ws['A1'] = 1
+    for row_idx in range(2, 5001):
+        ws[f'A{row_idx}'] = f"=A{row_idx - 1}+1"
+    ws['B1'] = "=B3000+1"
+    for row_idx in range(2, 3001):
+        ws[f'B{row_idx}'] = f"=B{row_idx - 1}+1"
+    evaluator = report.FormulaEvaluator(wb)
+    assert evaluator.value(ws.title, 'A5000') == 5000
+    assert evaluator.value(ws.title, 'B3000') == report.CIRCULAR_ERROR
+    evaluator.set_value(ws.title, 'A1', 11)
+    assert evaluator.value(ws.title, 'A5000') == 5010
+
+
+def test_sum_ignores_referenced_text():
+    wb = Workbook()
+    ws = wb.active
+    ws['A1'], ws['A2'], ws['A3'] = 5, "متن", True
+    ws['B1'] = "=SUM(A2)"
+    ws['B2'] = "=SUM(A1,A2,A3)"
+    ws['B3'] = '=SUM(A1,"3")'
+    ws['B4'] = '=SUM(A1,"متن")'
+    evaluator = report.FormulaEvaluator(wb)
+    assert evaluator.value(ws.title, 'B1') == 0
+    assert evaluator.value(ws.title, 'B2') == 5
+    assert evaluator.value(ws.title, 'B3') == 8
+    assert evaluator.value(ws.title, 'B4') == report.VALUE_ERROR
+
+
+def test_range_dependents_not_duplicated():
+    # بی‌اعتبار شدن B1 از راه C1 محدوده A1:A3 را دوباره ثبت می‌کند؛ ثبت تکراری نباید انباشته شود
+    wb = Workbook()
+    ws = wb.active
+    ws['A1'], ws['A2'], ws['A3'], ws['C1'] = 1, 2, 3, 0
+    ws['B1'] = "=SUM(A1:A3)+C1"
+    evaluator = report.FormulaEvaluator(wb)
+    for value in range(1, 4):
+        evaluator.set_value(ws.title, 'C1', value)
+        assert evaluator.value(ws.title, 'B1') == 6 + value
+    assert len(evaluator._range_dependents[ws.title]) == 1
+
+
+def test_vector_evaluator_matches_scalar_per_sample():
+    wb = small_workbook()
+    samples = np.array([0.0, 10.0, 40.0])
+    vector = report.VectorFormulaEvaluator(wb)
+    vector.set_value('داده', 'B4', samples)
+    results = {coordinate: vector.value('محاسبه', coordinate) for coordinate in ('A1', 'A3', 'A4')}
+    for i, sample in enumerate(samples):
+        scalar = report.FormulaEvaluator(wb)
+        scalar.set_value('داده', 'B4', float(sample))
+        for coordinate, values in results.items():
+            assert values[i] == pytest.approx(scalar.value('محاسبه', coordinate))
+
+
+@pytest.fixture(scope='module')
+def key_values(tmp_path_factory):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return report.create_full_financial_report(str(tmp_path_factory.mktemp('report')), 'report.xlsx', evaluate=True, seed=1402)
+
+
+# مقادیر کلیدی گزارش پیش‌فرض با seed=1402 (میلیون ریال)؛ تغییر آن‌ها باید آگاهانه باشد
+EXPECTED_KEY_VALUES = {
+    'کنترل تراز پایه': 0,
+    'درآمدهای عملیاتی 1403': 3_150_000.0,
+    'جمع کل دارایی‌ها 1402': 4_516_575.342465754,
+    'جمع کل دارایی‌ها 1403': 6_518_863.0907011125,
+    'سود خالص 1402': 1_123_379.5119471275,
+    'سود خالص 1403': 1_837_764.9228580198,
+    'موجودی نقد پایان 1403': 2_482_580.76193399,
+    'نسبت جاری 1403': 5.972502346330253,
+    'حاشیه سود خالص 1403': 0.5834174358279428,
+}
+
+
+def test_report_key_values(key_values):
+    for label, expected in EXPECTED_KEY_VALUES.items():
+        assert key_values[label] == pytest.approx(expected, rel=1e-9), label
+    assert key_values['کنترل درآمد مالی 1403'] == pytest.approx(0, abs=1e-6)
@@ -0,0 +1,47 @@
+# آزمون‌های ورود دفتر کل: تراز آزمایشی روی فایل اسناد و جدول حساب‌های کوچک
+import generate_financial_report as report
+
+CHART_OF_ACCOUNTS_CSV = """account,line,sign,kind
+1101,opening:cash,1,
+2101,opening:accounts_payable,-1,
+41,pl:revenue,-1,
+"""
+
+# اسناد به ریال؛ سند آخر سال 1403 یک طرفه و با حساب تعریف نشده است
+JOURNAL_CSV = """date,account,debit,credit
+1401/10/01,1101,5000000,
+1401/10/01,2101,,5000000
+1402/03/01,1101,20000000,
+1402/03/01,4101,,20000000
+1403/03/01,1101,30000000,
+1403/03/01,4102,,30000000
+1403/05/01,2101,2000000,
+1403/05/01,1101,,2000000
+1403/06/01,9999,1000000,
+"""
+
+
+def write_file(tmp_path, name, content):
+    path = tmp_path / name
+    path.write_text(content, encoding='utf-8')
+    return str(path)
+
+
+def test_build_trial_balance(tmp_path, capsys):
+    trial_balance = report.build_trial_balance(write_file(tmp_path, 'journal.csv', JOURNAL_CSV),
+                                               write_file(tmp_path, 'chart.csv', CHART_OF_ACCOUNTS_CSV))
+    assert trial_balance.lines == {
+        'opening:cash': {'1401': 5, '1402': 25, '1403': 53},
+        'opening:accounts_payable': {'1401': 5, '1402': 5, '1403': 3},
+        'pl:revenue': {'1401': 0, '1402': 20, '1403': 30},
+    }
+    assert trial_balance.unmapped_accounts == ['9999']
+    warnings = capsys.readouterr().out
+    assert "سال 1403" in warnings and "1,000,000" in warnings
+    assert "سال 1402" not in warnings
+
+
+def test_trial_balance_chunks_match(tmp_path):
+    journal = write_file(tmp_path, 'journal.csv', JOURNAL_CSV)
+    chart = write_file(tmp_path, 'chart.csv', CHART_OF_ACCOUNTS_CSV)
+    assert report.build_trial_balance(journal, chart, chunk_size=2) == report.build_trial_balance(journal, chart)
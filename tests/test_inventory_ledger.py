@@ -0,0 +1,40 @@
+# آزمون‌های دفتر گردش موجودی: بهای میانگین موزون متحرک روی فایل کوچک
+import pytest
+
+import generate_financial_report as report
+
+# گردش کالا (بهای واحد به ریال): ذرت با موجودی افتتاحیه در انبار 1 و ورود میان‌سال در فارم 1
+INVENTORY_MOVEMENTS_CSV = """date,item,unit,location,type,quantity,unit_cost
+1401/12/01,ذرت,کیلوگرم,انبار 1,in,10,1000000
+1402/02/01,ذرت,کیلوگرم,انبار 1,in,10,3000000
+1402/06/01,ذرت,کیلوگرم,انبار 1,out,5,
+1402/07/01,ذرت,کیلوگرم,فارم 1,in,4,5000000
+1403/03/01,ذرت,کیلوگرم,انبار 1,out,15,
+1403/04/01,کنجاله,کیسه,فارم 1,ورود,2,7000000
+"""
+
+
+def write_file(tmp_path, name, content):
+    path = tmp_path / name
+    path.write_text(content, encoding='utf-8')
+    return str(path)
+
+
+def test_cost_inventory_movements(tmp_path):
+    items = report.cost_inventory_movements(write_file(tmp_path, 'movements.csv', INVENTORY_MOVEMENTS_CSV))
+    # (ردیف، نام، واحد، مقدار 1403: اول دوره/ورود/خروج، مقدار 1402، بهای واحد پایان دوره،
+    #  ارزش 1403: اول دوره/ورود/خروج/پایان دوره، ارزش 1402) با ارزش‌ها به میلیون ریال
+    assert items == [
+        (1, 'ذرت', 'کیلوگرم', 19, 0, 15, 10, 14, 5, 5_000_000.0, 50, 0, 30, 20, 10, 50, 10, 50),
+        (2, 'کنجاله', 'کیسه', 0, 2, 0, 0, 0, 0, 7_000_000.0, 0, 14, 0, 14, 0, 0, 0, 0),
+    ]
+
+
+@pytest.mark.parametrize('bad_row, message', [
+    ('1403/09/01,ذرت,کیلوگرم,فارم 1,out,5,\n', 'بیش از موجودی'),
+    ('1402/01/01,ذرت,کیلوگرم,فارم 1,in,1,1\n', 'مرتب نیستند'),
+])
+def test_cost_inventory_movements_rejects_invalid_rows(tmp_path, bad_row, message):
+    path = write_file(tmp_path, 'movements.csv', INVENTORY_MOVEMENTS_CSV + bad_row)
+    with pytest.raises(ValueError, match=message):
+        report.cost_inventory_movements(path)
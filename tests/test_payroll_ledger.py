@@ -0,0 +1,100 @@
+# آزمون‌های دفتر حقوق ماهانه: اجزای حقوق یک کارمند معلوم و جمع‌های دفتر
+import io
+import contextlib
+
+import numpy as np
+import pytest
+
+import generate_financial_report as report
+
+
+def test_monthly_payroll_known_employee():
+    columns = {'base_salary': np.array([100_000_000]), 'num_children': np.array([1]), 'other_deductions': np.array([1_000_000])}
+    events = {'hire_month': np.array([1]), 'leave_month': np.array([12]), 'raise_month': np.array([7]),
+              'raise_rate': np.array([0.10])}
+    monthly = report.compute_monthly_payroll(columns, events, report.PAYROLL_RATES[1403])
+    child = 3 * report.MIN_WAGE_DAILY_1403
+    assert monthly['gross'][0, 0] == 100_000_000 + 9_000_000 + 14_000_000 + child
+    assert monthly['employee_insurance'][0, 0] == pytest.approx(123_000_000 * 0.07)
+    assert monthly['tax'][0, 0] == 155_618
+    # پس از افزایش حقوق ماه 7
+    assert monthly['gross'][6, 0] == 110_000_000 + 9_000_000 + 14_000_000 + child
+    assert monthly['tax'][6, 0] == 1_085_618
+    assert monthly['employer_cost'][6, 0] == pytest.approx(monthly['gross'][6, 0] + 133_000_000 * 0.23)
+
+
+def test_monthly_payroll_inactive_months():
+    columns = {'base_salary': np.array([90_000_000]), 'num_children': np.array([2]), 'other_deductions': np.array([800_000])}
+    events = {'hire_month': np.array([4]), 'leave_month': np.array([9]), 'raise_month': np.array([13]),
+              'raise_rate': np.array([0.05])}
+    monthly = report.compute_monthly_payroll(columns, events, report.PAYROLL_RATES[1402])
+    assert monthly['active'][:, 0].tolist() == [False] * 3 + [True] * 6 + [False] * 3
+    assert monthly['employer_cost'][:3, 0].tolist() == [0] * 3 and monthly['employer_cost'][9:, 0].tolist() == [0] * 3
+    assert monthly['gross'][3, 0] == 72_000_000 + 9_000_000 + 11_000_000 + 2 * 3 * 1_769_428
+
+
+def test_payroll_events_leave_after_hire():
+    events = report.generate_payroll_events(100_000, seed=1)
+    assert (events['leave_month'] >= events['hire_month']).all()
+    assert (events['leave_month'] < 12).any() and (events['hire_month'] > 1).any()
+
+
+def test_ledger_totals():
+    ledger = report.build_payroll_ledger(300, seed=4)
+    assert ledger.years == (1403, 1402)
+    for year in ledger.years:
+        totals = ledger.totals[year]
+        np.testing.assert_allclose(totals['production'] + totals['selling'] + totals['admin'], totals['employer_cost'])
+        np.testing.assert_allclose(totals['gross'] + totals['employer_insurance'], totals['employer_cost'])
+        assert (totals['headcount'] <= 300).all() and (totals['headcount'] > 250).all()
+        assert (totals['net'] < totals['gross'] - totals['employee_insurance'] - totals['tax'] + 1e-6).all()
+    repeated = report.build_payroll_ledger(300, seed=4)
+    for year in ledger.years:
+        for key, values in ledger.totals[year].items():
+            np.testing.assert_array_equal(repeated.totals[year][key], values)
+
+
+def test_ledger_chunks_match(monkeypatch):
+    # تکه‌های کوچک: جمع تکه به تکه باید با محاسبه یکجای همان کارمندان و رویدادها برابر باشد
+    monkeypatch.setattr(report, 'EMPLOYEE_CHUNK_SIZE', 7)
+    ledger = report.build_payroll_ledger(50, seed=4)
+    chunks = list(report.iter_employee_column_chunks(50, seed=4))
+    assert len(chunks) > 1
+    columns = {key: np.concatenate([chunk[key] for chunk in chunks]) for key in chunks[0]}
+    for year in ledger.years:
+        rng = report.payroll_events_rng(4, year)
+        events = [report.generate_payroll_events(len(chunk['unit']), year=year, rng=rng) for chunk in chunks]
+        events = {key: np.concatenate([chunk_events[key] for chunk_events in events]) for key in events[0]}
+        monthly = report.compute_monthly_payroll(columns, events, report.PAYROLL_RATES[year])
+        for key in ('gross', 'tax', 'net', 'employer_cost'):
+            np.testing.assert_allclose(ledger.totals[year][key], monthly[key].sum(axis=1))
+        np.testing.assert_array_equal(ledger.totals[year]['headcount'], monthly['active'].sum(axis=1))
+
+
+def test_ledger_sheet_summary():
+    with contextlib.redirect_stdout(io.StringIO()):
+        wb, _ = report.build_report_workbook(60, seed=2)
+    ledger = report.build_payroll_ledger(60, seed=2)
+    layout = report.payroll_ledger_layout(ledger.years)
+    evaluator = report.FormulaEvaluator(wb)
+    for col_letter, year in zip('CD', ledger.years):
+        for key in ('production', 'selling', 'admin', 'employer_cost'):
+            value = evaluator.value(report.PAYROLL_LEDGER_SHEET_TITLE, f"{col_letter}{layout['summary_rows'][key]}")
+            assert value == pytest.approx(ledger.totals[year][key].sum() / 1_000_000, abs=1), (year, key)
+
+
+def test_payroll_sheet_yearly_totals_from_ledger():
+    with contextlib.redirect_stdout(io.StringIO()):
+        wb, _ = report.build_report_workbook(60, seed=2)
+    layout = report.payroll_sheet_layout(60)
+    ledger_layout = report.payroll_ledger_layout()
+    evaluator = report.FormulaEvaluator(wb)
+    payroll = lambda coordinate: evaluator.value(report.PAYROLL_SHEET_TITLE, coordinate)
+    ledger = lambda coordinate: evaluator.value(report.PAYROLL_LEDGER_SHEET_TITLE, coordinate)
+    # کل هزینه کارفرما (ستون W شیت حقوق و ستون I دفتر) و هزینه پرسنل هر بخش برای هر دو سال
+    assert payroll(f"W{layout['total_yearly_million']}") == ledger(f"I{ledger_layout['tables'][1403]['total']}")
+    assert payroll(f"W{layout['total_yearly_rial']}") == pytest.approx(payroll(f"W{layout['total_yearly_million']}") * 1_000_000)
+    for offset, key in [(1, 'selling'), (3, 'admin'), (5, 'production')]:
+        row = layout['output_start'] + offset
+        assert payroll(f"E{row}") == ledger(f"C{ledger_layout['summary_rows'][key]}")
+        assert payroll(f"F{row}") == ledger(f"D{ledger_layout['summary_rows'][key]}")
@@ -0,0 +1,85 @@
+# آزمون‌های پیش‌بینی چندساله: تراز بودن هر سال و پیوستگی نقد و سود انباشته
+import io
+import contextlib
+
+import numpy as np
+import pytest
+from openpyxl import load_workbook
+
+import generate_financial_report as report
+
+
+BASE_REVENUE = 3_000_000
+
+
+def previous(values, opening_value):
+    return np.concatenate(([opening_value], values[:-1]))
+
+
+def test_projection_balances_every_year():
+    projection = report.project_financial_statements(8, report.OPENING_BALANCE_SHEET, BASE_REVENUE)
+    lines = projection.lines
+    assert projection.years == list(range(report.PROJECTION_FIRST_YEAR, report.PROJECTION_FIRST_YEAR + 8))
+    np.testing.assert_allclose(lines['balance_check'], 0, atol=1e-6)
+    np.testing.assert_allclose(lines['total_assets'], lines['total_liabilities_and_equity'])
+    # نقد پایان هر سال = نقد اول دوره + خالص جریان نقد
+    opening_cash = report.OPENING_BALANCE_SHEET['cash']
+    np.testing.assert_allclose(lines['cash'] - previous(lines['cash'], opening_cash), lines['net_change_in_cash'])
+    np.testing.assert_allclose(lines['net_change_in_cash'], lines['operating_cash_flow'] + lines['investing_cash_flow'] +
+                               lines['financing_cash_flow'])
+
+
+def test_projection_keeps_opening_imbalance():
+    # سود انباشته افتتاحیه 100 کمتر از رقم تراز کننده: اختلاف جذب نمی‌شود و در همه سال‌ها می‌ماند
+    balanced = report.project_financial_statements(3, report.OPENING_BALANCE_SHEET, BASE_REVENUE)
+    np.testing.assert_allclose(balanced.lines['opening_imbalance'], 0, atol=1e-6)
+    o = report.OPENING_BALANCE_SHEET
+    balancing = (o['cash'] + o['receivables'] + o['inventory'] + o['prepayments'] + o['fixed_asset_cost'] -
+                 o['accumulated_depreciation'] + o['other_non_current_assets'] - o['accounts_payable'] - o['tax_payable'] -
+                 o['dividends_payable'] - o['current_portion_of_debt'] - o['long_term_debt'] - o['end_of_service_benefits'] -
+                 o['capital'] - o['legal_reserve'] - o['other_reserves'])
+    opening = dict(report.OPENING_BALANCE_SHEET, retained_earnings=balancing - 100)
+    projection = report.project_financial_statements(3, opening, BASE_REVENUE)
+    np.testing.assert_allclose(projection.lines['opening_imbalance'], 100)
+    np.testing.assert_allclose(projection.lines['total_assets'] - projection.lines['total_liabilities_and_equity'], 100)
+    np.testing.assert_allclose(projection.lines['balance_check'], 0, atol=1e-6)
+
+
+def test_projection_overrides():
+    desc = report.PROJECTION_DRIVERS['capex']
+    base = report.project_financial_statements(3, report.OPENING_BALANCE_SHEET, BASE_REVENUE)
+    changed = report.project_financial_statements(3, report.OPENING_BALANCE_SHEET, BASE_REVENUE, overrides={desc: [0, 0, 0]})
+    np.testing.assert_allclose(changed.lines['investing_cash_flow'], 0)
+    assert not np.allclose(changed.lines['cash'], base.lines['cash'])
+    np.testing.assert_allclose(changed.lines['balance_check'], 0, atol=1e-6)
+    with pytest.raises(ValueError):
+        report.project_financial_statements(3, report.OPENING_BALANCE_SHEET, BASE_REVENUE, overrides={"مفروض ناموجود": 1})
+    with pytest.raises(ValueError):
+        report.project_financial_statements(0, report.OPENING_BALANCE_SHEET, BASE_REVENUE)
+
+
+def test_projection_first_year_growth():
+    desc = report.PROJECTION_DRIVERS['revenue_growth']
+    projection = report.project_financial_statements(2, report.OPENING_BALANCE_SHEET, BASE_REVENUE, overrides={desc: [0.5, 0.1]})
+    np.testing.assert_allclose(projection.lines['revenue'], [BASE_REVENUE * 1.5, BASE_REVENUE * 1.5 * 1.1])
+
+
+def test_projection_sheet_continues_statements(tmp_path):
+    with contextlib.redirect_stdout(io.StringIO()):
+        wb, _ = report.build_report_workbook(20, seed=1)
+        report.create_full_financial_report(str(tmp_path), 'report.xlsx', num_employees=20, seed=1, projection_years=4)
+    opening, revenue = report.statement_projection_inputs(report.FormulaEvaluator(wb))
+    ws = load_workbook(tmp_path / 'report.xlsx')[report.PROJECTION_SHEET_TITLE]
+    years = [cell.value for cell in ws[7][2:6]]
+    assert years == [report.PROJECTION_FIRST_YEAR + i for i in range(4)] and years[0] == 1404
+    rows = {row[1].value: [cell.value for cell in row[2:6]] for row in ws.iter_rows(min_row=8) if row[1].value}
+    assert rows["کنترل تراز پس از عدم تراز افتتاحیه (باید صفر باشد)"] == pytest.approx([0] * 4, abs=0.02)
+    # سود انباشته افتتاحیه همان 'حقوق مالکانه'!E18 است و عدم تراز 1403 صورت‌ها در پیش‌بینی دیده می‌شود
+    evaluator = report.FormulaEvaluator(wb)
+    imbalance = (evaluator.value(*report.report_cell_registry().address('total_assets', '1403')) -
+                 evaluator.value(*report.report_cell_registry().address('total_liabilities_and_equity', '1403')))
+    assert opening['retained_earnings'] == evaluator.value('حقوق مالکانه', 'E18')
+    assert rows["عدم تراز منتقل شده از مانده‌های افتتاحیه"] == pytest.approx([imbalance] * 4, abs=0.02)
+    # نقد اول 1404 همان نقد پایان 1403 صورت‌هاست
+    assert rows["موجودی نقد"][0] - rows["خالص افزایش (کاهش) در موجودی نقد"][0] == pytest.approx(opening['cash'], abs=0.02)
+    assert rows["درآمدهای عملیاتی"][0] > revenue
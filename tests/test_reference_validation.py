@@ -0,0 +1,112 @@
+# آزمون‌های بررسی ایستای ارجاع‌های کارپوشه
+import io
+import contextlib
+
+import pytest
+from openpyxl import Workbook
+
+import generate_financial_report as report
+
+
+def broken_workbook():
+    wb = Workbook()
+    first = wb.active
+    first.title = 'A'
+    second = wb.create_sheet('B')
+    second['A1'] = "متن"
+    second['C1'] = "='A'!C1+1"
+    first['A1'] = "='B'!B2"
+    first['A2'] = "='B'!A1+1"
+    first['A3'] = "='ناموجود'!A1"
+    first['A4'] = "='B'!A1"
+    first['C1'] = "='B'!C1*2"
+    return wb
+
+
+def test_validate_workbook_references():
+    issues = {(issue.kind, issue.sheet, issue.cell): issue.target for issue in report.validate_workbook_references(broken_workbook())}
+    assert issues == {
+        ('missing_sheet', 'A', 'A3'): 'ناموجود',
+        ('text_cell', 'A', 'A2'): "'B'!A1",
+        ('empty_cell', 'A', 'A1'): "'B'!B2",
+        ('cycle', 'B', 'C1'): "'B'!C1 -> 'A'!C1 -> 'B'!C1",
+    }
+
+
+def test_validate_without_cell_store(monkeypatch):
+    # نسخه آزموده نشده openpyxl: همان نتیجه از مسیر iter_rows
+    expected = report.validate_workbook_references(broken_workbook())
+    monkeypatch.setattr(report, 'OPENPYXL_CELL_STORE', False)
+    assert report.validate_workbook_references(broken_workbook()) == expected
+
+
+def test_validate_workbook_references_deferred_sheets():
+    kinds = [issue.kind for issue in report.validate_workbook_references(broken_workbook(), deferred_sheets=('B',))]
+    assert sorted(kinds) == ['cycle', 'missing_sheet']
+
+
+def test_generated_report_has_no_reference_issues():
+    with contextlib.redirect_stdout(io.StringIO()):
+        wb, ctx = report.build_report_workbook(50, seed=7, strict_references=True)
+    assert ctx['reference_issues'] == []
+    assert report.validate_workbook_references(wb) == []
+
+
+def family_workbook(last_formula=None):
+    wb = Workbook()
+    ws = wb.active
+    ws.title = 'A'
+    family = report.SharedFormula('=B{r}*2+C{r}', 2, 50)
+    for row_idx in range(2, 51):
+        ws.cell(row=row_idx, column=2, value=row_idx)
+        ws.cell(row=row_idx, column=4, value=report.shared_formula_text(family, row_idx))
+    ws['C30'] = '=D30' # چرخه در میان خانواده
+    if last_formula:
+        ws['D50'] = last_formula
+    return wb, {'A': {4: [family]}}
+
+
+@pytest.mark.parametrize('last_formula', [None, "='ناموجود'!B50"])
+def test_formula_families_match_full_index(last_formula):
+    wb, families = family_workbook(last_formula)
+    full, fast = report.FormulaIndex(wb), report.FormulaIndex(wb, families)
+    assert fast.formula_count == full.formula_count
+    assert {node: sorted(rows) for node, rows in fast.nodes.items()} == {node: sorted(rows) for node, rows in full.nodes.items()}
+    assert fast.missing == full.missing
+    # بدون آخرین ردیف مطابق، خانواده کنار گذاشته و ردیف‌ها یکی یکی نمایه می‌شوند
+    assert bool(fast.families) == (last_formula is None)
+    assert report.validate_workbook_references(wb, families=families) == report.validate_workbook_references(wb)
+    assert [issue.target for issue in report.validate_workbook_references(wb, families=families) if issue.kind == 'cycle'] == [
+        "'A'!C30 -> 'A'!D30 -> 'A'!C30"]
+
+
+def test_report_formula_families_cover_row_formulas():
+    with contextlib.redirect_stdout(io.StringIO()):
+        wb, ctx = report.build_report_workbook(40, report.generate_inventory_items(30, seed=1), seed=7)
+    index = report.FormulaIndex(wb, report.report_formula_families(ctx))
+    family_sheets = {sheet_name for sheet_name, _, _ in index.families}
+    assert family_sheets == {report.PAYROLL_SHEET_TITLE, 'موجودی_تفصیلی'}
+    assert index.formula_count == report.FormulaIndex(wb).formula_count
+
+
+def test_statement_sheets_read_assumptions_through_registry():
+    # صورت‌های اصلی آدرس مفروضات را از ثبت نشانی‌ها می‌گیرند، نه با ارجاع مستقیم 'مفروضات'!
+    cells = report.report_cell_registry()
+    steps = {step.name: step for step in report.get_report_build_steps()}
+    for name in ('سودوزیان', 'وضعیت مالی', 'جریان های نقدی', 'گردش دارایی ثابت', 'حقوق مالکانه'):
+        assert 'مفروضات' not in report.find_sheet_references(steps[name].func), name
+        assert 'مفروضات' in {cells.sheet_of(read) for read in steps[name].reads}, name
+
+
+def test_build_steps_declare_their_reads():
+    # گراف وابستگی از reads اعلام شده ساخته می‌شود؛ متن کد فقط برای کنترل متقابل خوانده می‌شود
+    steps = report.get_report_build_steps()
+    cells = report.report_cell_registry(steps)
+    assert report.undeclared_step_references(steps) == {}
+    for step in steps:
+        assert all(cells.sheet_of(name) is not None for name in step.reads), step.name
+    graph = report.sheet_dependency_graph(steps, cells)
+    assert graph['24.25'] == {'سودوزیان', 'حقوق مالکانه'}
+    assert graph['5'] == set()
+    bare = [step._replace(reads=()) if step.name == 'جامع' else step for step in steps]
+    assert report.undeclared_step_references(bare) == {'جامع': ['net_profit']}
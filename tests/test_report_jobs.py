@@ -0,0 +1,84 @@
+# آزمون‌های اجرای دسته‌ای کارهای JSONL: تجزیه سطرها و نتایج اجرا
+import io
+import json
+import os
+import contextlib
+
+import pytest
+
+import generate_financial_report as report
+
+
+def test_parse_report_job():
+    job = report.parse_report_job(3, json.dumps({'id': 'a', 'output': 'q1/base', 'scale': 'medium', 'num_employees': 20,
+                                                 'seed': 5, 'assumptions': {'نرخ مالیات بر درآمد': 0.2}}))
+    assert job.error is None
+    assert (job.line, job.id, job.output) == (3, 'a', os.path.join('q1', 'base.xlsx'))
+    assert job.options == {'num_employees': 20, 'inventory_item_count': 1_000, 'seed': 5,
+                           'assumption_overrides': {'نرخ مالیات بر درآمد': 0.2}}
+    assert report.parse_report_job(4, '{"output": "x.xlsx"}').id == 4
+
+
+@pytest.mark.parametrize('text', [
+    '{"seed": 1}',
+    '{"output": "/tmp/abs.xlsx"}',
+    '{"output": "../outside.xlsx"}',
+    '{"output": "a", "colour": "red"}',
+    '{"output": "a", "seed": "1"}',
+    '{"output": "a", "seed": true}',
+    '{"output": "a", "scale": "huge"}',
+    '{"output": "a", "num_employees": 0}',
+    '{"output": "a", "inventory_items": 0}',
+    '[1, 2]',
+    '{"output": ',
+])
+def test_parse_report_job_rejects_invalid_lines(text):
+    job = report.parse_report_job(7, text)
+    assert job.error and job.output is None and job.line == 7
+
+
+def test_run_report_jobs(tmp_path):
+    jobs_path = tmp_path / 'jobs.jsonl'
+    jobs_path.write_text('\n'.join([
+        json.dumps({'id': 'base', 'output': 'base', 'num_employees': 20, 'seed': 1, 'evaluate': True}),
+        '',
+        json.dumps({'id': 'bad', 'output': 'bad', 'colour': 'red'}),
+        json.dumps({'id': 'items', 'output': 'sub/items.xlsx', 'num_employees': 20, 'inventory_items': 3, 'seed': 2}),
+    ]), encoding='utf-8')
+    output_folder = tmp_path / 'out'
+    with contextlib.redirect_stdout(io.StringIO()):
+        code = report.report_jobs_main([str(jobs_path), '-o', str(output_folder), '-w', '1'])
+    assert code == 1
+    records = {record['id']: record for record in
+               map(json.loads, (output_folder / 'report_jobs_results.jsonl').read_text(encoding='utf-8').splitlines())}
+    assert [records[job_id]['status'] for job_id in ('base', 'bad', 'items')] == ['ok', 'invalid', 'ok']
+    assert records['bad']['line'] == 3 and "colour" in records['bad']['error']
+    assert records['base']['bytes'] == os.path.getsize(output_folder / 'base.xlsx')
+    assert records['base']['key_values']['درآمدهای عملیاتی 1403'] == 3_150_000
+    assert (output_folder / 'sub' / 'items.xlsx').is_file()
+    assert 'key_values' not in records['items']
+
+
+def test_duplicate_job_outputs_are_rejected(tmp_path):
+    jobs = [report.parse_report_job(line_no, json.dumps(spec)) for line_no, spec in enumerate([
+        {'id': 'first', 'output': 'q1/base', 'num_employees': 10, 'seed': 1},
+        {'id': 'same', 'output': 'q1/./base.xlsx', 'num_employees': 10, 'seed': 2},
+        {'id': 'other', 'output': 'q1/other', 'num_employees': 10, 'seed': 3},
+    ], 1)]
+    records = []
+    assert report.run_report_jobs(jobs, str(tmp_path), workers=1, on_result=records.append) == (2, 1)
+    statuses = {record['id']: (record['status'], record['error']) for record in records}
+    assert statuses['first'] == ('ok', None) and statuses['other'] == ('ok', None)
+    assert statuses['same'][0] == 'invalid' and "سطر 1" in statuses['same'][1]
+
+
+def test_service_and_jobs_share_option_schema():
+    from financial_report_service import SERVICE_REPORT_OPTIONS, payload_report_options
+    assert SERVICE_REPORT_OPTIONS.items() <= report.REPORT_JOB_FIELDS.items()
+    assert payload_report_options({'inventory_items': 3, 'seed': 4}) == {'inventory_item_count': 3, 'seed': 4}
+    for payload in ({'inventory_items': 0}, {'num_employees': -1}, {'evaluate': True}, {'seed': True}):
+        with pytest.raises(ValueError):
+            payload_report_options(payload)
+    options = report.report_build_options({'inventory_item_count': 3, 'seed': 4, 'num_employees': 5})
+    assert options['inventory_items'] == report.generate_inventory_items(3, seed=4)
+    assert 'inventory_item_count' not in options
@@ -0,0 +1,77 @@
+# آزمون‌های خروجی مقادیر ثابت: جایگزینی فرمول‌ها با مقدار محاسبه شده
+import io
+import contextlib
+
+import pytest
+from openpyxl import Workbook, load_workbook
+
+import generate_financial_report as report
+
+
+def small_workbook():
+    wb = Workbook()
+    data = wb.active
+    data.title = 'داده'
+    data['A1'], data['A2'] = 10, 32
+    data['B1'] = "=SUM(A1:A2)"
+    calc = wb.create_sheet('صورت')
+    calc['A1'] = "='داده'!B1*2"
+    calc['A2'] = "='داده'!C9"
+    return wb
+
+
+def test_freeze_workbook_values():
+    wb = small_workbook()
+    assert report.freeze_workbook_values(wb) == {}
+    assert wb['داده']['B1'].value == 42
+    assert wb['صورت']['A1'].value == 84
+    assert wb['صورت']['A2'].value == 0 # ارجاع به سلول خالی
+
+
+def test_freeze_without_cell_store(monkeypatch):
+    monkeypatch.setattr(report, 'OPENPYXL_CELL_STORE', False)
+    wb = small_workbook()
+    assert report.freeze_workbook_values(wb, keep_formula_sheets=('صورت',)) == {'صورت': {'A1': 84, 'A2': 0}}
+    assert wb['داده']['B1'].value == 42
+
+
+def test_freeze_keeps_formula_sheets():
+    wb = small_workbook()
+    cached = report.freeze_workbook_values(wb, keep_formula_sheets=('صورت',))
+    assert cached == {'صورت': {'A1': 84, 'A2': 0}}
+    assert wb['داده']['B1'].value == 42
+    assert wb['صورت']['A1'].value == "='داده'!B1*2"
+
+
+def formula_count(wb):
+    return sum(1 for ws in wb.worksheets for row in ws.iter_rows() for cell in row if cell.data_type == 'f')
+
+
+def write(path, **kwargs):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return report.write_financial_report(str(path), evaluate=True, num_employees=30, seed=3, **kwargs)
+
+
+def test_values_only_report(tmp_path):
+    key_values = write(tmp_path / 'formulas.xlsx')
+    frozen_key_values = write(tmp_path / 'values.xlsx', values_only=True)
+    assert frozen_key_values == key_values
+    frozen = load_workbook(tmp_path / 'values.xlsx')
+    assert formula_count(frozen) == 0
+    cells = report.report_cell_registry()
+    for name, year in (('net_profit', '1403'), ('total_assets', '1402')):
+        sheet_name, coordinate = cells.address(name, year)
+        assert frozen[sheet_name][coordinate].value == pytest.approx(key_values[next(
+            label for label, spec in report.KEY_REPORT_CELLS.items() if spec == (name, year))])
+
+
+def test_keep_statement_formulas(tmp_path):
+    write(tmp_path / 'kept.xlsx', values_only=True, keep_statement_formulas=True, output_backend='direct')
+    kept = load_workbook(tmp_path / 'kept.xlsx')
+    cached = load_workbook(tmp_path / 'kept.xlsx', data_only=True)
+    for ws in kept.worksheets:
+        formulas = [cell.coordinate for row in ws.iter_rows() for cell in row if cell.data_type == 'f']
+        assert bool(formulas) == (ws.title in report.FROZEN_FORMULA_SHEET_NAMES), ws.title
+        assert all(cached[ws.title][coordinate].value is not None for coordinate in formulas), ws.title
+    with pytest.raises(ValueError):
+        write(tmp_path / 'invalid.xlsx', keep_statement_formulas=True)